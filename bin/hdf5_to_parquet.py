@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+
+from tokio.cli.hdf5_to_parquet import main
+
+if __name__ == "__main__":
+    main()
@@ -62,6 +62,7 @@ def setup_package():
             'lmtdb': ['mysqlclient'],
             'nersc_jobsdb': ['mysqlclient'],
             'yamlconfig': ['pyyaml'],
+            'parquet': ['pyarrow'],
         },
         python_requires=">=3.5",
 
@@ -4,12 +4,20 @@ Test the archive_collectdes.py tool
 """
 
 import os
+import gzip
+import json
+import time
 import datetime
 import warnings
+import dateutil.parser
+import dateutil.tz
 import nose
+import numpy
 import h5py
+import tokio.timeseries
 import tokio.connectors.hdf5
 import tokiotest
+import tokio.connectors.collectd_es
 import tokio.cli.archive_collectdes
 
 #
@@ -169,3 +177,329 @@ def test_out_of_bounds():
         tokio.cli.archive_collectdes.main(argv)
         print("Caught %d warnings" % len(warn))
         assert len(warn) > 0
+
+def check_aggregate_equivalence(input_file):
+    """Archive documents and their aggregated buckets and compare results
+    """
+    with gzip.open(input_file, 'rt') as input_fp:
+        pages = json.load(input_fp)
+    bucket_file = os.path.join(tokiotest.TEMP_DIR, 'buckets.json.gz')
+    with gzip.open(bucket_file, 'wt') as output_fp:
+        json.dump(tokiotest.aggregate_collectd_pages(pages, tokiotest.SAMPLE_COLLECTDES_TIMESTEP),
+                  output_fp)
+
+    output_files = {}
+    for mode, mode_input, extra_args in [('docs', input_file, []),
+                                         ('buckets', bucket_file, ['--aggregate'])]:
+        output_files[mode] = os.path.join(tokiotest.TEMP_DIR, '%s.hdf5' % mode)
+        argv = extra_args + [
+            '--input', mode_input,
+            '--num-nodes', str(tokiotest.SAMPLE_COLLECTDES_NUMNODES),
+            '--ssds-per-node', str(tokiotest.SAMPLE_COLLECTDES_SSDS_PER),
+            '--timestep', str(tokiotest.SAMPLE_COLLECTDES_TIMESTEP),
+            '--output', output_files[mode],
+            tokiotest.SAMPLE_COLLECTDES_START,
+            tokiotest.SAMPLE_COLLECTDES_END]
+        print("Running [%s]" % ' '.join(argv))
+        tokio.cli.archive_collectdes.main(argv)
+
+    num_compared = 0
+    with tokio.connectors.hdf5.Hdf5(output_files['docs'], 'r') as docs_hdf5, \
+         tokio.connectors.hdf5.Hdf5(output_files['buckets'], 'r') as buckets_hdf5:
+        for dataset_name in tokio.cli.archive_collectdes.DATASETS:
+            if '/_' in dataset_name:
+                continue
+            docs = docs_hdf5.to_timeseries(dataset_name=dataset_name)
+            buckets = buckets_hdf5.to_timeseries(dataset_name=dataset_name)
+            print("Comparing %s" % dataset_name)
+            assert docs.dataset.shape == buckets.dataset.shape
+            assert sorted(docs.columns) == sorted(buckets.columns)
+            for column in docs.columns:
+                assert numpy.allclose(docs.dataset[:, docs.column_map[column]],
+                                      buckets.dataset[:, buckets.column_map[column]])
+            num_compared += 1
+    assert num_compared > 0
+
+@nose.tools.with_setup(tokiotest.create_tempdir, tokiotest.delete_tempdir)
+def test_aggregate():
+    """
+    cli.archive_collectdes --aggregate
+    """
+    for input_file in (tokiotest.SAMPLE_COLLECTDES_FILE, tokiotest.SAMPLE_COLLECTDES_CPULOAD):
+        check_aggregate_equivalence(input_file)
+
+@nose.tools.with_setup(tokiotest.create_tempdir, tokiotest.delete_tempdir)
+def test_archive_streaming():
+    """
+    cli.archive_collectdes.archive_collectdes() with flushing
+    """
+    with gzip.open(tokiotest.SAMPLE_COLLECTDES_CPULOAD, 'rt') as input_fp:
+        pages = json.load(input_fp)
+    start = datetime.datetime.strptime(tokiotest.SAMPLE_COLLECTDES_START, "%Y-%m-%dT%H:%M:%S")
+    end = datetime.datetime.strptime(tokiotest.SAMPLE_COLLECTDES_END, "%Y-%m-%dT%H:%M:%S")
+    kwargs = {
+        'init_start': start,
+        'init_end': end,
+        'query_start': start,
+        'query_end': end,
+        'timestep': tokiotest.SAMPLE_COLLECTDES_TIMESTEP,
+        'num_servers': tokiotest.SAMPLE_COLLECTDES_NUMNODES,
+        'devices_per_server': tokiotest.SAMPLE_COLLECTDES_SSDS_PER,
+    }
+
+    # archive all pages at once
+    batch_file = os.path.join(tokiotest.TEMP_DIR, 'batch.hdf5')
+    tokio.cli.archive_collectdes.pages_to_hdf5(pages=pages, output_file=batch_file, **kwargs)
+
+    # archive the same pages as they are scrolled; the cpu query returns all
+    # pages and the disk and memory queries return nothing
+    esdb = tokio.connectors.collectd_es.CollectdEs(host=None, port=None, index=None)
+    esdb.local_mode = True
+    esdb.fake_pages = [{'_scroll_id': 1, 'hits': {'hits': page}} for page in pages]
+    for _ in range(3):
+        esdb.fake_pages.append({'_scroll_id': 1, 'hits': {'hits': []}})
+    stream_file = os.path.join(tokiotest.TEMP_DIR, 'stream.hdf5')
+    num_inserts = tokio.cli.archive_collectdes.archive_collectdes(
+        esdb=esdb,
+        output_file=stream_file,
+        flush_every=2 * len(pages[0]),
+        **kwargs)
+
+    print("Inserted %d elements in %d flushes" % (num_inserts, esdb._num_flushes))
+    assert num_inserts > 0
+    assert esdb._num_flushes > 1
+    assert not esdb.scroll_pages
+    assert not esdb.fake_pages
+
+    # archive them again in parallel; one pool of workers serves every flush
+    esdb.fake_pages = [{'_scroll_id': 1, 'hits': {'hits': page}} for page in pages]
+    for _ in range(3):
+        esdb.fake_pages.append({'_scroll_id': 1, 'hits': {'hits': []}})
+    esdb._num_flushes = 0
+    parallel_file = os.path.join(tokiotest.TEMP_DIR, 'parallel.hdf5')
+    workers = []
+    real_workers = tokio.cli.archive_collectdes.PageWorkers
+    def counting_workers(*args, **kwargs):
+        """Record each set of workers created"""
+        workers.append(real_workers(*args, **kwargs))
+        return workers[-1]
+    tokio.cli.archive_collectdes.PageWorkers = counting_workers
+    try:
+        tokio.cli.archive_collectdes.archive_collectdes(
+            esdb=esdb,
+            output_file=parallel_file,
+            flush_every=2 * len(pages[0]),
+            threads=2,
+            **kwargs)
+    finally:
+        tokio.cli.archive_collectdes.PageWorkers = real_workers
+    print("Used %d sets of workers for %d flushes" % (len(workers), esdb._num_flushes))
+    assert esdb._num_flushes > 1
+    assert len(workers) == 1
+
+    with tokio.connectors.hdf5.Hdf5(batch_file, 'r') as batch_hdf5, \
+         tokio.connectors.hdf5.Hdf5(stream_file, 'r') as stream_hdf5, \
+         tokio.connectors.hdf5.Hdf5(parallel_file, 'r') as parallel_hdf5:
+        for dataset_name in tokio.cli.archive_collectdes.DATASETS:
+            if '/_' in dataset_name:
+                continue
+            batch = batch_hdf5.to_timeseries(dataset_name=dataset_name)
+            print("Comparing %s" % dataset_name)
+            for other in (stream_hdf5.to_timeseries(dataset_name=dataset_name),
+                          parallel_hdf5.to_timeseries(dataset_name=dataset_name)):
+                assert batch.dataset.shape == other.dataset.shape
+                for column in batch.columns:
+                    assert numpy.allclose(batch.dataset[:, batch.column_map[column]],
+                                          other.dataset[:, other.column_map[column]])
+
+def test_parse_timestamp():
+    """
+    cli.archive_collectdes.parse_timestamp()
+    """
+    for timestamp in ['2017-12-13T08:26:20.677Z',
+                      '2017-12-13T08:26:20Z',
+                      '2017-12-13T08:26:20.999999+00:00',
+                      '2017-03-12T10:00:00.000Z', # DST transition in America/Los_Angeles
+                      '2017-12-13T00:26:20.677-08:00',
+                      '2017-12-13T08:26:20']:
+        expected = dateutil.parser.parse(timestamp)
+        if expected.tzinfo is not None:
+            expected = expected.astimezone(dateutil.tz.tzlocal()).replace(tzinfo=None)
+        expected = int(time.mktime(expected.timetuple()))
+        epoch = tokio.cli.archive_collectdes.parse_timestamp(timestamp)
+        print("%s -> %d (expected %d)" % (timestamp, epoch, expected))
+        assert epoch == expected
+        # repeat to exercise the cache
+        assert tokio.cli.archive_collectdes.parse_timestamp(timestamp) == expected
+
+def compare_hdf5_datasets(output_file1, output_file2):
+    """Ensure two archive_collectdes outputs contain equivalent datasets
+    """
+    num_compared = 0
+    with tokio.connectors.hdf5.Hdf5(output_file1, 'r') as hdf5_file1, \
+         tokio.connectors.hdf5.Hdf5(output_file2, 'r') as hdf5_file2:
+        for dataset_name in tokio.cli.archive_collectdes.DATASETS:
+            if '/_' in dataset_name:
+                continue
+            timeseries1 = hdf5_file1.to_timeseries(dataset_name=dataset_name)
+            timeseries2 = hdf5_file2.to_timeseries(dataset_name=dataset_name)
+            print("Comparing %s" % dataset_name)
+            assert timeseries1.columns == timeseries2.columns
+            # values summed in parallel may be added in a different order
+            assert numpy.allclose(timeseries1.dataset, timeseries2.dataset)
+            num_compared += 1
+    assert num_compared > 0
+
+@nose.tools.with_setup(tokiotest.create_tempdir, tokiotest.delete_tempdir)
+def test_ndjson_input():
+    """
+    cli.archive_collectdes --input with an NDJSON cache
+    """
+    ndjson_file = os.path.join(tokiotest.TEMP_DIR, 'cache.ndjson.gz')
+    esdb = tokio.connectors.collectd_es.CollectdEs.from_cache(tokiotest.SAMPLE_COLLECTDES_FILE)
+    esdb.query_timeseries(tokio.connectors.collectd_es.QUERY_DISK_DATA,
+                          datetime.datetime.strptime(tokiotest.SAMPLE_COLLECTDES_START, "%Y-%m-%dT%H:%M:%S"),
+                          datetime.datetime.strptime(tokiotest.SAMPLE_COLLECTDES_END, "%Y-%m-%dT%H:%M:%S"))
+    esdb.save_cache(ndjson_file)
+
+    # NDJSON caches are streamed in batches, optionally in parallel
+    output_files = []
+    for input_file, extra_args in [(tokiotest.SAMPLE_COLLECTDES_FILE, []),
+                                   (ndjson_file, []),
+                                   (ndjson_file, ['--flush-every', '2000', '--threads', '2'])]:
+        output_files.append(os.path.join(tokiotest.TEMP_DIR, '%d.hdf5' % len(output_files)))
+        argv = extra_args + [
+            '--input', input_file,
+            '--num-nodes', str(tokiotest.SAMPLE_COLLECTDES_NUMNODES),
+            '--ssds-per-node', str(tokiotest.SAMPLE_COLLECTDES_SSDS_PER),
+            '--timestep', str(tokiotest.SAMPLE_COLLECTDES_TIMESTEP),
+            '--output', output_files[-1],
+            tokiotest.SAMPLE_COLLECTDES_START,
+            tokiotest.SAMPLE_COLLECTDES_END]
+        print("Running [%s]" % ' '.join(argv))
+        tokio.cli.archive_collectdes.main(argv)
+    compare_hdf5_datasets(output_files[0], output_files[1])
+    compare_hdf5_datasets(output_files[0], output_files[2])
+
+def test_batch_pages():
+    """
+    cli.archive_collectdes.batch_pages()
+    """
+    pages = [[0] * 3, [0] * 2, [0] * 6, [], [0]]
+    batches = list(tokio.cli.archive_collectdes.batch_pages(iter(pages), 5))
+    print([[len(page) for page in batch] for batch in batches])
+    assert batches == [pages[0:2], pages[2:3], pages[3:5]]
+    assert sum(batches, []) == pages
+
+def make_datasets(start, end):
+    """Create empty in-memory datasets for every one of DATASETS
+    """
+    datasets = {}
+    for dataset_name in tokio.cli.archive_collectdes.DATASETS:
+        num_columns = tokiotest.SAMPLE_COLLECTDES_NUMNODES
+        if dataset_name.lstrip('/').startswith('datatargets'):
+            num_columns *= tokiotest.SAMPLE_COLLECTDES_SSDS_PER
+        datasets[dataset_name] = tokio.timeseries.TimeSeries(
+            dataset_name=dataset_name,
+            start=start,
+            end=end,
+            timestep=tokiotest.SAMPLE_COLLECTDES_TIMESTEP,
+            num_columns=num_columns)
+    return datasets
+
+def test_page_workers():
+    """
+    cli.archive_collectdes.PageWorkers
+    """
+    if tokio.cli.archive_collectdes.FORK_CONTEXT is None:
+        raise nose.SkipTest("processes cannot be forked")
+
+    pages = []
+    for input_file in (tokiotest.SAMPLE_COLLECTDES_FILE, tokiotest.SAMPLE_COLLECTDES_CPULOAD):
+        with gzip.open(input_file, 'rt') as input_fp:
+            for page in json.load(input_fp):
+                pages += [page[i:i + 250] for i in range(0, len(page), 250)]
+    # documents that overwrite values from earlier pages
+    rewritten = json.loads(json.dumps(pages[0]))
+    for doc in rewritten:
+        doc['_source']['read'] += 1.0
+        doc['_source']['write'] *= 2.0
+    pages.append(rewritten)
+
+    start = datetime.datetime.strptime(tokiotest.SAMPLE_COLLECTDES_START, "%Y-%m-%dT%H:%M:%S")
+    end = datetime.datetime.strptime(tokiotest.SAMPLE_COLLECTDES_END, "%Y-%m-%dT%H:%M:%S")
+    delta = end - start
+
+    # datasets miss some data, and workers hold only part of the datasets
+    serial = make_datasets(start + delta / 4, end)
+    parallel = make_datasets(start + delta / 4, end)
+    half = len(pages) // 2
+    with warnings.catch_warnings(record=True) as warn:
+        warnings.simplefilter("always")
+        tokio.cli.archive_collectdes.process_pages(pages, serial)
+        assert warn
+
+    with warnings.catch_warnings(record=True) as warn:
+        warnings.simplefilter("always")
+        with tokio.cli.archive_collectdes.PageWorkers(parallel, 3,
+                                                      start=start + delta / 3,
+                                                      end=end - delta / 3,
+                                                      staging_bytes=2**18) as workers:
+            # pages that are too big to stage are rejected
+            nose.tools.assert_raises(ValueError, workers.process, [json.dumps(pages[0] * 20)], parallel)
+            # pages are sent to workers both as objects and as JSON
+            num_inserts = workers.process(pages[:half], parallel)
+            num_inserts += workers.process([json.dumps(page) + '\n' for page in pages[half:]],
+                                           parallel)
+            workers.reduce(parallel)
+        assert warn
+    assert num_inserts > 0
+
+    for dataset_name, timeseries in serial.items():
+        print("Comparing %s" % dataset_name)
+        other = parallel[dataset_name]
+        assert sorted(timeseries.columns) == sorted(other.columns)
+        for column in timeseries.columns:
+            assert numpy.allclose(timeseries.dataset[:, timeseries.column_map[column]],
+                                  other.dataset[:, other.column_map[column]])
+
+@nose.tools.with_setup(tokiotest.create_tempdir, tokiotest.delete_tempdir)
+def test_parallel():
+    """
+    cli.archive_collectdes.pages_to_hdf5() in parallel
+    """
+    pages = []
+    for input_file in (tokiotest.SAMPLE_COLLECTDES_FILE, tokiotest.SAMPLE_COLLECTDES_CPULOAD):
+        with gzip.open(input_file, 'rt') as input_fp:
+            for page in json.load(input_fp):
+                # split into many pages so that every worker gets several
+                pages += [page[i:i + 250] for i in range(0, len(page), 250)]
+    start = datetime.datetime.strptime(tokiotest.SAMPLE_COLLECTDES_START, "%Y-%m-%dT%H:%M:%S")
+    end = datetime.datetime.strptime(tokiotest.SAMPLE_COLLECTDES_END, "%Y-%m-%dT%H:%M:%S")
+    kwargs = {
+        'pages': pages,
+        'init_start': start,
+        'init_end': end,
+        'query_start': start,
+        'query_end': end,
+        'timestep': tokiotest.SAMPLE_COLLECTDES_TIMESTEP,
+        'num_servers': tokiotest.SAMPLE_COLLECTDES_NUMNODES,
+        'devices_per_server': tokiotest.SAMPLE_COLLECTDES_SSDS_PER,
+    }
+
+    serial_file = os.path.join(tokiotest.TEMP_DIR, 'serial.hdf5')
+    tokio.cli.archive_collectdes.pages_to_hdf5(output_file=serial_file, threads=1, **kwargs)
+
+    parallel_file = os.path.join(tokiotest.TEMP_DIR, 'parallel.hdf5')
+    tokio.cli.archive_collectdes.pages_to_hdf5(output_file=parallel_file, threads=3, **kwargs)
+    compare_hdf5_datasets(serial_file, parallel_file)
+
+    # also test sending pages to workers where processes cannot be forked
+    fork_context = tokio.cli.archive_collectdes.FORK_CONTEXT
+    tokio.cli.archive_collectdes.FORK_CONTEXT = None
+    try:
+        pickled_file = os.path.join(tokiotest.TEMP_DIR, 'pickled.hdf5')
+        tokio.cli.archive_collectdes.pages_to_hdf5(output_file=pickled_file, threads=3, **kwargs)
+    finally:
+        tokio.cli.archive_collectdes.FORK_CONTEXT = fork_context
+    compare_hdf5_datasets(serial_file, pickled_file)
@@ -144,3 +144,72 @@ def test_out_of_bounds():
         tokio.cli.archive_esnet_snmp.main(argv)
         print("Caught %d warnings" % len(warn))
         assert len(warn) > 0
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_remote():
+    """
+    cli.archive_esnet_snmp from a REST API
+    """
+    tokiotest.TEMP_FILE.close()
+
+    interfaces = [('router0', 'if0'), ('router0', 'if1'), ('router1', 'if0')]
+    argv = ['--output', tokiotest.TEMP_FILE.name,
+            '--timestep', '60',
+            '--threads', '2',
+            '--timeout', '5',
+            tokiotest.SAMPLE_ESNET_SNMP_START2,
+            tokiotest.SAMPLE_ESNET_SNMP_END2,
+            ','.join(["%s:%s" % x for x in interfaces])]
+    print("Running [%s]" % ' '.join(argv))
+    with tokiotest.FakeEsnetSnmpServer(rate_limit=True) as server:
+        tokio.cli.archive_esnet_snmp.main(argv)
+    assert server.rate_limited > 0
+
+    with tokio.connectors.hdf5.Hdf5(tokiotest.TEMP_FILE.name, 'r') as h5_file:
+        for dataset_name, direction in (('datatargets/readrates', 'in'),
+                                        ('datatargets/writerates', 'out')):
+            timeseries = h5_file.to_timeseries(dataset_name=dataset_name)
+            num_checked = 0
+            for endpoint, interface in interfaces:
+                column = timeseries.column_map[tokio.cli.archive_esnet_snmp.endpoint_name(endpoint, interface)]
+                path = '/%s/interface/%s/%s' % (endpoint, interface, direction)
+                for index, timestamp in enumerate(timeseries.timestamps):
+                    if timeseries.dataset[index, column]:
+                        expected = tokiotest.FakeEsnetSnmpServer.value(path, int(timestamp))
+                        assert timeseries.dataset[index, column] == expected
+                        num_checked += 1
+            print("Checked %d values in %s" % (num_checked, dataset_name))
+            assert num_checked > 0
+
+@nose.tools.with_setup(tokiotest.create_tempdir, tokiotest.delete_tempdir)
+def test_remote_cache():
+    """
+    cli.archive_esnet_snmp --cache-dir
+    """
+    output_file = os.path.join(tokiotest.TEMP_DIR, 'output.hdf5')
+    cache_dir = os.path.join(tokiotest.TEMP_DIR, 'cache')
+    interfaces = [('router0', 'if0'), ('router1', 'if0')]
+    argv = ['--output', output_file,
+            '--timestep', '60',
+            '--timeout', '5',
+            '--cache-dir', cache_dir,
+            # keep the sample data, which is older than the default retention
+            '--cache-retention', '36500',
+            tokiotest.SAMPLE_ESNET_SNMP_START2,
+            tokiotest.SAMPLE_ESNET_SNMP_END2,
+            ','.join(["%s:%s" % x for x in interfaces])]
+    print("Running [%s]" % ' '.join(argv))
+    datasets = []
+    with tokiotest.FakeEsnetSnmpServer() as server:
+        for _ in range(2):
+            # rerunning the same archive retrieves everything from the cache
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+            tokio.cli.archive_esnet_snmp.main(argv)
+            assert len(server.requests) == 2 * len(interfaces)
+            assert len(os.listdir(cache_dir)) == 2 * len(interfaces)
+            with tokio.connectors.hdf5.Hdf5(output_file, 'r') as h5_file:
+                datasets.append(h5_file['datatargets/readrates'][:, :])
+
+    assert datasets[0].sum() > 0
+    assert (datasets[0] == datasets[1]).all()
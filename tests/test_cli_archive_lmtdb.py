@@ -4,14 +4,19 @@ Test the archive_lmtdb.py tool
 """
 
 import os
+import sys
+import json
 import time
 import datetime
+import subprocess
 import warnings
 import nose
 import h5py
 import numpy
 import tokio
 import tokio.cli.archive_lmtdb
+import tokio.connectors.hdf5
+import tokio.connectors.lmtdb
 import tokiotest
 
 # expressed as fraction, not percent; used to account for differences in how
@@ -111,6 +116,221 @@ def test_bin_archive_lmtdb_overlaps():
 #       yield func, summary0, summary1
         func(summary0, summary1)
 
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_bin_archive_lmtdb_swmr():
+    """cli.archive_lmtdb --swmr: write + overwrite correctness
+    """
+    tokiotest.TEMP_FILE.close()
+
+    # reference output written without SWMR
+    generate_tts(tokiotest.TEMP_FILE.name)
+    h5_file = h5py.File(tokiotest.TEMP_FILE.name, 'r')
+    summary0 = tokiotest.summarize_hdf5(h5_file)
+    h5_file.close()
+    os.unlink(tokiotest.TEMP_FILE.name)
+    time.sleep(1.5)
+
+    # create, then update, the same output in SWMR mode
+    for _ in range(2):
+        argv = ['--init-start', tokiotest.SAMPLE_LMTDB_START_STAMP,
+                '--init-end', tokiotest.SAMPLE_LMTDB_END_STAMP,
+                '--input', tokiotest.SAMPLE_LMTDB_FILE,
+                '--timestep', str(tokiotest.SAMPLE_LMTDB_TIMESTEP),
+                '--output', tokiotest.TEMP_FILE.name,
+                '--swmr',
+                tokiotest.SAMPLE_LMTDB_START_STAMP,
+                tokiotest.SAMPLE_LMTDB_END_STAMP]
+        print("Running [%s]" % ' '.join(argv))
+        tokio.cli.archive_lmtdb.main(argv)
+
+        h5_file = h5py.File(tokiotest.TEMP_FILE.name, 'r', swmr=True)
+        summary1 = tokiotest.summarize_hdf5(h5_file)
+        h5_file.close()
+        tokiotest.identical_datasets(summary0, summary1)
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_bin_archive_lmtdb_threads():
+    """cli.archive_lmtdb --threads: concurrent retrieval matches serial
+    """
+    tokiotest.TEMP_FILE.close()
+
+    generate_tts(tokiotest.TEMP_FILE.name)
+    h5_file = h5py.File(tokiotest.TEMP_FILE.name, 'r')
+    summary0 = tokiotest.summarize_hdf5(h5_file)
+    h5_file.close()
+    os.unlink(tokiotest.TEMP_FILE.name)
+    time.sleep(1.5)
+
+    argv = ['--init-start', tokiotest.SAMPLE_LMTDB_START_STAMP,
+            '--init-end', tokiotest.SAMPLE_LMTDB_END_STAMP,
+            '--input', tokiotest.SAMPLE_LMTDB_FILE,
+            '--timestep', str(tokiotest.SAMPLE_LMTDB_TIMESTEP),
+            '--output', tokiotest.TEMP_FILE.name,
+            '--threads', '4',
+            tokiotest.SAMPLE_LMTDB_START_STAMP,
+            tokiotest.SAMPLE_LMTDB_END_STAMP]
+    print("Running [%s]" % ' '.join(argv))
+    tokio.cli.archive_lmtdb.main(argv)
+
+    h5_file = h5py.File(tokiotest.TEMP_FILE.name, 'r')
+    summary1 = tokiotest.summarize_hdf5(h5_file)
+    h5_file.close()
+    tokiotest.identical_datasets(summary0, summary1)
+
+class FailingLmtDb(tokio.connectors.lmtdb.LmtDb):
+    """LmtDb whose queries of one table fail after returning some rows
+    """
+    def __init__(self, fail_table, *args, **kwargs):
+        super(FailingLmtDb, self).__init__(*args, **kwargs)
+        self.fail_table = fail_table
+
+    def iter_timeseries_data(self, table, *args, **kwargs):
+        kwargs['batch_size'] = 16
+        for batch in super(FailingLmtDb, self).iter_timeseries_data(table, *args, **kwargs):
+            yield batch
+            if table == self.fail_table:
+                raise RuntimeError("lost connection to %s" % table)
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+@nose.tools.raises(RuntimeError)
+def test_archive_pipeline_failure():
+    """cli.archive_lmtdb.ArchivePipeline: retrieval errors propagate
+    """
+    tokiotest.TEMP_FILE.close()
+
+    start = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_START)
+    end = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_END)
+    lmtdb = FailingLmtDb('MDS_DATA', cache_file=tokiotest.SAMPLE_LMTDB_FILE)
+    datasets = tokio.cli.archive_lmtdb.DatasetDict(start, end, tokiotest.SAMPLE_LMTDB_TIMESTEP)
+    pipeline = tokio.cli.archive_lmtdb.ArchivePipeline(lmtdb=lmtdb,
+                                                       datasets=datasets,
+                                                       output_file=tokiotest.TEMP_FILE.name,
+                                                       init_start=start,
+                                                       init_end=end,
+                                                       queue_depth=1)
+    pipeline.run()
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_bin_archive_lmtdb_incremental():
+    """cli.archive_lmtdb --incremental: resume from last archived row
+    """
+    tokiotest.TEMP_FILE.close()
+
+    # reference output from a single pass
+    generate_tts(tokiotest.TEMP_FILE.name)
+    h5_file = h5py.File(tokiotest.TEMP_FILE.name, 'r')
+    summary0 = tokiotest.summarize_hdf5(h5_file)
+    h5_file.close()
+    os.unlink(tokiotest.TEMP_FILE.name)
+    time.sleep(1.5)
+
+    # archive the first half of the window, then catch up incrementally
+    start = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_START)
+    end = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_END)
+    midpoint = start + (end - start) // 2
+    argv = ['--init-start', tokiotest.SAMPLE_LMTDB_START_STAMP,
+            '--init-end', tokiotest.SAMPLE_LMTDB_END_STAMP,
+            '--input', tokiotest.SAMPLE_LMTDB_FILE,
+            '--timestep', str(tokiotest.SAMPLE_LMTDB_TIMESTEP),
+            '--output', tokiotest.TEMP_FILE.name,
+            '--incremental']
+    for query_end in [midpoint, end, end]:
+        tokio.cli.archive_lmtdb.main(argv + [
+            tokiotest.SAMPLE_LMTDB_START_STAMP,
+            query_end.strftime(tokiotest.SAMPLE_TIMESTAMP_DATE_FMT)])
+
+        h5_file = tokio.connectors.hdf5.Hdf5(tokiotest.TEMP_FILE.name, 'r')
+        last_archived = tokio.cli.archive_lmtdb.get_last_archived(h5_file)
+        h5_file.close()
+        print("Archived through %s" % last_archived)
+        assert last_archived == query_end - datetime.timedelta(seconds=tokiotest.SAMPLE_LMTDB_TIMESTEP)
+
+    h5_file = h5py.File(tokiotest.TEMP_FILE.name, 'r')
+    summary1 = tokiotest.summarize_hdf5(h5_file)
+    h5_file.close()
+    tokiotest.identical_datasets(summary0, summary1)
+
+def compare_follow_output(reference_file, follow_file):
+    """Ensure that all data in a reference file also appear in a follow file
+    """
+    schema = tokio.connectors.hdf5.SCHEMA[tokio.cli.archive_lmtdb.SCHEMA_VERSION]
+    reference = tokio.connectors.hdf5.Hdf5(reference_file, 'r')
+    followed = tokio.connectors.hdf5.Hdf5(follow_file, 'r')
+    for dataset_name in tokio.cli.archive_lmtdb.DatasetDict(None, datetime.datetime.now(), 5).config:
+        hdf5_dataset_name = schema.get(dataset_name)
+        expected = reference.to_dataframe(hdf5_dataset_name)
+        actual = followed.to_dataframe(hdf5_dataset_name).loc[expected.index, expected.columns]
+        print("Comparing %s (%d rows)" % (hdf5_dataset_name, len(expected)))
+        assert len(expected) == tokiotest.SAMPLE_LMTDB_MAX_INDEX
+        assert numpy.array_equal(expected.values, actual.values)
+        assert numpy.array_equal(numpy.signbit(expected.values), numpy.signbit(actual.values))
+    reference.close()
+    followed.close()
+
+def setup_follow():
+    """Create a reference output file and a directory for daily output files
+    """
+    tokiotest.create_tempfile()
+    tokiotest.create_tempdir()
+
+def teardown_follow():
+    """Delete the files created by setup_follow()
+    """
+    tokiotest.delete_tempfile()
+    tokiotest.delete_tempdir()
+
+@nose.tools.with_setup(setup_follow, teardown_follow)
+def test_archive_lmtdb_follow():
+    """cli.archive_lmtdb.LmtDbFollower: incremental ticks match one-shot archiving
+    """
+    tokiotest.TEMP_FILE.close()
+    generate_tts(tokiotest.TEMP_FILE.name)
+
+    start = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_START)
+    end = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_END)
+    timestep = datetime.timedelta(seconds=tokiotest.SAMPLE_LMTDB_TIMESTEP)
+    follower = tokio.cli.archive_lmtdb.LmtDbFollower(
+        lmtdb=tokio.connectors.lmtdb.LmtDb(cache_file=tokiotest.SAMPLE_LMTDB_FILE),
+        output_template=os.path.join(tokiotest.TEMP_DIR, '%Y-%m-%d.hdf5'),
+        timestep=tokiotest.SAMPLE_LMTDB_TIMESTEP,
+        start=start)
+
+    # irregular ticks, including ones too short to commit anything new
+    committed = 0
+    for offset in [7, 12, 13, 61, 62, 184]:
+        committed += follower.tick(start + datetime.timedelta(seconds=offset))
+        assert follower.lmtdb.saved_results == {}
+    assert follower.hdf5_file is not None
+    committed += follower.tick(end + timestep)
+    follower.close()
+
+    assert committed == tokiotest.SAMPLE_LMTDB_MAX_INDEX
+    compare_follow_output(tokiotest.TEMP_FILE.name,
+                          os.path.join(tokiotest.TEMP_DIR, start.strftime('%Y-%m-%d.hdf5')))
+
+@nose.tools.with_setup(setup_follow, teardown_follow)
+def test_bin_archive_lmtdb_follow_rollover():
+    """cli.archive_lmtdb --follow: roll over to a new file at midnight
+    """
+    tokiotest.TEMP_FILE.close()
+    generate_tts(tokiotest.TEMP_FILE.name)
+
+    start = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_START)
+    yesterday = start - datetime.timedelta(seconds=30)
+    argv = ['--follow',
+            '--interval', '0',
+            '--input', tokiotest.SAMPLE_LMTDB_FILE,
+            '--timestep', str(tokiotest.SAMPLE_LMTDB_TIMESTEP),
+            '--output', os.path.join(tokiotest.TEMP_DIR, '%Y-%m-%d.hdf5'),
+            yesterday.strftime(tokiotest.SAMPLE_TIMESTAMP_DATE_FMT),
+            tokiotest.SAMPLE_LMTDB_END_STAMP]
+    print("Running [%s]" % ' '.join(argv))
+    tokio.cli.archive_lmtdb.main(argv)
+
+    assert os.path.isfile(os.path.join(tokiotest.TEMP_DIR, yesterday.strftime('%Y-%m-%d.hdf5')))
+    compare_follow_output(tokiotest.TEMP_FILE.name,
+                          os.path.join(tokiotest.TEMP_DIR, start.strftime('%Y-%m-%d.hdf5')))
+
 def test_bin_archive_lmtdb_nonmonotonic():
     """cli.archive_lmtdb: counter reset to zero mid-day
 
@@ -131,6 +351,60 @@ def test_bin_archive_lmtdb_nonmonotonic():
     check_positivity(h5_file)
     h5_file.close()
 
+@nose.tools.with_setup(tokiotest.create_tempdir, tokiotest.delete_tempdir)
+def test_synthetic_lmtdb_benchmark():
+    """tests/tools: synthetic LMT database archival and benchmark
+    """
+    tools_dir = os.path.join(tokiotest.PYTOKIO_HOME, 'tests', 'tools')
+    lmtdb_file = os.path.join(tokiotest.TEMP_DIR, 'lmtdb.sqlite3')
+    output_file = os.path.join(tokiotest.TEMP_DIR, 'lmtdb.hdf5')
+    results_file = os.path.join(tokiotest.TEMP_DIR, 'results.json')
+
+    # the tools must import the same tokio package being tested
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([tokiotest.PYTOKIO_HOME]
+                                        + [x for x in [env.get('PYTHONPATH')] if x])
+
+    # generate two hours of data with frequent counter resets and gaps
+    subprocess.check_call([sys.executable, os.path.join(tools_dir, 'generate_lmtdb.py'),
+                           '--start', '2018-01-28T00:00:00',
+                           '--days', str(2.0 / 24.0),
+                           '--osts', '8',
+                           '--osts-per-oss', '2',
+                           '--mdses', '2',
+                           '--reset-fraction', '0.01',
+                           '--missing-rows', '0.01',
+                           '--missing-timestamps', '0.01',
+                           lmtdb_file], env=env)
+
+    lmtdb = tokio.connectors.lmtdb.LmtDb(cache_file=lmtdb_file)
+    assert len(lmtdb.ost_names) == 8
+    assert len(lmtdb.oss_names) == 4
+    assert len(lmtdb.mds_names) == 2
+    lmtdb.close()
+
+    generate_tts(output_file=output_file,
+                 input_file=lmtdb_file,
+                 init_start='2018-01-28T00:00:00',
+                 init_end='2018-01-28T01:00:00')
+    with h5py.File(output_file, 'r') as h5_file:
+        check_positivity(h5_file)
+        assert h5_file['datatargets/readbytes'][...].sum() > 0
+        assert h5_file['mdtargets/opens'][...].sum() > 0
+
+    subprocess.check_call([sys.executable, os.path.join(tools_dir, 'benchmark_archive_lmtdb.py'),
+                           '--repeat', '2',
+                           '--output', results_file,
+                           lmtdb_file], env=env)
+    with open(results_file, 'r') as results_fp:
+        results = json.load(results_fp)
+    stages = {stage['stage']: stage for stage in results['stages']}
+    for stage in ['query/OST_DATA', 'ingest/MDS_OPS_DATA', 'convert_deltas', 'commit_timeseries']:
+        assert len(stages[stage]['times']) == 2
+        assert stages[stage]['min'] <= stages[stage]['mean'] <= stages[stage]['max']
+    assert results['rows']['OST_DATA'] > 0
+    assert results['num_osts'] == 8
+
 
 ################################################################################
 ### Compare generated dataset to ground-truth datasets and pytokio H5LMT file ##
@@ -35,3 +35,49 @@ def test_to_epoch():
     assert flo_vers
     assert int_vers == int(flo_vers)
     assert flo_vers > int(int_vers) > 0.0
+
+def test_strptime_epoch():
+    """common.strptime_epoch()"""
+    for timestamp_str, fmt in [("2019-01-30 23:59:58", "%Y-%m-%d %H:%M:%S"),
+                               ("2019-01-30-23:59:58", "%Y-%m-%d-%H:%M:%S"),
+                               ("Wed Jan 30 23:59:58 2019", "%a %b %d %H:%M:%S %Y"),
+                               ("20190130235958.927804", "%Y%m%d%H%M%S.%f"),
+                               ("20190130235958.9", "%Y%m%d%H%M%S.%f")]:
+        expected = datetime.datetime.strptime(timestamp_str, fmt)
+        for astype in int, float:
+            # call twice to exercise the memoized path
+            for _ in range(2):
+                result = tokio.common.strptime_epoch(timestamp_str, fmt, astype)
+                print("%s (%s) -> %s" % (timestamp_str, fmt, result))
+                assert isinstance(result, astype)
+                assert result == tokio.common.to_epoch(expected, astype)
+
+def test_strptime_epoch_utc():
+    """common.strptime_epoch(utc=True)"""
+    for timestamp_str, fmt, expected in [
+            ("2019-01-30T23:59:58", "%Y-%m-%dT%H:%M:%S", 1548892798),
+            ("2019-01-30T23:59:58.25", "%Y-%m-%dT%H:%M:%S.%f", 1548892798.25)]:
+        for _ in range(2):
+            result = tokio.common.strptime_epoch(timestamp_str, fmt, type(expected), utc=True)
+            print("%s (%s) -> %s" % (timestamp_str, fmt, result))
+            assert result == expected
+        # the memo must not return UTC conversions for localtime lookups
+        assert tokio.common.strptime_epoch(timestamp_str, fmt, type(expected)) \
+            == tokio.common.to_epoch(datetime.datetime.strptime(timestamp_str, fmt),
+                                     type(expected))
+
+def test_strptime_epochs():
+    """common.strptime_epochs()"""
+    fmt = "%Y-%m-%d %H:%M:%S"
+    start = datetime.datetime(2019, 1, 30, 23, 59, 55)
+    timestamps = []
+    for index in range(30):
+        timestamp = start + datetime.timedelta(seconds=5 * (index // 3))
+        # mix strings and datetimes as returned by SQLite and MySQL
+        timestamps.append(timestamp.strftime(fmt) if index % 2 else timestamp)
+    epochs = tokio.common.strptime_epochs(timestamps, fmt)
+    assert len(epochs) == len(timestamps)
+    for timestamp, epoch in zip(timestamps, epochs):
+        if not isinstance(timestamp, datetime.datetime):
+            timestamp = datetime.datetime.strptime(timestamp, fmt)
+        assert epoch == tokio.common.to_epoch(timestamp)
@@ -6,7 +6,11 @@ database is not available, so only the sqlite3 functionality will be exercised.
 """
 
 import os
+import time
+import decimal
+import datetime
 import nose
+import numpy
 import tokiotest
 import tokio.connectors.cachingdb
 
@@ -142,6 +146,54 @@ def verify_cache_functionality(test_db):
         print("Found table %s with %d records" % (test_table, len(result)))
         assert len(result) == LIMIT_CYCLES[-1]
 
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def verify_iter_query(test_db):
+    """
+    Verifies that iter_query:
+
+    1. returns the same results as query() regardless of batch size
+    2. returns structured arrays when a dtype is given
+    3. writes each batch to a cache db when a cache file is given
+    4. does not save results in memory
+    """
+    test_table = 'OST_DATA'
+    test_table_schema = TEST_TABLES[test_table]
+    query_str = 'SELECT %s FROM %s' % (', '.join(test_table_schema['columns']), test_table)
+    expected = [tuple(row) for row in test_db.query(query_str)]
+    assert len(expected) > 0
+
+    for batch_size in 1, 7, len(expected), len(expected) * 2:
+        rows = []
+        num_batches = 0
+        for batch in test_db.iter_query(query_str, batch_size=batch_size):
+            assert len(batch) == len(test_table_schema['columns'])
+            assert 0 < len(batch[0]) <= batch_size
+            rows += list(zip(*batch))
+            num_batches += 1
+        print("Got %d records in %d batches of %d" % (len(rows), num_batches, batch_size))
+        assert rows == expected
+        assert num_batches == (len(expected) + batch_size - 1) // batch_size
+
+    dtype = [(column, 'f8') for column in test_table_schema['columns']]
+    batches = list(test_db.iter_query(query_str, batch_size=100, dtype=dtype))
+    array = numpy.concatenate(batches)
+    assert len(array) == len(expected)
+    assert (array['TS_ID'] == [row[1] for row in expected]).all()
+
+    ### Tee results into a new cache db as they are iterated over
+    for _ in test_db.iter_query(query_str,
+                                batch_size=100,
+                                table=test_table,
+                                table_schema=test_table_schema,
+                                cache_file=tokiotest.TEMP_FILE.name):
+        pass
+    assert test_table not in test_db.saved_results
+
+    cache_db = tokio.connectors.cachingdb.CachingDb(cache_file=tokiotest.TEMP_FILE.name)
+    result = cache_db.query(query_str)
+    print("Found %d records in %s" % (len(result), cache_db.cache_file))
+    assert sorted(result) == sorted(expected)
+
 TEST_FUNCTIONS = [
     (
         "cachingdb does not save results when table=None",
@@ -151,6 +203,10 @@ TEST_FUNCTIONS = [
         "cachingdb.save_cache functionality",
         verify_cache_functionality,
     ),
+    (
+        "cachingdb.iter_query functionality",
+        verify_iter_query,
+    ),
 ]
 
 def test_remote_db():
@@ -187,3 +243,227 @@ def test_cache_db():
         func = test_function
         func.description = description
         yield func, test_db
+
+class FakeConnection(object):
+    """Stand-in for a database connection that records whether it was closed
+    """
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        """Mark the connection closed"""
+        self.closed = True
+
+def test_connection_pool():
+    """
+    ConnectionPool reuses connections and discards those that raised
+    """
+    pool = tokio.connectors.cachingdb.ConnectionPool(FakeConnection, size=2)
+    with pool.connection() as conn:
+        first = conn
+    with pool.connection() as conn:
+        assert conn is first
+    assert pool.connections == [first]
+
+    ### a connection in use when an exception is raised is not reused
+    try:
+        with pool.connection() as conn:
+            assert conn is first
+            raise RuntimeError("server has gone away")
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("RuntimeError not raised")
+    assert first.closed
+    assert pool.connections == []
+
+    with pool.connection() as conn:
+        assert conn is not first
+        assert not conn.closed
+    assert pool.connections == [conn]
+
+    ### the slot held by the discarded connection was released
+    with pool.connection() as conn1:
+        with pool.connection() as conn2:
+            assert conn1 is not conn2
+    pool.close()
+    assert conn1.closed and conn2.closed
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_query_cache():
+    """
+    QueryCache hits, misses, expiration, and negative caching
+    """
+    query_cache = tokio.connectors.cachingdb.QueryCache(tokiotest.TEMP_FILE.name)
+    query_str = 'SELECT * FROM OST_DATA WHERE TS_ID = ?'
+    rows = [(1, 2, 3.0, 'a'), (4, 5, 6.0, 'b')]
+
+    assert query_cache.get(query_str, (1,)) is None
+    query_cache.put(query_str, (1,), rows)
+
+    ### whitespace in the query string does not matter, but parameters and
+    ### namespaces do
+    assert query_cache.get('  SELECT *\n FROM OST_DATA  WHERE TS_ID = ?', (1,)) == rows
+    assert query_cache.get(query_str, (2,)) is None
+    assert query_cache.get(query_str, (1,), namespace='elsewhere') is None
+
+    ### empty results are cached separately
+    query_cache.put(query_str, (2,), [])
+    assert query_cache.get(query_str, (2,)) == []
+
+    ### results persist across instances
+    query_cache.close()
+    query_cache = tokio.connectors.cachingdb.QueryCache(tokiotest.TEMP_FILE.name)
+    assert query_cache.get(query_str, (1,)) == rows
+
+    ### expired results are misses
+    query_cache.ttl = 0
+    assert query_cache.get(query_str, (1,)) is None
+    assert query_cache.stats['expirations'] == 1
+    query_cache.negative_ttl = 0
+    assert query_cache.get(query_str, (2,)) is None
+    print("Stats: %s" % query_cache.stats)
+    assert query_cache.stats['hits'] == 1
+    assert query_cache.stats['negative_hits'] == 0
+    assert query_cache.stats['misses'] == 2
+
+    ### zero ttl disables caching altogether
+    query_cache.put(query_str, (1,), rows)
+    assert query_cache.stats['stores'] == 0
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_query_cache_eviction():
+    """
+    QueryCache evicts least recently used results
+    """
+    query_cache = tokio.connectors.cachingdb.QueryCache(tokiotest.TEMP_FILE.name)
+    query_str = 'SELECT * FROM OST_DATA WHERE TS_ID = ?'
+    rows = [(x, x * 2.0) for x in range(100)]
+    query_cache.put(query_str, (0,), rows)
+    query_cache.put(query_str, (1,), rows)
+    assert query_cache.get(query_str, (0,)) == rows # (1,) is now least recent
+
+    ### room for only two entries
+    size = query_cache._db.execute("SELECT MAX(size) FROM query_cache").fetchone()[0]
+    query_cache.max_size = 2 * size
+    query_cache.put(query_str, (2,), rows)
+    print("Stats: %s" % query_cache.stats)
+    assert query_cache.stats['evictions'] == 1
+    assert query_cache.get(query_str, (1,)) is None
+    assert query_cache.get(query_str, (0,)) == rows
+    assert query_cache.get(query_str, (2,)) == rows
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_query_cache_types():
+    """
+    QueryCache preserves the types of database values
+    """
+    query_cache = tokio.connectors.cachingdb.QueryCache(tokiotest.TEMP_FILE.name)
+    query_str = 'SELECT * FROM TIMESTAMP_INFO WHERE TS_ID = ?'
+    rows = [(1, datetime.datetime(2019, 1, 30, 23, 59, 58), decimal.Decimal('1.25'),
+             b'\x00\xff', None, 'abc', 0.5),
+            (2, datetime.datetime(2019, 1, 30, 23, 59, 58, 123456), datetime.date(2019, 1, 30),
+             b'', True, '', -1.0)]
+    query_cache.put(query_str, (1,), rows)
+    query_cache.close()
+
+    query_cache = tokio.connectors.cachingdb.QueryCache(tokiotest.TEMP_FILE.name)
+    cached = query_cache.get(query_str, (1,))
+    print("Cached: %s" % cached)
+    assert cached == rows
+    for cached_row, row in zip(cached, rows):
+        assert [type(x) for x in cached_row] == [type(x) for x in row]
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_query_cache_accessed():
+    """
+    QueryCache writes back access times in batches
+    """
+    query_cache = tokio.connectors.cachingdb.QueryCache(tokiotest.TEMP_FILE.name)
+    query_str = 'SELECT * FROM OST_DATA WHERE TS_ID = ?'
+    query_cache.put(query_str, (0,), [(0, 1.0)])
+    key = query_cache.get_key(query_str, (0,))
+    get_accessed = lambda: query_cache._db.execute(
+        "SELECT accessed FROM query_cache WHERE key = ?", (key,)).fetchone()[0]
+    stored = get_accessed()
+
+    ### hits do not modify the database
+    time.sleep(0.01)
+    total_changes = query_cache._db.total_changes
+    for _ in range(3):
+        assert query_cache.get(query_str, (0,)) == [(0, 1.0)]
+    assert query_cache._db.total_changes == total_changes
+    assert get_accessed() == stored
+
+    ### access times are written back by put
+    query_cache.put(query_str, (1,), [(1, 2.0)])
+    assert get_accessed() > stored
+
+    ### and by close
+    stored = get_accessed()
+    time.sleep(0.01)
+    assert query_cache.get(query_str, (0,)) == [(0, 1.0)]
+    query_cache.close()
+    query_cache = tokio.connectors.cachingdb.QueryCache(tokiotest.TEMP_FILE.name)
+    assert get_accessed() > stored
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_cachingdb_result_cache():
+    """
+    CachingDb consults its result cache before the database
+    """
+    query_cache = tokio.connectors.cachingdb.QueryCache(tokiotest.TEMP_FILE.name)
+    test_db = tokio.connectors.cachingdb.CachingDb(cache_file=tokiotest.SAMPLE_LMTDB_FILE,
+                                                   result_cache=query_cache)
+    query_str = 'SELECT * FROM OST_DATA WHERE TS_ID = %(ps)s'
+    ts_id = test_db.query('SELECT MIN(TS_ID) FROM OST_DATA')[0][0]
+
+    result = test_db.query(query_str, (ts_id,), table='OST_DATA')
+    assert test_db.last_hit == tokio.connectors.cachingdb.HIT_CACHE_DB
+    assert len(result) > 0
+    cached_result = test_db.query(query_str, (ts_id,), table='OST_DATA')
+    assert test_db.last_hit == tokio.connectors.cachingdb.HIT_RESULT_CACHE
+    assert list(cached_result) == list(result)
+
+    ### cached results are still saved in memory
+    assert len(test_db.saved_results['OST_DATA']['rows']) == 2 * len(result)
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_cache_writer():
+    """
+    CacheWriter appends without duplicating rows
+    """
+    test_table = 'OSS_DATA'
+    test_table_schema = TEST_TABLES[test_table]
+    source_db = tokio.connectors.cachingdb.CachingDb(cache_file=tokiotest.SAMPLE_LMTDB_FILE)
+    rows = source_db.query('SELECT * FROM %s' % test_table)
+    assert len(rows) > 2
+
+    ### write the same rows twice in one transaction, then append half of them
+    ### again with different values
+    with tokio.connectors.cachingdb.CacheWriter(tokiotest.TEMP_FILE.name) as writer:
+        writer.write(test_table, rows, test_table_schema)
+        writer.write(test_table, iter(rows), test_table_schema)
+        assert writer.num_rows[test_table] == 2 * len(rows)
+
+    updated_rows = [row[:-1] + (-1.0,) for row in rows[:len(rows) // 2]]
+    with tokio.connectors.cachingdb.CacheWriter(tokiotest.TEMP_FILE.name) as writer:
+        writer.write(test_table, updated_rows, test_table_schema)
+
+    cache_db = tokio.connectors.cachingdb.CachingDb(cache_file=tokiotest.TEMP_FILE.name)
+    result = cache_db.query('SELECT * FROM %s' % test_table)
+    print("Wrote %d rows, found %d" % (2 * len(rows) + len(updated_rows), len(result)))
+    assert sorted(result) == sorted(updated_rows + list(rows[len(rows) // 2:]))
+    journal_mode = cache_db.query('PRAGMA journal_mode')[0][0]
+    assert journal_mode.lower() == 'delete'
+    cache_db.close_cache()
+
+    ### nothing is committed if writing fails
+    try:
+        with tokio.connectors.cachingdb.CacheWriter(tokiotest.TEMP_FILE.name) as writer:
+            writer.write(test_table, [row[:-1] + (-2.0,) for row in rows], test_table_schema)
+            raise RuntimeError("simulated failure")
+    except RuntimeError:
+        pass
+    cache_db = tokio.connectors.cachingdb.CachingDb(cache_file=tokiotest.TEMP_FILE.name)
+    assert sorted(cache_db.query('SELECT * FROM %s' % test_table)) == sorted(result)
@@ -149,3 +149,54 @@ def test_to_dataframe():
     dataframe = esdb.to_dataframe()
     print(dataframe)
     assert len(dataframe) > 0
+
+def test_aggregate_interfaces():
+    """connectors.collectd_es.CollectdEs.aggregate_*
+    """
+    timestep = tokiotest.SAMPLE_COLLECTDES_TIMESTEP
+    pages = json.load(gzip.open(tokiotest.SAMPLE_COLLECTDES_CPULOAD, 'rt'))
+    esdb = tokio.connectors.collectd_es.CollectdEs(host=None, port=None, index=None)
+    esdb.local_mode = True
+    for plugin, method in (('cpu', esdb.aggregate_cpu),
+                           ('disk', esdb.aggregate_disk),
+                           ('memory', esdb.aggregate_memory)):
+        plugin_pages = [[doc for doc in page if doc['_source']['plugin'] == plugin] for page in pages]
+        esdb.fake_pages = []
+        for buckets in tokiotest.aggregate_collectd_pages(plugin_pages, timestep, page_size=10):
+            esdb.fake_pages.append({
+                'aggregations': {
+                    tokio.connectors.es.AGGREGATION_NAME: {
+                        'after_key': buckets[-1]['key'],
+                        'buckets': buckets
+                    }
+                }
+            })
+        num_buckets = sum([len(page['aggregations'][tokio.connectors.es.AGGREGATION_NAME]['buckets'])
+                           for page in esdb.fake_pages])
+        esdb.fake_pages.append({'aggregations': {tokio.connectors.es.AGGREGATION_NAME: {'buckets': []}}})
+
+        method(datetime.datetime.now() - datetime.timedelta(hours=1), datetime.datetime.now(), timestep)
+        print("Got %d pages of %s buckets" % (len(esdb.scroll_pages), plugin))
+        assert esdb.scroll_pages
+        assert sum([len(page) for page in esdb.scroll_pages]) == num_buckets
+        for page in esdb.scroll_pages:
+            for bucket in page:
+                assert bucket['key']['plugin'] == plugin
+                for field in tokio.connectors.collectd_es.AGGREGATION_SOURCES[plugin]:
+                    assert field in bucket['key']
+        assert not esdb.fake_pages
+
+def test_build_aggregation_query():
+    """connectors.collectd_es.build_aggregation_query()
+    """
+    query = tokio.connectors.collectd_es.build_aggregation_query(
+        tokio.connectors.collectd_es.QUERY_DISK_DATA, 'disk', 10)
+    composite = query['aggs'][tokio.connectors.es.AGGREGATION_NAME]
+    sources = [list(source.keys())[0] for source in composite['composite']['sources']]
+    assert sources[0] == '@timestamp'
+    assert composite['composite']['sources'][0]['@timestamp']['date_histogram']['interval'] == '10s'
+    assert sources[1:] == tokio.connectors.collectd_es.AGGREGATION_SOURCES['disk']
+    assert set(composite['aggs'].keys()) == set(['read', 'write'])
+    assert query['size'] == 0
+    # the template's filters must be retained
+    assert query['query'] == tokio.connectors.collectd_es.QUERY_DISK_DATA['query']
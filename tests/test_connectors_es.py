@@ -4,8 +4,13 @@ Test the ElasticSearch collectd connector.  Some of these tests will essentially
 pass only at NERSC because of the assumptions built into the indices.
 """
 
+import os
 import copy
+import json
 import datetime
+import nose
+import numpy
+import tokiotest
 import tokio.connectors.es
 
 FLUSH_STATE = {'pages': []}
@@ -159,3 +164,333 @@ def test_build_timeseries_query():
             start_key='@timestamp',
             end_key='INVALID KEY')
         assert ret != ret_ref
+
+def make_fake_aggregation_pages(num_pages=NUM_PAGES, page_size=PAGE_SIZE):
+    """Create a set of fake composite aggregation responses
+    """
+    fake_pages = []
+    for page_id in range(num_pages):
+        buckets = []
+        for bucket_id in range(page_size):
+            buckets.append({
+                'key': {'id': page_id * page_size + bucket_id},
+                'doc_count': 1,
+            })
+        fake_pages.append({
+            'aggregations': {
+                tokio.connectors.es.AGGREGATION_NAME: {
+                    'after_key': buckets[-1]['key'],
+                    'buckets': buckets,
+                }
+            }
+        })
+
+    # a page without buckets signals the end of a composite aggregation
+    fake_pages.append({
+        'aggregations': {tokio.connectors.es.AGGREGATION_NAME: {'buckets': []}}
+    })
+    return fake_pages
+
+class FakeClient(object):
+    """Records queries and returns fake pages in place of Elasticsearch"""
+    def __init__(self, pages):
+        self.pages = pages
+        self.bodies = []
+
+    def search(self, body, **kwargs):
+        """Return the next fake page"""
+        self.bodies.append(copy.deepcopy(body))
+        return self.pages.pop(0)
+
+def test_query_and_aggregate():
+    """connectors.es.EsConnection.query_and_aggregate()
+    """
+    query = tokio.connectors.es.build_composite_query(
+        tokio.connectors.es.BASE_QUERY,
+        sources=[{'id': {'terms': {'field': 'id'}}}],
+        metrics={'total': {'sum': {'field': 'value'}}},
+        page_size=PAGE_SIZE)
+    composite = query['aggs'][tokio.connectors.es.AGGREGATION_NAME]
+    assert query['size'] == 0
+    assert composite['composite']['size'] == PAGE_SIZE
+    assert 'total' in composite['aggs']
+
+    # local mode
+    es_obj = tokio.connectors.es.EsConnection(host=None, port=None)
+    es_obj.local_mode = True
+    es_obj.fake_pages = make_fake_aggregation_pages()
+    es_obj.query_and_aggregate(
+        query,
+        filter_function=lambda x: x['aggregations'][tokio.connectors.es.AGGREGATION_NAME]['buckets'])
+    assert len(es_obj.scroll_pages) == NUM_PAGES
+    ids = [bucket['key']['id'] for page in es_obj.scroll_pages for bucket in page]
+    assert ids == list(range(NUM_PAGES * PAGE_SIZE))
+
+    # ensure each page's after_key is passed to the subsequent query
+    es_obj.local_mode = False
+    es_obj.client = FakeClient(make_fake_aggregation_pages())
+    es_obj.query_and_aggregate(query)
+    assert len(es_obj.scroll_pages) == NUM_PAGES
+    assert len(es_obj.client.bodies) == NUM_PAGES + 1
+    assert 'after' not in es_obj.client.bodies[0]['aggs'][tokio.connectors.es.AGGREGATION_NAME]['composite']
+    for page_id, body in enumerate(es_obj.client.bodies[1:]):
+        after = body['aggs'][tokio.connectors.es.AGGREGATION_NAME]['composite']['after']
+        assert after == {'id': (page_id + 1) * PAGE_SIZE - 1}
+    # the original query must not be modified
+    assert 'after' not in composite['composite']
+
+def make_sliced_fake_pages(num_slices, num_pages=NUM_PAGES, page_size=PAGE_SIZE):
+    """Create one set of fake pages per slice with unique document ids
+    """
+    sliced_pages = []
+    for slice_id in range(num_slices):
+        fake_pages = make_fake_pages(num_pages=num_pages, page_size=page_size)
+        for fake_page in fake_pages:
+            fake_page['_scroll_id'] = "%d-%s" % (slice_id, fake_page['_scroll_id'])
+            for hit in fake_page['hits']['hits']:
+                hit['_id'] = "%d-%s" % (slice_id, hit['_id'])
+        sliced_pages.append(fake_pages)
+    return sliced_pages
+
+class SlicedFakeClient(object):
+    """Serves fake pages for each slice of a sliced scroll"""
+    def __init__(self, sliced_pages, fail_slice=None):
+        self.sliced_pages = sliced_pages
+        self.fail_slice = fail_slice
+        self.slices = []
+
+    def search(self, body, **kwargs):
+        """Return the first page of a slice"""
+        self.slices.append(copy.deepcopy(body['slice']))
+        return self.sliced_pages[body['slice']['id']].pop(0)
+
+    def scroll(self, scroll_id, **kwargs):
+        """Return the next page of the slice that owns scroll_id"""
+        slice_id = int(scroll_id.split('-')[0])
+        if slice_id == self.fail_slice:
+            raise RuntimeError("slice %d failed" % slice_id)
+        return self.sliced_pages[slice_id].pop(0)
+
+def test_sliced_scroll():
+    """connectors.es.EsConnection.query_and_scroll(slices=N)
+    """
+    num_slices = 3
+    expected = set()
+    for fake_pages in make_sliced_fake_pages(num_slices):
+        for fake_page in fake_pages:
+            expected |= set([x['_id'] for x in fake_page['hits']['hits']])
+
+    es_obj = tokio.connectors.es.EsConnection(host=None, port=None)
+
+    # local mode, with flushing
+    es_obj.local_mode = True
+    es_obj.fake_pages = make_sliced_fake_pages(num_slices)
+    flushed = []
+    def sliced_flush_function(es_obj):
+        """retain and discard accumulated pages"""
+        flushed.extend(es_obj.scroll_pages)
+        es_obj.scroll_pages = []
+    es_obj.query_and_scroll({}, flush_every=3 * PAGE_SIZE, flush_function=sliced_flush_function,
+                            slices=num_slices)
+    assert es_obj._num_flushes > 0
+    hits = set([x['_id'] for page in flushed + es_obj.scroll_pages for x in page['hits']['hits']])
+    assert hits == expected
+    assert not any(es_obj.fake_pages)
+
+    # remote mode
+    es_obj.local_mode = False
+    es_obj.client = SlicedFakeClient(make_sliced_fake_pages(num_slices))
+    es_obj.query_and_scroll({}, slices=num_slices)
+    assert len(es_obj.scroll_pages) == num_slices * NUM_PAGES
+    hits = set([x['_id'] for page in es_obj.scroll_pages for x in page['hits']['hits']])
+    assert hits == expected
+    assert sorted([x['id'] for x in es_obj.client.slices]) == list(range(num_slices))
+    assert all([x['max'] == num_slices for x in es_obj.client.slices])
+
+@nose.tools.raises(RuntimeError)
+def test_sliced_scroll_failure():
+    """connectors.es.EsConnection.query_and_scroll(slices=N) with a failing slice
+    """
+    es_obj = tokio.connectors.es.EsConnection(host=None, port=None)
+    es_obj.local_mode = False
+    es_obj.client = SlicedFakeClient(make_sliced_fake_pages(3), fail_slice=1)
+    es_obj.query_and_scroll({}, slices=3)
+
+def make_fake_source_pages(num_pages=NUM_PAGES, page_size=PAGE_SIZE):
+    """Create a set of fake pages whose hits contain _source fields
+    """
+    fake_pages = make_fake_pages(num_pages=num_pages, page_size=page_size)
+    for fake_page in fake_pages:
+        for hit in fake_page['hits']['hits']:
+            hit['_source'] = {'id': int(hit['_id']), 'payload': hit['payload'], 'extra': None}
+    return fake_pages
+
+class ScrollFakeClient(FakeClient):
+    """Serves fake pages through the scroll API and records cleared scrolls"""
+    def __init__(self, pages):
+        super(ScrollFakeClient, self).__init__(pages)
+        self.cleared = []
+
+    def scroll(self, scroll_id, **kwargs):
+        """Return the next fake page"""
+        return self.pages.pop(0)
+
+    def clear_scroll(self, scroll_id, **kwargs):
+        """Record the scroll id being released"""
+        self.cleared.append(scroll_id)
+
+def test_iter_hits():
+    """connectors.es.EsConnection.iter_hits()
+    """
+    es_obj = tokio.connectors.es.EsConnection(host=None, port=None)
+    es_obj.local_mode = True
+
+    # whole hits, without retaining pages
+    es_obj.fake_pages = make_fake_source_pages()
+    ids = [hit['_id'] for hit in es_obj.iter_hits({})]
+    assert ids == [str(x) for x in range(NUM_PAGES * PAGE_SIZE)]
+    assert not es_obj.scroll_pages
+    assert not es_obj.fake_pages
+
+    # selected fields
+    es_obj.fake_pages = make_fake_source_pages()
+    docs = list(es_obj.iter_hits({}, fields=['id', 'missing']))
+    assert len(docs) == NUM_PAGES * PAGE_SIZE
+    assert docs[1] == {'id': 1, 'missing': None}
+
+    # column batches, one per page
+    es_obj.fake_pages = make_fake_source_pages()
+    batches = list(es_obj.iter_hits({}, fields=['id', 'payload'], columns=True))
+    assert len(batches) == NUM_PAGES
+    assert batches[0]['id'] == list(range(PAGE_SIZE))
+
+    # pages are only requested as they are consumed
+    es_obj.fake_pages = make_fake_source_pages()
+    hits = es_obj.iter_hits({})
+    for _ in range(PAGE_SIZE + 1):
+        next(hits)
+    assert len(es_obj.fake_pages) == NUM_PAGES - 1
+    hits.close()
+    assert len(es_obj.fake_pages) == NUM_PAGES - 1
+
+    # abandoning a scroll releases its search context
+    es_obj.local_mode = False
+    es_obj.client = ScrollFakeClient(make_fake_source_pages())
+    for hit in es_obj.iter_hits({}):
+        if hit['_id'] == str(PAGE_SIZE):
+            break
+    assert es_obj.client.cleared == ['1']
+    es_obj.client = ScrollFakeClient(make_fake_source_pages())
+    assert len(list(es_obj.iter_hits({}))) == NUM_PAGES * PAGE_SIZE
+    assert not es_obj.client.cleared
+
+    # without a query, retained pages are iterated and left intact
+    es_obj.local_mode = True
+    es_obj.fake_pages = make_fake_source_pages()
+    es_obj.query_and_scroll({})
+    assert len(list(es_obj.iter_hits())) == NUM_PAGES * PAGE_SIZE
+    assert len(es_obj.scroll_pages) == NUM_PAGES
+
+@nose.tools.raises(ValueError)
+def test_iter_hits_columns_without_fields():
+    """connectors.es.EsConnection.iter_hits(columns=True) without fields
+    """
+    es_obj = tokio.connectors.es.EsConnection(host=None, port=None)
+    next(es_obj.iter_hits(columns=True))
+
+def test_to_dataframe():
+    """connectors.es.EsConnection.to_dataframe()
+    """
+    fields = ['id', 'payload', 'extra']
+    es_obj = tokio.connectors.es.EsConnection(host=None, port=None)
+    es_obj.local_mode = True
+
+    # from retained pages
+    es_obj.fake_pages = make_fake_source_pages()
+    es_obj.query_and_scroll({}, filter_function=lambda x: x['hits']['hits'])
+    dataframe = es_obj.to_dataframe(fields)
+    assert list(dataframe.columns) == fields
+    assert len(dataframe) == NUM_PAGES * PAGE_SIZE
+    assert list(dataframe['id']) == list(range(NUM_PAGES * PAGE_SIZE))
+    assert dataframe['extra'].isnull().all()
+
+    # streamed directly from a query
+    es_obj.scroll_pages = []
+    es_obj.fake_pages = make_fake_source_pages()
+    streamed = es_obj.to_dataframe(fields, query={})
+    assert not es_obj.scroll_pages
+    assert streamed.equals(dataframe)
+
+@nose.tools.with_setup(tokiotest.create_tempdir, tokiotest.delete_tempdir)
+def test_ndjson_cache():
+    """connectors.es.EsConnection NDJSON caches
+    """
+    filter_function = lambda x: x['hits']['hits']
+    for extension in ('.ndjson', '.jsonl.gz', '.ndjson.bz2', '.ndjson.xz'):
+        if extension[-3:] == '.xz' and '.xz' not in tokio.connectors.es.CACHE_COMPRESSORS:
+            continue
+        saved_file = os.path.join(tokiotest.TEMP_DIR, 'saved' + extension)
+        streamed_file = os.path.join(tokiotest.TEMP_DIR, 'streamed' + extension)
+        assert tokio.connectors.es.is_ndjson_cache(saved_file)
+
+        # write one cache while scrolling and another afterward
+        es_obj = tokio.connectors.es.EsConnection(host=None, port=None)
+        es_obj.local_mode = True
+        es_obj.fake_pages = make_fake_source_pages()
+        es_obj.cache_output = tokio.connectors.es.open_cache(streamed_file, 'w')
+        es_obj.query_and_scroll({}, filter_function=filter_function)
+        es_obj.cache_output.close()
+        es_obj.save_cache(saved_file)
+        print("Wrote %s and %s" % (saved_file, streamed_file))
+
+        for cache_file in (saved_file, streamed_file):
+            decoded = []
+            def decoder(line):
+                """record each line as it is decoded"""
+                decoded.append(line)
+                return json.loads(line)
+            cached = tokio.connectors.es.EsConnection.from_cache(cache_file, decoder=decoder)
+
+            # pages are only decoded once they are needed
+            assert not decoded
+            next(cached.iter_hits({}))
+            assert len(decoded) == 1
+
+            del decoded[:]
+            cached = tokio.connectors.es.EsConnection.from_cache(cache_file, decoder=decoder)
+            cached.query_and_scroll({}, filter_function=filter_function)
+            assert len(decoded) == NUM_PAGES
+            assert cached.scroll_pages == es_obj.scroll_pages
+
+    assert not tokio.connectors.es.is_ndjson_cache('cache.json.gz')
+
+def test_convert_column():
+    """connectors.es.convert_column()
+    """
+    assert tokio.connectors.es.convert_column([1, 'a']) == [1, 'a']
+
+    column = tokio.connectors.es.convert_column(['a', 'b', 'a', None], 'category')
+    assert list(column.categories) == ['a', 'b']
+    assert list(column.codes) == [0, 1, 0, -1]
+
+    column = tokio.connectors.es.convert_column(['a', ('b', 'c'), None], 'object')
+    assert column.dtype == object and list(column) == ['a', ('b', 'c'), None]
+
+    column = tokio.connectors.es.convert_column([1, '2', 3], 'int')
+    assert column.dtype == numpy.int64 and list(column) == [1, 2, 3]
+    column = tokio.connectors.es.convert_column([1, None], 'int')
+    assert column.dtype == numpy.float64 and numpy.isnan(column[1])
+    column = tokio.connectors.es.convert_column([1.5, None], 'float')
+    assert column[0] == 1.5 and numpy.isnan(column[1])
+
+    column = tokio.connectors.es.convert_column(
+        ['1970-01-01T00:00:01.500Z', '1970-01-01T01:00:00+01:00', '1970-01-01T00:00:03Z',
+         None, 'garbage'], 'epoch')
+    assert list(column[:3]) == [1.5, 0.0, 3.0]
+    assert numpy.isnan(column[3]) and numpy.isnan(column[4])
+    column = tokio.connectors.es.convert_column(
+        ['19700101000002.250000'],
+        lambda x: tokio.connectors.es.to_epochs(x, fmt="%Y%m%d%H%M%S.%f"))
+    assert column[0] == 2.25
+
+    nose.tools.assert_raises(ValueError, tokio.connectors.es.convert_column, [1], 'bogus')
@@ -1,8 +1,10 @@
 """Test the ESnet SNMP REST API connector
 """
 
+import os
 import gzip
 import json
+import time
 import datetime
 
 HAVE_REQUESTS = True
@@ -12,6 +14,7 @@ except ImportError:
     HAVE_REQUESTS = False
 
 import nose
+import numpy
 
 import tokiotest
 import tokio.connectors.esnet_snmp
@@ -197,6 +200,279 @@ def test_to_dataframe():
         expected_rows))
     assert len(dataframe[filt]) == expected_rows 
 
+    # every value is in the dataframe with its local timestamp
+    for timestamp, value in esnetsnmp[endpoint][interface][direction].items():
+        row = dataframe[filt & (dataframe['timestamp'] == datetime.datetime.fromtimestamp(timestamp))]
+        assert len(row) == 1
+        assert row['data_rate'].iloc[0] == value
+
     # just make sure the multiindex=True parameter works and produces something
     dataframe = esnetsnmp.to_dataframe(multiindex=True)
     assert len(dataframe)
+    assert list(dataframe.index.names) == ['timestamp', 'endpoint', 'interface', 'direction']
+
+def test_snmp_series():
+    """esnet_snmp.SnmpSeries
+    """
+    series = tokio.connectors.esnet_snmp.SnmpSeries({'30': 2.0, '0': 1.0})
+    assert series.epochs.dtype == numpy.int64
+    assert series.rates.dtype == numpy.float64
+    assert list(series) == [0, 30]
+    assert series[30] == 2.0
+    assert 30 in series
+    assert '30' not in series
+
+    # single elements and bulk updates both keep the series sorted and unique
+    series[60] = 3.0
+    series[0] = 0.5
+    series.extend(numpy.array([120, 90, 60]), numpy.array([5.0, 4.0, 3.5]))
+    assert series.to_dict() == {0: 0.5, 30: 2.0, 60: 3.5, 90: 4.0, 120: 5.0}
+    assert series.keys() == [0, 30, 60, 90, 120]
+    assert sum(series.values()) == 15.0
+
+    # later values for the same timestamp win
+    series.extend(numpy.array([150, 150]), numpy.array([6.0, 7.0]))
+    assert series[150] == 7.0
+
+    del series[150]
+    assert len(series) == 5
+    assert series == {0: 0.5, 30: 2.0, 60: 3.5, 90: 4.0, 120: 5.0}
+    assert series == tokio.connectors.esnet_snmp.SnmpSeries(series.to_dict())
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_save_cache():
+    """EsnetSnmp.save_cache() round trip
+    """
+    esnetsnmp = tokio.connectors.esnet_snmp.EsnetSnmp(
+        start=ESNETSNMP_START,
+        end=ESNETSNMP_END,
+        input_file=tokiotest.SAMPLE_ESNET_SNMP_FILE)
+    esnetsnmp.save_cache(tokiotest.TEMP_FILE.name, sort_keys=True)
+
+    # the cache is still a plain dict of dicts
+    with gzip.open(tokiotest.SAMPLE_ESNET_SNMP_FILE, 'rt') as sample:
+        expected = json.load(sample)
+    with open(tokiotest.TEMP_FILE.name, 'r') as cache:
+        assert json.load(cache) == expected
+
+    reloaded = tokio.connectors.esnet_snmp.EsnetSnmp(
+        start=ESNETSNMP_START,
+        end=ESNETSNMP_END,
+        input_file=tokiotest.TEMP_FILE.name)
+    assert reloaded == esnetsnmp
+
+def test_split_window():
+    """esnet_snmp.split_window()
+    """
+    assert tokio.connectors.esnet_snmp.split_window(0, 99) == [(0, 99)]
+    assert tokio.connectors.esnet_snmp.split_window(0, 99, 40) == [(0, 39), (40, 79), (80, 99)]
+    assert tokio.connectors.esnet_snmp.split_window(0, 99, 50) == [(0, 49), (50, 99)]
+    assert tokio.connectors.esnet_snmp.split_window(0, 100, 50) == [(0, 49), (50, 99), (100, 100)]
+
+def test_merge_responses():
+    """esnet_snmp.merge_responses()
+    """
+    merged = tokio.connectors.esnet_snmp.merge_responses([
+        {'agg': '30', 'begin_time': 0, 'end_time': 59, 'data': [[0, 1.0], [30, 2.0]]},
+        {'agg': '30', 'begin_time': 60, 'end_time': 119, 'data': []},
+        {'agg': '30', 'begin_time': 120, 'end_time': 179, 'data': [[90, 3.0], [120, 4.0], [150, 5.0]]},
+    ])
+    assert merged['begin_time'] == 0
+    assert merged['end_time'] == 179
+    assert merged['agg'] == '30'
+    assert merged['data'] == [[0, 1.0], [30, 2.0], [90, 3.0], [120, 4.0], [150, 5.0]]
+
+def test_get_many_interface_counters():
+    """EsnetSnmp.get_many_interface_counters()
+    """
+    if not HAVE_REQUESTS:
+        raise nose.SkipTest("requests library not available")
+
+    start = datetime.datetime(2019, 2, 11, 0, 0, 0)
+    end = datetime.datetime(2019, 2, 11, 0, 59, 59)
+    targets = [(endpoint, interface, direction)
+               for endpoint, interfaces in sorted(ESNETSNMP_ENDPOINTS.items())
+               for interface in interfaces
+               for direction in ('in', 'out')]
+    max_workers = 3
+    window = 600
+
+    with tokiotest.FakeEsnetSnmpServer(rate_limit=True) as server:
+        concurrent = tokio.connectors.esnet_snmp.EsnetSnmp(start=start, end=end)
+        results = concurrent.get_many_interface_counters(targets,
+                                                         interval=60,
+                                                         max_workers=max_workers,
+                                                         window=window,
+                                                         timeout=5)
+        num_windows = len(tokio.connectors.esnet_snmp.split_window(
+            concurrent.start_epoch, concurrent.end_epoch, window))
+        print("Issued %d requests over %d connections; %d rate limited" % (
+            len(server.requests), len(server.client_ports), server.rate_limited))
+        # every window was rate limited once and then retried
+        assert server.rate_limited == len(targets) * num_windows
+        assert len(server.requests) == 2 * len(targets) * num_windows
+        # connections were reused
+        assert len(server.client_ports) <= max_workers
+
+    with tokiotest.FakeEsnetSnmpServer() as server:
+        serial = tokio.connectors.esnet_snmp.EsnetSnmp(start=start, end=end)
+        for endpoint, interface, direction in targets:
+            serial.get_interface_counters(endpoint, interface, direction, interval=60, timeout=5)
+
+    assert len(results) == len(targets)
+    for (endpoint, interface, direction), result in zip(targets, results):
+        timestamps = [point[0] for point in result['data']]
+        assert timestamps == sorted(set(timestamps))
+        assert len(timestamps) == 60
+        assert concurrent[endpoint][interface][direction] == serial[endpoint][interface][direction]
+    assert concurrent.timestep == 60
+
+class FailingSession(object):
+    """requests.Session stand-in whose requests always raise an exception
+    """
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def get(self, *args, **kwargs):
+        """Count the request and fail it"""
+        self.calls += 1
+        raise self.error
+
+def test_get_url_retries():
+    """esnet_snmp._get_url retries only transient failures
+    """
+    if not HAVE_REQUESTS:
+        raise nose.SkipTest("requests not available")
+    import requests.exceptions
+
+    backoff = tokio.connectors.esnet_snmp.RETRY_BACKOFF
+    tokio.connectors.esnet_snmp.RETRY_BACKOFF = 0.0
+    try:
+        for error, expected_calls in [(requests.exceptions.ConnectTimeout(), 3),
+                                      (requests.exceptions.ConnectionError(), 1)]:
+            session = FailingSession(error)
+            try:
+                tokio.connectors.esnet_snmp._get_url('http://localhost/',
+                                                     params={},
+                                                     session=session,
+                                                     max_retries=2)
+            except type(error):
+                pass
+            else:
+                raise AssertionError("%s not raised" % type(error).__name__)
+            print("%s: %d calls" % (type(error).__name__, session.calls))
+            assert session.calls == expected_calls
+    finally:
+        tokio.connectors.esnet_snmp.RETRY_BACKOFF = backoff
+
+def test_missing_ranges():
+    """esnet_snmp.merge_ranges() and esnet_snmp.missing_ranges()
+    """
+    merged = tokio.connectors.esnet_snmp.merge_ranges([(50, 60), (0, 9), (10, 20), (15, 30)])
+    assert merged.tolist() == [[0, 30], [50, 60]]
+    assert tokio.connectors.esnet_snmp.merge_ranges([]).shape == (0, 2)
+
+    missing_ranges = tokio.connectors.esnet_snmp.missing_ranges
+    assert missing_ranges([], 0, 99) == [(0, 99)]
+    assert missing_ranges(merged, 0, 99) == [(31, 49), (61, 99)]
+    assert missing_ranges(merged, 5, 25) == []
+    assert missing_ranges(merged, 25, 55) == [(31, 49)]
+
+@nose.tools.with_setup(tokiotest.create_tempdir, tokiotest.delete_tempdir)
+def test_snmp_cache():
+    """EsnetSnmp.get_many_interface_counters() with SnmpCache
+    """
+    if not HAVE_REQUESTS:
+        raise nose.SkipTest("requests library not available")
+
+    start = datetime.datetime(2019, 2, 11, 0, 0, 0)
+    end = datetime.datetime(2019, 2, 11, 0, 59, 59)
+    targets = [('sunn-cr5', '5_2_1', 'in'), ('sunn-cr5', '5_2_1', 'out')]
+    cache = tokio.connectors.esnet_snmp.SnmpCache(tokiotest.TEMP_DIR, retention=None)
+
+    with tokiotest.FakeEsnetSnmpServer() as server:
+        first = tokio.connectors.esnet_snmp.EsnetSnmp(start=start, end=end)
+        first.get_many_interface_counters(targets, interval=60, window=600, cache=cache, timeout=5)
+        assert len(server.requests) == len(targets) * 6
+        # nothing is written until the results are committed
+        assert not os.listdir(tokiotest.TEMP_DIR)
+        cache.commit()
+        assert len(os.listdir(tokiotest.TEMP_DIR)) == len(targets)
+        cache = tokio.connectors.esnet_snmp.SnmpCache(tokiotest.TEMP_DIR, retention=None)
+
+        # an overlapping window only retrieves what isn't cached
+        del server.requests[:]
+        second = tokio.connectors.esnet_snmp.EsnetSnmp(start=start + datetime.timedelta(minutes=30),
+                                                       end=end + datetime.timedelta(minutes=30))
+        results = second.get_many_interface_counters(targets, interval=60, window=600, cache=cache, timeout=5)
+        print("Cached run issued %d requests" % len(server.requests))
+        assert len(server.requests) == len(targets) * 3
+        assert second.timestep == 60
+
+        # a window that is entirely cached retrieves nothing
+        del server.requests[:]
+        third = tokio.connectors.esnet_snmp.EsnetSnmp(start=start, end=end)
+        third.get_many_interface_counters(targets, interval=60, window=600, cache=cache, timeout=5)
+        assert not server.requests
+        assert third == first
+
+        uncached = tokio.connectors.esnet_snmp.EsnetSnmp(start=second.start, end=second.end)
+        uncached.get_many_interface_counters(targets, interval=60, window=600, timeout=5)
+
+    for (endpoint, interface, direction), result in zip(targets, results):
+        assert len(result['data']) == 60
+        assert second[endpoint][interface][direction] == uncached[endpoint][interface][direction]
+
+@nose.tools.with_setup(tokiotest.create_tempdir, tokiotest.delete_tempdir)
+def test_snmp_cache_retention():
+    """SnmpCache retention policy
+    """
+    cache = tokio.connectors.esnet_snmp.SnmpCache(tokiotest.TEMP_DIR, retention=86400, settle_time=600)
+    key = ('sunn-cr5', '5_2_1', 'in', None, None)
+    now = int(time.time())
+    begin = now - 2 * 86400
+    response = {
+        'agg': '3600',
+        'begin_time': begin,
+        'end_time': now,
+        'data': [[timestamp, 1.0] for timestamp in range(begin, now + 1, 3600)],
+    }
+    result = cache.update(key, [response], [(begin, now)], begin, now)
+    assert len(result['data']) == len(response['data'])
+    cache.commit()
+
+    epochs, rates, covered, timestep = cache.load(key)
+    assert timestep == 3600
+    assert len(epochs) == len(rates)
+    assert epochs.min() >= now - 86400
+    # neither expired nor unsettled data is considered cached
+    assert cache.missing(key, begin, now) == [(begin, now - 86400 - 1), (now - 600 + 1, now)]
+
+    # stale series are removed entirely
+    os.utime(cache.path(key), (begin, begin))
+    assert cache.prune() == 1
+    assert not os.listdir(tokiotest.TEMP_DIR)
+
+@nose.tools.with_setup(tokiotest.create_tempdir, tokiotest.delete_tempdir)
+def test_snmp_cache_empty_response():
+    """SnmpCache does not cache windows that returned no data
+    """
+    cache = tokio.connectors.esnet_snmp.SnmpCache(tokiotest.TEMP_DIR, retention=None)
+    key = ('sunn-cr5', '5_2_1', 'in', None, None)
+    begin, end = 1549843200, 1549846799
+    windows = [(begin, begin + 1799), (begin + 1800, end)]
+    responses = [
+        {'agg': '30', 'data': [[timestamp, 1.0] for timestamp in range(begin, begin + 1800, 30)]},
+        # the REST API returns no data when it is rate limiting
+        {'agg': '30', 'data': []},
+    ]
+    result = cache.update(key, responses, windows, begin, end)
+    assert len(result['data']) == 60
+    assert cache.missing(key, begin, end) == [windows[1]]
+
+    # discarded updates are never written
+    cache.discard()
+    cache.commit()
+    assert not os.listdir(tokiotest.TEMP_DIR)
+    assert cache.missing(key, begin, end) == [(begin, end)]
@@ -454,6 +454,53 @@ def test_set_versions():
     hdf5.close()
     test_get_versions(hdf5_filename=tokiotest.TEMP_FILE.name)
 
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_key_cache_invalidation():
+    """connectors.hdf5.Hdf5 key resolution cache invalidation
+    """
+    hdf5 = tokio.connectors.hdf5.Hdf5(tokiotest.TEMP_FILE.name, 'w', ignore_version=True)
+    hdf5.set_version(version='global')
+
+    # populate the caches with a negative lookup
+    assert INVALID_DATASET not in hdf5
+    nose.tools.assert_raises(KeyError, hdf5.__getitem__, INVALID_DATASET)
+
+    # creating the dataset must make it visible through the cached lookups
+    hdf5.create_dataset(INVALID_DATASET, (10,))
+    assert hdf5[INVALID_DATASET].shape == (10,)
+    assert hdf5.get_version(INVALID_DATASET) == 'global'
+
+    # changing the version must be reflected in subsequent lookups
+    hdf5.set_version(version='dataset', dataset_name=INVALID_DATASET)
+    assert hdf5.get_version(INVALID_DATASET) == 'dataset'
+
+    # deleting the dataset must make it disappear
+    del hdf5[INVALID_DATASET]
+    nose.tools.assert_raises(KeyError, hdf5.__getitem__, INVALID_DATASET)
+    hdf5.close()
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_get_last_valid_index():
+    """connectors.hdf5.Hdf5.get_last_valid_index()
+    """
+    tokiotest.TEMP_FILE.close()
+    timeseries = tokiotest.generate_timeseries()
+    dataset_name = timeseries.dataset_name
+    num_rows = timeseries.dataset.shape[0]
+
+    hdf5_file = tokio.connectors.hdf5.Hdf5(tokiotest.TEMP_FILE.name, 'w')
+    hdf5_file.commit_timeseries(timeseries, chunks=(num_rows // 10, timeseries.dataset.shape[1]))
+
+    # populated rows may end long before the final chunk
+    for last_index in [num_rows - 1, num_rows // 2, 0]:
+        hdf5_file[dataset_name][last_index + 1:, :] = -0.0
+        hdf5_file[dataset_name][last_index, 0] = 1.0
+        assert hdf5_file.get_last_valid_index(dataset_name) == last_index
+
+    hdf5_file[dataset_name][...] = -0.0
+    assert hdf5_file.get_last_valid_index(dataset_name) == -1
+    hdf5_file.close()
+
 @nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
 def test_commit_timeseries():
     """connectors.hdf5.Hdf5.commit_timeseries()
@@ -477,6 +524,35 @@ def test_commit_timeseries():
     print("Comparing before/after read/write/read")
     tokiotest.compare_timeseries(timeseries2, timeseries1, verbose=True)
 
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_commit_timeseries_swmr():
+    """connectors.hdf5.Hdf5.commit_timeseries_swmr() with concurrent reader
+    """
+    tokiotest.TEMP_FILE.close()
+
+    timeseries1 = tokiotest.generate_timeseries()
+    dataset_name = timeseries1.dataset_name
+
+    # the first commit creates the dataset and then enters SWMR mode
+    writer = tokio.connectors.hdf5.Hdf5(tokiotest.TEMP_FILE.name, 'w', libver='latest')
+    writer.commit_timeseries_swmr([timeseries1])
+    assert writer.swmr_mode
+
+    reader = tokio.connectors.hdf5.Hdf5(tokiotest.TEMP_FILE.name, 'r', swmr=True)
+    assert (reader[dataset_name][...] == timeseries1.dataset).all()
+
+    # update the data while the reader holds the file open
+    timeseries1.dataset[0, :] = 12345.0
+    writer.commit_timeseries_swmr([timeseries1])
+    reader.refresh(dataset_name)
+    assert (reader[dataset_name][0, :] == 12345.0).all()
+
+    reader.close()
+    writer.close()
+
+    timeseries2 = tokiotest.generate_timeseries(file_name=tokiotest.TEMP_FILE.name)
+    tokiotest.compare_timeseries(timeseries2, timeseries1, verbose=True)
+
 @nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
 def test_commit_timeseries_bad_bounds():
     """connectors.hdf5.Hdf5.commit_timeseries() with out-of-bounds
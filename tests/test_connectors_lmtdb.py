@@ -5,9 +5,11 @@ cache db (mysql) and assumes that querying it is equivalent to querying a remote
 MySQL database.
 """
 
+import time
 import datetime
 import nose
 import tokiotest
+import tokio.connectors.cachingdb
 import tokio.connectors.lmtdb
 
 # Express job start/end time as epoch.  Note that these specific start/stop
@@ -110,3 +112,116 @@ def test_get_timeseries_data():
                                         datetime.timedelta(seconds=60))
     assert result0 == result1 == result2 == result3
     print(result0)
+
+def test_get_timeseries_data_epochs():
+    """
+    LmtDb.get_timeseries_data(epochs=True)
+    """
+    lmtdb = tokio.connectors.lmtdb.LmtDb(cache_file=SAMPLE_CACHE_DB)
+    dt_start = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_START)
+    dt_end = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_END)
+    rows, columns = lmtdb.get_ost_data(dt_start, dt_end)
+    epoch_rows, epoch_columns = lmtdb.get_ost_data(dt_start, dt_end, epochs=True)
+    assert columns == epoch_columns
+    assert len(rows) == len(epoch_rows) > 0
+
+    index = columns.index('TIMESTAMP')
+    for row, epoch_row in zip(rows, epoch_rows):
+        assert tokiotest.SAMPLE_LMTDB_START <= epoch_row[index] < tokiotest.SAMPLE_LMTDB_END
+        assert epoch_row[index] == int(time.mktime(
+            datetime.datetime.strptime(row[index], "%Y-%m-%d %H:%M:%S").timetuple()))
+        assert row[:index] + row[index + 1:] == epoch_row[:index] + epoch_row[index + 1:]
+
+    # saved results must retain the database's native timestamps for caching
+    for row in lmtdb.saved_results['OST_DATA']['rows']:
+        assert not isinstance(row[index], int)
+
+def test_get_timeseries_data_by_ts_id():
+    """
+    LmtDb.get_timeseries_data(by_ts_id=True)
+    """
+    lmtdb = tokio.connectors.lmtdb.LmtDb(cache_file=SAMPLE_CACHE_DB)
+    dt_start = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_START)
+    dt_end = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_END)
+    for table in 'OST_DATA', 'OSS_DATA', 'MDS_DATA', 'MDS_OPS_DATA':
+        for epochs in False, True:
+            rows, columns = lmtdb.get_timeseries_data(table, dt_start, dt_end, epochs=epochs)
+            ts_rows, ts_columns = lmtdb.get_timeseries_data(
+                table, dt_start, dt_end,
+                timechunk=datetime.timedelta(minutes=1),
+                epochs=epochs,
+                by_ts_id=True)
+            print("%s epochs=%s: %d rows joined, %d rows by TS_ID" % (table, epochs, len(rows), len(ts_rows)))
+            assert columns == ts_columns
+            assert len(rows) > 0
+            assert sorted(rows) == sorted(ts_rows)
+
+    # rows outside of the time range must be discarded
+    lmtdb.drop_cache()
+    dt_end = dt_start + datetime.timedelta(seconds=tokiotest.SAMPLE_LMTDB_TIMESTEP)
+    rows, columns = lmtdb.get_ost_data(dt_start, dt_end, epochs=True, by_ts_id=True)
+    assert len(rows) == len(lmtdb.ost_names)
+    for row in rows:
+        assert row[columns.index('TIMESTAMP')] == tokiotest.SAMPLE_LMTDB_START
+
+    # rows saved by TS_ID match the table schema so they can be cached
+    for row in lmtdb.saved_results['OST_DATA']['rows']:
+        assert len(row) == len(tokio.connectors.lmtdb.LMTDB_TABLES['OST_DATA']['columns'])
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_iter_timeseries_data():
+    """
+    LmtDb.iter_timeseries_data()
+    """
+    lmtdb = tokio.connectors.lmtdb.LmtDb(cache_file=SAMPLE_CACHE_DB)
+    dt_start = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_START)
+    dt_end = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_END)
+    rows, columns = lmtdb.get_ost_data(dt_start, dt_end, epochs=True, by_ts_id=True)
+    lmtdb.drop_cache()
+
+    batches = list(lmtdb.iter_timeseries_data('OST_DATA', dt_start, dt_end,
+                                              batch_size=100,
+                                              epochs=True,
+                                              cache_file=tokiotest.TEMP_FILE.name))
+    assert len(batches) > 1
+    assert 'OST_DATA' not in lmtdb.saved_results
+    iter_rows = []
+    for batch in batches:
+        assert len(batch['TIMESTAMP']) <= 100
+        iter_rows += list(zip(*[batch[column].tolist() for column in columns]))
+    print("Got %d rows in %d batches" % (len(iter_rows), len(batches)))
+    assert sorted(rows) == sorted(iter_rows)
+
+    # the tee'd cache database must contain both the rows and their timestamps
+    cached = tokio.connectors.cachingdb.CachingDb(cache_file=tokiotest.TEMP_FILE.name)
+    cached_rows = cached.query(
+        "SELECT TIMESTAMP_INFO.TIMESTAMP, %s FROM OST_DATA"
+        " INNER JOIN TIMESTAMP_INFO ON TIMESTAMP_INFO.TS_ID = OST_DATA.TS_ID"
+        % ', '.join(columns[1:]).replace('TS_ID', 'OST_DATA.TS_ID'),
+        epoch_columns=[0])
+    assert sorted(rows) == sorted(cached_rows)
+
+def test_get_timeseries_data_pooled():
+    """
+    LmtDb.get_timeseries_data() with a connection pool
+    """
+    dt_start = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_START)
+    dt_end = datetime.datetime.fromtimestamp(tokiotest.SAMPLE_LMTDB_END)
+    timechunk = datetime.timedelta(seconds=30)
+
+    lmtdb = tokio.connectors.lmtdb.LmtDb(cache_file=SAMPLE_CACHE_DB)
+    pooled = tokio.connectors.lmtdb.LmtDb(cache_file=SAMPLE_CACHE_DB, pool_size=4)
+    for by_ts_id in False, True:
+        rows, _ = lmtdb.get_ost_data(dt_start, dt_end, timechunk=timechunk, by_ts_id=by_ts_id)
+        pooled_rows, _ = pooled.get_ost_data(dt_start, dt_end, timechunk=timechunk,
+                                             by_ts_id=by_ts_id)
+        # results must be reassembled in time order, not completion order
+        assert rows == pooled_rows
+        assert lmtdb.saved_results['OST_DATA']['rows'] == pooled.saved_results['OST_DATA']['rows']
+        lmtdb.drop_cache()
+        pooled.drop_cache()
+
+    print("Pool opened %d connections" % len(pooled.pool.connections))
+    assert 1 < len(pooled.pool.connections) <= 4
+    pooled.close()
+    assert pooled.pool is None
@@ -10,6 +10,7 @@ import gzip
 import json
 import copy
 import datetime
+import numpy
 
 import tokio.connectors.es
 import tokio.connectors.nersc_globuslogs
@@ -149,3 +150,41 @@ def test_to_dataframe():
     dataframe = esdb.to_dataframe()
     print(dataframe)
     assert len(dataframe) > 0
+    # without dtypes, timestamps are left as strings
+    assert dataframe['DATE'].dtype == object
+
+    # columns are typed rather than left as objects when requested
+    dataframe = esdb.to_dataframe(dtypes=tokio.connectors.nersc_globuslogs.DATAFRAME_DTYPES)
+    print(dataframe.dtypes)
+    for field in ('USER', 'TYPE', 'host'):
+        assert str(dataframe[field].dtype) == 'category'
+    for field in ('TASKID', 'DESTIP'):
+        assert dataframe[field].dtype == object
+    for field in ('NBYTES', 'STREAMS', 'STRIPES'):
+        assert str(dataframe[field].dtype) == 'int64'
+    for field in ('@timestamp', 'start_date', 'end_date', 'DATE', 'START', 'duration'):
+        assert str(dataframe[field].dtype) == 'float64'
+
+    # timestamps expressed in different formats agree
+    assert numpy.allclose(dataframe['end_date'], dataframe['DATE'], atol=1e-3)
+    assert numpy.allclose(dataframe['start_date'], dataframe['START'], atol=1e-3)
+    first = esdb.scroll_pages[0][0]['_source']
+    expected = datetime.datetime.strptime(first['@timestamp'], "%Y-%m-%dT%H:%M:%S.%fZ") \
+        - datetime.datetime(1970, 1, 1)
+    assert numpy.isclose(dataframe['@timestamp'][0], expected.total_seconds())
+
+def test_date_to_epochs():
+    """connectors.nersc_globuslogs.date_to_epochs()
+    """
+    date_to_epochs = tokio.connectors.nersc_globuslogs.date_to_epochs
+    expected = [datetime.datetime(2019, 2, 28, 23, 59, 58, 250000), datetime.datetime(2020, 3, 1, 1, 2, 3)]
+    expected = [(x - datetime.datetime(1970, 1, 1)).total_seconds() for x in expected]
+
+    # values of the same width are decoded directly
+    assert list(date_to_epochs(['20190228235958.250000', '20200301010203.000000'])) == expected
+    assert list(date_to_epochs(['20190228235958.25', '20200301010203.00'])) == expected
+    # anything else is parsed
+    epochs = date_to_epochs(['20190228235958.25', '20200301010203.000000', None, 'garbage'])
+    assert list(epochs[:2]) == expected
+    assert numpy.isnan(epochs[2]) and numpy.isnan(epochs[3])
+    assert len(date_to_epochs([])) == 0
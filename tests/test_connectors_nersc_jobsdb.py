@@ -7,6 +7,7 @@ MySQL database.
 
 import nose
 import tokiotest
+import tokio.connectors.cachingdb
 import tokio.connectors.nersc_jobsdb
 
 # Express job start/end time as epoch.  Note that these specific start/stop
@@ -167,3 +168,25 @@ def test_save_cache():
 
     print("Piecewise gave %d rows; ground truth gave %d" % (len(piecewise_jobs), len(truth_jobs)))
     assert len(piecewise_jobs - truth_jobs) == 0
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_result_cache():
+    """
+    NerscJobsDb persistent result cache functionality
+    """
+    result_cache = tokio.connectors.cachingdb.QueryCache(tokiotest.TEMP_FILE.name)
+    nerscjobsdb = tokio.connectors.nersc_jobsdb.NerscJobsDb(cache_file=SAMPLE_CACHE_DB,
+                                                             result_cache=result_cache)
+    results1 = nerscjobsdb.get_concurrent_jobs(*(SAMPLE_QUERY))
+    assert nerscjobsdb.last_hit == tokio.connectors.nersc_jobsdb.HIT_CACHE_DB
+    verify_concurrent_jobs(results1, nerscjobsdb, 1)
+
+    ### A new NerscJobsDb should be served out of the persistent cache
+    nerscjobsdb = tokio.connectors.nersc_jobsdb.NerscJobsDb(cache_file=SAMPLE_CACHE_DB,
+                                                             result_cache=result_cache)
+    results2 = nerscjobsdb.get_concurrent_jobs(*(SAMPLE_QUERY))
+    print("Got %d hits from source %d" % (len(results2), nerscjobsdb.last_hit))
+    print("Result cache stats: %s" % result_cache.stats)
+    assert nerscjobsdb.last_hit == tokio.connectors.nersc_jobsdb.HIT_RESULT_CACHE
+    assert results1 == results2
+    assert result_cache.stats['hits'] > 0
@@ -276,6 +276,56 @@ def test_insert_element_columns():
 
     assert 'f' in timeseries.columns
 
+def test_insert_elements():
+    """TimeSeries.insert_elements() matches TimeSeries.insert_element()
+    """
+    kwargs = {
+        'dataset_name': 'test_dataset',
+        'start': START,
+        'end': END,
+        'timestep': DELTIM.total_seconds(),
+        'num_columns': 5,
+        'column_names': ['a', 'b', 'c', 'd', 'e'],
+    }
+    timeseries0 = tokio.timeseries.TimeSeries(**kwargs)
+    timeseries1 = tokio.timeseries.TimeSeries(**kwargs)
+
+    # include out-of-bounds timestamps and repeated elements
+    random.seed(0)
+    num_values = 2000
+    span = int((END - START + 2 * DELTIM).total_seconds())
+    offsets = [random.randint(0, span) - int(DELTIM.total_seconds()) for _ in range(num_values)]
+    column_indices = [random.randint(0, 4) for _ in range(num_values)]
+    values = [random.random() for _ in range(num_values)]
+
+    expected = 0
+    for offset, column_index, value in zip(offsets, column_indices, values):
+        expected += timeseries0.insert_element(
+            timestamp=START + datetime.timedelta(seconds=offset),
+            column_name=timeseries0.columns[column_index],
+            value=value)
+
+    epochs = numpy.array([timeseries1.timestamps[0] + x for x in offsets])
+    inserted = timeseries1.insert_elements(epochs, numpy.array(column_indices), numpy.array(values))
+    assert inserted == expected
+    assert (timeseries0.dataset == timeseries1.dataset).all()
+    assert (numpy.signbit(timeseries0.dataset) == numpy.signbit(timeseries1.dataset)).all()
+
+    # reducers must accumulate every repeated element
+    timeseries0 = tokio.timeseries.TimeSeries(**kwargs)
+    timeseries1 = tokio.timeseries.TimeSeries(**kwargs)
+    for offset, column_index, value in zip(offsets, column_indices, values):
+        timeseries0.insert_element(
+            timestamp=START + datetime.timedelta(seconds=offset),
+            column_name=timeseries0.columns[column_index],
+            value=value,
+            reducer=lambda x, y: x + y)
+    inserted = timeseries1.insert_elements(epochs, numpy.array(column_indices), numpy.array(values),
+                                           reducer=numpy.add)
+    assert inserted == expected
+    assert (timeseries0.dataset == timeseries1.dataset).all()
+    assert (numpy.signbit(timeseries0.dataset) == numpy.signbit(timeseries1.dataset)).all()
+
 @nose.tools.raises(IndexError)
 def test_insert_element_column_overflow():
     """TimeSeries.insert_element(): insert element in column that doesn't fit"""
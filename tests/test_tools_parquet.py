@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Test Arrow/Parquet export of TOKIO Time Series datasets
+"""
+
+import datetime
+import nose
+import numpy
+import tokiotest
+import tokio.tools.parquet
+import tokio.cli.hdf5_to_parquet
+import tokio.connectors.hdf5
+
+try:
+    import pyarrow.parquet
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+def check_pyarrow():
+    """Skip test if pyarrow is not available
+    """
+    if not HAVE_PYARROW:
+        raise nose.SkipTest("pyarrow not available")
+
+def test_record_batches():
+    """tools.parquet.iter_record_batches() correctness
+    """
+    check_pyarrow()
+    dataset_name = tokiotest.SAMPLE_COLLECTDES_DSET
+    with tokio.connectors.hdf5.Hdf5(tokiotest.SAMPLE_COLLECTDES_HDF5, 'r') as hdf5_file:
+        dataframe = hdf5_file.to_dataframe(dataset_name)
+        chunk_rows = hdf5_file[dataset_name].chunks[0]
+        batches = list(tokio.tools.parquet.iter_record_batches(hdf5_file, dataset_name,
+                                                               batch_rows=1))
+
+    # every batch should be exactly one HDF5 chunk
+    assert len(batches) > 1
+    for batch in batches[:-1]:
+        assert batch.num_rows == chunk_rows
+
+    table = pyarrow.Table.from_batches(batches)
+    assert table.num_rows == len(dataframe)
+    assert table.column_names[1:] == list(dataframe.columns)
+    for column in dataframe.columns:
+        exported = table.column(column).to_numpy(zero_copy_only=False)
+        expected = dataframe[column].values
+        assert numpy.allclose(exported, expected, equal_nan=True)
+
+@nose.tools.with_setup(tokiotest.create_tempfile, tokiotest.delete_tempfile)
+def test_cli_time_and_column_filter():
+    """cli.hdf5_to_parquet with --start, --end, and --columns
+    """
+    check_pyarrow()
+    tokiotest.TEMP_FILE.close()
+    dataset_name = tokiotest.SAMPLE_COLLECTDES_DSET
+    with tokio.connectors.hdf5.Hdf5(tokiotest.SAMPLE_COLLECTDES_HDF5, 'r') as hdf5_file:
+        dataframe = hdf5_file.to_dataframe(dataset_name)
+        units = hdf5_file[dataset_name].attrs['units']
+    columns = list(dataframe.columns[2:5])
+    start = dataframe.index[10]
+    end = dataframe.index[100]
+
+    tokiotest.run_bin(tokio.cli.hdf5_to_parquet, [
+        '--dataset', dataset_name,
+        '--output', tokiotest.TEMP_FILE.name,
+        '--columns', ','.join(columns),
+        '--start', start.strftime(tokio.cli.hdf5_to_parquet.DATE_FMT),
+        '--end', end.strftime(tokio.cli.hdf5_to_parquet.DATE_FMT),
+        tokiotest.SAMPLE_COLLECTDES_HDF5])
+
+    table = pyarrow.parquet.read_table(tokiotest.TEMP_FILE.name)
+    expected = dataframe[(dataframe.index >= start) & (dataframe.index < end)][columns]
+    assert table.column_names == [tokio.tools.parquet.TIMESTAMP_FIELD] + columns
+    assert table.num_rows == len(expected)
+
+    timestamps = table.column(0).to_numpy().astype('datetime64[s]').astype('i8')
+    first = datetime.datetime.fromtimestamp(timestamps[0])
+    assert first == start
+
+    for column in columns:
+        exported = table.column(column).to_numpy(zero_copy_only=False)
+        assert numpy.allclose(exported, expected[column].values, equal_nan=True)
+        metadata = table.schema.field(column).metadata
+        assert metadata[b'units'] == tokio.tools.parquet._decode(units).encode()
+        assert metadata[b'version'] == b'1'
@@ -6,12 +6,16 @@ Useful helpers that are used throughout the TOKIO test suite
 import os
 import sys
 import gzip
+import json
+import time
+import zlib
 import errno
 import shutil
 import tarfile
 import tempfile
 import subprocess
 import datetime
+import threading
 import numpy # for compare_timeseries
 import h5py
 
@@ -20,6 +24,15 @@ try:
 except ImportError:
     import io
 
+try:
+    import http.server as http_server
+    import socketserver
+    import urllib.parse as urlparse
+except ImportError:
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
+    import urlparse
+
 import nose
 
 ### Sample input files and their expected contents
@@ -29,6 +42,7 @@ BIN_DIR = os.path.join(PYTOKIO_HOME, 'bin')
 
 sys.path.insert(0, os.path.abspath(PYTOKIO_HOME))
 
+import tokio.config
 import tokio.connectors.darshan
 
 SAMPLE_TIMESTAMP_DATE_FMT = "%Y-%m-%dT%H:%M:%S"
@@ -472,6 +486,60 @@ def generate_timeseries(file_name=SAMPLE_COLLECTDES_HDF5,
 
     return timeseries
 
+def aggregate_collectd_pages(pages, timestep, page_size=1000):
+    """Reduce pages of collectd documents the way Elasticsearch would
+
+    Emulates the composite aggregations issued by CollectdEs.aggregate_* so
+    that aggregation-based retrieval can be tested without Elasticsearch.
+
+    Args:
+        pages (list): pages of collectd documents, e.g., the contents of
+            SAMPLE_COLLECTDES_FILE
+        timestep (int): width of each time bucket, in seconds
+        page_size (int): maximum number of buckets per page
+
+    Returns:
+        list: pages of buckets sorted by their keys
+    """
+    import dateutil.parser
+    import tokio.connectors.collectd_es
+
+    reductions = {}
+    for page in pages:
+        for doc in page:
+            source = doc['_source']
+            plugin = source['plugin']
+            epoch_ms = int(round(dateutil.parser.parse(source['@timestamp']).timestamp() * 1000))
+            key = (('@timestamp', epoch_ms - epoch_ms % (timestep * 1000)),) \
+                + tuple((field, source.get(field))
+                        for field in tokio.connectors.collectd_es.AGGREGATION_SOURCES[plugin])
+            # composite aggregations omit documents missing any source field
+            if None in dict(key).values():
+                continue
+            if key not in reductions:
+                reductions[key] = {}
+            metrics = tokio.connectors.collectd_es.AGGREGATION_METRICS[plugin]
+            for metric, aggregation in metrics.items():
+                function, params = list(aggregation.items())[0]
+                value = source.get(params['field'])
+                if value is not None:
+                    reductions[key].setdefault(metric, (function, []))[1].append(value)
+
+    buckets = []
+    for key in sorted(reductions):
+        bucket = {'key': dict(key), 'doc_count': 0}
+        for metric, (function, values) in reductions[key].items():
+            if function == 'avg':
+                bucket[metric] = {'value': sum(values) / len(values)}
+            elif function == 'sum':
+                bucket[metric] = {'value': sum(values)}
+            elif function == 'value_count':
+                bucket[metric] = {'value': len(values)}
+            bucket['doc_count'] = max(bucket['doc_count'], len(values))
+        buckets.append(bucket)
+
+    return [buckets[i:i + page_size] for i in range(0, len(buckets), page_size)]
+
 def untar(input_filename):
     """Unpack a tarball to test support for that input type
     """
@@ -545,4 +613,98 @@ def identical_datasets(summary0, summary1):
 
     assert num_compared > 0
 
+class FakeEsnetSnmpServer(object):
+    """Context manager that serves a stand-in for the ESnet SNMP REST API
+
+    Serves deterministic counters for any endpoint, interface, and direction
+    over HTTP on localhost and points the ``esnet_snmp_url`` configuration
+    value at it for the duration of the context.
+    """
+    def __init__(self, latency=0.0, rate_limit=False):
+        """
+        Args:
+            latency (float): Seconds to wait before answering each request
+            rate_limit (bool): Answer the first request for each distinct URL
+                with HTTP 429 so that clients must retry
+        """
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.requests = []
+        self.rate_limited = 0
+        self.client_ports = set()
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+        self.old_url = None
+
+    @staticmethod
+    def value(path, timestamp):
+        """Counter value served for a URL path at a timestamp"""
+        return float(zlib.crc32(path.encode()) % 1000) * 1000.0 + timestamp % 1000
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+            """Answers ESnet SNMP REST API requests"""
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                """Serve counters for the requested window"""
+                url = urlparse.urlparse(self.path)
+                params = dict(urlparse.parse_qsl(url.query))
+                with fake.lock:
+                    fake.client_ports.add(self.client_address[1])
+                    first = self.path not in fake.requests
+                    fake.requests.append(self.path)
+                    if fake.rate_limit and first:
+                        fake.rate_limited += 1
+                time.sleep(fake.latency)
+                if fake.rate_limit and first:
+                    self.send_response(429)
+                    self.send_header('Retry-After', '0')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                interval = int(params.get('calc', 30))
+                begin = int(params['begin'])
+                end = int(params['end'])
+                result = {
+                    'begin_time': begin,
+                    'end_time': end,
+                    'data': [[timestamp, fake.value(url.path, timestamp)]
+                             for timestamp in range(begin - begin % interval, end + 1, interval)],
+                }
+                if 'calc' in params:
+                    result['calc'] = str(interval)
+                else:
+                    result['agg'] = str(interval)
+                body = json.dumps(result).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                """Do not log each request"""
+                pass
+
+        class Server(socketserver.ThreadingMixIn, http_server.HTTPServer):
+            """Serves each connection in its own thread"""
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.old_url = tokio.config.CONFIG.get('esnet_snmp_url')
+        tokio.config.CONFIG['esnet_snmp_url'] = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        return self
 
+    def __exit__(self, *args):
+        tokio.config.CONFIG['esnet_snmp_url'] = self.old_url
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
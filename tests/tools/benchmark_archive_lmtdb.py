@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""
+Benchmark each stage of archive_lmtdb against an LMT database
+
+Times the stages of the archive_lmtdb pipeline separately so that performance
+regressions can be attributed to the component that caused them:
+
+* query/TABLE - retrieving a table's rows with LmtDb.iter_timeseries_data
+* ingest/TABLE - populating a DatasetDict from those rows, replayed from
+  memory so that query time is excluded
+* convert_deltas - DatasetDict.convert_deltas
+* init_hdf5 - creating empty datasets in a new HDF5 file
+* commit_timeseries - writing every dataset with Hdf5.commit_timeseries
+* archive_lmtdb - all of the above, end to end, as archive_lmtdb does it
+
+Results are written as JSON.  If a baseline produced by an earlier run is
+given, any stage whose best time regressed by more than the given tolerance
+is reported and the exit code is nonzero.  Use generate_lmtdb.py to create a
+database of the desired size to benchmark against.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import argparse
+import tempfile
+import numpy
+import tokio
+import tokio.connectors.lmtdb
+import tokio.connectors.hdf5
+import tokio.cli.archive_lmtdb
+
+DATE_FMT = "%Y-%m-%dT%H:%M:%S"
+LMT_DATE_FMT = "%Y-%m-%d %H:%M:%S"
+
+TABLES = ['OST_DATA', 'OSS_DATA', 'MDS_DATA', 'MDS_OPS_DATA']
+
+class ReplayLmtDb(object):
+    """LmtDb proxy that returns previously retrieved time series data
+
+    Allows DatasetDict ingest to be timed without including the time spent
+    querying the database.
+    """
+    def __init__(self, lmtdb, batches):
+        """
+        Args:
+            lmtdb (LmtDb): database whose attributes should be exposed
+            batches (dict): keyed by table name and containing lists of the
+                batches returned by lmtdb.iter_timeseries_data for that table
+        """
+        self.lmtdb = lmtdb
+        self.batches = batches
+
+    def __getattr__(self, name):
+        return getattr(self.lmtdb, name)
+
+    def iter_timeseries_data(self, table, *args, **kwargs):
+        """Yield the recorded batches for a table"""
+        return iter(self.batches[table])
+
+class Timer(object):
+    """Accumulates wall clock times of named benchmark stages
+    """
+    def __init__(self):
+        self.results = {}
+        self.order = []
+
+    def time(self, stage, func, *args, **kwargs):
+        """Call a function and record how long it took
+
+        Args:
+            stage (str): name of the stage being timed
+            func: function to call
+            args: positional arguments to func
+            kwargs: keyword arguments to func
+
+        Returns:
+            The return value of func
+        """
+        t0 = time.time()
+        retval = func(*args, **kwargs)
+        elapsed = time.time() - t0
+        if stage not in self.results:
+            self.results[stage] = []
+            self.order.append(stage)
+        self.results[stage].append(elapsed)
+        sys.stderr.write("%-24s %10.4f s\n" % (stage, elapsed))
+        return retval
+
+    def summarize(self):
+        """Reduce recorded times to summary statistics
+
+        Returns:
+            list of dict: one dict per stage in the order stages were first
+            timed, each containing the stage's name, the time of each
+            repetition, and their minimum, mean, and maximum
+        """
+        summary = []
+        for stage in self.order:
+            times = self.results[stage]
+            summary.append({
+                'stage': stage,
+                'times': times,
+                'min': min(times),
+                'mean': sum(times) / len(times),
+                'max': max(times),
+            })
+        return summary
+
+def fetch_table(lmtdb, table, query_start, query_end):
+    """Retrieve all batches of a table's time series data
+
+    Returns:
+        tuple of (list, int): batches returned by iter_timeseries_data and the
+        total number of rows they contain
+    """
+    batches = list(lmtdb.iter_timeseries_data(table, query_start, query_end, epochs=True))
+    return batches, sum(len(batch['TS_ID']) for batch in batches)
+
+def ingest_table(datasets, lmtdb, table):
+    """Populate a DatasetDict from every batch of a table's rows
+
+    Args:
+        datasets (DatasetDict): datasets to populate
+        lmtdb (LmtDb or ReplayLmtDb): database from which to retrieve rows
+        table (str): name of the LMT table to ingest
+    """
+    datasets.init_table(lmtdb, table)
+    for arrays in tokio.cli.archive_lmtdb.iter_result_columns(
+            lmtdb, table, datasets.query_start, datasets.query_end_plusplus,
+            tokio.cli.archive_lmtdb.TABLE_COLUMNS[table]):
+        datasets.ingest_batch(lmtdb, table, arrays)
+
+def commit_datasets(hdf5_file, datasets):
+    """Write every TimeSeries in a DatasetDict to an HDF5 file"""
+    for dataset in datasets.values():
+        hdf5_file.commit_timeseries(dataset)
+
+def get_time_range(lmtdb):
+    """Find the first and last timestamps in an LMT database
+
+    Returns:
+        tuple of datetime.datetime: the earliest and latest timestamps in
+        TIMESTAMP_INFO
+    """
+    first, last = lmtdb.query("SELECT MIN(TIMESTAMP), MAX(TIMESTAMP) FROM TIMESTAMP_INFO")[0]
+    if first is None:
+        raise ValueError("TIMESTAMP_INFO is empty")
+    if not isinstance(first, datetime.datetime):
+        first = datetime.datetime.strptime(first, LMT_DATE_FMT)
+        last = datetime.datetime.strptime(last, LMT_DATE_FMT)
+    return first, last
+
+def benchmark(lmtdb, query_start, query_end, timestep, output_file, repeat=1):
+    """Time each stage of archiving an LMT database into HDF5
+
+    Args:
+        lmtdb (LmtDb): database to archive
+        query_start (datetime.datetime): first timestamp to archive
+        query_end (datetime.datetime): archive up to but not including this
+            timestamp
+        timestep (int): seconds between timestamps
+        output_file (str): path of HDF5 file to create.  It is overwritten
+            on each repetition.
+        repeat (int): number of times to run the full pipeline
+
+    Returns:
+        tuple of (list of dict, dict): summary of each stage's times as
+        returned by Timer.summarize and the number of rows retrieved from each
+        table
+    """
+    timer = Timer()
+    row_counts = {}
+    for _ in range(repeat):
+        datasets = tokio.cli.archive_lmtdb.DatasetDict(query_start, query_end, timestep)
+
+        batches = {}
+        for table in TABLES:
+            batches[table], row_counts[table] = timer.time(
+                "query/%s" % table, fetch_table,
+                lmtdb, table, datasets.query_start, datasets.query_end_plusplus)
+
+        replay = ReplayLmtDb(lmtdb, batches)
+        for table in TABLES:
+            timer.time("ingest/%s" % table, ingest_table, datasets, replay, table)
+        del replay, batches
+
+        timer.time("convert_deltas", datasets.convert_deltas, list(datasets.config.keys()))
+        datasets.set_timeseries_metadata(list(datasets.config.keys()))
+
+        if os.path.exists(output_file):
+            os.unlink(output_file)
+        # init_hdf5_file reports its progress on stdout, which carries results
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            with tokio.connectors.hdf5.Hdf5(output_file, mode='w') as hdf5_file:
+                hdf5_file.attrs['version'] = tokio.cli.archive_lmtdb.SCHEMA_VERSION
+                timer.time("init_hdf5", tokio.cli.archive_lmtdb.init_hdf5_file,
+                           datasets, query_start, query_end, hdf5_file)
+                timer.time("commit_timeseries", commit_datasets, hdf5_file, datasets)
+
+            # end to end, as run by the archive_lmtdb CLI
+            datasets = None
+            os.unlink(output_file)
+            timer.time("archive_lmtdb", tokio.cli.archive_lmtdb.archive_lmtdb,
+                       lmtdb=lmtdb,
+                       init_start=query_start,
+                       init_end=query_end,
+                       timestep=timestep,
+                       output_file=output_file,
+                       query_start=query_start,
+                       query_end=query_end)
+        finally:
+            sys.stdout = stdout
+
+    return timer.summarize(), row_counts
+
+def compare(results, baseline, tolerance):
+    """Find stages that are slower than a baseline
+
+    Args:
+        results (dict): output of this benchmark
+        baseline (dict): output of an earlier run of this benchmark
+        tolerance (float): ratio of best times above which a stage is
+            considered to have regressed
+
+    Returns:
+        list of str: descriptions of each regressed stage
+    """
+    baseline_times = {stage['stage']: stage['min'] for stage in baseline['stages']}
+    regressions = []
+    for stage in results['stages']:
+        old = baseline_times.get(stage['stage'])
+        if old and stage['min'] / old > tolerance:
+            regressions.append("%s regressed from %.4f s to %.4f s (%.2fx)" % (
+                stage['stage'], old, stage['min'], stage['min'] / old))
+    return regressions
+
+def main(argv=None):
+    """Entry point for the CLI interface
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("lmtdb", type=str, help="LMT database in SQLite format")
+    parser.add_argument("-s", "--start", type=str, default=None,
+                        help="first timestamp to archive in %s format (default: first in database)" % DATE_FMT.replace('%', '%%'))
+    parser.add_argument("-e", "--end", type=str, default=None,
+                        help="archive up to this timestamp in %s format (default: last in database)" % DATE_FMT.replace('%', '%%'))
+    parser.add_argument("-t", "--timestep", type=int, default=5,
+                        help="seconds between timestamps (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type=int, default=1,
+                        help="number of times to run each stage (default: %(default)s)")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="write results to this file instead of stdout")
+    parser.add_argument("--hdf5", type=str, default=None,
+                        help="HDF5 file to create while benchmarking (default: temporary file)")
+    parser.add_argument("-b", "--baseline", type=str, default=None,
+                        help="results of a previous run against which to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=1.2,
+                        help="slowdown relative to baseline considered a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.lmtdb):
+        parser.error("%s does not exist" % args.lmtdb)
+    if args.repeat < 1:
+        parser.error("--repeat must be positive")
+
+    lmtdb = tokio.connectors.lmtdb.LmtDb(cache_file=args.lmtdb)
+    first, last = get_time_range(lmtdb)
+    query_start = datetime.datetime.strptime(args.start, DATE_FMT) if args.start else first
+    # archive_lmtdb queries one timestep past query_end to calculate deltas
+    query_end = datetime.datetime.strptime(args.end, DATE_FMT) if args.end \
+        else last - datetime.timedelta(seconds=args.timestep)
+    if query_end <= query_start:
+        parser.error("end must be later than start")
+
+    if args.hdf5:
+        hdf5_file = args.hdf5
+    else:
+        fd, hdf5_file = tempfile.mkstemp(suffix='.hdf5')
+        os.close(fd)
+
+    try:
+        stages, row_counts = benchmark(lmtdb=lmtdb,
+                                       query_start=query_start,
+                                       query_end=query_end,
+                                       timestep=args.timestep,
+                                       output_file=hdf5_file,
+                                       repeat=args.repeat)
+    finally:
+        if not args.hdf5 and os.path.exists(hdf5_file):
+            os.unlink(hdf5_file)
+    lmtdb.close()
+
+    results = {
+        'lmtdb': os.path.abspath(args.lmtdb),
+        'start': query_start.strftime(DATE_FMT),
+        'end': query_end.strftime(DATE_FMT),
+        'timestep': args.timestep,
+        'repeat': args.repeat,
+        'num_osts': len(lmtdb.ost_names),
+        'num_osses': len(lmtdb.oss_names),
+        'num_mdses': len(lmtdb.mds_names),
+        'rows': row_counts,
+        'stages': stages,
+        'pytokio_version': tokio.__version__,
+        'python_version': platform.python_version(),
+        'numpy_version': numpy.__version__,
+        'platform': platform.platform(),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=4, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=4, sort_keys=True))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            sys.stderr.write(regression + "\n")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Benchmark conversion of Elasticsearch documents into DataFrames
+
+Generates synthetic pages of Globus transfer log documents and times several
+ways of converting them into a pandas.DataFrame:
+
+* records - one dict per document passed to pandas.DataFrame, as
+  EsConnection.to_dataframe used to do
+* columns - EsConnection.to_dataframe without any type conversion
+* typed - NerscGlobusLogs.to_dataframe with DATAFRAME_DTYPES, which converts
+  timestamps to epochs and encodes low-cardinality fields as categoricals
+
+Both the time taken and the memory consumed by the resulting DataFrame are
+reported as JSON.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import pandas
+import tokio.connectors.nersc_globuslogs
+
+def make_pages(num_docs, page_size, num_users, num_hosts, seed=0):
+    """Generate pages of synthetic Globus transfer log documents
+
+    Args:
+        num_docs (int): total number of documents to generate
+        page_size (int): number of documents per page
+        num_users (int): number of distinct USER values
+        num_hosts (int): number of distinct host values
+        seed (int): seed for the random number generator
+
+    Returns:
+        list of list: pages of hits, as retained in scroll_pages
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2019, 1, 29)
+    pages = []
+    for page_start in range(0, num_docs, page_size):
+        hits = []
+        for doc_id in range(page_start, min(num_docs, page_start + page_size)):
+            begin = start + datetime.timedelta(seconds=doc_id / 10.0)
+            end = begin + datetime.timedelta(seconds=rng.random() * 10.0)
+            host = "dtn%02d.nersc.gov" % rng.randrange(num_hosts)
+            nbytes = rng.randrange(2**30)
+            hits.append({
+                '_id': str(doc_id),
+                '_source': {
+                    '@timestamp': end.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + 'Z',
+                    'BLOCK': 4194304,
+                    'BUFFER': 235104,
+                    'CODE': rng.choice(['226', '226', '226', '451']),
+                    'DATE': end.strftime("%Y%m%d%H%M%S.%f"),
+                    'DEST': '192.168.63.%d' % rng.randrange(64),
+                    'DESTIP': '192.168.63.%d' % rng.randrange(64),
+                    'FILE': '/global/homes/u/user%d/file%d' % (rng.randrange(num_users), doc_id),
+                    'HOST': host,
+                    'NBYTES': nbytes,
+                    'START': begin.strftime("%Y%m%d%H%M%S.%f"),
+                    'STREAMS': rng.choice([1, 4, 8]),
+                    'STRIPES': '1',
+                    'TASKID': 'task-%d' % (doc_id // 100),
+                    'TYPE': rng.choice(['RETR', 'STOR']),
+                    'USER': 'user%d' % rng.randrange(num_users),
+                    'VOLUME': '/',
+                    'bandwidth_mbps': nbytes / 2.0**20,
+                    'duration': (end - begin).total_seconds(),
+                    'start_date': begin.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + 'Z',
+                    'end_date': end.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + 'Z',
+                    'host': host,
+                },
+            })
+        pages.append(hits)
+    return pages
+
+def records_to_dataframe(esdb, fields):
+    """Convert scroll_pages using one dict per document"""
+    to_df = []
+    for page in esdb.scroll_pages:
+        for record in page:
+            record_dict = {}
+            for field in fields:
+                record_dict[field] = record['_source'].get(field)
+            to_df.append(record_dict)
+    return pandas.DataFrame(to_df)
+
+def main(argv=None):
+    """Entry point for the CLI interface
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num-docs", type=int, default=500000,
+                        help="number of documents to generate (default: %(default)s)")
+    parser.add_argument("-p", "--page-size", type=int, default=10000,
+                        help="documents per page (default: %(default)s)")
+    parser.add_argument("-u", "--num-users", type=int, default=50,
+                        help="distinct users (default: %(default)s)")
+    parser.add_argument("--num-hosts", type=int, default=16,
+                        help="distinct hosts (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="number of times to run each method (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    esdb = tokio.connectors.nersc_globuslogs.NerscGlobusLogs(host=None, port=None)
+    esdb.scroll_pages = make_pages(args.num_docs, args.page_size, args.num_users, args.num_hosts)
+    fields = tokio.connectors.nersc_globuslogs.SOURCE_FILTER
+
+    methods = [
+        ('records', lambda: records_to_dataframe(esdb, fields)),
+        ('columns', lambda: tokio.connectors.es.EsConnection.to_dataframe(esdb, fields)),
+        ('typed', lambda: esdb.to_dataframe(dtypes=tokio.connectors.nersc_globuslogs.DATAFRAME_DTYPES)),
+    ]
+
+    results = {
+        'num_docs': args.num_docs,
+        'page_size': args.page_size,
+        'num_users': args.num_users,
+        'num_hosts': args.num_hosts,
+        'methods': [],
+    }
+    for name, method in methods:
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.time()
+            dataframe = method()
+            times.append(time.time() - t0)
+        sys.stderr.write("%-8s %10.4f s\n" % (name, min(times)))
+        results['methods'].append({
+            'method': name,
+            'times': times,
+            'min': min(times),
+            'memory_bytes': int(dataframe.memory_usage(deep=True).sum()),
+        })
+        del dataframe
+
+    print(json.dumps(results, indent=4, sort_keys=True))
+
+if __name__ == "__main__":
+    main()
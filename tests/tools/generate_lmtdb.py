@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+"""
+Generate a synthetic LMT database in SQLite format
+
+Creates every table in tokio.connectors.lmtdb.LMTDB_TABLES and populates it
+with plausible data: monotonically increasing byte and metadata operation
+counters, slowly changing fullness, and noisy CPU/memory loads.  Counters are
+occasionally reset to zero as if a server rebooted, and samples and entire
+timestamps may be dropped to emulate gaps in LMT's collection.  The result
+can be read by tokio.connectors.lmtdb.LmtDb(cache_file=...) and archived with
+archive_lmtdb for benchmarking without access to a production LMT database.
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import datetime
+import argparse
+import numpy
+import tokio.connectors.lmtdb
+
+DATE_FMT = "%Y-%m-%dT%H:%M:%S"
+LMT_DATE_FMT = "%Y-%m-%d %H:%M:%S"
+
+# OPERATION_INFO as populated by LMT
+OPERATION_NAMES = [
+    'open', 'close', 'mknod', 'link', 'unlink', 'mkdir', 'rmdir', 'rename',
+    'getxattr', 'setxattr', 'iocontrol', 'get_info', 'set_info_async',
+    'attach', 'detach', 'setup', 'precleanup', 'cleanup', 'process_config',
+    'postrecov', 'add_conn', 'del_conn', 'connect', 'reconnect', 'disconnect',
+    'statfs', 'statfs_async', 'packmd', 'unpackmd', 'checkmd', 'preallocate',
+    'precreate', 'create', 'destroy', 'setattr', 'setattr_async', 'getattr',
+    'getattr_async', 'brw', 'brw_async', 'prep_async_page', 'reget_short_lock',
+    'release_short_lock', 'queue_async_io', 'queue_group_io',
+    'trigger_group_io', 'set_async_flags', 'teardown_async_page', 'merge_lvb',
+    'adjust_kms', 'punch', 'sync', 'migrate', 'copy', 'iterate', 'preprw',
+    'commitrw', 'enqueue', 'match', 'change_cbdata', 'cancel', 'cancel_unused',
+    'join_lru', 'init_export', 'destroy_export', 'extent_calc', 'llog_init',
+    'llog_finish', 'pin', 'unpin', 'import_event', 'notify', 'health_check',
+    'quotacheck', 'quotactl', 'quota_adjust_quint', 'ping',
+    'register_page_removal_cb', 'unregister_page_removal_cb',
+    'register_lock_cancel_cb', 'unregister_lock_cancel_cb',
+]
+
+# Operations that actually appear in MDS_OPS_DATA and their mean rates (ops/sec)
+MDS_OPS_RATES = {
+    'open': 400.0,
+    'close': 400.0,
+    'mknod': 20.0,
+    'link': 0.1,
+    'unlink': 20.0,
+    'mkdir': 2.0,
+    'rmdir': 1.0,
+    'rename': 5.0,
+    'getxattr': 100.0,
+    'process_config': 0.0,
+    'connect': 0.01,
+    'reconnect': 0.001,
+    'disconnect': 0.01,
+    'statfs': 50.0,
+    'create': 0.0,
+    'destroy': 0.0,
+    'setattr': 50.0,
+    'getattr': 800.0,
+    'llog_init': 0.0,
+    'notify': 0.0,
+    'quotactl': 0.1,
+}
+
+OST_VARIABLE_INFO = [
+    (1, 'READ_BYTES', 'Bytes Read', 0, None, None),
+    (2, 'WRITE_BYTES', 'Bytes Written', 0, None, None),
+    (3, 'READ_RATE', 'Read Rate', 0, None, None),
+    (4, 'WRITE_RATE', 'Write Rate', 0, None, None),
+    (5, 'KBYTES_FREE', 'KB Free', 0, None, None),
+    (6, 'KBYTES_USED', 'KB Used', 0, None, None),
+    (7, 'INODES_FREE', 'Inodes Free', 0, None, None),
+    (8, 'INODES_USED', 'Inodes Used', 0, None, None),
+    (9, 'PCT_CPU', '%CPU', 3, 90.0, 101.0),
+    (10, 'PCT_KBYTES', '%KB', 3, 95.0, 100.0),
+    (11, 'PCT_INODES', '%Inodes', 3, 95.0, 100.0),
+]
+
+MDS_VARIABLE_INFO = [
+    (1, 'KBYTES_FREE', 'KB Free', 0, None, None),
+    (2, 'KBYTES_USED', 'KB Used', 0, None, None),
+    (3, 'INODES_FREE', 'Inodes Free', 0, None, None),
+    (4, 'INODES_USED', 'Inodes Used', 0, None, None),
+    (5, 'PCT_CPU', '%CPU', 3, 90.0, 101.0),
+    (6, 'PCT_KBYTES', '%KB', 3, 95.0, 100.0),
+    (7, 'PCT_INODES', '%Inodes', 3, 95.0, 100.0),
+]
+
+OST_KBYTES_TOTAL = 90767651352
+OST_INODES_TOTAL = 88668544
+MDT_KBYTES_TOTAL = 2255453580
+MDT_INODES_TOTAL = 1503920128
+
+OST_BYTES_PER_SEC = 100 * 2**20 # mean bandwidth of an OST while busy
+OST_DUTY_CYCLE = 0.3 # fraction of samples during which an OST is busy
+
+# number of timestamps to generate and insert at once
+BLOCK_SIZE = 720
+
+def accumulate(prev, increments, resets):
+    """Convert increments into counters that restart from zero when reset
+
+    Args:
+        prev (numpy.ndarray): value of each counter before the first row
+        increments (numpy.ndarray): amount by which each counter (column)
+            increases at each timestamp (row)
+        resets (numpy.ndarray): bool array of the same shape as increments
+            that is True where a counter was reset immediately before it was
+            incremented
+
+    Returns:
+        numpy.ndarray: value of each counter at each timestamp
+    """
+    totals = prev + numpy.cumsum(increments, axis=0)
+    offsets = numpy.where(resets, totals - increments, 0)
+    return totals - numpy.maximum.accumulate(offsets, axis=0)
+
+def drift(prev, increments, total):
+    """Apply increments to a quantity bounded between zero and total
+
+    Args:
+        prev (numpy.ndarray): value of each quantity before the first row
+        increments (numpy.ndarray): signed change in each quantity (column)
+            at each timestamp (row)
+        total (int): upper bound of each quantity
+
+    Returns:
+        numpy.ndarray: value of each quantity at each timestamp
+    """
+    return numpy.clip(prev + numpy.cumsum(increments, axis=0), 0, total)
+
+def create_tables(conn):
+    """Create empty LMT tables and the indices LMT uses to query them
+
+    Args:
+        conn (sqlite3.Connection): database in which tables should be created
+    """
+    for table, schema in tokio.connectors.lmtdb.LMTDB_TABLES.items():
+        conn.execute("CREATE TABLE %s (%s, PRIMARY KEY(%s))" % (
+            table,
+            ', '.join(schema['columns']),
+            ', '.join(schema['primary_key'])))
+    conn.execute("CREATE INDEX TIMESTAMP_INFO_TIMESTAMP ON TIMESTAMP_INFO(TIMESTAMP)")
+
+def create_indices(conn):
+    """Create the TS_ID indices of the data tables
+
+    These are created after the data tables are populated since maintaining
+    them during insertion is much slower.
+
+    Args:
+        conn (sqlite3.Connection): database containing LMT data tables
+    """
+    for table in 'OST_DATA', 'OSS_DATA', 'MDS_DATA', 'MDS_OPS_DATA':
+        conn.execute("CREATE INDEX %s_TS_ID ON %s(TS_ID)" % (table, table))
+
+def populate_info(conn, fsname, num_osts, osts_per_oss, num_mdses):
+    """Populate the LMT tables that describe the file system
+
+    Args:
+        conn (sqlite3.Connection): database containing LMT tables
+        fsname (str): name of the file system
+        num_osts (int): number of OSTs
+        osts_per_oss (int): number of OSTs served by each OSS
+        num_mdses (int): number of MDSes
+
+    Returns:
+        int: number of OSSes
+    """
+    num_osses = -(-num_osts // osts_per_oss)
+    conn.execute("INSERT INTO FILESYSTEM_INFO VALUES (?, ?, ?, ?)", (1, fsname, '', 1.1))
+    conn.executemany("INSERT INTO MDS_INFO VALUES (?, ?, ?, ?, ?)",
+                     [(mds_id, 1, '%s-MDT%04x' % (fsname, mds_id - 1),
+                       '%sn%03d' % (fsname, 2 + mds_id), '/dev/md66')
+                      for mds_id in range(1, num_mdses + 1)])
+    conn.executemany("INSERT INTO OSS_INFO VALUES (?, ?, ?, ?)",
+                     [(oss_id, 1, '%sn%03d' % (fsname, 2 + num_mdses + oss_id), None)
+                      for oss_id in range(1, num_osses + 1)])
+    conn.executemany("INSERT INTO OST_INFO VALUES (?, ?, ?, ?, ?, ?)",
+                     [(ost_id,
+                       1 + (ost_id - 1) // osts_per_oss,
+                       '%s-OST%04x' % (fsname, ost_id - 1),
+                       '%sn%03d' % (fsname, 3 + num_mdses + (ost_id - 1) // osts_per_oss),
+                       0,
+                       '/dev/md%d' % ((ost_id - 1) % osts_per_oss))
+                      for ost_id in range(1, num_osts + 1)])
+    conn.executemany("INSERT INTO OPERATION_INFO VALUES (?, ?, ?)",
+                     [(op_id, op_name, 'reqs')
+                      for op_id, op_name in enumerate(OPERATION_NAMES, 1)])
+    conn.executemany("INSERT INTO OST_VARIABLE_INFO VALUES (?, ?, ?, ?, ?, ?)",
+                     OST_VARIABLE_INFO)
+    conn.executemany("INSERT INTO MDS_VARIABLE_INFO VALUES (?, ?, ?, ?, ?, ?)",
+                     MDS_VARIABLE_INFO)
+    return num_osses
+
+def insert_rows(conn, table, keep, columns):
+    """Insert the rows of a block of data whose samples were not dropped
+
+    Args:
+        conn (sqlite3.Connection): database containing LMT tables
+        table (str): name of table to populate
+        keep (numpy.ndarray): bool array that is True for rows to insert
+        columns (list of numpy.ndarray): arrays of values for each column of
+            table.  Each array must be the same shape as keep.
+
+    Returns:
+        int: number of rows inserted
+    """
+    columns = [numpy.broadcast_to(column, keep.shape)[keep].tolist() for column in columns]
+    conn.executemany("INSERT INTO %s VALUES (%s)" % (table, ', '.join(['?'] * len(columns))),
+                     zip(*columns))
+    return len(columns[0])
+
+def generate_lmtdb(output_file, start, end, timestep=5, num_osts=24, osts_per_oss=1, num_mdses=1,
+                   fsname='snx99999', reset_fraction=1e-4, missing_rows=1e-3,
+                   missing_timestamps=1e-3, seed=0):
+    """Create a synthetic LMT database
+
+    Args:
+        output_file (str): path to SQLite database to create
+        start (datetime.datetime): first timestamp to generate
+        end (datetime.datetime): generate timestamps up to but not including
+            this time
+        timestep (int): seconds between consecutive timestamps
+        num_osts (int): number of OSTs
+        osts_per_oss (int): number of OSTs served by each OSS
+        num_mdses (int): number of MDSes
+        fsname (str): name of the file system
+        reset_fraction (float): probability that a server's counters are
+            reset to zero at each timestamp
+        missing_rows (float): probability that a server's sample is absent
+            from a timestamp
+        missing_timestamps (float): probability that a timestamp is absent
+            altogether
+        seed (int): random number generator seed
+
+    Returns:
+        dict: number of rows inserted into each table
+    """
+    rng = numpy.random.RandomState(seed)
+    conn = sqlite3.connect(output_file)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA journal_mode = MEMORY")
+    create_tables(conn)
+    num_osses = populate_info(conn, fsname, num_osts, osts_per_oss, num_mdses)
+
+    op_ids = []
+    op_rates = []
+    for op_id, op_name in enumerate(OPERATION_NAMES, 1):
+        if op_name in MDS_OPS_RATES:
+            op_ids.append(op_id)
+            op_rates.append(MDS_OPS_RATES[op_name])
+    op_ids = numpy.array(op_ids)
+    op_rates = numpy.tile(op_rates, num_mdses) * timestep
+
+    ost_ids = numpy.arange(1, num_osts + 1)
+    oss_ids = numpy.arange(1, num_osses + 1)
+    mds_ids = numpy.arange(1, num_mdses + 1)
+
+    # state carried between blocks
+    read_bytes = rng.randint(0, 2**44, num_osts)
+    write_bytes = rng.randint(0, 2**44, num_osts)
+    ost_kbytes_used = rng.randint(OST_KBYTES_TOTAL // 4, OST_KBYTES_TOTAL // 2, num_osts)
+    ost_inodes_used = rng.randint(OST_INODES_TOTAL // 8, OST_INODES_TOTAL // 4, num_osts)
+    mdt_kbytes_used = rng.randint(MDT_KBYTES_TOTAL // 16, MDT_KBYTES_TOTAL // 8, num_mdses)
+    mdt_inodes_used = rng.randint(MDT_INODES_TOTAL // 8, MDT_INODES_TOTAL // 4, num_mdses)
+    op_samples = rng.randint(0, 2**32, num_mdses * len(op_ids))
+    next_ts_id = 1
+
+    row_counts = {table: 0 for table in ('TIMESTAMP_INFO', 'OST_DATA', 'OSS_DATA',
+                                         'MDS_DATA', 'MDS_OPS_DATA')}
+    num_timestamps = int((end - start).total_seconds() // timestep)
+    for block_start in range(0, num_timestamps, BLOCK_SIZE):
+        nrows = min(BLOCK_SIZE, num_timestamps - block_start)
+
+        # timestamps that were never recorded are not assigned a TS_ID
+        kept = rng.random_sample(nrows) >= missing_timestamps
+        num_kept = kept.sum()
+        ts_ids = numpy.arange(next_ts_id, next_ts_id + num_kept)
+        next_ts_id += num_kept
+        conn.executemany("INSERT INTO TIMESTAMP_INFO VALUES (?, ?)",
+                         zip(ts_ids.tolist(),
+                             [(start + datetime.timedelta(seconds=int(index) * timestep)).strftime(LMT_DATE_FMT)
+                              for index in numpy.flatnonzero(kept) + block_start]))
+        row_counts['TIMESTAMP_INFO'] += num_kept
+        ts_col = ts_ids[:, None]
+
+        # OST_DATA
+        shape = (nrows, num_osts)
+        resets = rng.random_sample(shape) < reset_fraction
+        busy = rng.random_sample(shape) < OST_DUTY_CYCLE
+        read_incr = numpy.where(busy, rng.exponential(OST_BYTES_PER_SEC * timestep, shape), 0).astype('i8')
+        busy = rng.random_sample(shape) < OST_DUTY_CYCLE
+        write_incr = numpy.where(busy, rng.exponential(OST_BYTES_PER_SEC * timestep, shape), 0).astype('i8')
+        read_counters = accumulate(read_bytes, read_incr, resets)
+        write_counters = accumulate(write_bytes, write_incr, resets)
+        read_bytes, write_bytes = read_counters[-1], write_counters[-1]
+
+        freed = numpy.where(rng.random_sample(shape) < OST_DUTY_CYCLE,
+                            rng.exponential(OST_BYTES_PER_SEC * timestep, shape), 0).astype('i8')
+        kbytes_used = drift(ost_kbytes_used, (write_incr - freed) // 1024, OST_KBYTES_TOTAL)
+        inodes_used = drift(ost_inodes_used,
+                            rng.poisson(timestep, shape) - rng.poisson(timestep, shape),
+                            OST_INODES_TOTAL)
+        ost_kbytes_used, ost_inodes_used = kbytes_used[-1], inodes_used[-1]
+
+        keep = kept[:, None] & (rng.random_sample(shape) >= missing_rows)
+        row_counts['OST_DATA'] += insert_rows(conn, 'OST_DATA', keep[kept], [
+            ost_ids[None, :],
+            ts_col,
+            read_counters[kept],
+            write_counters[kept],
+            numpy.round(rng.uniform(0.0, 5.0, shape), 5)[kept],
+            (OST_KBYTES_TOTAL - kbytes_used)[kept],
+            kbytes_used[kept],
+            (OST_INODES_TOTAL - inodes_used)[kept],
+            inodes_used[kept],
+        ])
+
+        # OSS_DATA
+        shape = (nrows, num_osses)
+        keep = kept[:, None] & (rng.random_sample(shape) >= missing_rows)
+        row_counts['OSS_DATA'] += insert_rows(conn, 'OSS_DATA', keep[kept], [
+            oss_ids[None, :],
+            ts_col,
+            numpy.round(rng.gamma(1.0, 2.0, shape), 5)[kept],
+            numpy.round(rng.uniform(90.0, 99.0, shape), 4)[kept],
+        ])
+
+        # MDS_DATA
+        shape = (nrows, num_mdses)
+        kbytes_used = drift(mdt_kbytes_used, rng.randint(-8, 12, shape), MDT_KBYTES_TOTAL)
+        inodes_used = drift(mdt_inodes_used,
+                            rng.poisson(timestep * 20, shape) - rng.poisson(timestep * 20, shape),
+                            MDT_INODES_TOTAL)
+        mdt_kbytes_used, mdt_inodes_used = kbytes_used[-1], inodes_used[-1]
+        mds_resets = rng.random_sample(shape) < reset_fraction
+        keep = kept[:, None] & (rng.random_sample(shape) >= missing_rows)
+        row_counts['MDS_DATA'] += insert_rows(conn, 'MDS_DATA', keep[kept], [
+            mds_ids[None, :],
+            ts_col,
+            numpy.round(rng.gamma(2.0, 1.5, shape), 5)[kept],
+            (MDT_KBYTES_TOTAL - kbytes_used)[kept],
+            kbytes_used[kept],
+            (MDT_INODES_TOTAL - inodes_used)[kept],
+            inodes_used[kept],
+        ])
+
+        # MDS_OPS_DATA; columns are ordered by MDS_ID, then OPERATION_ID
+        shape = (nrows, num_mdses * len(op_ids))
+        resets = numpy.repeat(mds_resets, len(op_ids), axis=1)
+        counters = accumulate(op_samples, rng.poisson(op_rates, shape), resets)
+        op_samples = counters[-1]
+        keep = numpy.repeat(keep, len(op_ids), axis=1)
+        row_counts['MDS_OPS_DATA'] += insert_rows(conn, 'MDS_OPS_DATA', keep[kept], [
+            numpy.repeat(mds_ids, len(op_ids))[None, :],
+            ts_col,
+            numpy.tile(op_ids, num_mdses)[None, :],
+            counters[kept],
+            0,
+            0,
+        ])
+
+    create_indices(conn)
+    conn.commit()
+    conn.close()
+    return {table: int(count) for table, count in row_counts.items()}
+
+def main(argv=None):
+    """Entry point for the CLI interface
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output", type=str, help="SQLite file to create")
+    parser.add_argument("-s", "--start", type=str, default="2018-01-28T00:00:00",
+                        help="first timestamp to generate in %s format (default: %%(default)s)" % DATE_FMT.replace('%', '%%'))
+    parser.add_argument("-d", "--days", type=float, default=1.0,
+                        help="number of days to generate (default: %(default)s)")
+    parser.add_argument("-t", "--timestep", type=int, default=5,
+                        help="seconds between timestamps (default: %(default)s)")
+    parser.add_argument("--osts", type=int, default=24,
+                        help="number of OSTs (default: %(default)s)")
+    parser.add_argument("--osts-per-oss", type=int, default=1,
+                        help="number of OSTs per OSS (default: %(default)s)")
+    parser.add_argument("--mdses", type=int, default=1,
+                        help="number of MDSes (default: %(default)s)")
+    parser.add_argument("--fsname", type=str, default="snx99999",
+                        help="file system name (default: %(default)s)")
+    parser.add_argument("--reset-fraction", type=float, default=1e-4,
+                        help="probability of a server's counters being reset at each timestamp (default: %(default)s)")
+    parser.add_argument("--missing-rows", type=float, default=1e-3,
+                        help="probability of a server's sample being missing (default: %(default)s)")
+    parser.add_argument("--missing-timestamps", type=float, default=1e-3,
+                        help="probability of a timestamp being missing (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random number generator seed (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.output):
+        parser.error("%s already exists" % args.output)
+    if args.osts < 1 or args.osts_per_oss < 1 or args.mdses < 1 or args.timestep < 1:
+        parser.error("--osts, --osts-per-oss, --mdses, and --timestep must be positive")
+
+    start = datetime.datetime.strptime(args.start, DATE_FMT)
+    end = start + datetime.timedelta(days=args.days)
+
+    t0 = time.time()
+    row_counts = generate_lmtdb(output_file=args.output,
+                                start=start,
+                                end=end,
+                                timestep=args.timestep,
+                                num_osts=args.osts,
+                                osts_per_oss=args.osts_per_oss,
+                                num_mdses=args.mdses,
+                                fsname=args.fsname,
+                                reset_fraction=args.reset_fraction,
+                                missing_rows=args.missing_rows,
+                                missing_timestamps=args.missing_timestamps,
+                                seed=args.seed)
+    for table in sorted(row_counts):
+        print("%-16s %12d rows" % (table, row_counts[table]))
+    sys.stderr.write("Generated %s in %.1f seconds\n" % (args.output, time.time() - t0))
+
+if __name__ == "__main__":
+    main()
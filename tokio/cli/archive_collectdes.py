@@ -11,12 +11,17 @@ import os
 import sys
 import gzip
 import json
+import mmap
 import time
+import marshal
+import resource
 import datetime
 import argparse
 import warnings
 import mimetypes
+import contextlib
 import collections
+import itertools
 import multiprocessing
 
 import dateutil.parser # because of how ElasticSearch returns time data
@@ -24,7 +29,9 @@ import dateutil.tz
 import numpy
 
 import tokio.debug
+import tokio.common
 import tokio.timeseries
+import tokio.connectors.es
 import tokio.connectors.collectd_es
 import tokio.connectors.hdf5
 
@@ -52,13 +59,39 @@ DATASETS = collections.OrderedDict([
 
 DATE_FMT = "%Y-%m-%dT%H:%M:%S"
 
-# This is necessary because multiprocessing needs to be able to serialize the
-# reducer that is passed back, but lambda functions are not pickleable.  So we
-# pass back a string that maps to a lambda.
-LAMBDA_MAPS = {
-    'sum': lambda x, y: x + y,
+# datasets whose values are summed per CPU and must be normalized by the
+# number of CPUs reported
+CPU_DATASETS = ['dataservers/cpuload', 'dataservers/cpuuser', 'dataservers/cpusys']
+
+# map of collectd memory type_instance to the dataset it populates
+MEMORY_DATASETS = {
+    'cached': 'dataservers/memcached',
+    'buffered': 'dataservers/membuffered',
+    'free': 'dataservers/memfree',
+    'used': 'dataservers/memused',
+    'slab_recl': 'dataservers/memslab',
+    'slab_unrecl': 'dataservers/memslab_unrecl',
 }
 
+# datasets whose values are summed within each element rather than replaced
+SUMMED_DATASETS = set(CPU_DATASETS + [x.replace('/', '/_num_', 1) for x in CPU_DATASETS])
+
+# Parallel page processing relies on workers inheriting shared memory when
+# they are forked; this is None where processes cannot be forked
+try:
+    FORK_CONTEXT = multiprocessing.get_context('fork')
+except ValueError:
+    FORK_CONTEXT = None
+
+# Number of slices of pages to hand each worker during parallel processing
+SLICES_PER_THREAD = 4
+
+# Size of the shared buffer through which PageWorkers hands pages to workers
+STAGING_BYTES = 64 * 2**20
+
+# State of a worker process started by PageWorkers; see _init_page_worker()
+_WORKER = {}
+
 def metadataset2dataset_key(metadataset_name):
     """Return the dataset name corresponding to a metadataset name
 
@@ -88,19 +121,94 @@ def dataset2metadataset_key(dataset_key):
     """
     return dataset_key.replace('/', '/_num_', 1)
 
+def parse_timestamp(timestamp):
+    """Convert an Elasticsearch ``@timestamp`` string into seconds since epoch
+
+    UTC timestamps in ISO8601 format (e.g., ``2017-12-13T08:26:20.677Z``) are
+    parsed using a fixed format, and each distinct second is parsed only
+    once.  Fractional seconds are truncated.  Any other timestamp is parsed
+    with dateutil and interpreted as local time if it has no time zone.
+
+    Args:
+        timestamp (str): Timestamp as returned by Elasticsearch
+
+    Returns:
+        int: Seconds since epoch
+    """
+    seconds = timestamp[:19]
+    zone = timestamp[19:].lstrip('.0123456789')
+    if zone == 'Z' or zone == '+00:00':
+        return tokio.common.strptime_epoch(seconds, DATE_FMT, utc=True)
+
+    # We jump through these hoops because most of TOKIO uses tz-unaware
+    # local datetimes and we don't want to inject a bunch of dateutil
+    # dependencies elsewhere
+    timestamp = dateutil.parser.parse(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(dateutil.tz.tzlocal()).replace(tzinfo=None)
+    return int(time.mktime(timestamp.timetuple()))
+
+def _append_insert(inserts, dataset_name, epoch, col_name, value):
+    """Append a single value to a columnar set of inserts
+
+    Args:
+        inserts (dict): Keyed by dataset name and containing lists of epochs,
+            column codes, and values and a dict mapping column names to codes
+        dataset_name (str): Name of dataset into which value should be inserted
+        epoch (int): Seconds since epoch of value
+        col_name (str): Name of column into which value should be inserted
+        value (float): Value to insert
+    """
+    entry = inserts.get(dataset_name)
+    if entry is None:
+        entry = inserts[dataset_name] = ([], [], [], {})
+    epochs, codes, values, columns = entry
+    code = columns.get(col_name)
+    if code is None:
+        code = columns[col_name] = len(columns)
+    epochs.append(epoch)
+    codes.append(code)
+    values.append(value)
+
+def _finalize_inserts(inserts):
+    """Convert the lists built by _append_insert into arrays
+
+    Args:
+        inserts (dict): As populated by _append_insert
+
+    Returns:
+        dict: Keyed by dataset name and containing tuples of (epochs, column
+        codes, column names, values) where column names is a list indexed by
+        column code and the rest are numpy.ndarray
+    """
+    finalized = {}
+    for dataset_name, (epochs, codes, values, columns) in inserts.items():
+        col_names = [None] * len(columns)
+        for col_name, code in columns.items():
+            col_names[code] = col_name
+        finalized[dataset_name] = (numpy.array(epochs, dtype='i8'),
+                                   numpy.array(codes, dtype='i8'),
+                                   col_names,
+                                   numpy.array(values, dtype='f8'))
+    return finalized
+
 def process_page(page):
     """
-    Go through a list of docs and insert their data into a numpy matrix.  In
+    Go through a list of docs and extract their data into arrays.  In
     the future this should be a flush function attached to the CollectdEs
     connector class.
 
     Args:
-        page (dict): A single page of output from an Elasticsearch scroll
-            query.  Should contain a ``hits`` key.
+        page (iterable): The hits of one or more pages of output from an
+            Elasticsearch scroll query
+
+    Returns:
+        dict: Keyed by dataset name and containing tuples of (epochs, column
+        codes, column names, values) to be passed to update_datasets()
     """
 
     _time0 = time.time()
-    inserts = []
+    inserts = {}
     for doc in page:
         # basic validity checking
         if '_source' not in doc:
@@ -108,118 +216,148 @@ def process_page(page):
             print(json.dumps(doc, indent=4))
             continue
         source = doc['_source']
+        plugin = source['plugin']
 
         # check to see if this is from plugin:disk
-        if source['plugin'] == 'disk':
-            # We jump through these hoops because most of TOKIO uses tz-unaware
-            # local datetimes and we don't want to inject a bunch of dateutil
-            # dependencies elsewhere
-            # timezone-aware string
-            # `-> tz-aware utc datetime
-            #     `-> local datetime
-            #         `-> tz-unaware local datetime
-            timestamp = dateutil.parser.parse(source['@timestamp'])\
-                                              .astimezone(dateutil.tz.tzlocal())\
-                                              .replace(tzinfo=None)
+        if plugin == 'disk':
+            val1 = source.get('read')
+            val2 = source.get('write')
+            if val1 is None or val2 is None:
+                continue
+            collectd_type = source['collectd_type']
+            if collectd_type == 'disk_octets':
+                dataset1, dataset2 = 'datatargets/readrates', 'datatargets/writerates'
+            elif collectd_type == 'disk_ops':
+                dataset1, dataset2 = 'datatargets/readoprates', 'datatargets/writeoprates'
+            else:
+                continue
+            timestamp = parse_timestamp(source['@timestamp'])
             col_name = "%s:%s" % (source['hostname'], source['plugin_instance'])
-
-            if source['collectd_type'] == 'disk_octets':
-                val1 = source.get('read')
-                val2 = source.get('write')
-                if val1 is not None and val2 is not None:
-                    inserts.append(('datatargets/readrates', timestamp, col_name, val1))
-                    inserts.append(('datatargets/writerates', timestamp, col_name, val2))
-            elif source['collectd_type'] == 'disk_ops':
-                val1 = source.get('read')
-                val2 = source.get('write')
-                if val1 is not None and val2 is not None:
-                    inserts.append(('datatargets/readoprates', timestamp, col_name, val1))
-                    inserts.append(('datatargets/writeoprates', timestamp, col_name, val2))
-        elif source['plugin'] == 'cpu' and 'value' in source:
-            timestamp = dateutil.parser.parse(source['@timestamp'])\
-                                              .astimezone(dateutil.tz.tzlocal())\
-                                              .replace(tzinfo=None)
-            val1 = source.get('value')
-            if source['type_instance'] == 'idle':
+            _append_insert(inserts, dataset1, timestamp, col_name, val1)
+            _append_insert(inserts, dataset2, timestamp, col_name, val2)
+        elif plugin == 'cpu' and 'value' in source:
+            val1 = source['value']
+            type_instance = source['type_instance']
+            if type_instance == 'idle':
                 # note that we store (100 - idle) as load
-                inserts.append(('dataservers/cpuload', timestamp, source['hostname'],
-                                100.0 - val1, 'sum'))
-                inserts.append(('dataservers/_num_cpuload', timestamp, source['hostname'],
-                                1, 'sum'))
-            elif source['type_instance'] == 'user':
-                inserts.append(('dataservers/cpuuser', timestamp, source['hostname'],
-                                val1, 'sum'))
-                inserts.append(('dataservers/_num_cpuuser', timestamp, source['hostname'],
-                                1, 'sum'))
-            elif source['type_instance'] == 'system':
-                inserts.append(('dataservers/cpusys', timestamp, source['hostname'],
-                                val1, 'sum'))
-                inserts.append(('dataservers/_num_cpusys', timestamp, source['hostname'],
-                                1, 'sum'))
-        elif source['plugin'] == 'memory' and 'value' in source:
-            timestamp = dateutil.parser.parse(source['@timestamp'])\
-                                              .astimezone(dateutil.tz.tzlocal())\
-                                              .replace(tzinfo=None)
-            val1 = source.get('value')
-            if source['type_instance'] == 'cached':
-                inserts.append(('dataservers/memcached', timestamp, source['hostname'], val1))
-            elif source['type_instance'] == 'buffered':
-                inserts.append(('dataservers/membuffered', timestamp, source['hostname'], val1))
-            elif source['type_instance'] == 'free':
-                inserts.append(('dataservers/memfree', timestamp, source['hostname'], val1))
-            elif source['type_instance'] == 'used':
-                inserts.append(('dataservers/memused', timestamp, source['hostname'], val1))
-            elif source['type_instance'] == 'slab_recl':
-                inserts.append(('dataservers/memslab', timestamp, source['hostname'], val1))
-            elif source['type_instance'] == 'slab_unrecl':
-                inserts.append(('dataservers/memslab_unrecl', timestamp, source['hostname'], val1))
-
+                dataset_name = 'dataservers/cpuload'
+                val1 = 100.0 - val1
+            elif type_instance == 'user':
+                dataset_name = 'dataservers/cpuuser'
+            elif type_instance == 'system':
+                dataset_name = 'dataservers/cpusys'
+            else:
+                continue
+            timestamp = parse_timestamp(source['@timestamp'])
+            _append_insert(inserts, dataset_name, timestamp, source['hostname'], val1)
+            _append_insert(inserts, dataset2metadataset_key(dataset_name),
+                           timestamp, source['hostname'], 1)
+        elif plugin == 'memory' and 'value' in source:
+            dataset_name = MEMORY_DATASETS.get(source['type_instance'])
+            if dataset_name:
+                _append_insert(inserts, dataset_name,
+                               parse_timestamp(source['@timestamp']),
+                               source['hostname'],
+                               source['value'])
+
+    inserts = _finalize_inserts(inserts)
     _timef = time.time()
     if tokio.debug.DEBUG:
-        print("Extracted %d inserts in %.4f seconds" % (len(inserts), _timef - _time0))
-        per_dataset = {}
-        for insert in inserts:
-            if insert[0] not in per_dataset:
-                per_dataset[insert[0]] = 0
-            per_dataset[insert[0]] += 1
-        for dataset_name in sorted(per_dataset.keys()):
-            print("  %6d entries for %s" % (per_dataset[dataset_name], dataset_name))
+        print("Extracted %d inserts in %.4f seconds"
+              % (sum([len(x[0]) for x in inserts.values()]), _timef - _time0))
+        for dataset_name in sorted(inserts.keys()):
+            print("  %6d entries for %s" % (len(inserts[dataset_name][0]), dataset_name))
+    return inserts
+
+def process_buckets(buckets):
+    """
+    Go through a list of aggregation buckets and extract their data into
+    arrays.  Equivalent to process_page() for data that was reduced by
+    Elasticsearch using the aggregations in tokio.connectors.collectd_es.
+
+    Args:
+        buckets (iterable): A single page of buckets from a composite aggregation
+            query.  Each bucket's ``key`` should contain ``@timestamp`` (in
+            epoch milliseconds), ``hostname``, and ``plugin``.
+
+    Returns:
+        dict: Keyed by dataset name and containing tuples of (epochs, column
+        codes, column names, values) to be passed to update_datasets()
+    """
+    _time0 = time.time()
+    inserts = {}
+    num_buckets = 0
+    for bucket in buckets:
+        num_buckets += 1
+        key = bucket['key']
+        # date_histogram keys are epoch milliseconds
+        timestamp = int(key['@timestamp'] // 1000)
+
+        if key['plugin'] == 'disk':
+            col_name = "%s:%s" % (key['hostname'], key['plugin_instance'])
+            val1 = bucket.get('read', {}).get('value')
+            val2 = bucket.get('write', {}).get('value')
+            if val1 is None or val2 is None:
+                continue
+            if key['collectd_type'] == 'disk_octets':
+                _append_insert(inserts, 'datatargets/readrates', timestamp, col_name, val1)
+                _append_insert(inserts, 'datatargets/writerates', timestamp, col_name, val2)
+            elif key['collectd_type'] == 'disk_ops':
+                _append_insert(inserts, 'datatargets/readoprates', timestamp, col_name, val1)
+                _append_insert(inserts, 'datatargets/writeoprates', timestamp, col_name, val2)
+        elif key['plugin'] == 'cpu':
+            # buckets carry the sum and number of per-core values so that
+            # normalize_cpu_datasets can average them like process_page's
+            val1 = bucket.get('value', {}).get('value')
+            count = bucket.get('count', {}).get('value')
+            if not count:
+                continue
+            if key['type_instance'] == 'idle':
+                dataset_name = 'dataservers/cpuload'
+                val1 = 100.0 * count - val1
+            elif key['type_instance'] == 'user':
+                dataset_name = 'dataservers/cpuuser'
+            elif key['type_instance'] == 'system':
+                dataset_name = 'dataservers/cpusys'
+            else:
+                continue
+            _append_insert(inserts, dataset_name, timestamp, key['hostname'], val1)
+            _append_insert(inserts, dataset2metadataset_key(dataset_name),
+                           timestamp, key['hostname'], count)
+        elif key['plugin'] == 'memory':
+            val1 = bucket.get('value', {}).get('value')
+            dataset_name = MEMORY_DATASETS.get(key['type_instance'])
+            if val1 is not None and dataset_name:
+                _append_insert(inserts, dataset_name, timestamp, key['hostname'], val1)
+
+    inserts = _finalize_inserts(inserts)
+    tokio.debug.debug_print("Extracted %d inserts from %d buckets in %.4f seconds"
+                            % (sum([len(x[0]) for x in inserts.values()]),
+                               num_buckets,
+                               time.time() - _time0))
     return inserts
 
 def update_datasets(inserts, datasets):
-    """Insert list of tuples into a dataset
+    """Insert arrays of values into datasets
 
-    Insert a list of tuples into a :class:`tokio.timeseries.TimeSeries` object serially
+    Scatter the arrays of values returned by process_page() into
+    :class:`tokio.timeseries.TimeSeries` objects.  Values destined for
+    SUMMED_DATASETS are added to the existing value of their element; all
+    others replace it.
 
     Args:
-        inserts (list of tuples): List of tuples which should be serially
-            inserted into a dataset.  The tuples can be of the form
-
-                * dataset name (str)
-                * timestamp (:class:`datetime.datetime`)
-                * column name (str)
-                * value
-
-            or
-
-                * dataset name (str)
-                * timestamp (:class:`datetime.datetime`)
-                * column name (str)
-                * value
-                * reducer name (str)
-
-            where
-
-                * `dataset name` is the key used to retrieve a target
-                  :class:`tokio.timeseries.TimeSeries` object from the `datasets`
-                  argument
-                * `timestamp` and `column name` reference the element to be udpated
-                * value is the new value to insert into the given (`timestamp`,
-                  `column name`) location within `dataset`.
-                * `reducer name` is None (to just replace whatever value
-                  currently exists in the (`timestamp`, `column name`) location,
-                  or 'sum' to add `value` to the existing value.
-
+        inserts (dict): Keyed by dataset name and containing tuples of
+
+                * epochs (numpy.ndarray): seconds since epoch of each value
+                * column codes (numpy.ndarray): index into column names of
+                  each value
+                * column names (list of str): names of the columns referenced
+                  by column codes
+                * values (numpy.ndarray): values to insert
+
+            where dataset name is the key used to retrieve a target
+            :class:`tokio.timeseries.TimeSeries` object from the `datasets`
+            argument.
         datasets (dict): Dictionary mapping dataset names (str) to
             :class:`tokio.timeseries.TimeSeries` objects
 
@@ -233,29 +371,30 @@ def update_datasets(inserts, datasets):
         data_volume[key] = 0.0
         errors[key] = 0
 
-    for insert in inserts:
-        try:
-            if len(insert) == 4:
-                (dataset_name, timestamp, col_name, value) = insert
-                reducer = None
-            else:
-                (dataset_name, timestamp, col_name, value, reducer_name) = insert
-                reducer = LAMBDA_MAPS.get(reducer_name)
-        except ValueError:
-            print(insert)
-            raise
-
-        if datasets[dataset_name].insert_element(timestamp, col_name, value, reducer):
-            data_volume[dataset_name] += value
-            tidx, cidx = datasets[dataset_name].get_insert_pos(timestamp, col_name)
-        else:
-            errors[dataset_name] += 1
-
-    # Update dataset metadata
-    for key in datasets:
-        unit = DATASETS.get(key, "unknown")
-        datasets[key].dataset_metadata.update({'version': SCHEMA_VERSION, 'units': unit})
-        datasets[key].group_metadata.update({'source': 'collectd_disk'})
+    for dataset_name, (epochs, codes, col_names, values) in inserts.items():
+        timeseries = datasets[dataset_name]
+
+        # only create columns for values that will actually be inserted, and
+        # create them in the order in which they were first encountered
+        t_index = (epochs - timeseries.timestamps[0]) // timeseries.timestep
+        valid = (t_index >= 0) & (t_index < timeseries.timestamps.shape[0])
+        present, first = numpy.unique(codes[valid], return_index=True)
+        lookup = numpy.full(len(col_names), -1, dtype='i8')
+        for code in present[numpy.argsort(first)]:
+            c_index = timeseries.column_map.get(col_names[code])
+            if c_index is None:
+                c_index = timeseries.add_column(col_names[code])
+            lookup[code] = c_index
+
+        inserted = timeseries.insert_elements(
+            epochs,
+            lookup[codes],
+            values,
+            reducer=numpy.add if dataset_name in SUMMED_DATASETS else None)
+        errors[dataset_name] += len(values) - inserted
+        data_volume[dataset_name] += values[valid].sum()
+
+    _update_metadata(datasets)
 
     index_errors = sum(errors.values())
     if index_errors > 0:
@@ -274,6 +413,14 @@ def update_datasets(inserts, datasets):
         print(update_str % data_volume)
     return index_errors
 
+def _update_metadata(datasets):
+    """Set the units and provenance of each dataset
+    """
+    for key in datasets:
+        unit = DATASETS.get(key, "unknown")
+        datasets[key].dataset_metadata.update({'version': SCHEMA_VERSION, 'units': unit})
+        datasets[key].group_metadata.update({'source': 'collectd_disk'})
+
 def reset_timeseries(timeseries, start, end, value=-0.0):
     """Zero out a region of a tokio.timeseries.TimeSeries dataset
 
@@ -292,49 +439,667 @@ def reset_timeseries(timeseries, start, end, value=-0.0):
     indexf, _ = timeseries.get_insert_pos(end, None)
     timeseries.dataset[index0:indexf, :] = value
 
-def normalize_cpu_datasets(inserts, datasets):
+def normalize_cpu_datasets(datasets):
     """Normalize CPU load datasets
 
     Divide each element of CPU datasets by the number of CPUs counted at each
     point in time.  Necessary because these measurements are reported on a
     per-core basis, but not all cores may be reported for each timestamp.
 
+    Must be called exactly once, after all pages have been inserted, since
+    the values for a single element may arrive across many pages.
+
     Args:
-        inserts (list of tuples): list of inserts that were used to populate
-            datasets
         datasets (dict of TimeSeries): all of the datasets being populated
 
     Returns:
         Nothing
     """
-    dataset_names = set(['dataservers/cpuload', 'dataservers/cpuuser', 'dataservers/cpusys'])
-    num_dataset_names = {}
-
-    norm_elements = {}
-    for dataset_name in dataset_names:
-        norm_elements[dataset_name] = set([])
-        num_dataset_names[dataset_name] = dataset2metadataset_key(dataset_name)
-
-    # build a set of all elements that must be divided
-    for insert in inserts:
-        (dataset_name, timestamp, col_name) = insert[0:3]
-        if dataset_name in dataset_names:
-            # get the position of this element to be inserted
-            t_index, c_index = datasets[dataset_name].get_insert_pos(timestamp, col_name)
-            if t_index is not None and c_index is not None:
-                norm_elements[dataset_name].add((t_index, c_index))
-
-    # now divide each element to be divided
-    for dataset_name in dataset_names:
-        num_dataset_name = num_dataset_names[dataset_name]
-        for t_index, c_index in norm_elements[dataset_name]:
-            datasets[dataset_name].dataset[t_index, c_index] /= \
-                datasets[num_dataset_name].dataset[t_index, c_index]
+    for dataset_name in CPU_DATASETS:
+        # elements that received no inserts have a count of -0.0
+        counts = datasets[dataset2metadataset_key(dataset_name)].dataset
+        dataset = datasets[dataset_name].dataset
+        inserted = counts > 0.0
+        dataset[inserted] /= counts[inserted]
         # convert NaNs (0.0 / 0.0) back to -0.0
-        datasets[dataset_name].dataset[numpy.isnan(datasets[dataset_name].dataset)] = -0.0
+        dataset[numpy.isnan(dataset)] = -0.0
+
+def get_peak_rss():
+    """Return the peak resident set size of this process
+
+    Returns:
+        int: Peak resident set size in bytes
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, but macOS reports bytes
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+def init_datasets(hdf5_file, output_file, file_exists, init_start, init_end,
+                  query_start, query_end, timestep, num_servers, devices_per_server):
+    """Load or create every dataset to be archived
+
+    Upgrades ``hdf5_file`` to the latest schema version, then loads each of
+    DATASETS from it or creates them if they do not exist.
+
+    Args:
+        hdf5_file (tokio.connectors.hdf5.Hdf5): Open file from which existing
+            datasets should be loaded
+        output_file (str): Path to ``hdf5_file``, used in warnings
+        file_exists (bool): Whether ``output_file`` existed before it was
+            opened
+        init_start (datetime.datetime): Lower bound of time (inclusive) to be
+            stored in new datasets
+        init_end (datetime.datetime): Upper bound of time (inclusive) to be
+            stored in new datasets
+        query_start (datetime.datetime): Lower bound of time (inclusive) of
+            data being archived
+        query_end (datetime.datetime); Upper bound of time (exclusive) of
+            data being archived
+        timestep (int): Time, in seconds, between successive sample intervals
+        num_servers (int): Number of discrete servers in the cluster
+        devices_per_server (int): Number of SSDs per server
+
+    Returns:
+        dict: Maps each of DATASETS to its :class:`tokio.timeseries.TimeSeries`
+    """
+    datasets = {}
+
+    schema_version = hdf5_file.get_version()
+
+    # New files have a blank slate and should use the latest; existing files may
+    # have orphaned duplicate data if two schemata are encoded at once
+    if file_exists and schema_version != SCHEMA_VERSION:
+        warnings.warn("%s existing version %s will be upgraded in-place to %s"
+            % (output_file, schema_version, SCHEMA_VERSION))
+
+    # Update to the latest schema version no matter what
+    schema_version = SCHEMA_VERSION
+    hdf5_file.attrs['version'] = SCHEMA_VERSION
+    schema = tokio.connectors.hdf5.SCHEMA.get(schema_version)
+    if schema is None:
+        raise KeyError("Schema version %d in %s is not known by connectors.hdf5" % (SCHEMA_VERSION, output_file))
+
+    # Initialize datasets
+    for dataset_name in DATASETS:
+        hdf5_dataset_name = schema.get(dataset_name)
+        if hdf5_dataset_name is None:
+            if '/_' not in dataset_name:
+                warnings.warn("Dataset %s in %s is not in schema version %s (passing through)" % (dataset_name, output_file, schema_version))
+            hdf5_dataset_name = dataset_name
+        if dataset_name.lstrip('/').startswith('datatargets'):
+            num_columns = num_servers * devices_per_server
+        else:
+            num_columns = num_servers
+
+        # If this is a metadataset, initialize it with the shape and columns of
+        # the dataset it describes so that we can use the same index values for
+        # both.  This requires the parent dataset's TimeSeries to already be
+        # defined and attached, which requires DATASETS to be an OrderedDict so
+        # that we aren't initializing metadatasets before datasets.
+        real_dataset_name = metadataset2dataset_key(dataset_name)
+        if real_dataset_name:
+            if real_dataset_name not in datasets:
+                raise KeyError("Cannot init metadataset %s; dataset %s does not exist" %
+                               (dataset_name, real_dataset_name))
+            global_start = datetime.datetime.fromtimestamp(datasets[real_dataset_name].timestamps[0])
+            global_end = datetime.datetime.fromtimestamp(datasets[real_dataset_name].timestamps[-1] + datasets[real_dataset_name].timestep)
+            timeseries = tokio.timeseries.TimeSeries(dataset_name=hdf5_dataset_name,
+                                                     start=global_start,
+                                                     end=global_end,
+                                                     timestep=timestep,
+                                                     num_columns=num_columns,
+                                                     column_names=datasets[real_dataset_name].columns)
+
+            # we can't update an average, so zero out all prior values that
+            # we will be overwriting
+            reset_timeseries(datasets[real_dataset_name], query_start, query_end)
+        else:
+            timeseries = hdf5_file.to_timeseries(dataset_name=hdf5_dataset_name)
+            if timeseries is None:
+                timeseries = tokio.timeseries.TimeSeries(dataset_name=hdf5_dataset_name,
+                                                         start=init_start,
+                                                         end=init_end,
+                                                         timestep=timestep,
+                                                         num_columns=num_columns)
+        datasets[dataset_name] = timeseries
+
+    return datasets
+
+def _get_rows(timeseries, start, end):
+    """Find the rows of a dataset that cover a range of time
+
+    Args:
+        timeseries (tokio.timeseries.TimeSeries): dataset to inspect
+        start (datetime.datetime or None): first time of interest, or None for
+            the first row of the dataset
+        end (datetime.datetime or None): time following the last time of
+            interest, or None for the last row of the dataset
+
+    Returns:
+        tuple of int: indices of the first row (inclusive) and last row
+        (exclusive) covering [start, end)
+    """
+    num_rows = timeseries.dataset.shape[0]
+    first_epoch = int(timeseries.timestamps[0])
+    row0 = 0
+    row1 = num_rows
+    if start is not None:
+        row0 = (int(time.mktime(start.timetuple())) - first_epoch) // timeseries.timestep
+    if end is not None:
+        row1 = -(-(int(time.mktime(end.timetuple())) - first_epoch) // timeseries.timestep)
+    row0 = min(max(row0, 0), num_rows)
+    return row0, min(max(row1, row0), num_rows)
+
+def _map_partials(buf, layout):
+    """Create arrays backed by one worker's shared partial datasets
+
+    Args:
+        buf (mmap.mmap): shared memory holding the partial datasets
+        layout (dict): as built by PageWorkers
+
+    Returns:
+        dict: keyed by dataset name and containing tuples of (values, stamps)
+        arrays, or None for datasets whose partials contain no rows
+    """
+    partials = {}
+    for dataset_name, (_, _, _, row0, row1, num_columns, offset) in layout.items():
+        num_elements = (row1 - row0) * num_columns
+        if not num_elements:
+            partials[dataset_name] = None
+            continue
+        values = numpy.frombuffer(buf, dtype='f8', count=num_elements, offset=offset)
+        stamps = numpy.frombuffer(buf, dtype='i4', count=num_elements,
+                                  offset=offset + 8 * num_elements)
+        partials[dataset_name] = (values.reshape(row1 - row0, num_columns),
+                                  stamps.reshape(row1 - row0, num_columns))
+    return partials
+
+def _init_page_worker(counter, buffers, layout, pages, staging):
+    """Attach a newly forked worker to its share of a PageWorkers' memory
+
+    Args:
+        counter (multiprocessing.Value): number of workers initialized so far,
+            used to give each worker its own partial datasets
+        buffers (list of mmap.mmap): shared partial datasets of every worker
+        layout (dict): as built by PageWorkers
+        pages (list or None): pages inherited from the parent
+        staging (mmap.mmap): shared buffer through which pages are passed
+    """
+    with counter.get_lock():
+        slot = counter.value
+        counter.value += 1
+    if slot >= len(buffers):
+        raise RuntimeError("more workers started than partial datasets allocated")
+    _WORKER.clear()
+    _WORKER.update({
+        'slot': slot,
+        'layout': layout,
+        'partials': _map_partials(buffers[slot], layout),
+        'columns': {},
+        'pages': pages,
+        'staging': staging,
+    })
+
+def _insert_partials(inserts, seq):
+    """Insert extracted values into the calling worker's partial datasets
+
+    Runs in a worker started by PageWorkers.  Every element that is written
+    is stamped with ``seq`` so that the parent can determine which worker
+    wrote each element last.
+
+    Args:
+        inserts (dict): as returned by process_page() or process_buckets()
+        seq (int): sequence number of the slice of pages being inserted
+
+    Returns:
+        tuple of (dict, dict, int, int): names of columns added to each
+        dataset, values that fall outside of the rows held in partial datasets
+        (in the same form as ``inserts``), the number of values extracted, and
+        the number of values that fall outside of their datasets
+    """
+    new_columns = {}
+    spills = {}
+    num_inserts = 0
+    num_errors = 0
+    for dataset_name, (epochs, codes, col_names, values) in inserts.items():
+        first_epoch, timestep, num_rows, row0, row1, num_columns, _ = _WORKER['layout'][dataset_name]
+        num_inserts += len(values)
+
+        t_index = (epochs - first_epoch) // timestep
+        valid = (t_index >= 0) & (t_index < num_rows)
+        num_errors += len(values) - int(valid.sum())
+
+        # number columns in the order they were first encountered, as
+        # update_datasets() does
+        columns = _WORKER['columns'].setdefault(dataset_name, {})
+        present, first = numpy.unique(codes[valid], return_index=True)
+        lookup = numpy.full(len(col_names), -1, dtype='i8')
+        for code in present[numpy.argsort(first)]:
+            c_index = columns.get(col_names[code])
+            if c_index is None:
+                c_index = len(columns)
+                if c_index >= num_columns:
+                    raise IndexError("new index %d (%s) exceeds number of columns %d in %s"
+                                     % (c_index, col_names[code], num_columns, dataset_name))
+                columns[col_names[code]] = c_index
+                new_columns.setdefault(dataset_name, []).append(col_names[code])
+            lookup[code] = c_index
+
+        in_partial = valid & (t_index >= row0) & (t_index < row1)
+        if in_partial.any():
+            partial_values, partial_stamps = _WORKER['partials'][dataset_name]
+            rows = t_index[in_partial] - row0
+            cols = lookup[codes[in_partial]]
+            if dataset_name in SUMMED_DATASETS:
+                numpy.add.at(partial_values, (rows, cols), values[in_partial])
+            else:
+                partial_values[rows, cols] = values[in_partial]
+            partial_stamps[rows, cols] = seq
+
+        spilled = valid & ~in_partial
+        if spilled.any():
+            spills[dataset_name] = (epochs[spilled], codes[spilled], col_names, values[spilled])
+
+    return new_columns, spills, num_inserts, num_errors
+
+def _reduce_pages(task):
+    """Extract a slice of pages into the calling worker's partial datasets
+
+    Runs in a worker started by PageWorkers.
+
+    Args:
+        task (tuple): sequence number of the slice, whether pages contain
+            aggregation buckets, and the source of the slice: either
+            ``('inherited', start, stop)`` for a slice of the pages inherited
+            from the parent, or ``(fmt, offset, lengths)`` for pages stored
+            consecutively in the staging buffer as JSON text (``fmt='json'``)
+            or with marshal (``fmt='marshal'``)
+
+    Returns:
+        tuple: the calling worker's slot followed by the output of
+        _insert_partials()
+    """
+    seq, aggregated, source = task
+    if source[0] == 'inherited':
+        pages = _WORKER['pages'][source[1]:source[2]]
+    else:
+        fmt, offset, lengths = source
+        staging = _WORKER['staging']
+        pages = []
+        for length in lengths:
+            blob = staging[offset:offset + length]
+            offset += length
+            if fmt == 'json':
+                pages.append(json.loads(blob.decode('utf-8')))
+            else:
+                pages.append(marshal.loads(blob))
+    page_processor = process_buckets if aggregated else process_page
+    inserts = page_processor(itertools.chain.from_iterable(pages))
+    return (_WORKER['slot'],) + _insert_partials(inserts, seq)
+
+class PageWorkers(object):
+    """Worker processes that reduce pages into shared partial datasets
+
+    Each worker owns a partial copy of every dataset in memory that is shared
+    with the parent.  Partial datasets only hold the rows between ``start``
+    and ``end`` so that their size is bounded by the time being archived
+    rather than the size of the output file.  Workers insert the values they
+    extract directly into their own partial datasets and only return the
+    names of new columns and the rare value that falls outside of those rows.
+    Once all pages have been processed, :meth:`reduce` combines the partial
+    datasets into the parent's datasets.  Elements of SUMMED_DATASETS are
+    added together, and every other element takes the value written by the
+    slice of pages processed last, as if pages were processed serially.
+
+    Pages are never pickled.  Pages given when the workers are started are
+    inherited when they are forked.  Pages given later are copied into a
+    shared staging buffer, as the JSON text from which they were read if they
+    are strings or serialized with marshal otherwise, and workers are only
+    told which part of the buffer to read.
+
+    Workers are forked when this object is created, so it should be created
+    before any threads are started.  Memory shared with workers is released
+    when this object is garbage collected.
+    """
+    def __init__(self, datasets, threads, start=None, end=None, pages=None,
+                 staging_bytes=STAGING_BYTES):
+        """
+        Args:
+            datasets (dict): Dictionary mapping dataset names (str) to
+                :class:`tokio.timeseries.TimeSeries` objects that will receive
+                values
+            threads (int): Number of worker processes
+            start (datetime.datetime or None): Earliest time held in partial
+                datasets.  If None, start at the first row of each dataset.
+            end (datetime.datetime or None): Time following the last time held
+                in partial datasets.  If None, end at the last row of each
+                dataset.
+            pages (list or None): Pages that workers should inherit
+            staging_bytes (int): Size of the buffer through which pages not
+                given as ``pages`` are passed to workers
+        """
+        if FORK_CONTEXT is None:
+            raise RuntimeError("PageWorkers requires processes that can be forked")
+        self.threads = threads
+        self.pages = pages
+        self.staging = mmap.mmap(-1, staging_bytes)
+        # names of the columns in each worker's partial datasets
+        self.columns = [{} for _ in range(threads)]
+        self._seq = 0
+
+        # partial datasets are laid out back-to-back as values (f8) followed
+        # by the sequence number of the slice that last wrote each value (i4)
+        self.layout = collections.OrderedDict()
+        size = 0
+        for dataset_name, timeseries in datasets.items():
+            row0, row1 = _get_rows(timeseries, start, end)
+            num_columns = timeseries.dataset.shape[1]
+            self.layout[dataset_name] = (int(timeseries.timestamps[0]),
+                                         timeseries.timestep,
+                                         timeseries.timestamps.shape[0],
+                                         row0,
+                                         row1,
+                                         num_columns,
+                                         size)
+            # keep every array 8-byte aligned
+            size += -(-12 * (row1 - row0) * num_columns // 8) * 8
+
+        # anonymous shared mappings are zero-filled on first use, so memory is
+        # only consumed by the rows each worker actually touches
+        self.buffers = [mmap.mmap(-1, max(size, mmap.PAGESIZE)) for _ in range(threads)]
+        self.pool = FORK_CONTEXT.Pool(threads,
+                                      initializer=_init_page_worker,
+                                      initargs=(FORK_CONTEXT.Value('i', 0),
+                                                self.buffers,
+                                                self.layout,
+                                                pages,
+                                                self.staging))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Stop all workers
+        """
+        if self.pool is not None:
+            # explicitly terminate to prevent HDF5 locking problems caused by
+            # un-gc'ed file handles
+            self.pool.terminate()
+            self.pool = None
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def _run(self, tasks, datasets):
+        """Have workers process slices of pages
+
+        Args:
+            tasks (list): arguments to _reduce_pages() for each slice
+            datasets (dict): datasets into which values that do not fit in
+                partial datasets should be inserted
+
+        Returns:
+            int: Number of elements extracted
+        """
+        num_inserts = 0
+        num_errors = 0
+        # imap preserves slice order so that values falling outside of the
+        # partial datasets are inserted in the same order as in serial
+        for slot, new_columns, spills, inserted, errors in self.pool.imap(_reduce_pages, tasks):
+            for dataset_name, col_names in new_columns.items():
+                self.columns[slot].setdefault(dataset_name, []).extend(col_names)
+            if spills:
+                update_datasets(spills, datasets)
+            num_inserts += inserted
+            num_errors += errors
+        if num_errors > 0:
+            warnings.warn("Out-of-bounds indices (%d total) were detected" % num_errors)
+        return num_inserts
+
+    def process(self, pages, datasets, aggregated=False):
+        """Extract data from pages into the workers' partial datasets
+
+        Values are not visible in ``datasets`` until :meth:`reduce` is called.
+
+        Args:
+            pages (list): A list of page objects (lists of documents) or of
+                their JSON encodings
+            datasets (dict): Dictionary mapping dataset names (str) to
+                :class:`tokio.timeseries.TimeSeries` objects
+            aggregated (bool): ``pages`` contain aggregation buckets as
+                returned by CollectdEs.aggregate_timeseries rather than
+                documents
+
+        Returns:
+            int: Number of elements extracted from ``pages``
+        """
+        if not pages:
+            return 0
+        num_slices = min(len(pages), self.threads * SLICES_PER_THREAD)
+
+        # workers already have these pages, so only send slice bounds
+        if pages is self.pages:
+            bounds = [len(pages) * i // num_slices for i in range(num_slices + 1)]
+            return self._run([(self._next_seq(), aggregated, ('inherited', bounds[i], bounds[i + 1]))
+                              for i in range(num_slices)],
+                             datasets)
+
+        if tokio.common.isstr(pages[0]):
+            fmt = 'json'
+            blobs = [page.strip().encode('utf-8') for page in pages]
+        else:
+            fmt = 'marshal'
+            blobs = [marshal.dumps(page) for page in pages]
+        slice_bytes = max(1, sum(len(blob) for blob in blobs) // num_slices)
+
+        # fill the staging buffer with slices, process them, and repeat
+        num_inserts = 0
+        tasks = []
+        offset = 0
+        start = 0
+        lengths = []
+        for blob in blobs:
+            if len(blob) > len(self.staging):
+                raise ValueError("page of %d bytes exceeds staging buffer of %d bytes"
+                                 % (len(blob), len(self.staging)))
+            if lengths and (offset - start >= slice_bytes
+                            or offset + len(blob) > len(self.staging)):
+                tasks.append((self._next_seq(), aggregated, (fmt, start, lengths)))
+                start = offset
+                lengths = []
+            if offset + len(blob) > len(self.staging):
+                num_inserts += self._run(tasks, datasets)
+                tasks = []
+                offset = start = 0
+            self.staging[offset:offset + len(blob)] = blob
+            offset += len(blob)
+            lengths.append(len(blob))
+        tasks.append((self._next_seq(), aggregated, (fmt, start, lengths)))
+        return num_inserts + self._run(tasks, datasets)
+
+    def reduce(self, datasets):
+        """Combine every worker's partial datasets into datasets
+
+        Should be called once, after all pages have been processed.
+
+        Args:
+            datasets (dict): Dictionary mapping dataset names (str) to
+                :class:`tokio.timeseries.TimeSeries` objects
+        """
+        _time0 = time.time()
+        partials = [_map_partials(buf, self.layout) for buf in self.buffers]
+        for dataset_name, layout in self.layout.items():
+            row0, row1 = layout[3:5]
+            timeseries = datasets[dataset_name]
+            last_stamps = None
+            for slot in range(self.threads):
+                col_names = self.columns[slot].get(dataset_name)
+                if not col_names:
+                    continue
+                c_indices = []
+                for col_name in col_names:
+                    c_index = timeseries.column_map.get(col_name)
+                    if c_index is None:
+                        c_index = timeseries.add_column(col_name)
+                    c_indices.append(c_index)
+                if partials[slot][dataset_name] is None:
+                    continue
+
+                values, stamps = partials[slot][dataset_name]
+                values = values[:, :len(col_names)]
+                stamps = stamps[:, :len(col_names)]
+                existing = timeseries.dataset[row0:row1, c_indices]
+                if dataset_name in SUMMED_DATASETS:
+                    timeseries.dataset[row0:row1, c_indices] = numpy.where(
+                        stamps > 0, existing + values, existing)
+                else:
+                    if last_stamps is None:
+                        last_stamps = numpy.zeros((row1 - row0, timeseries.dataset.shape[1]),
+                                                  dtype='i4')
+                    newer = stamps > last_stamps[:, c_indices]
+                    timeseries.dataset[row0:row1, c_indices] = numpy.where(newer, values, existing)
+                    last_stamps[:, c_indices] = numpy.where(newer, stamps, last_stamps[:, c_indices])
+
+        _update_metadata(datasets)
+        tokio.debug.debug_print("Reduced partial datasets from %d workers in %.4f seconds"
+                                % (self.threads, time.time() - _time0))
+
+@contextlib.contextmanager
+def page_workers(datasets, threads, start=None, end=None, pages=None):
+    """Start PageWorkers if pages should be processed in parallel
+
+    Args:
+        datasets (dict): Passed to PageWorkers
+        threads (int): Number of worker processes
+        start (datetime.datetime or None): Passed to PageWorkers
+        end (datetime.datetime or None): Passed to PageWorkers
+        pages (list or None): Passed to PageWorkers
+
+    Yields:
+        PageWorkers or None: Workers, or None if threads < 2 or processes
+        cannot be forked
+    """
+    if threads < 2 or FORK_CONTEXT is None:
+        yield None
+        return
+    workers = PageWorkers(datasets, threads, start=start, end=end, pages=pages)
+    try:
+        yield workers
+    finally:
+        workers.close()
+
+def process_pages(pages, datasets, threads=1, aggregated=False, workers=None):
+    """Extract data from pages and insert it into datasets
+
+    If ``workers`` are given, they process the pages and hold the extracted
+    values until :meth:`PageWorkers.reduce` is called.  Otherwise, if run in
+    parallel, PageWorkers are started for just these pages and reduced before
+    returning.  If processes cannot be forked, pages are instead pickled to a
+    pool of workers which return the values they extract.
+
+    Args:
+        pages (list): A list of page objects (lists of documents), or of their
+            JSON encodings if ``workers`` are given
+        datasets (dict): Dictionary mapping dataset names (str) to
+            :class:`tokio.timeseries.TimeSeries` objects
+        threads (int): Number of parallel processes to use when parsing
+            pages.  Ignored if ``workers`` are given.
+        aggregated (bool): ``pages`` contain aggregation buckets as returned
+            by CollectdEs.aggregate_timeseries rather than documents
+        workers (PageWorkers or None): Running workers to use
+
+    Returns:
+        int: Number of elements extracted from ``pages``
+    """
+    page_processor = process_buckets if aggregated else process_page
+    threads = min(threads, len(pages))
+
+    # Process all pages retrieved (this is computationally expensive)
+    _time0 = time.time()
+    if workers is not None:
+        num_inserts = workers.process(pages, datasets, aggregated=aggregated)
+    elif threads > 1 and FORK_CONTEXT is not None:
+        with PageWorkers(datasets, threads, pages=pages) as workers:
+            num_inserts = workers.process(pages, datasets, aggregated=aggregated)
+            workers.reduce(datasets)
+    else:
+        pool = multiprocessing.Pool(threads) if threads > 1 else None
+        if pool is None:
+            updates = (page_processor(page) for page in pages)
+        else:
+            updates = pool.imap(page_processor, pages)
+
+        # Take the processed list of data to insert and actually insert them
+        # as each page is extracted so only one page's inserts are resident
+        num_inserts = 0
+        try:
+            for update in updates:
+                update_datasets(update, datasets)
+                num_inserts += sum([len(x[0]) for x in update.values()])
+        finally:
+            if pool is not None:
+                # explicitly terminate to prevent HDF5 locking problems caused
+                # by un-gc'ed file handles
+                pool.terminate()
+
+    tokio.debug.debug_print("Processed %d elements from %d pages in %.4f seconds"
+                            % (num_inserts, len(pages), time.time() - _time0))
+    return num_inserts
+
+def commit_datasets(hdf5_file, datasets, swmr=False):
+    """Write datasets out to an HDF5 file
+
+    Metadatasets are not written.
+
+    Args:
+        hdf5_file (tokio.connectors.hdf5.Hdf5): File to which datasets should
+            be written
+        datasets (dict): Dictionary mapping dataset names (str) to
+            :class:`tokio.timeseries.TimeSeries` objects
+        swmr (bool): Write ``hdf5_file`` in single-writer/multiple-reader mode
+    """
+    _time0 = time.time()
+    to_commit = [dataset for dataset_name, dataset in datasets.items() if '/_' not in dataset_name]
+    if swmr:
+        hdf5_file.commit_timeseries_swmr(to_commit)
+    else:
+        for dataset in to_commit:
+            hdf5_file.commit_timeseries(dataset)
+    tokio.debug.debug_print("Committed data to disk in %.4f seconds" % (time.time() - _time0))
+
+def batch_pages(pages, flush_every):
+    """Group pages into batches of a bounded number of documents
+
+    Like the flushes of a scroll, a batch is emitted before the page that
+    would push it past ``flush_every`` documents, so a single page larger than
+    ``flush_every`` forms its own batch.
+
+    Args:
+        pages (iterable): Page objects (lists of documents)
+        flush_every (int): Maximum number of documents per batch
+
+    Yields:
+        list: Consecutive pages from ``pages``
+    """
+    batch = []
+    num_docs = 0
+    for page in pages:
+        if batch and num_docs + len(page) > flush_every:
+            yield batch
+            batch = []
+            num_docs = 0
+        batch.append(page)
+        num_docs += len(page)
+    if batch:
+        yield batch
 
 def pages_to_hdf5(pages, output_file, init_start, init_end, query_start, query_end,
-                  timestep, num_servers, devices_per_server, threads=1):
+                  timestep, num_servers, devices_per_server, threads=1, swmr=False,
+                  aggregated=False, flush_every=None):
     """Stores a page from Elasticsearch query in an HDF5 file
     Take pages from ElasticSearch query and store them in output_file
 
@@ -360,116 +1125,139 @@ def pages_to_hdf5(pages, output_file, init_start, init_end, query_start, query_e
             initializing ``output_file``.
         threads (int): Number of parallel threads to utilize when parsing the
             Elasticsearch output
+        swmr (bool): Write ``output_file`` in single-writer/multiple-reader
+            mode so it can be read while it is being updated
+        aggregated (bool): ``pages`` contain aggregation buckets as returned
+            by CollectdEs.aggregate_timeseries rather than documents
+        flush_every (int or None): Number of documents to read from ``pages``
+            before inserting them into datasets, so that ``pages`` may be an
+            iterator that is never held in memory at once.  If None, ``pages``
+            must be a list and is processed all at once.
     """
-    datasets = {}
-
-    file_exists = False
-    if os.path.isfile(output_file):
-        file_exists = True
-
-    with tokio.connectors.hdf5.Hdf5(output_file) as hdf5_file:
-        schema_version = hdf5_file.get_version()
-
-        # New files have a blank slate and should use the latest; existing files may
-        # have orphaned duplicate data if two schemata are encoded at once
-        if file_exists and schema_version != SCHEMA_VERSION:
-            warnings.warn("%s existing version %s will be upgraded in-place to %s"
-                % (output_file, schema_version, SCHEMA_VERSION))
-
-        # Update to the latest schema version no matter what
-        schema_version = SCHEMA_VERSION
-        hdf5_file.attrs['version'] = SCHEMA_VERSION
-        schema = tokio.connectors.hdf5.SCHEMA.get(schema_version)
-        if schema is None:
-            raise KeyError("Schema version %d in %s is not known by connectors.hdf5" % (SCHEMA_VERSION, output_file))
-
-        # Initialize datasets
-        for dataset_name in DATASETS:
-            hdf5_dataset_name = schema.get(dataset_name)
-            if hdf5_dataset_name is None:
-                if '/_' not in dataset_name:
-                    warnings.warn("Dataset %s in %s is not in schema version %s (passing through)" % (dataset_name, output_file, schema_version))
-                hdf5_dataset_name = dataset_name
-            if dataset_name.lstrip('/').startswith('datatargets'):
-                num_columns = num_servers * devices_per_server
-            else:
-                num_columns = num_servers
-
-            # If this is a metadataset, initialize it with the shape and columns of
-            # the dataset it describes so that we can use the same index values for
-            # both.  This requires the parent dataset's TimeSeries to already be
-            # defined and attached, which requires DATASETS to be an OrderedDict so
-            # that we aren't initializing metadatasets before datasets.
-            real_dataset_name = metadataset2dataset_key(dataset_name)
-            if real_dataset_name:
-                if real_dataset_name not in datasets:
-                    raise KeyError("Cannot init metadataset %s; dataset %s does not exist" %
-                                   (dataset_name, real_dataset_name))
-                global_start = datetime.datetime.fromtimestamp(datasets[real_dataset_name].timestamps[0])
-                global_end = datetime.datetime.fromtimestamp(datasets[real_dataset_name].timestamps[-1] + datasets[real_dataset_name].timestep)
-                timeseries = tokio.timeseries.TimeSeries(dataset_name=hdf5_dataset_name,
-                                                         start=global_start,
-                                                         end=global_end,
-                                                         timestep=timestep,
-                                                         num_columns=num_columns,
-                                                         column_names=datasets[real_dataset_name].columns)
-
-                # we can't update an average, so zero out all prior values that
-                # we will be overwriting
-                reset_timeseries(datasets[real_dataset_name], query_start, query_end)
-            else:
-                timeseries = hdf5_file.to_timeseries(dataset_name=hdf5_dataset_name)
-                if timeseries is None:
-                    timeseries = tokio.timeseries.TimeSeries(dataset_name=hdf5_dataset_name,
-                                                             start=init_start,
-                                                             end=init_end,
-                                                             timestep=timestep,
-                                                             num_columns=num_columns)
-            datasets[dataset_name] = timeseries
-
-        # Process all pages retrieved (this is computationally expensive)
-        _time0 = time.time()
-        updates = []
-        if threads > 1:
-            pool = multiprocessing.Pool(threads)
-            for update in pool.imap_unordered(process_page, pages):
-                updates.append(update)
-            # explicitly terminate to prevent HDF5 locking problems caused by
-            # un-gc'ed file handles
-            pool.terminate()
+    file_exists = os.path.isfile(output_file)
+
+    hdf5_kwargs = {'libver': 'latest'} if swmr else {}
+    with tokio.connectors.hdf5.Hdf5(output_file, **hdf5_kwargs) as hdf5_file:
+        datasets = init_datasets(hdf5_file=hdf5_file,
+                                 output_file=output_file,
+                                 file_exists=file_exists,
+                                 init_start=init_start,
+                                 init_end=init_end,
+                                 query_start=query_start,
+                                 query_end=query_end,
+                                 timestep=timestep,
+                                 num_servers=num_servers,
+                                 devices_per_server=devices_per_server)
+        if flush_every is None:
+            # workers inherit pages and only hold the rows being updated
+            batches = [pages]
+            inherited = pages
         else:
-            for page in pages:
-                updates.append(process_page(page))
-        _timef = time.time()
-        _extract_time = _timef - _time0
-        tokio.debug.debug_print("Extracted %d elements from %d pages in %.4f seconds" \
-                                % (sum([len(x) for x in updates]),
-                                   len(pages),
-                                   _extract_time))
+            batches = batch_pages(pages, flush_every)
+            inherited = None
+        with page_workers(datasets, threads, query_start, query_end, pages=inherited) as workers:
+            for batch in batches:
+                process_pages(batch, datasets, threads=threads, aggregated=aggregated,
+                              workers=workers)
+            if workers is not None:
+                workers.reduce(datasets)
+        normalize_cpu_datasets(datasets)
+        commit_datasets(hdf5_file, datasets, swmr=swmr)
+
+def archive_collectdes(esdb, output_file, init_start, init_end, query_start, query_end,
+                       timestep, num_servers, devices_per_server, threads=1, swmr=False,
+                       aggregate=False, flush_every=None, slices=1):
+    """Stream data from Elasticsearch into an HDF5 file
+
+    Unlike :func:`pages_to_hdf5`, pages are never all held in memory at once.
+    Instead, every ``flush_every`` documents, the pages received so far are
+    inserted into the resident datasets and discarded.  Datasets are
+    committed to ``output_file`` once all data has been received.
 
-        # Take the processed list of data to insert and actually insert them
-        _time0 = time.time()
-        for update in updates:
-            update_datasets(update, datasets)
-        _timef = time.time()
-        _update_time = _timef - _time0
-        if tokio.debug.DEBUG:
-            print("Inserted %d elements from %d pages in %.4f seconds" \
-                % (len(updates), len(pages), _update_time))
-            print("Processed %d pages in %.4f seconds" \
-                % (len(pages), _extract_time + _update_time))
-
-        for update in updates:
-            normalize_cpu_datasets(update, datasets)
-
-        # Write datasets out to HDF5 file
-        _time0 = time.time()
-        for dataset_name, dataset in datasets.items():
-            if '/_' not in dataset_name:
-                hdf5_file.commit_timeseries(dataset)
+    Args:
+        esdb (tokio.connectors.collectd_es.CollectdEs): Connection from which
+            data should be retrieved
+        output_file (str): Path to an HDF5 file in which data should be stored
+        init_start (datetime.datetime): Lower bound of time (inclusive) to be
+            stored in the ``output_file``.  Used when creating a non-existent
+            HDF5 file.
+        init_end (datetime.datetime): Upper bound of time (inclusive) to be
+            stored in the ``output_file``.  Used when creating a non-existent
+            HDF5 file.
+        query_start (datetime.datetime): Retrieve data greater than or equal to
+            this time from Elasticsearch
+        query_end (datetime.datetime); Retrieve data less than this time from
+            Elasticsearch
+        timestep (int): Time, in seconds, between successive sample intervals
+        num_servers (int): Number of discrete servers in the cluster
+        devices_per_server (int): Number of SSDs per server
+        threads (int): Number of parallel threads to utilize when parsing the
+            Elasticsearch output
+        swmr (bool): Write ``output_file`` in single-writer/multiple-reader
+            mode so it can be read while it is being updated
+        aggregate (bool): Retrieve data reduced by Elasticsearch aggregations
+            rather than documents
+        flush_every (int or None): Number of documents to retrieve before
+            inserting them into datasets.  If None, use the default of
+            ``esdb``.
+        slices (int): Number of slices of each query to retrieve concurrently
 
-    if tokio.debug.DEBUG:
-        print("Committed data to disk in %.4f seconds" % (time.time() - _time0))
+    Returns:
+        int: Number of elements extracted from Elasticsearch
+    """
+    file_exists = os.path.isfile(output_file)
+    num_inserts = [0]
+
+    hdf5_kwargs = {'libver': 'latest'} if swmr else {}
+    with tokio.connectors.hdf5.Hdf5(output_file, **hdf5_kwargs) as hdf5_file:
+        datasets = init_datasets(hdf5_file=hdf5_file,
+                                 output_file=output_file,
+                                 file_exists=file_exists,
+                                 init_start=init_start,
+                                 init_end=init_end,
+                                 query_start=query_start,
+                                 query_end=query_end,
+                                 timestep=timestep,
+                                 num_servers=num_servers,
+                                 devices_per_server=devices_per_server)
+
+        # start workers once, before any scroll threads are running, and
+        # reuse them for every flush
+        with page_workers(datasets, threads, query_start, query_end) as workers:
+            def flush_function(es_obj):
+                """Insert accumulated pages into datasets, then discard them"""
+                num_inserts[0] += process_pages(es_obj.scroll_pages,
+                                                datasets,
+                                                threads=threads,
+                                                aggregated=aggregate,
+                                                workers=workers)
+                es_obj.scroll_pages = []
+
+            if aggregate:
+                # aggregations return few enough buckets to process per query
+                for query in [esdb.aggregate_cpu, esdb.aggregate_disk, esdb.aggregate_memory]:
+                    query(query_start, query_end, timestep)
+                    flush_function(esdb)
+            else:
+                for plugin_query in [tokio.connectors.collectd_es.QUERY_CPU_DATA,
+                                     tokio.connectors.collectd_es.QUERY_DISK_DATA,
+                                     tokio.connectors.collectd_es.QUERY_MEMORY_DATA]:
+                    esdb.query_timeseries(plugin_query,
+                                          query_start,
+                                          query_end,
+                                          flush_every=flush_every,
+                                          flush_function=flush_function,
+                                          slices=slices)
+                    # flush whatever remains after the last page
+                    flush_function(esdb)
+
+            if workers is not None:
+                workers.reduce(datasets)
+
+        normalize_cpu_datasets(datasets)
+        commit_datasets(hdf5_file, datasets, swmr=swmr)
+
+    return num_inserts[0]
 
 def main(argv=None):
     """Entry point for the CLI interface
@@ -501,7 +1289,19 @@ def main(argv=None):
     parser.add_argument('--threads', type=int, default=1,
                         help='parallel threads for document extraction (default: 1)')
     parser.add_argument('--input', type=str, default=None,
-                        help="use cached ElasticSearch json as input")
+                        help="use cached ElasticSearch json or ndjson as input")
+    parser.add_argument('--aggregate', action='store_true',
+                        help="reduce data per timestep within ElasticSearch and retrieve"
+                        + " only the resulting buckets; with --input, input contains buckets")
+    parser.add_argument('--flush-every', type=int, default=None,
+                        help='number of documents to retrieve, or to read from NDJSON'
+                        + ' --input, before archiving them'
+                        + ' (default: %d)' % tokio.connectors.collectd_es.FLUSH_EVERY)
+    parser.add_argument('--slices', type=int, default=1,
+                        help='number of slices of each ElasticSearch scroll to retrieve'
+                        + ' concurrently (default: 1)')
+    parser.add_argument('--swmr', action='store_true',
+                        help="write output in HDF5 single-writer/multiple-reader mode")
     parser.add_argument("-o", "--output", type=str, default='output.hdf5',
                         help="output file (default: output.hdf5)")
     parser.add_argument('-h', '--host', type=str, default="localhost",
@@ -536,6 +1336,8 @@ def main(argv=None):
         raise Exception('init_start >= init_end')
     elif args.timestep < 1:
         raise Exception('--timestep must be > 0')
+    elif args.slices < 1:
+        raise Exception('--slices must be > 0')
 
     # Read input from a cached json file (generated previously via the --json
     # option) or by querying ElasticSearch?
@@ -554,38 +1356,37 @@ def main(argv=None):
 
         esdb = tokio.connectors.collectd_es.CollectdEs(**kwargs)
 
-        pages = None
-        for plugin_query in [tokio.connectors.collectd_es.QUERY_CPU_DATA,
-                             tokio.connectors.collectd_es.QUERY_DISK_DATA,
-                             tokio.connectors.collectd_es.QUERY_MEMORY_DATA]:
-            esdb.query_timeseries(plugin_query,
-                                  query_start,
-                                  query_end)
-            if pages is None:
-                pages = esdb.scroll_pages
-            else:
-                pages += esdb.scroll_pages
-
-            tokio.debug.debug_print("Loaded results from %s:%s" % (args.host, args.port))
-            pages_to_hdf5(pages=pages,
-                          output_file=args.output,
-                          init_start=init_start,
-                          init_end=init_end,
-                          query_start=query_start,
-                          query_end=query_end,
-                          timestep=args.timestep,
-                          num_servers=args.num_nodes,
-                          devices_per_server=args.ssds_per_node,
-                          threads=args.threads)
+        num_inserts = archive_collectdes(esdb=esdb,
+                                         output_file=args.output,
+                                         init_start=init_start,
+                                         init_end=init_end,
+                                         query_start=query_start,
+                                         query_end=query_end,
+                                         timestep=args.timestep,
+                                         num_servers=args.num_nodes,
+                                         devices_per_server=args.ssds_per_node,
+                                         threads=args.threads,
+                                         swmr=args.swmr,
+                                         aggregate=args.aggregate,
+                                         flush_every=args.flush_every,
+                                         slices=args.slices)
+        tokio.debug.debug_print("Archived %d elements from %s:%s"
+                                % (num_inserts, args.host, args.port))
     else:
-        _, encoding = mimetypes.guess_type(args.input)
-        if encoding == 'gzip':
-            input_file = gzip.open(args.input, 'rt')
+        flush_every = None
+        if tokio.connectors.es.is_ndjson_cache(args.input):
+            # stream the cache rather than loading it all at once
+            pages = tokio.connectors.es.iter_cache_pages(args.input)
+            flush_every = args.flush_every or tokio.connectors.collectd_es.FLUSH_EVERY
         else:
-            input_file = open(args.input, 'rt')
-        pages = json.load(input_file)
-        input_file.close()
-        tokio.debug.debug_print("Loaded results from %s" % args.input)
+            _, encoding = mimetypes.guess_type(args.input)
+            if encoding == 'gzip':
+                input_file = gzip.open(args.input, 'rt')
+            else:
+                input_file = open(args.input, 'rt')
+            pages = json.load(input_file)
+            input_file.close()
+        tokio.debug.debug_print("Reading results from %s" % args.input)
         pages_to_hdf5(pages=pages,
                       output_file=args.output,
                       init_start=init_start,
@@ -595,6 +1396,10 @@ def main(argv=None):
                       timestep=args.timestep,
                       num_servers=args.num_nodes,
                       devices_per_server=args.ssds_per_node,
-                      threads=args.threads)
+                      threads=args.threads,
+                      swmr=args.swmr,
+                      aggregated=args.aggregate,
+                      flush_every=flush_every)
 
     print("Wrote output to %s" % args.output)
+    print("Peak memory usage: %s" % tokio.common.humanize_bytes(get_peak_rss()))
@@ -5,6 +5,7 @@ import sys
 import datetime
 import argparse
 import warnings
+import numpy
 import tokio.debug
 import tokio.config
 import tokio.timeseries
@@ -35,7 +36,9 @@ class Archiver(dict):
     Implemented as a class so that a single object can store all of the
     TimeSeries objects that are generated by multiple method calls.
     """
-    def __init__(self, query_start, query_end, interfaces, timestep, timeout=30.0, *args, **kwargs):
+    def __init__(self, query_start, query_end, interfaces, timestep, timeout=30.0,
+                 max_workers=tokio.connectors.esnet_snmp.MAX_WORKERS, cache_dir=None,
+                 cache_retention=tokio.connectors.esnet_snmp.CACHE_RETENTION, *args, **kwargs):
         """Initializes the archiver and stores its settings
 
         Args:
@@ -48,6 +51,12 @@ class Archiver(dict):
             timestep (int): Number of seconds between successive data points.
                 The ESnet service may not honor this request.
             timeout (float): Seconds before HTTP connection times out
+            max_workers (int): Maximum number of concurrent HTTP requests
+            cache_dir (str or None): Directory in which to cache data retrieved
+                from the REST API so that later runs need not retrieve it
+                again.  If None, do not cache.
+            cache_retention (int or None): Seconds of data to keep in the
+                cache.  If None, keep all data.
         """
         super(Archiver, self).__init__(*args, **kwargs)
         self.query_start = query_start
@@ -55,6 +64,9 @@ class Archiver(dict):
         self.timestep = timestep
         self.interfaces = interfaces
         self.timeout = timeout
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
+        self.cache_retention = cache_retention
 
         self.config = {
             'datatargets/readrates': {
@@ -137,40 +149,58 @@ class Archiver(dict):
 
         # Retrieve all counters from REST API if not loaded from cache
         if input_file is None:
+            targets = [(endpoint, interface, direction)
+                       for endpoint, interface in self.interfaces
+                       for direction in ('in', 'out')]
+            cache = None
+            if self.cache_dir:
+                cache = tokio.connectors.esnet_snmp.SnmpCache(self.cache_dir,
+                                                              retention=self.cache_retention)
+            raw_results = esnetsnmp.get_many_interface_counters(
+                targets=targets,
+                agg_func='average',
+                interval=self.timestep,
+                max_workers=self.max_workers,
+                cache=cache,
+                timeout=self.timeout)
+
             last_payload_ck = None
-            for endpoint, interface in self.interfaces:
-                for direction in 'in', 'out':
-                    raw_result = esnetsnmp.get_interface_counters(
-                        endpoint=endpoint,
-                        interface=interface,
-                        direction=direction,
-                        agg_func='average',
-                        interval=self.timestep,
-                        timeout=self.timeout)
-
-                    # verify that the payload returned data and didn't hit an API rate limit
-                    payload = raw_result.get('data')
-                    if not payload:
-                        raise RuntimeError("%s:%s:%s returned no data" % (endpoint, interface, direction))
-
-                    # verify that the payload returned a consistent number of data points
-                    this_payload_ck = len(payload)
-                    if last_payload_ck is not None and this_payload_ck != last_payload_ck:
-                        raise RuntimeError(
-                            "%s:%s:%s returned %d entries, but previous contained %d"
-                            % (endpoint, interface, direction, this_payload_ck, last_payload_ck))
-
-        # Loop over all retrieved data
+            for (endpoint, interface, direction), raw_result in zip(targets, raw_results):
+                # verify that the payload returned data and didn't hit an API rate limit
+                payload = raw_result.get('data')
+                if not payload:
+                    raise RuntimeError("%s:%s:%s returned no data" % (endpoint, interface, direction))
+
+                # verify that the payload returned a consistent number of data points
+                this_payload_ck = len(payload)
+                if last_payload_ck is not None and this_payload_ck != last_payload_ck:
+                    raise RuntimeError(
+                        "%s:%s:%s returned %d entries, but previous contained %d"
+                        % (endpoint, interface, direction, this_payload_ck, last_payload_ck))
+
+            # only cache data that passed the checks above
+            if cache is not None:
+                cache.commit()
+                cache.prune()
+
+        # Insert each dataset's data for all interfaces at once
         for dataset_name, config in self.config.items():
             direction = config['direction']
+            timeseries = self[dataset_name]
+            epochs = []
+            column_indices = []
+            rates = []
             for endpoint, interface in self.interfaces:
-                for timestamp_int, bytes_sec in esnetsnmp[endpoint][interface][direction].items():
-                    timestamp = datetime.datetime.fromtimestamp(timestamp_int)
-                    target_name = endpoint_name(endpoint, interface)
-                    self[dataset_name].insert_element(
-                        timestamp,
-                        target_name,
-                        bytes_sec)
+                series = esnetsnmp[endpoint][interface][direction]
+                epochs.append(series.epochs)
+                rates.append(series.rates)
+                column_indices.append(numpy.full(len(series),
+                                                 timeseries.column_map[endpoint_name(endpoint, interface)],
+                                                 dtype='i8'))
+            if epochs:
+                timeseries.insert_elements(numpy.concatenate(epochs),
+                                           numpy.concatenate(column_indices),
+                                           numpy.concatenate(rates))
 
 def init_hdf5_file(datasets, init_start, init_end, hdf5_file):
     """
@@ -262,6 +292,14 @@ def main(argv=None):
                         help='collection frequency, in seconds (default: 30)')
     parser.add_argument("--timeout", type=float, default=30.0,
                         help="connection timeout, in seconds (default: 30 sec)")
+    parser.add_argument("--threads", type=int, default=tokio.connectors.esnet_snmp.MAX_WORKERS,
+                        help="maximum concurrent requests to the REST API (default: %(default)s)")
+    parser.add_argument("--cache-dir", type=str, default=tokio.config.CONFIG.get('esnet_snmp_cache_dir'),
+                        help="directory in which to cache data retrieved from the REST API so"
+                        + " that subsequent runs only retrieve new data (default: %(default)s)")
+    parser.add_argument("--cache-retention", type=float,
+                        default=tokio.connectors.esnet_snmp.CACHE_RETENTION / 86400.0,
+                        help="days of data to keep in the cache (default: %(default)s)")
     parser.add_argument("query_start", type=str,
                         help="start time in %s format" % DATE_FMT_PRINT)
     parser.add_argument("query_end", type=str,
@@ -296,6 +334,10 @@ def main(argv=None):
         raise ValueError('query_start >= query_end')
     elif args.timestep < 1:
         raise ValueError('--timestep must be > 0')
+    elif args.threads < 1:
+        raise ValueError('--threads must be > 0')
+    elif args.cache_retention <= 0:
+        raise ValueError('--cache-retention must be > 0')
 
     # Build list of desired interfaces
     if ':' not in args.endpoints:
@@ -320,4 +362,7 @@ def main(argv=None):
         query_start=query_start,
         query_end=query_end,
         input_file=args.input,
-        timeout=args.timeout)
+        timeout=args.timeout,
+        max_workers=args.threads,
+        cache_dir=args.cache_dir,
+        cache_retention=int(args.cache_retention * 86400))
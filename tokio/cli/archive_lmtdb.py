@@ -2,21 +2,114 @@
 Retrieve the contents of an LMT database and cache it locally.
 """
 
+import os
 import sys
+import time
 import datetime
 import argparse
 import warnings
+import threading
+import multiprocessing.pool
+try:
+    import queue
+except ImportError:
+    import Queue as queue # Python 2
+import numpy
 import tokio.debug
 import tokio.timeseries
 import tokio.connectors.lmtdb
 import tokio.connectors.hdf5
-from tokio.common import isstr
 
 DATE_FMT = "%Y-%m-%dT%H:%M:%S"
 DATE_FMT_PRINT = "YYYY-MM-DDTHH:MM:SS"
 
 SCHEMA_VERSION = "1"
 
+# Columns retrieved from each LMT table
+TABLE_COLUMNS = {
+    'MDS_DATA': ['TIMESTAMP', 'MDS_ID', 'PCT_CPU'],
+    'MDS_OPS_DATA': ['TIMESTAMP', 'MDS_ID', 'OPERATION_ID', 'SAMPLES'],
+    'OSS_DATA': ['TIMESTAMP', 'OSS_ID', 'PCT_CPU', 'PCT_MEMORY'],
+    'OST_DATA': ['TIMESTAMP', 'OST_ID', 'READ_BYTES', 'WRITE_BYTES', 'KBYTES_USED',
+                 'KBYTES_FREE', 'INODES_USED', 'INODES_FREE'],
+}
+
+# Mapping between OPERATION_INFO.OPERATION_NAME and dataset names
+MDS_OPS_DATASETS = {
+    'open': 'mdtargets/opens',
+    'close': 'mdtargets/closes',
+    'mknod': 'mdtargets/mknods',
+    'link': 'mdtargets/links',
+    'unlink': 'mdtargets/unlinks',
+    'mkdir': 'mdtargets/mkdirs',
+    'rmdir': 'mdtargets/rmdirs',
+    'rename': 'mdtargets/renames',
+    'getxattr': 'mdtargets/getxattrs',
+    'statfs': 'mdtargets/statfss',
+    'setattr': 'mdtargets/setattrs',
+    'getattr': 'mdtargets/getattrs',
+}
+
+# Datasets populated from each LMT table
+TABLE_DATASETS = {
+    'MDS_DATA': [
+        'mdservers/cpuload',
+    ],
+    'MDS_OPS_DATA': list(MDS_OPS_DATASETS.values()),
+    'OSS_DATA': [
+        'dataservers/cpuload',
+        'dataservers/memused',
+    ],
+    'OST_DATA': [
+        'datatargets/readbytes',
+        'datatargets/writebytes',
+        'fullness/bytes',
+        'fullness/bytestotal',
+        'fullness/inodes',
+        'fullness/inodestotal',
+    ],
+}
+
+# Order in which ArchivePipeline retrieves tables; OST_DATA's datasets take the
+# longest to finalize and write, so it goes first to let that overlap with
+# retrieving the other tables
+PIPELINE_TABLES = ['OST_DATA', 'OSS_DATA', 'MDS_OPS_DATA', 'MDS_DATA']
+
+# Maximum number of retrieved batches waiting to be ingested
+PIPELINE_QUEUE_DEPTH = 4
+
+# Seconds between checks for failures elsewhere in the pipeline while blocked
+PIPELINE_POLL_INTERVAL = 0.1
+
+def iter_result_columns(lmtdb, table, query_start, query_end, db_cols):
+    """Retrieve LMT time series data as batches of NumPy arrays
+
+    Args:
+        lmtdb (LmtDb): database object
+        table (str): name of the LMT table to query
+        query_start (datetime.datetime): lower bound of rows to retrieve
+        query_end (datetime.datetime): upper bound of rows to retrieve
+        db_cols (list of str): names of the columns to extract
+
+    Yields:
+        dict: keyed by column name and containing numpy.ndarray of that
+        column's values.  TIMESTAMP is expressed in seconds since epoch, ID
+        columns are left as-is, and all other columns are converted to floats.
+    """
+    table_columns = ['TIMESTAMP'] + tokio.connectors.lmtdb.LMTDB_TABLES[table]['columns']
+    for db_col in db_cols:
+        if db_col not in table_columns:
+            raise ValueError("LMT database schema does not match expectation")
+
+    for batch in lmtdb.iter_timeseries_data(table, query_start, query_end, epochs=True):
+        arrays = {}
+        for db_col in db_cols:
+            if db_col == 'TIMESTAMP' or db_col.endswith('_ID'):
+                arrays[db_col] = batch[db_col]
+            else:
+                arrays[db_col] = batch[db_col].astype('f8')
+        yield arrays
+
 class DatasetDict(dict):
     """A dictionary containing TimeSeries objects
 
@@ -137,7 +230,9 @@ class DatasetDict(dict):
     def init_datasets(self, dataset_names, columns):
         """Populate empty datasets within self
 
-        Creates and attachs TimeSeries objects to self based on a given column list
+        Creates and attachs TimeSeries objects to self based on a given column
+        list.  Datasets that already exist are left untouched so that repeated
+        archive_* calls accumulate into the same TimeSeries objects.
 
         Args:
             dataset_names (list of str): keys corresponding to self.config
@@ -146,6 +241,8 @@ class DatasetDict(dict):
                 datasets being created
         """
         for dataset_name in dataset_names:
+            if dataset_name in self:
+                continue
             hdf5_dataset_name = self.schema.get(dataset_name)
             if hdf5_dataset_name is None:
                 warnings.warn("Skipping %s (not in schema)" % dataset_name)
@@ -194,6 +291,34 @@ class DatasetDict(dict):
                     # for initial over-sizing of the time range by an extra timestamp
                     self[dataset_name].trim_rows(1)
 
+    def slice_rows(self, start_index, end_index):
+        """Copy a range of rows out of each dataset
+
+        Args:
+            start_index (int): first row (inclusive) to copy
+            end_index (int): last row (exclusive) to copy
+
+        Returns:
+            DatasetDict: a new object whose TimeSeries contain copies of rows
+            start_index through end_index of the TimeSeries in self.  Its
+            query_end_plusplus corresponds to the final row copied, so
+            finalize() will trim the result by one row as usual.
+        """
+        timestamps = next(iter(self.values())).timestamps
+        query_start = datetime.datetime.fromtimestamp(timestamps[start_index])
+        query_end = datetime.datetime.fromtimestamp(timestamps[end_index - 1])
+        sliced = DatasetDict(query_start, query_end, self.timestep, self.sort_hex)
+        for dataset_name, dataset in self.items():
+            timeseries = tokio.timeseries.TimeSeries(sort_hex=dataset.sort_hex)
+            timeseries.dataset_name = dataset.dataset_name
+            timeseries.timestep = dataset.timestep
+            timeseries.timestamps = dataset.timestamps[start_index:end_index].copy()
+            timeseries.dataset = dataset.dataset[start_index:end_index, :].copy()
+            timeseries.set_columns(dataset.columns)
+            timeseries.set_timestamp_key(dataset.timestamp_key)
+            sliced[dataset_name] = timeseries
+        return sliced
+
     def set_timeseries_metadata(self, dataset_names):
         """Set metadata constants (version, units, etc) on datasets and groups
 
@@ -209,242 +334,151 @@ class DatasetDict(dict):
                 })
                 self[dataset_name].group_metadata.update({'source': 'lmt'})
 
-    def archive_mds_data(self, lmtdb):
-        """Extract and encode data from LMT's MDS_DATA table
-
-        Queries the LMT database, interprets resulting rows, and populates a
-        dictionary of TimeSeries objects with those values.
+    def insert_results(self, dataset_name, timestamps, db_ids, id_map, values, strict=True):
+        """Scatter columns of LMT query results into a TimeSeries
 
         Args:
-            lmtdb (LmtDb): database object
+            dataset_name (str): key corresponding to self.config of the
+                dataset to populate
+            timestamps (numpy.ndarray): seconds since epoch of each row
+            db_ids (numpy.ndarray): LMT database ID (e.g., OST_ID) of each row
+            id_map (dict): mapping of LMT database IDs to column names
+            values (numpy.ndarray): value to insert for each row
+            strict (bool): raise KeyError if a database ID is not in id_map.
+                If False, warn and skip rows with unknown IDs instead.
         """
+        timeseries = self[dataset_name]
+        if db_ids.dtype.kind in 'iu' and len(db_ids) and db_ids.min() >= 0:
+            # LMT IDs are small integers, so index a lookup table directly
+            unique_ids = numpy.flatnonzero(numpy.bincount(db_ids))
+            lookup_keys, id_inverse = unique_ids, db_ids
+        else:
+            unique_ids, id_inverse = numpy.unique(db_ids, return_inverse=True)
+            lookup_keys = numpy.arange(len(unique_ids))
+        lookup = numpy.full(lookup_keys[-1] + 1 if len(lookup_keys) else 0, -1, dtype='i8')
+        for lookup_key, db_id in zip(lookup_keys, unique_ids):
+            column_name = id_map.get(db_id)
+            if column_name is None:
+                if strict:
+                    raise KeyError("unknown ID %s" % db_id)
+                warnings.warn("unknown ID %s" % db_id)
+                continue
+            c_index = timeseries.column_map.get(column_name)
+            if c_index is None:
+                c_index = timeseries.add_column(column_name)
+            lookup[lookup_key] = c_index
+        timeseries.insert_elements(timestamps, lookup[id_inverse], values)
 
-        dataset_names = [
-            'mdservers/cpuload',
-        ]
-
-        self.init_datasets(dataset_names, lmtdb.mds_names)
-
-        # Now query the MDS_DATA table to get byte counts over the query time range
-        results, columns = lmtdb.get_mds_data(self.query_start, self.query_end_plusplus)
-
-
-        # Index the columns to speed up insertion of data
-        col_map = {}
-        try:
-            for db_col in ['TIMESTAMP', 'MDS_ID', 'PCT_CPU']:
-                col_map[db_col] = columns.index(db_col)
-        except ValueError:
-            raise ValueError("LMT database schema does not match expectation")
-
-        # Loop through all the results of the timeseries query
-        for row in results:
-            if isstr(row[col_map['TIMESTAMP']]):
-                # SQLite stores timestamps as a unicode string
-                timestamp = datetime.datetime.strptime(row[col_map['TIMESTAMP']],
-                                                       "%Y-%m-%d %H:%M:%S")
-            else:
-                # MySQL timestamps are automatically converted to datetime.datetime
-                timestamp = row[col_map['TIMESTAMP']]
-            target_name = lmtdb.mds_id_map[row[col_map['MDS_ID']]]
-            for dataset_name in dataset_names:
-                target_dbcol = self.config[dataset_name].get('column')
-                # target_dbcol=PCT_CPU, target_name=snx11025n022
-                if target_dbcol is not None:
-                    self[dataset_name].insert_element(
-                        timestamp,
-                        target_name,
-                        row[col_map[target_dbcol]])
-                else:
-                    errmsg = "%s in self.config but missing 'column' setting" % dataset_name
-                    raise KeyError(errmsg)
+    def init_table(self, lmtdb, table):
+        """Populate empty datasets for the contents of an LMT table
 
-    def archive_mds_ops_data(self, lmtdb):
-        """Extract and encode data from LMT's MDS_OPS_DATA table
+        Args:
+            lmtdb (LmtDb): database object
+            table (str): name of an LMT table in TABLE_DATASETS
+        """
+        if table == 'OST_DATA':
+            columns = lmtdb.ost_names
+        elif table == 'OSS_DATA':
+            columns = lmtdb.oss_names
+        else:
+            columns = lmtdb.mds_names
+        self.init_datasets(TABLE_DATASETS[table], columns)
 
-        Queries the LMT database, interprets resulting rows, and populates a
-        dictionary of TimeSeries objects with those values.  Avoids JOINing the
-        MDS_VARIABLE_INFO table and instead uses an internal mapping of
-        OPERATION_IDs to demultiplex the data in MDS_OPS_DATA into different
-        HDF5 datasets.
+    def ingest_batch(self, lmtdb, table, arrays):
+        """Populate datasets from a batch of rows retrieved from an LMT table
 
         Args:
             lmtdb (LmtDb): database object
+            table (str): name of the LMT table from which arrays were retrieved
+            arrays (dict): columns listed in TABLE_COLUMNS[table] as returned
+                by iter_result_columns
         """
-
-        # mapping between OPERATION_INFO.OPERATION_NAME to HDF5 dataset names
-        opname_to_dataset_name = {
-            'open': 'mdtargets/opens',
-            'close': 'mdtargets/closes',
-            'mknod': 'mdtargets/mknods',
-            'link': 'mdtargets/links',
-            'unlink': 'mdtargets/unlinks',
-            'mkdir': 'mdtargets/mkdirs',
-            'rmdir': 'mdtargets/rmdirs',
-            'rename': 'mdtargets/renames',
-            'getxattr': 'mdtargets/getxattrs',
-            'statfs': 'mdtargets/statfss',
-            'setattr': 'mdtargets/setattrs',
-            'getattr': 'mdtargets/getattrs',
+        ingest_funcs = {
+            'MDS_DATA': self.ingest_mds_data,
+            'MDS_OPS_DATA': self.ingest_mds_ops_data,
+            'OSS_DATA': self.ingest_oss_data,
+            'OST_DATA': self.ingest_ost_data,
         }
-        dataset_names = list(opname_to_dataset_name.values())
-
-        self.init_datasets(dataset_names, lmtdb.mds_names)
+        ingest_funcs[table](lmtdb, arrays)
 
-        results, columns = lmtdb.get_mds_ops_data(self.query_start, self.query_end_plusplus)
+    def ingest_mds_data(self, lmtdb, arrays):
+        """Populate datasets from a batch of LMT's MDS_DATA table
 
-        # Index the columns to speed up insertion of data
-        col_map = {}
-        try:
-            for db_col in ['TIMESTAMP', 'MDS_ID', 'OPERATION_ID', 'SAMPLES']:
-                col_map[db_col] = columns.index(db_col)
-        except ValueError:
-            raise ValueError("LMT database schema does not match expectation")
+        Args:
+            lmtdb (LmtDb): database object
+            arrays (dict): columns of MDS_DATA returned by iter_result_columns
+        """
+        for dataset_name in TABLE_DATASETS['MDS_DATA']:
+            target_dbcol = self.config[dataset_name].get('column')
+            if target_dbcol is None:
+                errmsg = "%s in self.config but missing 'column' setting" % dataset_name
+                raise KeyError(errmsg)
+            # target_dbcol=PCT_CPU, column=snx11025n022
+            self.insert_results(dataset_name, arrays['TIMESTAMP'],
+                                arrays['MDS_ID'], lmtdb.mds_id_map,
+                                arrays[target_dbcol])
+
+    def ingest_mds_ops_data(self, lmtdb, arrays):
+        """Populate datasets from a batch of LMT's MDS_OPS_DATA table
+
+        Avoids JOINing the MDS_VARIABLE_INFO table and instead uses an
+        internal mapping of OPERATION_IDs to demultiplex the data in
+        MDS_OPS_DATA into different HDF5 datasets.
 
-        # Loop through all the results of the timeseries query
-        for row in results:
-            if isstr(row[col_map['TIMESTAMP']]):
-                # SQLite stores timestamps as a unicode string
-                timestamp = datetime.datetime.strptime(row[col_map['TIMESTAMP']],
-                                                       "%Y-%m-%d %H:%M:%S")
-            else:
-                # MySQL timestamps are automatically converted to datetime.datetime
-                timestamp = row[col_map['TIMESTAMP']]
-
-            # figure out the dataset this row's data will go into (this
-            # implicitly filters out operations that aren't defined in
-            # opname_to_dataset_name)
-            op_name = lmtdb.mds_op_id_map[row[col_map['OPERATION_ID']]]
-            dataset_name = opname_to_dataset_name.get(op_name)
+        Args:
+            lmtdb (LmtDb): database object
+            arrays (dict): columns of MDS_OPS_DATA returned by
+                iter_result_columns
+        """
+        # demultiplex rows by operation; this implicitly filters out
+        # operations that aren't defined in MDS_OPS_DATASETS
+        op_ids, op_inverse = numpy.unique(arrays['OPERATION_ID'], return_inverse=True)
+        for index, op_id in enumerate(op_ids):
+            dataset_name = MDS_OPS_DATASETS.get(lmtdb.mds_op_id_map[op_id])
             if dataset_name is None:
                 continue
+            mask = op_inverse == index
+            self.insert_results(dataset_name, arrays['TIMESTAMP'][mask],
+                                arrays['MDS_ID'][mask], lmtdb.mds_id_map,
+                                arrays['SAMPLES'][mask], strict=False)
 
-            # figure out which column (MDS name) this row's data will go into
-            mds_name = lmtdb.mds_id_map.get(row[col_map['MDS_ID']])
-            if not mds_name:
-                errmsg = "unknown MDS_ID %s" % row[col_map['MDS_ID']]
-                warnings.warn(errmsg)
-                continue
-
-            self[dataset_name].insert_element(
-                timestamp,
-                mds_name,
-                row[col_map['SAMPLES']])
-
-    def archive_oss_data(self, lmtdb):
-        """Extract and encode data from LMT's OSS_DATA table
-
-        Queries the LMT database, interprets resulting rows, and populates a
-        dictionary of TimeSeries objects with those values.
+    def ingest_oss_data(self, lmtdb, arrays):
+        """Populate datasets from a batch of LMT's OSS_DATA table
 
         Args:
             lmtdb (LmtDb): database object
+            arrays (dict): columns of OSS_DATA returned by iter_result_columns
         """
-
-        dataset_names = [
-            'dataservers/cpuload',
-            'dataservers/memused',
-        ]
-
-        self.init_datasets(dataset_names, lmtdb.oss_names)
-
-        # Now query the OSS_DATA table to get byte counts over the query time range
-        results, columns = lmtdb.get_oss_data(self.query_start, self.query_end_plusplus)
-
-        # Index the columns to speed up insertion of data
-        col_map = {}
-        try:
-            for db_col in ['TIMESTAMP', 'OSS_ID', 'PCT_CPU', 'PCT_MEMORY']:
-                col_map[db_col] = columns.index(db_col)
-        except ValueError:
-            raise ValueError("LMT database schema does not match expectation")
-
-        # Loop through all the results of the timeseries query
-        for row in results:
-            if isstr(row[col_map['TIMESTAMP']]):
-                # SQLite stores timestamps as a unicode string
-                timestamp = datetime.datetime.strptime(row[col_map['TIMESTAMP']],
-                                                       "%Y-%m-%d %H:%M:%S")
-            else:
-                # MySQL timestamps are automatically converted to datetime.datetime
-                timestamp = row[col_map['TIMESTAMP']]
-            target_name = lmtdb.oss_id_map[row[col_map['OSS_ID']]]
-            for dataset_name in dataset_names:
-                target_dbcol = self.config[dataset_name].get('column')
-                # target_dbcol=PCT_CPU, target_name=snx11025n022
-                if target_dbcol is not None:
-                    self[dataset_name].insert_element(
-                        timestamp,
-                        target_name,
-                        row[col_map[target_dbcol]])
-                else:
-                    errmsg = "%s in self.config but missing 'column' setting" % dataset_name
-                    raise KeyError(errmsg)
-
-    def archive_ost_data(self, lmtdb):
-        """Extract and encode data from LMT's OST_DATA table
-
-        Queries the LMT database, interprets resulting rows, and populates a
-        dictionary of TimeSeries objects with those values.
+        for dataset_name in TABLE_DATASETS['OSS_DATA']:
+            target_dbcol = self.config[dataset_name].get('column')
+            if target_dbcol is None:
+                errmsg = "%s in self.config but missing 'column' setting" % dataset_name
+                raise KeyError(errmsg)
+            # target_dbcol=PCT_CPU, column=snx11025n022
+            self.insert_results(dataset_name, arrays['TIMESTAMP'],
+                                arrays['OSS_ID'], lmtdb.oss_id_map,
+                                arrays[target_dbcol])
+
+    def ingest_ost_data(self, lmtdb, arrays):
+        """Populate datasets from a batch of LMT's OST_DATA table
 
         Args:
             lmtdb (LmtDb): database object
+            arrays (dict): columns of OST_DATA returned by iter_result_columns
         """
-
-        dataset_names = [
-            'datatargets/readbytes',
-            'datatargets/writebytes',
-            'fullness/bytes',
-            'fullness/bytestotal',
-            'fullness/inodes',
-            'fullness/inodestotal'
-        ]
-
-        self.init_datasets(dataset_names, lmtdb.ost_names)
-
-        # Now query the OST_DATA table to get byte counts over the query time range
-        results, columns = lmtdb.get_ost_data(self.query_start, self.query_end_plusplus)
-
-        # Index the columns to speed up insertion of data
-        col_map = {}
-        try:
-            for db_col in ['TIMESTAMP', 'OST_ID', 'READ_BYTES',
-                           'WRITE_BYTES', 'KBYTES_USED', 'KBYTES_FREE',
-                           'INODES_USED', 'INODES_FREE']:
-                col_map[db_col] = columns.index(db_col)
-        except ValueError:
-            raise ValueError("LMT database schema does not match expectation")
-
-        # Loop through all the results of the timeseries query
-        for row in results:
-            if isstr(row[col_map['TIMESTAMP']]):
-                # SQLite stores timestamps as a unicode string
-                timestamp = datetime.datetime.strptime(row[col_map['TIMESTAMP']],
-                                                       "%Y-%m-%d %H:%M:%S")
+        for dataset_name in TABLE_DATASETS['OST_DATA']:
+            target_dbcol = self.config[dataset_name].get('column')
+            if target_dbcol is not None:
+                values = arrays[target_dbcol]
+            elif dataset_name == 'fullness/bytestotal':
+                values = arrays['KBYTES_USED'] + arrays['KBYTES_FREE']
+            elif dataset_name == 'fullness/inodestotal':
+                values = arrays['INODES_USED'] + arrays['INODES_FREE']
             else:
-                # MySQL timestamps are automatically converted to datetime.datetime
-                timestamp = row[col_map['TIMESTAMP']]
-            target_name = lmtdb.ost_id_map[row[col_map['OST_ID']]]
-            for dataset_name in dataset_names:
-                target_dbcol = self.config[dataset_name].get('column')
-                if target_dbcol is not None:
-                    self[dataset_name].insert_element(
-                        timestamp,
-                        target_name,
-                        row[col_map[target_dbcol]])
-                elif dataset_name == 'fullness/bytestotal':
-                    self[dataset_name].insert_element(
-                        timestamp,
-                        target_name,
-                        row[col_map['KBYTES_USED']] + row[col_map['KBYTES_FREE']])
-                elif dataset_name == 'fullness/inodestotal':
-                    self[dataset_name].insert_element(
-                        timestamp,
-                        target_name,
-                        row[col_map['INODES_USED']] + row[col_map['INODES_FREE']])
-                else:
-                    errmsg = "%s in self.config but missing 'column' setting" % dataset_name
-                    raise KeyError(errmsg)
+                errmsg = "%s in self.config but missing 'column' setting" % dataset_name
+                raise KeyError(errmsg)
+            self.insert_results(dataset_name, arrays['TIMESTAMP'],
+                                arrays['OST_ID'], lmtdb.ost_id_map, values)
 
 def init_hdf5_file(datasets, init_start, init_end, hdf5_file):
     """
@@ -474,30 +508,577 @@ def init_hdf5_file(datasets, init_start, init_end, hdf5_file):
                 hdf5_file.name,
                 timeseries.dataset.shape))
 
-def archive_lmtdb(lmtdb, init_start, init_end, timestep, output_file, query_start, query_end):
+def get_last_archived(hdf5_file, dataset_names=None):
+    """Find the most recent timestamp up to which all datasets are populated
+
+    Args:
+        hdf5_file (tokio.connectors.hdf5.Hdf5): file to inspect
+        dataset_names (list of str): schema keys of datasets to inspect
+            (default: all datasets archived from LMT)
+
+    Returns:
+        datetime.datetime or None: timestamp of the last row containing data
+        in the least up-to-date dataset, ignoring datasets that are empty or
+        absent.  None if no datasets contain any data.
+    """
+    schema = tokio.connectors.hdf5.SCHEMA.get(SCHEMA_VERSION)
+    if dataset_names is None:
+        dataset_names = sum([TABLE_DATASETS[table] for table in PIPELINE_TABLES], [])
+
+    last_archived = None
+    for dataset_name in dataset_names:
+        hdf5_dataset_name = schema.get(dataset_name)
+        if hdf5_dataset_name not in hdf5_file:
+            continue
+        index = hdf5_file.get_last_valid_index(hdf5_dataset_name)
+        if index < 0:
+            continue
+        timestamp = hdf5_file.get_timestamps(hdf5_dataset_name)[index]
+        if last_archived is None or timestamp < last_archived:
+            last_archived = timestamp
+
+    if last_archived is None:
+        return None
+    return datetime.datetime.fromtimestamp(last_archived)
+
+class ArchivePipeline(object):
+    """Retrieve, ingest, and write LMT data concurrently
+
+    Rather than retrieving every table before converting and writing any of
+    it, batches of rows are passed from the thread(s) querying the database
+    to an ingest thread through a bounded queue.  Once all of a table's rows
+    have been ingested, its datasets are handed to a writer thread which
+    finalizes them and commits them to HDF5.  Database I/O, ingest, and HDF5
+    I/O can therefore overlap, and at most queue_depth retrieved batches are
+    held in memory at once.
+
+    In SWMR mode, no datasets can be created once the file is being written,
+    so nothing is written until every table has been ingested.  If no
+    output_file is given, the pipeline only retrieves and ingests rows and
+    leaves finalizing and writing the datasets to the caller.
+
+    Attributes:
+        timings (dict): seconds spent in each stage, keyed by stage name.
+            fetch is summed across all retrieval threads, and elapsed is the
+            wall-clock time of the whole pipeline.
+        num_rows (int): total number of rows retrieved
+    """
+    def __init__(self, lmtdb, datasets, output_file=None, init_start=None, init_end=None,
+                 swmr=False, num_threads=1, queue_depth=PIPELINE_QUEUE_DEPTH,
+                 query_start=None, query_end=None):
+        """
+        Args:
+            lmtdb (LmtDb): database object
+            datasets (DatasetDict): datasets to populate
+            output_file (str or None): path to HDF5 file to create or update.
+                If None, datasets are populated but not written.
+            init_start (datetime.datetime): first timestamp of datasets that
+                must be created in output_file
+            init_end (datetime.datetime): final timestamp of datasets that must
+                be created in output_file
+            swmr (bool): write output_file in single-writer/multiple-reader mode
+            num_threads (int): maximum number of tables to retrieve concurrently
+            queue_depth (int): maximum number of retrieved batches awaiting
+                ingest
+            query_start (datetime.datetime): lower bound of rows to retrieve
+                (default: datasets.query_start)
+            query_end (datetime.datetime): upper bound of rows to retrieve
+                (default: datasets.query_end_plusplus)
+        """
+        self.lmtdb = lmtdb
+        self.datasets = datasets
+        self.output_file = output_file
+        self.query_start = datasets.query_start if query_start is None else query_start
+        self.query_end = datasets.query_end_plusplus if query_end is None else query_end
+        self.init_start = init_start
+        self.init_end = init_end
+        self.swmr = swmr
+        self.num_threads = num_threads
+        self.timings = {'fetch': 0.0, 'ingest': 0.0, 'finalize': 0.0, 'write': 0.0,
+                        'elapsed': 0.0}
+        self.num_rows = 0
+        self._batches = queue.Queue(maxsize=queue_depth)
+        self._finished = queue.Queue()
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def _add_time(self, stage, seconds, num_rows=0):
+        with self._lock:
+            self.timings[stage] += seconds
+            self.num_rows += num_rows
+
+    def _fail(self, error):
+        with self._lock:
+            self._errors.append(error)
+
+    def _put_batch(self, item):
+        """Queue an item for ingest unless the pipeline has failed
+
+        Returns:
+            bool: True if item was queued
+        """
+        while not self._errors:
+            try:
+                self._batches.put(item, timeout=PIPELINE_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, items):
+        """Wait for the next item in a queue unless the pipeline has failed
+
+        Returns:
+            The next item in items, or None if the pipeline has failed
+        """
+        while not self._errors:
+            try:
+                return items.get(timeout=PIPELINE_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        return None
+
+    def fetch_table(self, table):
+        """Retrieve a table and queue its rows for ingest
+
+        Args:
+            table (str): name of LMT table to retrieve
+        """
+        batches = iter_result_columns(self.lmtdb, table,
+                                      self.query_start,
+                                      self.query_end,
+                                      TABLE_COLUMNS[table])
+        while True:
+            t_start = time.time()
+            arrays = next(batches, None)
+            self._add_time('fetch', time.time() - t_start,
+                           0 if arrays is None else len(arrays['TIMESTAMP']))
+            # (table, None) marks the end of a table
+            if not self._put_batch((table, arrays)) or arrays is None:
+                return
+
+    def ingest(self):
+        """Populate datasets from queued batches until the end of input
+
+        Passes the names of each table's datasets to the writer once all of
+        that table's rows have been ingested.
+        """
+        try:
+            while True:
+                item = self._get(self._batches)
+                if item is None:
+                    break
+                table, arrays = item
+                if arrays is None:
+                    if not self.swmr and self.output_file is not None:
+                        self._finished.put(TABLE_DATASETS[table])
+                    continue
+                t_start = time.time()
+                self.datasets.ingest_batch(self.lmtdb, table, arrays)
+                self._add_time('ingest', time.time() - t_start)
+            if self.swmr and self.output_file is not None and not self._errors:
+                self._finished.put(sum([TABLE_DATASETS[table] for table in PIPELINE_TABLES], []))
+        except Exception as error: # pylint: disable=broad-except
+            self._fail(error)
+        finally:
+            self._finished.put(None)
+
+    def write(self):
+        """Finalize and commit datasets to HDF5 as their tables are completed
+        """
+        hdf5_file = None
+        try:
+            while True:
+                dataset_names = self._get(self._finished)
+                if dataset_names is None:
+                    break
+                dataset_names = [x for x in dataset_names if x in self.datasets]
+
+                t_start = time.time()
+                self.datasets.convert_deltas(dataset_names)
+                self.datasets.set_timeseries_metadata(dataset_names)
+                self._add_time('finalize', time.time() - t_start)
+
+                t_start = time.time()
+                if hdf5_file is None:
+                    hdf5_kwargs = {'libver': 'latest'} if self.swmr else {}
+                    hdf5_file = tokio.connectors.hdf5.Hdf5(self.output_file, **hdf5_kwargs)
+                    hdf5_file.attrs['version'] = SCHEMA_VERSION
+                datasets = dict((x, self.datasets[x]) for x in dataset_names)
+                init_hdf5_file(datasets, self.init_start, self.init_end, hdf5_file)
+                if self.swmr:
+                    print("Writing out %s" % ", ".join([x.dataset_name for x in datasets.values()]))
+                    hdf5_file.commit_timeseries_swmr(list(datasets.values()))
+                else:
+                    for dataset in datasets.values():
+                        print("Writing out %s" % dataset.dataset_name)
+                        hdf5_file.commit_timeseries(dataset)
+                self._add_time('write', time.time() - t_start)
+        except Exception as error: # pylint: disable=broad-except
+            self._fail(error)
+        finally:
+            if hdf5_file is not None:
+                hdf5_file.close()
+
+    def run(self):
+        """Archive all tables into the output file
+
+        Tables are retrieved in the calling thread, or by up to num_threads
+        threads if num_threads > 1.  The first exception raised by any stage
+        is re-raised once all stages have stopped.
+        """
+        t_start = time.time()
+        for table in PIPELINE_TABLES:
+            self.datasets.init_table(self.lmtdb, table)
+
+        threads = [threading.Thread(target=self.ingest)]
+        if self.output_file is not None:
+            threads.append(threading.Thread(target=self.write))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            if self.num_threads < 2:
+                for table in PIPELINE_TABLES:
+                    self.fetch_table(table)
+            else:
+                workers = multiprocessing.pool.ThreadPool(min(self.num_threads,
+                                                              len(PIPELINE_TABLES)))
+                try:
+                    workers.map(self.fetch_table, PIPELINE_TABLES)
+                finally:
+                    workers.close()
+                    workers.join()
+        except Exception as error: # pylint: disable=broad-except
+            self._fail(error)
+        finally:
+            self._put_batch(None)
+            for thread in threads:
+                thread.join()
+            self.timings['elapsed'] = time.time() - t_start
+
+        if self._errors:
+            raise self._errors[0]
+
+def archive_lmtdb(lmtdb, init_start, init_end, timestep, output_file, query_start, query_end,
+                  swmr=False, incremental=False, num_threads=1):
     """
     Given a start and end time, retrieve all of the relevant contents of an LMT
-    database.
+    database.  If swmr is True, write output_file in HDF5
+    single-writer/multiple-reader mode so it can be read while being updated.
+    If incremental is True and output_file already exists, only retrieve data
+    starting from the last row already archived in output_file.  Up to
+    num_threads tables are retrieved concurrently.  Retrieval, ingest, and
+    writing are overlapped using an ArchivePipeline, and the time spent in
+    each is reported in debug mode.
     """
+    if incremental and os.path.isfile(output_file):
+        with tokio.connectors.hdf5.Hdf5(output_file, mode='r') as hdf5_file:
+            last_archived = get_last_archived(hdf5_file)
+        if last_archived is not None:
+            if last_archived + datetime.timedelta(seconds=timestep) >= query_end:
+                print("%s is already up to date through %s" % (output_file, query_end))
+                return
+            # re-retrieve the last archived row since it may have been
+            # incomplete, along with the row before it so that at least two
+            # rows are committed
+            resume = last_archived - datetime.timedelta(seconds=timestep)
+            if resume > query_start:
+                tokio.debug.debug_print("Resuming from %s" % resume)
+                query_start = resume
+
     datasets = DatasetDict(query_start, query_end, timestep)
+    pipeline = ArchivePipeline(lmtdb=lmtdb,
+                               datasets=datasets,
+                               output_file=output_file,
+                               init_start=init_start,
+                               init_end=init_end,
+                               swmr=swmr,
+                               num_threads=num_threads)
+    pipeline.run()
+
+    tokio.debug.debug_print(
+        "Archived %d rows in %.2f s (fetch %.2f s, ingest %.2f s, finalize %.2f s, write %.2f s)" % (
+            pipeline.num_rows,
+            pipeline.timings['elapsed'],
+            pipeline.timings['fetch'],
+            pipeline.timings['ingest'],
+            pipeline.timings['finalize'],
+            pipeline.timings['write']))
+    tokio.debug.debug_print("Wrote output to %s" % output_file)
 
-    datasets.archive_ost_data(lmtdb)
-    datasets.archive_oss_data(lmtdb)
-    datasets.archive_mds_data(lmtdb)
-    datasets.archive_mds_ops_data(lmtdb)
+class LmtDbFollower(object):
+    """Continuously archive an LMT database into one HDF5 file per day
+
+    Keeps the database connection, the output HDF5 file, and the raw
+    (not-yet-differenced) TimeSeries for the current day resident between
+    ticks.  Each tick retrieves only those rows that arrived since the
+    previous tick, then commits every row whose value can no longer change.
+    When a day has been completely archived, its output file is closed and
+    a new one is started for the following day.
+
+    Attributes:
+        lmtdb (LmtDb): database object
+        output_template (str): path to output file; strftime directives are
+            expanded using the start of each day being archived
+        timestep (int): seconds between consecutive rows
+        swmr (bool): write output in HDF5 single-writer/multiple-reader mode
+        num_threads (int): maximum number of tables to retrieve concurrently
+        datasets (DatasetDict): raw values retrieved so far for the day
+            being archived
+        hdf5_file (tokio.connectors.hdf5.Hdf5): output file for the day being
+            archived, or None if it has not been opened yet
+        num_rows (int): number of raw rows needed to archive the current day,
+            including the first row of the following day
+        first_index (int): index of first raw row retrieved for the current day
+        fetched_index (int): index of first raw row not yet retrieved
+        commit_index (int): index of first row not yet committed to hdf5_file
+    """
+    def __init__(self, lmtdb, output_template, timestep, start, swmr=False, num_threads=1):
+        """Prepare to archive data starting at a given time
 
-    datasets.finalize()
+        Args:
+            lmtdb (LmtDb): database object
+            output_template (str): path to output file; may contain strftime
+                directives to give each day its own file
+            timestep (int): seconds between consecutive rows
+            start (datetime.datetime): first timestamp to archive
+            swmr (bool): write output in HDF5 single-writer/multiple-reader mode
+            num_threads (int): maximum number of tables to retrieve concurrently
+        """
+        self.lmtdb = lmtdb
+        self.output_template = output_template
+        self.timestep = timestep
+        self.swmr = swmr
+        self.num_threads = num_threads
+        self.datasets = None
+        self.hdf5_file = None
+        self.first_epoch = None
+        self.num_rows = 0
+        self.first_index = 0
+        self.fetched_index = 0
+        self.commit_index = 0
+        self._start_day(datetime.datetime.combine(start.date(), datetime.time()))
+        self.first_index = self.fetched_index = self.commit_index = self.get_index(start)
+
+    def _start_day(self, day_start):
+        """Reset state to begin archiving a new day
+        """
+        self.close()
+        day_end = day_start + datetime.timedelta(days=1)
+        self.datasets = DatasetDict(day_start, day_end, self.timestep)
+        self.first_epoch = int(time.mktime(day_start.timetuple()))
+        end_epoch = int(time.mktime(self.datasets.query_end_plusplus.timetuple()))
+        self.num_rows = -(-(end_epoch - self.first_epoch) // self.timestep)
+        self.first_index = 0
+        self.fetched_index = 0
+        self.commit_index = 0
+
+    def get_index(self, timestamp):
+        """Map a timestamp to a raw row index within the current day
+
+        Args:
+            timestamp (datetime.datetime): time to map
 
-    with tokio.connectors.hdf5.Hdf5(output_file) as hdf5_file:
-        hdf5_file.attrs['version'] = SCHEMA_VERSION
+        Returns:
+            int: index of the row containing timestamp, clipped to the range
+            [0, self.num_rows]
+        """
+        index = (int(time.mktime(timestamp.timetuple())) - self.first_epoch) // self.timestep
+        return int(min(max(index, 0), self.num_rows))
 
-        init_hdf5_file(datasets, init_start, init_end, hdf5_file)
+    def get_timestamp(self, index):
+        """Map a raw row index within the current day to its timestamp
+        """
+        return datetime.datetime.fromtimestamp(self.first_epoch + index * self.timestep)
 
-        for dataset in datasets.values():
-            print("Writing out %s" % dataset.dataset_name)
-            hdf5_file.commit_timeseries(dataset)
+    def tick(self, now):
+        """Archive all rows that precede a given time
 
-    tokio.debug.debug_print("Wrote output to %s" % output_file)
+        Args:
+            now (datetime.datetime): retrieve rows up to (but not including)
+                this time
+
+        Returns:
+            int: number of rows committed to HDF5
+        """
+        committed = 0
+        while True:
+            fetch_index = self.get_index(now)
+            if fetch_index > self.fetched_index:
+                fetch_start = self.get_timestamp(self.fetched_index)
+                fetch_end = self.get_timestamp(fetch_index)
+                tokio.debug.debug_print("Retrieving %s to %s" % (fetch_start, fetch_end))
+                ArchivePipeline(lmtdb=self.lmtdb,
+                                datasets=self.datasets,
+                                num_threads=self.num_threads,
+                                query_start=fetch_start,
+                                query_end=fetch_end).run()
+                self.lmtdb.drop_cache()
+                self.fetched_index = fetch_index
+
+            committed += self.commit()
+
+            # roll over once the first row of the next day has been retrieved
+            if self.fetched_index < self.num_rows:
+                break
+            self._start_day(self.datasets.query_end)
+
+        return committed
+
+    def commit(self):
+        """Commit rows whose values can no longer change
+
+        Each row's value depends on the raw values of that row and the
+        following row, so rows up to, but not including, the last retrieved
+        row are finalized and written out.
+
+        Returns:
+            int: number of rows committed to HDF5
+        """
+        if self.fetched_index - 1 <= self.commit_index:
+            return 0
+
+        # committing requires at least two rows to determine the timestep, so
+        # rewrite already-committed rows if necessary
+        start_index = min(self.commit_index, max(self.first_index, self.fetched_index - 3))
+        if self.fetched_index - start_index < 3:
+            return 0
+
+        datasets = self.datasets.slice_rows(start_index, self.fetched_index)
+        datasets.finalize()
+
+        if self.hdf5_file is None:
+            output_file = self.datasets.query_start.strftime(self.output_template)
+            hdf5_kwargs = {'libver': 'latest'} if self.swmr else {}
+            self.hdf5_file = tokio.connectors.hdf5.Hdf5(output_file, **hdf5_kwargs)
+            self.hdf5_file.attrs['version'] = SCHEMA_VERSION
+            init_hdf5_file(self.datasets,
+                           self.datasets.query_start,
+                           self.datasets.query_end,
+                           self.hdf5_file)
+
+        if self.swmr:
+            self.hdf5_file.commit_timeseries_swmr(list(datasets.values()))
+        else:
+            for dataset in datasets.values():
+                self.hdf5_file.commit_timeseries(dataset)
+            self.hdf5_file.flush()
+
+        num_rows = self.fetched_index - 1 - self.commit_index
+        tokio.debug.debug_print("Committed %d rows from %s to %s" % (
+            num_rows,
+            self.get_timestamp(self.commit_index),
+            self.hdf5_file.filename))
+        self.commit_index = self.fetched_index - 1
+        return num_rows
+
+    def close(self):
+        """Close the output file for the day being archived
+        """
+        if self.hdf5_file is not None:
+            self.hdf5_file.close()
+            self.hdf5_file = None
+
+    def run(self, interval, lag=0, until=None):
+        """Archive new rows at a fixed interval
+
+        Args:
+            interval (int): seconds to sleep between ticks
+            lag (int): seconds to wait before archiving a row to allow
+                late-arriving data to be inserted into the database
+            until (datetime.datetime or None): stop after retrieving all rows
+                preceding this time.  If None, run forever.
+        """
+        try:
+            while True:
+                now = datetime.datetime.now() - datetime.timedelta(seconds=lag)
+                done = until is not None and now >= until
+                if done:
+                    now = until
+                committed = self.tick(now)
+                if committed:
+                    print("Archived %d rows through %s" % (committed,
+                                                           self.get_timestamp(self.commit_index)))
+                if done:
+                    break
+                time.sleep(interval)
+        finally:
+            self.close()
+
+def get_lmtdb(args):
+    """Connect to the LMT database described by CLI arguments
+    """
+    pool_size = args.threads if args.threads > 1 else None
+    if args.input is not None:
+        return tokio.connectors.lmtdb.LmtDb(cache_file=args.input, pool_size=pool_size)
+    return tokio.connectors.lmtdb.LmtDb(
+        dbhost=args.host,
+        dbuser=args.user,
+        dbpassword=args.password,
+        dbname=args.database,
+        pool_size=pool_size)
+
+def get_follow_start(output_file, now):
+    """Determine where to resume archiving a day's output file
+
+    Args:
+        output_file (str): path to the output file for the current day
+        now (datetime.datetime): current time
+
+    Returns:
+        datetime.datetime: timestamp of the last row archived in output_file,
+        or the start of the day if output_file contains no data
+    """
+    last_archived = None
+    if os.path.isfile(output_file):
+        with tokio.connectors.hdf5.Hdf5(output_file, mode='r') as hdf5_file:
+            last_archived = get_last_archived(hdf5_file)
+    if last_archived is None:
+        return datetime.datetime.combine(now.date(), datetime.time())
+    return min(last_archived, now)
+
+def follow(args):
+    """Run archive_lmtdb as a daemon using parsed CLI arguments
+    """
+    try:
+        if args.query_start:
+            query_start = datetime.datetime.strptime(args.query_start, DATE_FMT)
+        else:
+            query_start = datetime.datetime.now() - datetime.timedelta(seconds=args.lag)
+            if args.incremental:
+                # catch up on today's file before following
+                query_start = get_follow_start(query_start.strftime(args.output), query_start)
+        until = None
+        if args.query_end:
+            # retrieve one extra row so the final row's deltas can be calculated
+            until = datetime.datetime.strptime(args.query_end, DATE_FMT) \
+                    + datetime.timedelta(seconds=args.timestep)
+    except ValueError:
+        sys.stderr.write("Start and end times must be in format %s\n" % DATE_FMT)
+        raise
+
+    if until is not None and query_start >= until:
+        raise Exception('query_start >= query_end')
+    elif args.timestep < 1:
+        raise Exception('--timestep must be > 0')
+    elif args.interval < 0:
+        raise Exception('--interval must be >= 0')
+    elif args.threads < 1:
+        raise Exception('--threads must be > 0')
+
+    if '%' not in args.output:
+        warnings.warn("--output contains no strftime directives; each day will be"
+                      + " written to the same file")
+
+    follower = LmtDbFollower(lmtdb=get_lmtdb(args),
+                             output_template=args.output,
+                             timestep=args.timestep,
+                             start=query_start,
+                             swmr=args.swmr,
+                             num_threads=args.threads)
+    follower.run(interval=args.interval, lag=args.lag, until=until)
 
 def main(argv=None):
     """Entry point for the CLI interface
@@ -514,19 +1095,41 @@ def main(argv=None):
                         help='final timestamp (exclusive) when creating new output file,' +
                         ' in %s format (default: same as end)' % DATE_FMT_PRINT)
     parser.add_argument('--debug', action='store_true', help="produce debug messages")
+    parser.add_argument('--swmr', action='store_true',
+                        help="write output in HDF5 single-writer/multiple-reader mode")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only retrieve data newer than the last row already in output file;"
+                        + " with --follow and no query_start, catch up on today's output file")
+    parser.add_argument('--threads', type=int, default=1,
+                        help='number of concurrent database connections (default: 1)')
     parser.add_argument('--timestep', type=int, default=5,
                         help='collection frequency, in seconds (default: 5)')
+    parser.add_argument('--follow', action='store_true',
+                        help="keep archiving new data into one output file per day;"
+                        + " --output may contain strftime directives (e.g., %%Y-%%m-%%d)")
+    parser.add_argument('--interval', type=int, default=60,
+                        help='seconds between database queries with --follow (default: 60)')
+    parser.add_argument('--lag', type=int, default=30,
+                        help='seconds to wait for late-arriving data with --follow (default: 30)')
     parser.add_argument("--host", type=str, default=None, help="database hostname")
     parser.add_argument("--user", type=str, default=None, help="database user")
     parser.add_argument("--password", type=str, default=None, help="database password")
     parser.add_argument("--database", type=str, default=None, help="database name")
-    parser.add_argument("query_start", type=str, help="start time in %s format" % DATE_FMT_PRINT)
-    parser.add_argument("query_end", type=str, help="end time in %s format" % DATE_FMT_PRINT)
+    parser.add_argument("query_start", type=str, nargs='?',
+                        help="start time in %s format (default with --follow: now)" % DATE_FMT_PRINT)
+    parser.add_argument("query_end", type=str, nargs='?',
+                        help="end time in %s format (default with --follow: never)" % DATE_FMT_PRINT)
     args = parser.parse_args(argv)
 
     if args.debug:
         tokio.debug.DEBUG = True
 
+    if args.follow:
+        follow(args)
+        return
+    elif args.query_start is None or args.query_end is None:
+        parser.error("query_start and query_end are required without --follow")
+
     # Convert CLI options into datetime
     try:
         query_start = datetime.datetime.strptime(args.query_start, DATE_FMT)
@@ -548,20 +1151,16 @@ def main(argv=None):
         raise Exception('query_start >= query_end')
     elif args.timestep < 1:
         raise Exception('--timestep must be > 0')
+    elif args.threads < 1:
+        raise Exception('--threads must be > 0')
 
-    if args.input is not None:
-        lmtdb = tokio.connectors.lmtdb.LmtDb(cache_file=args.input)
-    else:
-        lmtdb = tokio.connectors.lmtdb.LmtDb(
-            dbhost=args.host,
-            dbuser=args.user,
-            dbpassword=args.password,
-            dbname=args.database)
-
-    archive_lmtdb(lmtdb=lmtdb,
+    archive_lmtdb(lmtdb=get_lmtdb(args),
                   init_start=init_start,
                   init_end=init_end,
                   timestep=args.timestep,
                   output_file=args.output,
                   query_start=query_start,
-                  query_end=query_end)
+                  query_end=query_end,
+                  swmr=args.swmr,
+                  incremental=args.incremental,
+                  num_threads=args.threads)
@@ -17,10 +17,15 @@ import warnings
 import mimetypes
 
 import tokio.debug
+import tokio.connectors.es
 import tokio.connectors.collectd_es
 
 DATE_FMT = "%Y-%m-%dT%H:%M:%S"
 
+def discard_pages(esdb):
+    """Flush function that drops pages which have already been cached"""
+    esdb.scroll_pages = []
+
 def main(argv=None):
     """Entry point for the CLI interface
     """
@@ -39,7 +44,8 @@ def main(argv=None):
     parser.add_argument('--input', type=str, default=None,
                         help="use cached output from previous ES query")
     parser.add_argument("-o", "--output", type=str, default=None,
-                        help="output file")
+                        help="output file; .ndjson or .jsonl outputs, optionally"
+                        + " compressed, are written incrementally")
     parser.add_argument('-h', '--host', type=str, default="localhost",
                         help="hostname of ElasticSearch endpoint (default: localhost)")
     parser.add_argument('-p', '--port', type=int, default=9200,
@@ -75,6 +81,14 @@ def main(argv=None):
             index=args.index,
             timeout=args.timeout)
 
+        # write NDJSON caches page by page as they are retrieved rather than
+        # retaining every page until the end
+        streaming = args.output is not None and not args.csv \
+            and tokio.connectors.es.is_ndjson_cache(args.output)
+        if streaming:
+            esdb.cache_output = tokio.connectors.es.open_cache(args.output, 'w')
+            esdb.flush_function = discard_pages
+
         pages = None
         for plugin_query in [tokio.connectors.collectd_es.QUERY_CPU_DATA,
                              tokio.connectors.collectd_es.QUERY_DISK_DATA,
@@ -82,11 +96,19 @@ def main(argv=None):
             esdb.query_timeseries(plugin_query,
                             query_start,
                             query_end)
-            if pages is None:
+            if streaming:
+                discard_pages(esdb)
+            elif pages is None:
                 pages = esdb.scroll_pages
             else:
                 pages += esdb.scroll_pages
 
+        if streaming:
+            esdb.cache_output.close()
+            esdb.cache_output = None
+            print("Cached to %s" % args.output)
+            return
+
         tokio.debug.debug_print("Loaded results from %s:%s" % (args.host, args.port))
     else:
         esdb = tokio.connectors.collectd_es.CollectdEs.from_cache(args.input)
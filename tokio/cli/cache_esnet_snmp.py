@@ -85,17 +85,14 @@ def main(argv=None):
         esnetdata = tokio.connectors.esnet_snmp.EsnetSnmp(start=start, end=end)
 
         # Query each endpoint:interface specified
+        targets = []
         for endpoint, interfaces in query_args.items():
             for interface in interfaces:
-                ret = esnetdata.get_interface_counters(endpoint=endpoint, interface=interface,
-                                                       direction="in",
-                                                       agg_func='average',
-                                                       timeout=args.timeout)
-                ret = esnetdata.get_interface_counters(endpoint=endpoint,
-                                                       interface=interface,
-                                                       direction="out",
-                                                       agg_func='average',
-                                                       timeout=args.timeout)
+                targets.append((endpoint, interface, "in"))
+                targets.append((endpoint, interface, "out"))
+        esnetdata.get_many_interface_counters(targets=targets,
+                                              agg_func='average',
+                                              timeout=args.timeout)
 
     # Serialize the object
     cache_file = args.output
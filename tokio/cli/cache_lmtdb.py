@@ -5,16 +5,15 @@ Retrieve the contents of an LMT database and cache it locally.
 import os
 import datetime
 import argparse
+import tokio.connectors.cachingdb
 import tokio.connectors.lmtdb
 
-def retrieve_tables(lmtdb, datetime_start, datetime_end, limit=None):
+def get_table_queries(lmtdb, datetime_start, datetime_end, limit=None):
     """
-    Given a start and end time, retrieve and cache all of the relevant contents
-    of an LMT database.
+    Given a start and end time, generate the queries needed to retrieve all of
+    the relevant contents of an LMT database as (table, schema, query) tuples.
     """
-
     min_ts_id, max_ts_id = lmtdb.get_ts_ids(datetime_start, datetime_end)
-
     for lmtdb_table, table_schema in tokio.connectors.lmtdb.LMTDB_TABLES.items():
         query_str = 'SELECT * from %s' % lmtdb_table
 
@@ -27,11 +26,36 @@ def retrieve_tables(lmtdb, datetime_start, datetime_end, limit=None):
         if limit is not None:
             query_str += " LIMIT %d" % limit
 
-        result = lmtdb.query(
+        yield lmtdb_table, table_schema, query_str
+
+def retrieve_tables(lmtdb, datetime_start, datetime_end, limit=None):
+    """
+    Given a start and end time, retrieve and cache all of the relevant contents
+    of an LMT database.
+    """
+    for lmtdb_table, table_schema, query_str in get_table_queries(
+            lmtdb, datetime_start, datetime_end, limit):
+        lmtdb.query(
             query_str=query_str,
             table=lmtdb_table,
             table_schema=table_schema)
 
+def stream_tables(lmtdb, datetime_start, datetime_end, cache_file, limit=None):
+    """
+    Given a start and end time, copy all of the relevant contents of an LMT
+    database into a cache database.  Unlike retrieve_tables(), rows are written
+    to the cache database as they are retrieved rather than being retained in
+    memory.
+    """
+    with tokio.connectors.cachingdb.CacheWriter(cache_file) as writer:
+        for lmtdb_table, table_schema, query_str in get_table_queries(
+                lmtdb, datetime_start, datetime_end, limit):
+            for _ in lmtdb.iter_query(query_str=query_str,
+                                      table=lmtdb_table,
+                                      table_schema=table_schema,
+                                      cache_file=writer):
+                pass
+
 def main(argv=None):
     """Entry point for the CLI interface
     """
@@ -64,8 +88,6 @@ def main(argv=None):
             dbpassword=args.password,
             dbname=args.database)
 
-    retrieve_tables(lmtdb, start, end, args.limit)
-
     if cache_file is None:
         i = 0
         while True:
@@ -75,4 +97,4 @@ def main(argv=None):
             else:
                 break
     print("Caching to %s" % cache_file)
-    lmtdb.save_cache(cache_file)
+    stream_tables(lmtdb, start, end, cache_file, args.limit)
@@ -0,0 +1,59 @@
+"""
+Export a dataset from one or more TOKIO Time Series HDF5 files into a single
+Apache Parquet file without loading whole datasets into memory.
+"""
+
+import sys
+import datetime
+import argparse
+import tokio.tools.parquet
+
+DATE_FMT = "%Y-%m-%dT%H:%M:%S"
+DATE_FMT_PRINT = "YYYY-MM-DDTHH:MM:SS"
+
+def main(argv=None):
+    """Entry point for the CLI interface
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("hdf5", type=str, nargs='+',
+                        help="TOKIO Time Series HDF5 file(s) to export, in time order")
+    parser.add_argument("-d", "--dataset", type=str, required=True,
+                        help="name of dataset to export (e.g., datatargets/readbytes)")
+    parser.add_argument("-o", "--output", type=str, default='output.parquet',
+                        help="output file (default: output.parquet)")
+    parser.add_argument("-c", "--columns", type=str, default=None,
+                        help="comma-separated list of columns to export (default: all)")
+    parser.add_argument("--start", type=str, default=None,
+                        help="first timestamp (inclusive) to export in %s format" % DATE_FMT_PRINT)
+    parser.add_argument("--end", type=str, default=None,
+                        help="last timestamp (exclusive) to export in %s format" % DATE_FMT_PRINT)
+    parser.add_argument("--batch-rows", type=int, default=tokio.tools.parquet.DEFAULT_BATCH_ROWS,
+                        help="minimum rows per Parquet row group; rounded up to whole HDF5 chunks"
+                        + " (default: %d)" % tokio.tools.parquet.DEFAULT_BATCH_ROWS)
+    parser.add_argument("--compression", type=str, default='snappy',
+                        help="Parquet compression codec (default: snappy)")
+    args = parser.parse_args(argv)
+
+    try:
+        datetime_start = datetime.datetime.strptime(args.start, DATE_FMT) if args.start else None
+        datetime_end = datetime.datetime.strptime(args.end, DATE_FMT) if args.end else None
+    except ValueError:
+        sys.stderr.write("Start and end times must be in format %s\n" % DATE_FMT)
+        raise
+
+    if datetime_start and datetime_end and datetime_start >= datetime_end:
+        raise ValueError('--start must be earlier than --end')
+    if args.batch_rows < 1:
+        raise ValueError('--batch-rows must be > 0')
+
+    columns = args.columns.split(',') if args.columns else None
+
+    rows = tokio.tools.parquet.hdf5_to_parquet(hdf5_filenames=args.hdf5,
+                                               dataset_name=args.dataset,
+                                               output_file=args.output,
+                                               datetime_start=datetime_start,
+                                               datetime_end=datetime_end,
+                                               columns=columns,
+                                               batch_rows=args.batch_rows,
+                                               compression=args.compression)
+    print("Wrote %d rows of %s to %s" % (rows, args.dataset, args.output))
@@ -3,6 +3,7 @@
 
 import time
 import json
+import calendar
 import datetime
 import numpy
 
@@ -27,6 +28,10 @@ UNITS_10 = [
     (10**3, "KB")
 ]
 
+# Maximum number of distinct timestamps remembered by strptime_epoch()
+EPOCH_CACHE_SIZE = 131072
+_EPOCH_CACHE = {}
+
 class ConfigError(RuntimeError):
     pass
 
@@ -127,6 +132,70 @@ def to_epoch(datetime_obj, astype=int):
         return time.mktime(datetime_obj.timetuple()) + datetime_obj.microsecond / 1e6
     return astype(time.mktime(datetime_obj.timetuple()))
 
+def strptime_epoch(timestamp_str, fmt, astype=int, utc=False):
+    """Convert a timestamp string into epoch seconds
+
+    Equivalent to ``to_epoch(datetime.datetime.strptime(timestamp_str, fmt),
+    astype)`` but memoizes conversions since monitoring data typically
+    contains many records per distinct timestamp.  If fmt ends in ``.%f``,
+    the fractional seconds are split off before consulting the memo so that
+    records with unique sub-second timestamps still benefit.
+
+    Args:
+        timestamp_str (str): Timestamp expressed in localtime, or in UTC if
+            utc is True
+        fmt (str): strptime format of timestamp_str
+        astype: Whether you want the resulting timestamp as an int or float
+        utc (bool): Interpret timestamp_str as UTC rather than localtime
+
+    Returns:
+        int or float: Seconds since epoch
+    """
+    if fmt.endswith('.%f'):
+        whole, _, fraction = timestamp_str.rpartition('.')
+        epoch = strptime_epoch(whole, fmt[:-3], int, utc)
+        if astype == float:
+            return epoch + float('0.' + fraction)
+        return astype(epoch)
+
+    key = (timestamp_str, fmt, utc)
+    epoch = _EPOCH_CACHE.get(key)
+    if epoch is None:
+        if len(_EPOCH_CACHE) >= EPOCH_CACHE_SIZE:
+            _EPOCH_CACHE.clear()
+        if utc:
+            epoch = calendar.timegm(time.strptime(timestamp_str, fmt))
+        else:
+            epoch = time.mktime(datetime.datetime.strptime(timestamp_str, fmt).timetuple())
+        _EPOCH_CACHE[key] = epoch
+    return astype(epoch)
+
+def strptime_epochs(timestamps, fmt, astype=int):
+    """Convert a sequence of timestamps into an array of epoch seconds
+
+    Each distinct timestamp is converted only once.  Elements may be strings
+    in the given format or datetime.datetime objects, since the same column
+    may be returned as either depending on the database driver.
+
+    Args:
+        timestamps (sequence): timestamps expressed in localtime as strings
+            or datetime.datetime objects
+        fmt (str): strptime format of string timestamps
+        astype: Whether you want the resulting timestamps as ints or floats
+
+    Returns:
+        numpy.ndarray: Seconds since epoch of each element of timestamps
+    """
+    epochs = {}
+    for timestamp in set(timestamps):
+        if isstr(timestamp):
+            epochs[timestamp] = strptime_epoch(timestamp, fmt, astype)
+        else:
+            epochs[timestamp] = to_epoch(timestamp, astype)
+    return numpy.fromiter((epochs[x] for x in timestamps),
+                          dtype='f8' if astype == float else 'i8',
+                          count=len(timestamps))
+
 def recast_string(value):
     """Converts a string to some type of number or True/False if possible
 
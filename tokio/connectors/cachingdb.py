@@ -6,7 +6,21 @@ database (sqlite3) to allow for reanalysis on platforms that cannot access the
 original remote database or to reduce the load on remote databases.
 """
 
+import os
+import json
+import time
+import base64
+import decimal
+import hashlib
+import datetime
 import warnings
+import threading
+import contextlib
+import multiprocessing.pool
+try:
+    import queue
+except ImportError:
+    import Queue as queue # Python 2
 try:
     import pymysql
     pymysql.install_as_MySQLdb()
@@ -18,15 +32,430 @@ except ImportError:
     pass
 
 import sqlite3
+import numpy
+import tokio.common
 
 HIT_CACHE_DB = 1
 HIT_REMOTE_DB = 2
+HIT_RESULT_CACHE = 3
+
+# Format of timestamps returned as strings by SQLite
+DATE_FMT = "%Y-%m-%d %H:%M:%S"
+
+# Default number of rows fetched at a time by CachingDb.iter_query()
+ITER_BATCH_SIZE = 65536
+
+# SQLite page cache used while bulk loading a cache database, in KiB
+BULK_LOAD_CACHE_KIB = 256 * 1024
+
+# Defaults for QueryCache
+RESULT_CACHE_TTL = 3600
+RESULT_CACHE_NEGATIVE_TTL = 60
+RESULT_CACHE_MAX_SIZE = 256 * 2**20
+
+class ConnectionPool(object):
+    """Bounded pool of database connections that can be shared by threads
+
+    Connections are created on demand, up to `size` of them, and are reused
+    once released.  Threads requesting a connection while all `size` are in
+    use block until one is released.
+    """
+    def __init__(self, connect, size):
+        """Create an empty connection pool
+
+        Args:
+            connect (function): takes no arguments and returns a new database
+                connection
+            size (int): maximum number of connections in the pool
+        """
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self.connect = connect
+        self.size = size
+        self.connections = []
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection from the pool
+
+        Yields:
+            A database connection that is returned to the pool on exit.  If
+            the caller raises an exception while using it, the connection may
+            be broken or left mid-query, so it is closed and discarded
+            instead and a later borrower opens a new one.
+        """
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+                with self._lock:
+                    self.connections.append(conn)
+            try:
+                yield conn
+            except BaseException:
+                self._discard(conn)
+                raise
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        """Close a connection and forget that the pool created it
+        """
+        with self._lock:
+            if conn in self.connections:
+                self.connections.remove(conn)
+        try:
+            conn.close()
+        except Exception: # pylint: disable=broad-except
+            pass
+
+    def close(self):
+        """Close all connections that the pool has created
+        """
+        with self._lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+            self._idle = queue.Queue()
+
+class CacheWriter(object):
+    """Bulk-load rows into an SQLite cache database
+
+    All rows are written in a single transaction that is committed by
+    close().  SQLite is tuned for bulk loading: synchronous writes are
+    disabled, the page cache is enlarged, and the rollback journal is kept in
+    memory for new files and write-ahead logged for existing ones.
+
+    Tables that do not already exist are created without a primary key so
+    that rows can be appended without maintaining an index.  When the writer
+    is closed, a unique index on the primary key is built, removing any
+    duplicate rows first (keeping the row written last).  Rows written to
+    tables that already exist replace any rows with the same primary key, so
+    appending to an existing cache database never duplicates rows.
+
+    Can be used as a context manager, in which case the transaction is only
+    committed if no exception was raised.
+    """
+    def __init__(self, cache_file, cache_kib=BULK_LOAD_CACHE_KIB):
+        """Open a cache database for bulk loading
+
+        Args:
+            cache_file (str): path to the SQLite database to create or append
+            cache_kib (int): size of SQLite's page cache in KiB
+        """
+        self.cache_file = cache_file
+        self.new_tables = {}
+        self.num_rows = {}
+        new_file = not os.path.isfile(cache_file) or os.path.getsize(cache_file) == 0
+        self.cache_db = sqlite3.connect(cache_file, isolation_level=None)
+        self.journal_mode = 'MEMORY' if new_file else 'WAL'
+        self.cache_db.execute("PRAGMA journal_mode=%s" % self.journal_mode)
+        self.cache_db.execute("PRAGMA synchronous=OFF")
+        self.cache_db.execute("PRAGMA cache_size=-%d" % cache_kib)
+        self.cache_db.execute("PRAGMA temp_store=MEMORY")
+        self.cache_db.execute("BEGIN")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+
+    def write(self, table, rows, table_schema=None):
+        """Append rows to a table
+
+        Args:
+            table (str): name of table to which rows are written
+            rows (iterable of tuples): rows to write; each must have one
+                value per column of `table`
+            table_schema (dict, optional): the columns and primary key used to
+                create `table` if it does not exist
+        """
+        if table not in self.num_rows:
+            exists = self.cache_db.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?",
+                (table,)).fetchone()[0]
+            if not exists and table_schema is not None:
+                self.cache_db.execute("CREATE TABLE %s (%s)" % (
+                    table, ', '.join(table_schema['columns'])))
+                self.new_tables[table] = table_schema
+            self.num_rows[table] = 0
+
+        rows = iter(rows)
+        try:
+            first_row = next(rows)
+        except StopIteration:
+            return
+
+        ### New tables have no unique index until close(), so plain INSERTs
+        ### suffice.  Existing tables INSERT OR REPLACE so that the cache db
+        ### never wins if a duplicate primary key is detected
+        query_str = "%s into %s values (%s)" % (
+            "insert" if table in self.new_tables else "insert or replace",
+            table,
+            ','.join(['?'] * len(first_row)))
+        self.cache_db.execute(query_str, first_row)
+        cursor = self.cache_db.executemany(query_str, rows)
+        self.num_rows[table] += 1 + max(cursor.rowcount, 0)
+
+    def close(self, commit=True):
+        """Deduplicate and index new tables and commit the transaction
+
+        Args:
+            commit (bool): if False, roll back everything written instead
+        """
+        if self.cache_db is None:
+            return
+        if commit:
+            for table, table_schema in self.new_tables.items():
+                primary_key = ', '.join(table_schema['primary_key'])
+                create_index = "CREATE UNIQUE INDEX %s_pkey ON %s (%s)" % (
+                    table, table, primary_key)
+                ### rows are usually unique already, so only deduplicate if
+                ### building the index fails
+                try:
+                    self.cache_db.execute(create_index)
+                except sqlite3.IntegrityError:
+                    self.cache_db.execute(
+                        "DELETE FROM %s WHERE rowid NOT IN (SELECT MAX(rowid) FROM %s GROUP BY %s)" % (
+                            table, table, primary_key))
+                    self.cache_db.execute(create_index)
+            self.cache_db.execute("COMMIT")
+        else:
+            self.cache_db.execute("ROLLBACK")
+        if self.journal_mode == 'WAL':
+            self.cache_db.execute("PRAGMA journal_mode=DELETE")
+        self.cache_db.close()
+        self.cache_db = None
+
+def _encode_value(value):
+    """Encode a database value that JSON cannot represent natively
+
+    Used as the ``default`` of json.dumps so that values returned by database
+    drivers survive a round trip through QueryCache.
+    """
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.strftime("%Y-%m-%d %H:%M:%S.%f")}
+    elif isinstance(value, datetime.date):
+        return {'$date': value.strftime("%Y-%m-%d")}
+    elif isinstance(value, decimal.Decimal):
+        return {'$decimal': str(value)}
+    elif isinstance(value, bytes):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    elif isinstance(value, numpy.generic):
+        return value.item()
+    raise TypeError("cannot cache values of type %s" % type(value).__name__)
+
+def _decode_value(obj):
+    """Reverse _encode_value; used as the ``object_hook`` of json.loads
+    """
+    if len(obj) == 1:
+        if '$datetime' in obj:
+            return datetime.datetime.strptime(obj['$datetime'], "%Y-%m-%d %H:%M:%S.%f")
+        elif '$date' in obj:
+            return datetime.datetime.strptime(obj['$date'], "%Y-%m-%d").date()
+        elif '$decimal' in obj:
+            return decimal.Decimal(obj['$decimal'])
+        elif '$bytes' in obj:
+            return base64.b64decode(obj['$bytes'])
+    return obj
+
+class QueryCache(object):
+    """Persistent cache of query results stored in an SQLite file
+
+    Results are keyed by the whitespace-normalized query string, its
+    parameters, and an optional namespace identifying the database that was
+    queried.  Entries expire after a time-to-live, and the least recently used
+    entries are evicted once the total size of all cached results exceeds a
+    limit.  Queries that return no rows are cached with their own, typically
+    shorter, time-to-live so that data that has not arrived yet is retried
+    soon.
+
+    Results are stored as JSON.  Access times used to choose which entries to
+    evict are tracked in memory and only written back when results are cached
+    or the cache is closed so that cache hits do not write to the database.
+
+    Attributes:
+        cache_file (str): path to the SQLite file storing cached results
+        ttl (float or None): seconds for which non-empty results remain valid,
+            or None to never expire them
+        negative_ttl (float or None): seconds for which empty results remain
+            valid, or None to never expire them
+        max_size (int or None): maximum total size of cached results in bytes,
+            or None for no limit
+        stats (dict): counts of ``hits``, ``negative_hits``, ``misses``,
+            ``stores``, ``expirations``, and ``evictions``
+    """
+    def __init__(self, cache_file, ttl=RESULT_CACHE_TTL, negative_ttl=RESULT_CACHE_NEGATIVE_TTL,
+                 max_size=RESULT_CACHE_MAX_SIZE):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.stats = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'expirations': 0,
+            'evictions': 0,
+        }
+        self._lock = threading.Lock()
+        self._accessed = {}
+        self._db = sqlite3.connect(cache_file, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS query_cache (
+                                key TEXT PRIMARY KEY,
+                                query TEXT,
+                                num_rows INTEGER,
+                                size INTEGER,
+                                created REAL,
+                                accessed REAL,
+                                results TEXT)""")
+        self._db.commit()
+
+    def close(self):
+        """Write back access times and close the underlying SQLite file
+        """
+        with self._lock:
+            if self._db is not None:
+                self._flush_accessed()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def _flush_accessed(self):
+        """Write access times of cache hits back to the database
+
+        Must be called with self._lock held; the caller is responsible for
+        committing.
+        """
+        if self._accessed:
+            self._db.executemany("UPDATE query_cache SET accessed = ? WHERE key = ?",
+                                 [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed = {}
+
+    @staticmethod
+    def get_key(query_str, query_variables=(), namespace=None):
+        """Generate the key under which a query's results are cached
+
+        Args:
+            query_str (str): SQL query expressed as a string
+            query_variables (tuple): parameters to be substituted into
+                `query_str`
+            namespace (str, optional): identifies the database being queried
+
+        Returns:
+            str: hex digest uniquely identifying the query
+        """
+        key = repr((namespace, ' '.join(query_str.split()), tuple(query_variables)))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, query_str, query_variables=(), namespace=None):
+        """Retrieve cached results of a query
+
+        Args:
+            query_str (str): SQL query expressed as a string
+            query_variables (tuple): parameters to be substituted into
+                `query_str`
+            namespace (str, optional): identifies the database being queried
+
+        Returns:
+            list or None: rows returned by the query when it was cached, or
+            None if the query is not cached or its results have expired
+        """
+        key = self.get_key(query_str, query_variables, namespace)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT num_rows, created, results FROM query_cache WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+
+            num_rows, created, results = row
+            ttl = self.ttl if num_rows else self.negative_ttl
+            if ttl is not None and now - created >= ttl:
+                self._db.execute("DELETE FROM query_cache WHERE key = ?", (key,))
+                self._db.commit()
+                self._accessed.pop(key, None)
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            self._accessed[key] = now
+            self.stats['hits' if num_rows else 'negative_hits'] += 1
+        return [tuple(row) for row in json.loads(results, object_hook=_decode_value)]
+
+    def put(self, query_str, query_variables, results, namespace=None):
+        """Cache the results of a query
+
+        Args:
+            query_str (str): SQL query expressed as a string
+            query_variables (tuple): parameters to be substituted into
+                `query_str`
+            results (list): rows returned by the query
+            namespace (str, optional): identifies the database being queried
+        """
+        ttl = self.ttl if len(results) else self.negative_ttl
+        if ttl is not None and ttl <= 0:
+            return
+
+        key = self.get_key(query_str, query_variables, namespace)
+        encoded = json.dumps([list(row) for row in results], default=_encode_value,
+                             separators=(',', ':'))
+        if self.max_size is not None and len(encoded) > self.max_size:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._flush_accessed()
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, ' '.join(query_str.split()), len(results), len(encoded), now, now,
+                 encoded))
+            self.stats['stores'] += 1
+            if self.max_size is not None:
+                self._evict(self.max_size)
+            self._db.commit()
+
+    def _evict(self, max_size):
+        """Delete least recently used entries until the cache fits in max_size
+        """
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM query_cache").fetchone()[0]
+        if total <= max_size:
+            return
+        cursor = self._db.execute("SELECT key, size FROM query_cache ORDER BY accessed, created")
+        evict_keys = []
+        for key, size in cursor:
+            if total <= max_size:
+                break
+            evict_keys.append((key,))
+            total -= size
+        cursor.close()
+        self._db.executemany("DELETE FROM query_cache WHERE key = ?", evict_keys)
+        self.stats['evictions'] += len(evict_keys)
+
+    def clear(self):
+        """Delete all cached results
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM query_cache")
+            self._db.commit()
+            self._accessed = {}
 
 class CachingDb(object):
     """Connect relational database with an optional caching layer interposed.
     """
     #pylint: disable=too-many-arguments
-    def __init__(self, dbhost=None, dbuser=None, dbpassword=None, dbname=None, cache_file=None):
+    def __init__(self, dbhost=None, dbuser=None, dbpassword=None, dbname=None, cache_file=None,
+                 pool_size=None, result_cache=None):
         """Connect to a relational database.
 
         If instantiated with a cache_file argument, all queries will go to that
@@ -44,6 +473,11 @@ class CachingDb(object):
             dbname (str, optional): name of database to use when connecting
             cache_file (str, optional):  Path to an SQLite3 database to use as
                 a caching layer.
+            pool_size (int, optional): if specified, open a pool of up to this
+                many connections so queries can be issued from multiple threads
+                concurrently.  See open_pool().
+            result_cache (QueryCache, optional): persistent cache consulted
+                before any database is queried
 
         Attributes:
             saved_results (dict): in-memory data cache, keyed by table names
@@ -60,6 +494,9 @@ class CachingDb(object):
             remote_db: remote database connection handle
             remote_db_ps (str): paramstyle of the remote database as defined
                 by `PEP-0249`_
+            pool (ConnectionPool): connections used in place of `cache_db` or
+                `remote_db` so that queries can run concurrently
+            result_cache (QueryCache): persistent cache of query results
 
         .. _PEP-0249: https://www.python.org/dev/peps/pep-0249
         """
@@ -84,6 +521,13 @@ class CachingDb(object):
         # actual db
         self.remote_db = None
         self.remote_db_ps = None
+        self.remote_db_args = None
+
+        # connections shared by concurrent queries
+        self.pool = None
+
+        # memoized query results
+        self.result_cache = result_cache
 
         # Connect to cache db if specified
         if cache_file is not None:
@@ -102,6 +546,9 @@ class CachingDb(object):
                          dbpassword=dbpassword,
                          dbname=dbname)
 
+        if pool_size is not None:
+            self.open_pool(pool_size)
+
     def connect(self, dbhost, dbuser, dbpassword, dbname):
         """Establish remote db connection.
 
@@ -121,20 +568,53 @@ class CachingDb(object):
             warnings.warn("attempting to use both remote and cache db; disabling cache db")
             self.close_cache()
 
-        self.remote_db = MySQLdb.connect(host=dbhost,
-                                         user=dbuser,
-                                         passwd=dbpassword,
-                                         db=dbname)
+        self.remote_db_args = {
+            'host': dbhost,
+            'user': dbuser,
+            'passwd': dbpassword,
+            'db': dbname,
+        }
+        self.remote_db = MySQLdb.connect(**self.remote_db_args)
         self.remote_db_ps = get_paramstyle_symbol(MySQLdb.paramstyle)
 
     def close(self):
         """Destroy connection objects.
 
         Close the remote database connection handler and reset state of remote
-        connection attributes.
+        connection attributes.  Also closes the connection pool, if any.
         """
+        self.close_pool()
         self.remote_db = None
         self.remote_db_ps = None
+        self.remote_db_args = None
+
+    def open_pool(self, size):
+        """Open a pool of connections for concurrent queries.
+
+        The pool connects to the cache database if one is open, or the remote
+        database otherwise.  Once opened, all queries borrow a connection from
+        the pool rather than using `cache_db` or `remote_db` so that queries
+        can be issued from multiple threads at once.
+
+        Args:
+            size (int): maximum number of connections in the pool
+        """
+        self.close_pool()
+        if self.cache_db is not None:
+            cache_file = self.cache_file
+            connect = lambda: sqlite3.connect(cache_file, check_same_thread=False)
+        elif self.remote_db is not None:
+            connect = lambda: MySQLdb.connect(**self.remote_db_args)
+        else:
+            raise RuntimeError('No databases available to pool')
+        self.pool = ConnectionPool(connect, size)
+
+    def close_pool(self):
+        """Close all pooled connections and stop using the connection pool.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
 
     def connect_cache(self, cache_file):
         """Open the cache database file and set the handler attribute.
@@ -176,99 +656,36 @@ class CachingDb(object):
     def save_cache(self, cache_file):
         """Commit the in-memory cache to a cache database.
 
-        This method is currently very memory-inefficient and not good for
-        caching giant pieces of a database without something wrapping it to feed
-        it smaller pieces.
-
-        Note:
-            This manipulates the ``cache_db*`` attributes in a dirty way
-            to prevent closing and re-opening the original cache db.  If the
-            ``self.open_cache()`` is ever changed to include tracking more
-            state, this function must also be updated to retain that state while
-            the old cache db state is being temporarily shuffled out.
+        Rows are bulk loaded into `cache_file` in a single transaction using a
+        CacheWriter.  If `cache_file` already exists, rows are appended to it,
+        replacing any existing rows with the same primary key.  Committed rows
+        are dropped from memory.
 
         Args:
             cache_file (str): Path to the cache file to be used to write out
-                the cache contents.  This file will temporarily pre-empt the
-                `cache_file` attribute and should be a different file.
+                the cache contents.
         """
-        ### Shuffle out the old cache db state (if it exists)
-        old_state = {}
-        if self.cache_file is not None and self.cache_file != cache_file:
-            old_state = {
-                'cache_file': self.cache_file,
-                'cache_db': self.cache_db,
-                'cache_db_ps': self.cache_db_ps,
-            }
-
-        ### Open a new cache db connection without closing the old cache db
-        self.connect_cache(cache_file)
-
-        ### Commit each table we've retained in memory
-        drop_caches = set([])
-        for table, table_info in self.saved_results.items():
-            if len(self.saved_results[table]['rows']) < 1:
-                warnings.warn("table %s has no rows" % table)
-                continue
-
-            num_fields = None
-            ### Verify and preprocess each saved row
-            for row in self.saved_results[table]['rows']:
-                if num_fields is None:
-                    num_fields = len(row)
-
-                ### Verify that the rows we've saved are actually all of the
-                ### same length so that they have a hope of being inserted
-                ### into the schema
-                if len(row) != num_fields:
-                    warnings.warn(
-                        "saved_results[%s] contains non-uniform rows (%d, %d); skipping table" %
-                        table, len(row), num_fields)
+        saved_tables = []
+        with CacheWriter(cache_file) as writer:
+            for table, table_info in self.saved_results.items():
+                if len(table_info['rows']) < 1:
+                    warnings.warn("table %s has no rows" % table)
                     continue
-                else:
-                    ### Prepend table name to row to facilitate the bulk insert
-                    ### query below
-#                   self.saved_results[table]['rows'][index] = (table,) + row
-                    pass
-
-            ### Create the table (if necessary).  This will throw all sorts of
-            ### exceptions if
-            ###   (1) the table doesn't already exist in the cache database, or
-            ###   (2) 'schema' isn't set correctly by the downstream application
-            if table_info['schema'] is not None:
-                self.cache_db.execute(
-                    "CREATE TABLE IF NOT EXISTS %s (%s, PRIMARY KEY(%s))" %
-                    (table,
-                     ', '.join(table_info['schema']['columns']),
-                     ', '.join(table_info['schema']['primary_key'])))
-
-            ### INSERT OR REPLACE so that the cache db never wins if a duplicate
-            ### primary key is detected
-            query_str = "insert or replace into %s values (%s)" % (table, ','.join(['?'] * num_fields))
-            self.cache_db.executemany(
-                query_str,
-                table_info['rows'])
-            self.cache_db.commit()
-
-            ### Drop committed rows from memory
-            drop_caches.add(table)
-
-        for drop_cache in drop_caches:
-            del self.saved_results[drop_cache]
+                writer.write(table, table_info['rows'], table_info['schema'])
+                saved_tables.append(table)
 
-        self.close_cache()
+        ### Drop committed rows from memory
+        for table in saved_tables:
+            del self.saved_results[table]
 
-        ### Shuffle back in the state of the old cache db
-        if len(old_state) > 0:
-            self.cache_file = old_state['cache_file']
-            self.cache_db = old_state['cache_db']
-            self.cache_db_ps = old_state['cache_db_ps']
-
-    def query(self, query_str, query_variables=(), table=None, table_schema=None):
+    def query(self, query_str, query_variables=(), table=None, table_schema=None,
+              epoch_columns=None):
         """Pass a query through all layers of cache and return on the first hit.
 
         If a table is specified, the results of this query can be saved to the
-        cache db into a table of that name.
+        cache db into a table of that name.  If a result cache is configured,
+        it is consulted before any database and stores the results of queries
+        that miss it.
 
         Args:
             query_str (str): SQL query expressed as a string
@@ -279,6 +696,9 @@ class CachingDb(object):
             table_schema (str, optional): when `table` is specified, the SQL
                 line to initialize the table in which the query results will
                 be cached.
+            epoch_columns (list of int, optional): indices of columns containing
+                timestamps to be returned as seconds since epoch.  Results
+                saved for `table` are not converted.
 
         Returns:
             tuple: Tuple of tuples corresponding to rows of fields as returned
@@ -288,34 +708,206 @@ class CachingDb(object):
         ### Collapse query string to remove extraneous whitespace
         query_str = ' '.join(query_str.split())
 
-        ### Check the cache database (if available)
+        ### Check the result cache (if available)
+        results = None
+        if self.result_cache is not None:
+            namespace = self._get_namespace()
+            results = self.result_cache.get(query_str, query_variables, namespace)
+
+        if results is not None:
+            self.last_hit = HIT_RESULT_CACHE
+        else:
+            ### Check the cache database (if available)
+            if self.cache_db is not None:
+                results = self._query_sqlite3(query_str, query_variables)
+                self.last_hit = HIT_CACHE_DB
+            ### Check the MySQL database (if available)
+            elif self.remote_db is not None:
+                results = self._query_mysql(query_str, query_variables)
+                self.last_hit = HIT_REMOTE_DB
+            else:
+                raise RuntimeError('No databases available to query')
+
+            if self.result_cache is not None:
+                self.result_cache.put(query_str, query_variables, results, namespace)
+
+        if table is not None:
+            self.save_results(table, results, table_schema)
+
+        if epoch_columns:
+            return timestamps_to_epochs(results, epoch_columns)
+        return results
+
+    def query_parallel(self, queries, table=None, table_schema=None):
+        """Run several queries concurrently using the connection pool.
+
+        If no connection pool is open, the queries are run one after another.
+        Results are returned (and saved, if `table` is specified) in the same
+        order as `queries` regardless of the order in which they complete.
+
+        Args:
+            queries (list of tuples): (query_str, query_variables) for each
+                query to run
+            table (str, optional): name of table in the cache database to save
+                the results of the queries
+            table_schema (dict, optional): when `table` is specified, the
+                columns and primary key of the table
+
+        Returns:
+            list: Tuple of tuples for each query as returned by query()
+        """
+        run_query = lambda query: self.query(*query)
+        if self.pool is None or len(queries) < 2:
+            results = [run_query(query) for query in queries]
+        else:
+            workers = multiprocessing.pool.ThreadPool(min(self.pool.size, len(queries)))
+            try:
+                results = workers.map(run_query, queries)
+            finally:
+                workers.close()
+                workers.join()
+
+        if table is not None:
+            for result in results:
+                self.save_results(table, result, table_schema)
+        return results
+
+    def save_results(self, table, rows, table_schema=None):
+        """Append rows to the in-memory cache.
+
+        Args:
+            table (str): name of table in the cache database to which the rows
+                will be saved
+            rows (list of tuples): rows to save
+            table_schema (dict, optional): the columns and primary key of the
+                table
+        """
+        ### Initialize the table if our intent is to save the result of this
+        ### query.
+        if table not in self.saved_results:
+            self.saved_results[table] = {
+                'rows': [],
+                'schema': None,
+            }
+        ### Table schema can be defined or re-defined on any query.  It is
+        ### up to the downstream application to manage this correctly.
+        if table_schema is not None:
+            self.saved_results[table]['schema'] = table_schema
+
+        ### Append our results
+        self.saved_results[table]['rows'] += list(rows)
+
+    def _get_namespace(self):
+        """Identify the database being queried for the result cache
+        """
         if self.cache_db is not None:
-            results = self._query_sqlite3(query_str, query_variables)
+            return 'sqlite:%s' % os.path.abspath(self.cache_file)
+        elif self.remote_db_args is not None:
+            return 'mysql:%s@%s/%s' % (self.remote_db_args['user'],
+                                       self.remote_db_args['host'],
+                                       self.remote_db_args['db'])
+        return None
+
+    @contextlib.contextmanager
+    def _connection(self, default):
+        """Borrow a pooled connection if a pool is open, else use `default`
+        """
+        if self.pool is None:
+            yield default
+        else:
+            with self.pool.connection() as conn:
+                yield conn
+
+    def iter_query(self, query_str, query_variables=(), batch_size=ITER_BATCH_SIZE, dtype=None,
+                   table=None, table_schema=None, cache_file=None):
+        """Run a query and yield its results in batches.
+
+        Unlike query(), results are fetched from the database incrementally and
+        are never retained in ``saved_results``, so arbitrarily large results
+        can be processed in bounded memory.  MySQL queries use a server-side
+        cursor so that the remote result set is not buffered client-side
+        either.
+
+        If both `table` and `cache_file` are specified, each batch is also
+        written to that table in the given SQLite database as it is yielded.
+        Rows are committed once the iteration finishes.
+
+        If a connection pool is open, one of its connections is held until
+        the generator is exhausted or closed.
+
+        Args:
+            query_str (str): SQL query expressed as a string
+            query_variables (tuple): parameters to be substituted into
+                `query_str` if `query_str` is a parameterized query
+            batch_size (int): maximum number of rows per batch
+            dtype (numpy.dtype, optional): if specified, yield each batch as a
+                numpy structured array of this dtype rather than as lists
+            table (str, optional): name of the table in `cache_file` to which
+                results should be written
+            table_schema (dict, optional): when `table` is specified, the
+                columns and primary key used to create it if necessary
+            cache_file (str or CacheWriter, optional): path to an SQLite
+                database, or an open CacheWriter, to which results should be
+                written
+
+        Yields:
+            list or numpy.ndarray: One list of values per column returned by
+            the query, or a structured array with one element per row if
+            `dtype` is specified.  Batches are never empty.
+        """
+        ### Collapse query string to remove extraneous whitespace
+        query_str = ' '.join(query_str.split())
+
+        if self.cache_db is not None:
+            default_db = self.cache_db
+            paramstyle = self.cache_db_ps
             self.last_hit = HIT_CACHE_DB
-        ### Check the MySQL database (if available)
         elif self.remote_db is not None:
-            results = self._query_mysql(query_str, query_variables)
+            default_db = self.remote_db
+            paramstyle = self.remote_db_ps
             self.last_hit = HIT_REMOTE_DB
         else:
             raise RuntimeError('No databases available to query')
 
-        if table is not None:
-            ### Initialize the table if our intent is to save the result of this
-            ### query.
-            if table not in self.saved_results:
-                self.saved_results[table] = {
-                    'rows': [],
-                    'schema': None,
-                }
-            ### Table schema can be defined or re-defined on any query.  It is
-            ### up to the downstream application to manage this correctly.
-            if table_schema is not None:
-                self.saved_results[table]['schema'] = table_schema
-
-            ### Append our results
-            self.saved_results[table]['rows'] += list(results)
-
-        return results
+        if '%(ps)' in query_str:
+            query_str = query_str % {'ps': paramstyle}
+
+        with self._connection(default_db) as conn:
+            if self.last_hit == HIT_REMOTE_DB:
+                try:
+                    cursor = conn.cursor(MySQLdb.cursors.SSCursor)
+                except AttributeError:
+                    cursor = conn.cursor()
+            else:
+                cursor = conn.cursor()
+
+            writer = None
+            if table is not None and cache_file is not None:
+                if isinstance(cache_file, CacheWriter):
+                    writer = cache_file
+                else:
+                    writer = CacheWriter(cache_file)
+
+            try:
+                cursor.execute(query_str, query_variables)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    if writer is not None:
+                        writer.write(table, rows, table_schema)
+                    if dtype is not None:
+                        yield numpy.array([tuple(row) for row in rows], dtype=dtype)
+                    else:
+                        yield [list(column) for column in zip(*rows)]
+            except Exception:
+                if writer is not None and writer is not cache_file:
+                    writer.close(commit=False)
+                raise
+            finally:
+                cursor.close()
+                if writer is not None and writer is not cache_file:
+                    writer.close()
 
     def _query_sqlite3(self, query_str, query_variables):
         """Run a query against the cache database and return the full output.
@@ -325,12 +917,13 @@ class CachingDb(object):
             query_variables (tuple): parameters to be substituted into
                 `query_str` if `query_str` is a parameterized query
         """
-        cursor = self.cache_db.cursor()
         if '%(ps)' in query_str:
             query_str = query_str % {'ps': self.cache_db_ps}
-        cursor.execute(query_str, query_variables)
-        rows = cursor.fetchall()
-        cursor.close()
+        with self._connection(self.cache_db) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query_str, query_variables)
+            rows = cursor.fetchall()
+            cursor.close()
         return rows
 
     def _query_mysql(self, query_str, query_variables):
@@ -341,12 +934,13 @@ class CachingDb(object):
             query_variables (tuple): parameters to be substituted into
                 `query_str` if `query_str` is a parameterized query
         """
-        cursor = self.remote_db.cursor()
         if '%(ps)' in query_str:
             query_str = query_str % {'ps': self.remote_db_ps}
-        cursor.execute(query_str, query_variables)
-        rows = cursor.fetchall()
-        cursor.close()
+        with self._connection(self.remote_db) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query_str, query_variables)
+            rows = cursor.fetchall()
+            cursor.close()
         return rows
 
 def get_paramstyle_symbol(paramstyle):
@@ -371,3 +965,24 @@ def get_paramstyle_symbol(paramstyle):
         return "%s"
     else:
         raise Exception("Unsupported paramstyle %s" % paramstyle)
+
+def timestamps_to_epochs(rows, epoch_columns):
+    """Convert timestamp columns of query results into seconds since epoch
+
+    SQLite returns timestamps as strings and MySQL returns them as
+    datetime.datetime objects; both are converted to integer epoch seconds,
+    decoding each distinct timestamp only once.
+
+    Args:
+        rows (list of tuples): rows as returned by CachingDb.query()
+        epoch_columns (list of int): indices of columns to convert
+
+    Returns:
+        list of tuples: rows with the timestamp columns converted
+    """
+    if not rows:
+        return list(rows)
+    columns = [list(column) for column in zip(*rows)]
+    for index in epoch_columns:
+        columns[index] = tokio.common.strptime_epochs(columns[index], DATE_FMT).tolist()
+    return list(zip(*columns))
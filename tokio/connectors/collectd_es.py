@@ -20,6 +20,9 @@ es.mutate_query(QUERY_CPU_DATA, term='regexp', field='type_instance', value='(id
 QUERY_MEMORY_DATA = copy.deepcopy(BASE_QUERY)
 es.mutate_query(QUERY_MEMORY_DATA, term='term', field='plugin', value='memory')
 
+# default number of documents to accumulate before applying the flush function
+FLUSH_EVERY = 50000
+
 ### Only return the following _source fields
 SOURCE_FILTER = [
     '@timestamp',
@@ -44,6 +47,80 @@ SOURCE_FILTER = [
     'io_time',
 ]
 
+### Conversions that to_dataframe() can apply to each field
+DATAFRAME_DTYPES = {
+    '@timestamp': 'epoch',
+    'hostname': 'category',
+    'plugin': 'category',
+    'collectd_type': 'category',
+    'type_instance': 'category',
+    'plugin_instance': 'category',
+    'value': 'float',
+    'longterm': 'float',
+    'midterm': 'float',
+    'shortterm': 'float',
+    'majflt': 'float',
+    'minflt': 'float',
+    'if_octets': 'float',
+    'if_packets': 'float',
+    'if_errors': 'float',
+    'rx': 'float',
+    'tx': 'float',
+    'read': 'float',
+    'write': 'float',
+    'io_time': 'float',
+}
+
+### Bucket keys and per-bucket metrics used to reduce each plugin's documents
+### on the Elasticsearch server rather than retrieving every document
+AGGREGATION_SOURCES = {
+    'disk': ['hostname', 'plugin', 'plugin_instance', 'collectd_type'],
+    'cpu': ['hostname', 'plugin', 'type_instance'],
+    'memory': ['hostname', 'plugin', 'type_instance'],
+}
+
+AGGREGATION_METRICS = {
+    'disk': {
+        'read': {'avg': {'field': 'read'}},
+        'write': {'avg': {'field': 'write'}},
+    },
+    'cpu': {
+        'value': {'sum': {'field': 'value'}},
+        'count': {'value_count': {'field': 'value'}},
+    },
+    'memory': {
+        'value': {'avg': {'field': 'value'}},
+    },
+}
+
+def build_aggregation_query(query_template, plugin, timestep):
+    """Create a query that buckets a plugin's documents by time and source
+
+    Args:
+        query_template (dict): a query object selecting documents from
+            ``plugin``, e.g., QUERY_DISK_DATA
+        plugin (str): key of AGGREGATION_SOURCES and AGGREGATION_METRICS
+            describing how documents should be bucketed and reduced
+        timestep (int): width of each time bucket, in seconds
+
+    Returns:
+        dict: A query object containing a composite aggregation whose bucket
+        keys are ``@timestamp`` (in epoch milliseconds) and each of
+        ``AGGREGATION_SOURCES[plugin]``
+    """
+    sources = [{
+        '@timestamp': {
+            'date_histogram': {
+                'field': '@timestamp',
+                'interval': '%ds' % timestep,
+            }
+        }
+    }]
+    for field in AGGREGATION_SOURCES[plugin]:
+        sources.append({field: {'terms': {'field': field}}})
+    return es.build_composite_query(query_template,
+                                    sources=sources,
+                                    metrics=AGGREGATION_METRICS[plugin])
 
 class CollectdEs(es.EsConnection):
     """collectd-Elasticsearch connection handler
@@ -51,15 +128,17 @@ class CollectdEs(es.EsConnection):
     def __init__(self, *args, **kwargs):
         super(CollectdEs, self).__init__(*args, **kwargs)
         self.filter_function = lambda x: x['hits']['hits']
-        self.flush_every = 50000
+        self.flush_every = FLUSH_EVERY
         self.flush_function = lambda x: x
+        self.slices = 1
 
     @classmethod
     def from_cache(cls, *args, **kwargs):
         instance = super(CollectdEs, cls).from_cache(*args, **kwargs)
         instance.filter_function = lambda x: x['hits']['hits']
-        instance.flush_every = 50000
+        instance.flush_every = FLUSH_EVERY
         instance.flush_function = lambda x: x
+        instance.slices = 1
         return instance
 
     def query_disk(self, start, end):
@@ -89,9 +168,63 @@ class CollectdEs(es.EsConnection):
         """
         self.query_timeseries(QUERY_CPU_DATA, start, end)
 
+    def aggregate_disk(self, start, end, timestep):
+        """Query Elasticsearch for collectd disk plugin data reduced per timestep.
+
+        Args:
+            start (datetime.datetime): lower bound for query (inclusive)
+            end (datetime.datetime): upper bound for query (exclusive)
+            timestep (int): width of each time bucket, in seconds
+        """
+        self.aggregate_timeseries(QUERY_DISK_DATA, 'disk', start, end, timestep)
+
+    def aggregate_memory(self, start, end, timestep):
+        """Query Elasticsearch for collectd memory plugin data reduced per timestep.
+
+        Args:
+            start (datetime.datetime): lower bound for query (inclusive)
+            end (datetime.datetime): upper bound for query (exclusive)
+            timestep (int): width of each time bucket, in seconds
+        """
+        self.aggregate_timeseries(QUERY_MEMORY_DATA, 'memory', start, end, timestep)
+
+    def aggregate_cpu(self, start, end, timestep):
+        """Query Elasticsearch for collectd cpu plugin data reduced per timestep.
+
+        Args:
+            start (datetime.datetime): lower bound for query (inclusive)
+            end (datetime.datetime): upper bound for query (exclusive)
+            timestep (int): width of each time bucket, in seconds
+        """
+        self.aggregate_timeseries(QUERY_CPU_DATA, 'cpu', start, end, timestep)
+
+    def aggregate_timeseries(self, query_template, plugin, start, end, timestep):
+        """Retrieve one plugin's data as buckets reduced by Elasticsearch
+
+        Rather than scrolling through every document, has Elasticsearch group
+        documents into one bucket per timestep and source (as defined by
+        AGGREGATION_SOURCES) and return only each bucket's reduced metrics.
+        Each page appended to ``scroll_pages`` is a list of buckets.
+
+        Args:
+            query_template (dict): a query object containing at least one
+                ``@timestamp`` field
+            plugin (str): name of the collectd plugin being queried
+            start (datetime.datetime): lower bound for query (inclusive)
+            end (datetime.datetime): upper bound for query (exclusive)
+            timestep (int): width of each time bucket, in seconds
+        """
+        query = build_aggregation_query(
+            es.build_timeseries_query(query_template, start, end),
+            plugin,
+            timestep)
+        return self.query_and_aggregate(
+            query=query,
+            filter_function=lambda x: x['aggregations'][es.AGGREGATION_NAME]['buckets'])
+
     def query_timeseries(self, query_template, start, end, source_filter=None,
                          filter_function=None, flush_every=None,
-                         flush_function=None):
+                         flush_function=None, slices=None):
         """Map connection-wide attributes to super(self).query_timeseries arguments
 
         Args:
@@ -114,6 +247,8 @@ class CollectdEs(es.EsConnection):
             flush_function (function, optional): function to call when
                 `flush_every` docs are retrieved.  If None, use the default for
                 this connector.
+            slices (int or None): Number of slices to retrieve concurrently.
+                If None, use the default for this connector.
         """
         if source_filter is None:
             source_filter = SOURCE_FILTER
@@ -123,6 +258,8 @@ class CollectdEs(es.EsConnection):
             flush_every = self.flush_every
         if flush_function is None:
             flush_function = self.flush_function
+        if slices is None:
+            slices = self.slices
         return super(CollectdEs, self)\
             .query_timeseries(query_template=query_template,
                               start=start,
@@ -130,12 +267,27 @@ class CollectdEs(es.EsConnection):
                               source_filter=source_filter,
                               filter_function=filter_function,
                               flush_every=flush_every,
-                              flush_function=flush_function)
+                              flush_function=flush_function,
+                              slices=slices)
 
-    def to_dataframe(self):
+    def to_dataframe(self, query=None, dtypes=None):
         """Converts self.scroll_pages to a DataFrame
 
+        Only applies to pages of documents, not pages of aggregation buckets.
+        Passing ``dtypes=DATAFRAME_DTYPES`` converts timestamps to seconds
+        since the epoch and stores low-cardinality fields such as hostname as
+        categoricals.
+
+        Args:
+            query (dict or None): If given, stream the results of this query
+                into the DataFrame instead of converting self.scroll_pages
+            dtypes (dict or None): Conversions to apply to each field as
+                accepted by :func:`tokio.connectors.es.convert_column`.  If
+                None, pandas infers the type of each column.
+
         Returns:
             pandas.DataFrame: Contents of the last query's pages
         """
-        return super(CollectdEs, self).to_dataframe(fields=SOURCE_FILTER)
+        return super(CollectdEs, self).to_dataframe(fields=SOURCE_FILTER,
+                                                    query=query,
+                                                    dtypes=dtypes)
@@ -5,12 +5,24 @@ This module provides a wrapper around the Elasticsearch connection handler and
 methods to query, scroll, and process pages of scrolling data.
 """
 
+import os
 import copy
 import time
 import json
 import mimetypes
 import gzip
+import bz2
 import warnings
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import lzma
+except ImportError:
+    lzma = None
+import numpy
 import pandas
 from .. import debug
 try:
@@ -19,6 +31,28 @@ try:
 except ImportError:
     HAVE_ES_PKG = True
 
+# pages each slice may retrieve ahead of processing during a sliced scroll
+SLICE_QUEUE_DEPTH = 2
+# seconds between checks for failure while waiting on other slices
+SLICE_POLL_INTERVAL = 0.1
+
+# name under which composite aggregations are issued and their buckets returned
+AGGREGATION_NAME = 'composite_buckets'
+
+# pandas >= 2 infers one format from the first timestamp unless told to accept
+# any ISO 8601 timestamp, which older versions do by default
+ISO8601_FORMAT = 'ISO8601' if int(pandas.__version__.split('.')[0]) >= 2 else None
+
+# cache files with these extensions contain one page of hits per line
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+# functions that open cache files compressed with each of these extensions
+CACHE_COMPRESSORS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+}
+if lzma is not None:
+    CACHE_COMPRESSORS['.xz'] = lzma.open
+
 BASE_QUERY = {
     "query": {
         "constant_score": {
@@ -73,10 +107,16 @@ class EsConnection(object):
                 before returning them as query results
             fake_pages (list): A list of ``page`` structures that should be
                 returned by self.scroll() when the elasticsearch module is not
-                actually available.  Used only for debugging.
+                actually available, or a list of such lists (one per slice)
+                for sliced scrolls.  May also be an iterator of pages, as set
+                by ``from_cache()`` for NDJSON caches.  Used only for
+                debugging.
             local_mode (bool): If True, retrieve query results from
                 self.fake_pages instead of attempting to contact an
                 Elasticsearch server
+            cache_output (file or None): If set, each page processed by
+                query_and_scroll is also appended to this NDJSON cache, which
+                should have been opened with :func:`open_cache`
             kwargs (dict): Passed to elasticsearch.Elasticsearch.__init__ if
                 host and port are defined
         """
@@ -102,6 +142,8 @@ class EsConnection(object):
         self._hits_since_flush = 0
         # hidden parameters to refine how Elasticsearch queries are issued
         self.sort_by = ''
+        # file to which each page is appended as it is retrieved
+        self.cache_output = None
         # for debugging
         self.fake_pages = []
         # if elasticsearch package is not available, we MUST run in local mode.
@@ -114,33 +156,30 @@ class EsConnection(object):
             self.connect(**kwargs)
 
     @classmethod
-    def from_cache(cls, cache_file):
+    def from_cache(cls, cache_file, decoder=None):
         """Initializes an EsConnection object from a cache file.
 
-        This path is designed to be used for testing.
+        This path is designed to be used for testing.  Caches in NDJSON format
+        (see :meth:`save_cache`) are read lazily, one page at a time, as the
+        resulting object is queried.
 
         Args:
-            cache_file (str): Path to the JSON formatted list of pages
+            cache_file (str): Path to the JSON formatted list of pages or
+                an NDJSON file containing one page per line
+            decoder (function, optional): Function that deserializes one line
+                of an NDJSON cache, such as a faster drop-in replacement for
+                json.loads.  Ignored for JSON caches.
         """
-        _, encoding = mimetypes.guess_type(cache_file)
-        if encoding == 'gzip':
-            input_fp = gzip.open(cache_file, 'rt')
+        if is_ndjson_cache(cache_file):
+            pages = _wrap_cached_pages(iter_cache_pages(cache_file, decoder=decoder))
         else:
-            input_fp = open(cache_file, 'rt')
-
-        # convert cached hits into something resembling a real Elasticsearch response
-        pages = []
-        for hits in json.load(input_fp):
-            pages.append({
-                '_scroll_id': '0',
-                'hits': {
-                    'hits': hits
-                }
-            })
-
-        # never forget to terminate fake pages with an empty page
-        pages.append({'_scroll_id': 0, 'hits': {'hits': []}})
-        input_fp.close()
+            _, encoding = mimetypes.guess_type(cache_file)
+            if encoding == 'gzip':
+                input_fp = gzip.open(cache_file, 'rt')
+            else:
+                input_fp = open(cache_file, 'rt')
+            pages = list(_wrap_cached_pages(json.load(input_fp)))
+            input_fp.close()
 
         instance = cls(host=None, port=None, index=None)
         instance.local_mode = True
@@ -157,6 +196,12 @@ class EsConnection(object):
 
         Its principal intention is to be used with testing.
 
+        If ``output_file`` ends in ``.ndjson`` or ``.jsonl`` (optionally
+        followed by ``.gz``, ``.bz2``, or ``.xz``), the hits of each page are
+        written as one line so that the cache can be read back one page at a
+        time.  To write such a cache while scrolling rather than after, set
+        ``cache_output`` to a file opened with :func:`open_cache` instead.
+
         Args:
             output_file (str or None): Path to file to which json should be
                 written.  If None, write to stdout.  Default is None.
@@ -164,9 +209,13 @@ class EsConnection(object):
         # write out pages to a file
         if output_file is None:
             print(json.dumps(self.scroll_pages, indent=4))
+        elif is_ndjson_cache(output_file):
+            with open_cache(output_file, 'w') as output:
+                for page in self.scroll_pages:
+                    write_cache_page(output, page)
         else:
             _, encoding = mimetypes.guess_type(output_file)
-            output_file = gzip.open(output_file, 'w') if encoding == 'gzip' else open(output_file, 'w')
+            output_file = gzip.open(output_file, 'wt') if encoding == 'gzip' else open(output_file, 'w')
             json.dump(self.scroll_pages, output_file)
             output_file.close()
 
@@ -205,19 +254,28 @@ class EsConnection(object):
         else:
             filtered_page = self._filter_function(self.page)
 
+        if self.cache_output is not None:
+            write_cache_page(self.cache_output, filtered_page)
+
         # finally append the page
         self.scroll_pages.append(filtered_page)
         return True
 
 
     def _pop_fake_page(self):
-        if not self.fake_pages:
+        if isinstance(self.fake_pages, list):
+            page = self.fake_pages.pop(0) if self.fake_pages else None
+        else:
+            # pages being read lazily from a cache
+            page = next(self.fake_pages, None)
+        if page is None:
             warn_str = "fake_pages is empty on a query/scroll; this means either"
             warn_str += "\n\n"
             warn_str += "1. You forgot to set self.fake_pages before issuing the query, or\n"
             warn_str += "2. You forgot to terminate self.fake_pages with an empty page"
             warnings.warn(warn_str)
-        self.page = self.fake_pages.pop(0)
+            raise IndexError("no fake pages remain")
+        self.page = page
 
     def connect(self, **kwargs):
         """Instantiate a connection and retain the connection context.
@@ -287,7 +345,7 @@ class EsConnection(object):
         return self.page
 
     def query_and_scroll(self, query, source_filter=True, filter_function=None,
-                         flush_every=None, flush_function=None):
+                         flush_every=None, flush_function=None, slices=1):
         """Issue a query and retain all results.
 
         Issues a query and scrolls through every resulting page, optionally
@@ -311,6 +369,11 @@ class EsConnection(object):
                 this value.  If None, do not apply `flush_function`.
             flush_function (function, optional): function to call when
                 `flush_every` docs are retrieved.
+            slices (int): Number of slices into which the scroll should be
+                divided and retrieved concurrently.  Pages from all slices
+                are filtered and flushed in the order they arrive.  When
+                operating in local mode with more than one slice,
+                ``fake_pages`` must contain one list of pages per slice.
         """
         ### Print query
         debug.debug_print(json.dumps(query, indent=4))
@@ -326,6 +389,12 @@ class EsConnection(object):
         self._total_hits = 0
         self._hits_since_flush = 0
 
+        if slices > 1:
+            self._scroll_slices(query, source_filter, slices)
+            debug.debug_print("Elasticsearch query of %d slices took %s seconds"
+                              % (slices, time.time() - time0))
+            return
+
         # Get first set of results and a scroll id
         if self.local_mode:
             self._pop_fake_page()
@@ -349,9 +418,154 @@ class EsConnection(object):
             more = self._process_page()
         debug.debug_print("Elasticsearch query took %s seconds" % (time.time() - time0))
 
+    def _scroll_slices(self, query, source_filter, slices):
+        """Retrieve all slices of a sliced scroll concurrently
+
+        Each slice is scrolled in its own thread, and its pages are handed
+        back to this thread to be processed by _process_page().  Each slice
+        may only retrieve SLICE_QUEUE_DEPTH pages ahead of processing.
+
+        Args:
+            query (dict): Dictionary representing the query to issue
+            source_filter (bool or list): Passed to the search request
+            slices (int): Number of slices to retrieve
+        """
+        if self.local_mode:
+            if not isinstance(self.fake_pages, list) or len(self.fake_pages) != slices:
+                raise ValueError("fake_pages must contain one list of pages per slice")
+        elif not self.client:
+            # connect before threads race to do so
+            self.connect()
+
+        pages = queue.Queue(maxsize=SLICE_QUEUE_DEPTH * slices)
+        failed = threading.Event()
+
+        def put(item):
+            """Queue an item unless another slice has failed"""
+            while not failed.is_set():
+                try:
+                    pages.put(item, timeout=SLICE_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def scroll_slice(slice_id):
+            """Retrieve every page of one slice"""
+            try:
+                if self.local_mode:
+                    next_page = lambda scroll_id: self.fake_pages[slice_id].pop(0)
+                else:
+                    next_page = lambda scroll_id: self.client.scroll(scroll_id=scroll_id,
+                                                                     scroll=self.scroll_size)
+                sliced_query = copy.deepcopy(query)
+                sliced_query['slice'] = {'id': slice_id, 'max': slices}
+                if self.local_mode:
+                    page = next_page(None)
+                else:
+                    page = self.client.search(
+                        index=self.index,
+                        body=sliced_query,
+                        scroll=self.scroll_size,
+                        size=self.page_size,
+                        _source=source_filter,
+                    )
+                while page['hits']['hits']:
+                    if not put((page, None)):
+                        return
+                    page = next_page(page.get('_scroll_id'))
+                put((None, None))
+            except Exception as error: # pylint: disable=broad-except
+                put((None, error))
+
+        threads = [threading.Thread(target=scroll_slice, args=(slice_id,))
+                   for slice_id in range(slices)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            remaining = slices
+            while remaining:
+                page, error = pages.get()
+                if error is not None:
+                    raise error
+                if page is None:
+                    remaining -= 1
+                    continue
+                self.page = page
+                self._process_page()
+        finally:
+            # release any slices still waiting to queue pages
+            failed.set()
+            for thread in threads:
+                thread.join()
+
+    def query_and_aggregate(self, query, filter_function=None,
+                            aggregation_name=AGGREGATION_NAME):
+        """Issue a composite aggregation query and retain all resulting buckets.
+
+        Pages through every bucket of a composite aggregation by reissuing
+        ``query`` with each page's ``after_key`` until an empty page of
+        buckets is returned.  Only buckets are returned by Elasticsearch, so
+        this transfers far less data than ``query_and_scroll()`` when
+        documents can be reduced on the server.  Resulting pages are appended
+        to the ``scroll_pages`` attribute of this object.
+
+        When operating in local mode, each page is taken from ``fake_pages``,
+        which must be terminated by a page containing no buckets.
+
+        Args:
+            query (dict): Dictionary representing the query to issue.  Must
+                contain a composite aggregation named ``aggregation_name`` as
+                created by :meth:`build_composite_query`.
+            filter_function (function, optional): Function to call before each
+                page is appended to the ``scroll_pages`` attribute; if
+                specified, return value of this function is what is appended.
+            aggregation_name (str): Name of the composite aggregation within
+                ``query``
+        """
+        debug.debug_print(json.dumps(query, indent=4))
+
+        time0 = time.time()
+
+        self.scroll_pages = []
+        self._total_hits = 0
+        query = copy.deepcopy(query)
+        composite = query['aggs'][aggregation_name]['composite']
+        composite.pop('after', None)
+
+        while True:
+            if self.local_mode:
+                self._pop_fake_page()
+            else:
+                if not self.client:
+                    # allow lazy connect
+                    self.connect()
+                self.page = self.client.search(index=self.index, body=query)
+
+            result = self.page['aggregations'][aggregation_name]
+            if not result['buckets']:
+                break
+            self._total_hits += len(result['buckets'])
+
+            if filter_function is None:
+                self.scroll_pages.append(self.page)
+            else:
+                self.scroll_pages.append(filter_function(self.page))
+
+            if 'after_key' in result:
+                composite['after'] = result['after_key']
+            else:
+                # Elasticsearch < 6.3 does not return after_key
+                composite['after'] = result['buckets'][-1]['key']
+
+        debug.debug_print("Elasticsearch aggregation of %d buckets took %s seconds"
+                          % (self._total_hits, time.time() - time0))
+
     def query_timeseries(self, query_template, start, end, source_filter=True,
                          filter_function=None, flush_every=None,
-                         flush_function=None):
+                         flush_function=None, slices=1):
         """Craft and issue query bounded by time
 
         Args:
@@ -370,6 +584,7 @@ class EsConnection(object):
                 this value.  If None, do not apply `flush_function`.
             flush_function (function, optional): function to call when
                 `flush_every` docs are retrieved.
+            slices (int): Number of slices to retrieve concurrently
         """
         query = build_timeseries_query(query_template, start, end)
 
@@ -378,22 +593,318 @@ class EsConnection(object):
             source_filter=source_filter,
             filter_function=filter_function,
             flush_every=flush_every,
-            flush_function=flush_function)
+            flush_function=flush_function,
+            slices=slices)
+
+    def iter_hits(self, query=None, fields=None, columns=False):
+        """Yield documents as their pages are retrieved
+
+        Issues a query and scrolls through the results, yielding each page's
+        documents before the next page is requested.  Pages are not retained in
+        ``scroll_pages`` and each is released once its documents have been
+        consumed, so memory use is bounded by a single page regardless of how
+        many documents match.  Because the next page is only requested when
+        the consumer asks for more documents, a slow consumer throttles the
+        scroll rather than causing pages to pile up, and closing the generator
+        early stops the scroll and releases its search context.
+
+        If no query is given, the documents already retained in
+        ``scroll_pages`` (e.g., by ``query_and_scroll()`` or ``from_cache()``)
+        are yielded instead and ``scroll_pages`` is left intact.
+
+        Args:
+            query (dict or None): Dictionary representing the query to issue, or
+                None to iterate over ``scroll_pages``
+            fields (list of str or None): If given, only retrieve these fields
+                of each document's _source and yield each document as a dict
+                keyed by these fields.  Otherwise yield every hit unmodified.
+            columns (bool): Instead of yielding documents one at a time, yield
+                one dict per page that maps each of ``fields`` to a list of that
+                field's values in the page's documents.  Requires ``fields``.
+
+        Yields:
+            dict: A hit, the requested fields of a hit, or a batch of columns
+            depending on ``fields`` and ``columns``
+        """
+        if columns and not fields:
+            raise ValueError("columns=True requires fields")
+
+        for hits in self._iter_hit_pages(query, source_filter=fields if fields else True):
+            if columns:
+                sources = [hit['_source'] for hit in hits]
+                yield dict((field, [source.get(field) for source in sources]) for field in fields)
+            elif fields:
+                for hit in hits:
+                    source = hit['_source']
+                    yield dict((field, source.get(field)) for field in fields)
+            else:
+                for hit in hits:
+                    yield hit
+
+    def _iter_hit_pages(self, query, source_filter):
+        """Yield the list of hits contained in each page of a query
+
+        Args:
+            query (dict or None): Dictionary representing the query to issue, or
+                None to iterate over ``scroll_pages``
+            source_filter (bool or list): Passed to Elasticsearch as _source
+
+        Yields:
+            list: hits contained in each successive page
+        """
+        if query is None:
+            for page in self.scroll_pages:
+                yield page_hits(page)
+            return
+
+        debug.debug_print(json.dumps(query, indent=4))
+
+        if self.local_mode:
+            self._pop_fake_page()
+        else:
+            if not self.client:
+                # allow lazy connect
+                self.connect()
+            self.page = self.client.search(
+                index=self.index,
+                body=query,
+                scroll=self.scroll_size,
+                size=self.page_size,
+                _source=source_filter,
+            )
 
-    def to_dataframe(self, fields):
-        """Converts self.scroll_pages to CSV
+        exhausted = False
+        try:
+            while True:
+                hits = self.page['hits']['hits']
+                if not hits:
+                    exhausted = True
+                    break
+                self.scroll_id = self.page.get('_scroll_id')
+                # only the consumer should hold a reference to this page
+                self.page = None
+                yield hits
+                hits = None
+                self.scroll()
+        finally:
+            if not exhausted:
+                self._clear_scroll()
+
+    def _clear_scroll(self):
+        """Release the search context of an abandoned scroll
+        """
+        if self.local_mode or not self.client or self.scroll_id is None:
+            return
+        try:
+            self.client.clear_scroll(scroll_id=self.scroll_id)
+        except Exception as error: # pylint: disable=broad-except
+            # the context will expire on its own after scroll_size anyway
+            debug.debug_print("failed to clear scroll %s: %s" % (self.scroll_id, error))
+
+    def to_dataframe(self, fields, query=None, dtypes=None):
+        """Converts documents into a DataFrame
+
+        Each column is accumulated as a list of values straight from the
+        documents' _source and converted as a whole, so no per-document
+        records are built.
+
+        Args:
+            fields (list of str): _source fields to include as columns
+            query (dict or None): If given, issue this query and build the
+                DataFrame directly from its results without retaining pages in
+                ``scroll_pages``.  Otherwise convert ``scroll_pages``.
+            dtypes (dict or None): Maps fields to the conversions accepted by
+                :func:`convert_column`.  Fields not included are left for
+                pandas to infer.
 
         Returns:
-            str: Contents of the last query's pages in CSV format
+            pandas.DataFrame: One row per document and one column per field
         """
-        to_df = []
-        for page in self.scroll_pages:
-            for record in page:
-                record_dict = {}
-                for field in fields:
-                    record_dict[field] = record['_source'].get(field)
-                to_df.append(record_dict)
-        return pandas.DataFrame(to_df)
+        if dtypes is None:
+            dtypes = {}
+        data = dict((field, []) for field in fields)
+        for batch in self.iter_hits(query=query, fields=fields, columns=True):
+            for field in fields:
+                data[field].extend(batch[field])
+        for field in fields:
+            data[field] = convert_column(data[field], dtypes.get(field))
+        return pandas.DataFrame(data, columns=fields)
+
+def page_hits(page):
+    """Return the hits contained in a page
+
+    Args:
+        page (dict or list): A page as returned by Elasticsearch, or the list
+            of hits to which a filter_function reduced it
+
+    Returns:
+        list: The hits contained in the page
+    """
+    return page['hits']['hits'] if isinstance(page, dict) else page
+
+def convert_column(values, dtype=None):
+    """Convert a list of field values into a typed column
+
+    Args:
+        values (list): Values of one field across many documents, where
+            missing values are None
+        dtype (str, function, or None): One of
+
+            * ``'category'`` to encode values as a pandas.Categorical, which
+              is best for fields with few distinct values like host names
+            * ``'object'`` for an array of arbitrary Python objects such as
+              strings with many distinct values
+            * ``'float'`` for float64 values, with missing values as NaN
+            * ``'int'`` for int64 values, or float64 if any are missing
+            * ``'epoch'`` to convert ISO 8601 timestamps into float seconds
+              since the epoch; see :func:`to_epochs`
+            * a function that takes ``values`` and returns the column
+            * None to return ``values`` unmodified
+
+    Returns:
+        The converted column, suitable for passing to pandas.DataFrame
+    """
+    if dtype is None:
+        return values
+    elif callable(dtype):
+        return dtype(values)
+    elif dtype == 'category':
+        return pandas.Categorical(values)
+    elif dtype == 'object':
+        column = numpy.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+    elif dtype == 'float':
+        return numpy.array(values, dtype='f8')
+    elif dtype == 'int':
+        try:
+            return numpy.array(values, dtype='i8')
+        except (TypeError, ValueError):
+            # None can only be represented as NaN
+            return numpy.array(values, dtype='f8')
+    elif dtype == 'epoch':
+        return to_epochs(values)
+    raise ValueError("unknown dtype %s" % dtype)
+
+def to_epochs(values, fmt=None):
+    """Convert timestamps into seconds since the epoch
+
+    Timestamps without an explicit time zone are assumed to be in UTC, as
+    Elasticsearch stores them.
+
+    Args:
+        values (list): Timestamps as strings, where missing values are None
+        fmt (str or None): strptime format of the timestamps; if None, they
+            are parsed as ISO 8601
+
+    Returns:
+        numpy.ndarray: float64 seconds since the epoch, with missing or
+        unparseable timestamps as NaN
+    """
+    if fmt is None:
+        # numpy parses the UTC timestamps Elasticsearch returns much faster
+        # than pandas, but does not handle anything else gracefully
+        try:
+            stripped = [value[:-1] for value in values if value[-1:] == 'Z']
+            if len(stripped) == len(values):
+                return _ns_to_epochs(numpy.array(stripped, dtype='datetime64[ns]').view('i8'))
+        except (TypeError, ValueError):
+            pass
+        fmt = ISO8601_FORMAT
+
+    timestamps = pandas.to_datetime(values, format=fmt, utc=True, errors='coerce')
+    epochs = _ns_to_epochs(numpy.asarray(timestamps.values).view('i8'))
+    epochs[pandas.isnull(timestamps)] = numpy.nan
+    return epochs
+
+def _ns_to_epochs(nanoseconds):
+    """Convert int64 nanoseconds into float64 seconds since the epoch
+
+    Whole and fractional seconds are converted separately since dividing
+    nanoseconds directly would round away sub-microsecond precision.
+    """
+    return (nanoseconds // 1000000000) + (nanoseconds % 1000000000) / 1.0e9
+
+def is_ndjson_cache(cache_file):
+    """Determine if a cache file should be in NDJSON format
+
+    Args:
+        cache_file (str): Path to a cache file
+
+    Returns:
+        bool: True if the file's extension, less any compression extension, is
+        one of NDJSON_EXTENSIONS
+    """
+    base, ext = os.path.splitext(cache_file)
+    if ext in CACHE_COMPRESSORS:
+        ext = os.path.splitext(base)[1]
+    return ext in NDJSON_EXTENSIONS
+
+def open_cache(cache_file, mode='r'):
+    """Open a cache file in text mode, compressed according to its extension
+
+    Args:
+        cache_file (str): Path to a cache file
+        mode (str): 'r' to read, 'w' to write, or 'a' to append
+
+    Returns:
+        file: Handle to the (de)compressed contents of ``cache_file``
+    """
+    opener = CACHE_COMPRESSORS.get(os.path.splitext(cache_file)[1])
+    if opener is None:
+        return open(cache_file, mode + 't')
+    return opener(cache_file, mode + 't')
+
+def write_cache_page(output, page):
+    """Append one page of hits to an NDJSON cache
+
+    Args:
+        output (file): Handle opened with :func:`open_cache`
+        page (dict or list): A page as returned by Elasticsearch, or the list
+            of hits to which a filter_function reduced it
+    """
+    output.write(json.dumps(page_hits(page), separators=(',', ':')))
+    output.write('\n')
+
+def iter_cache_pages(cache_file, decoder=None):
+    """Lazily read the pages of an NDJSON cache
+
+    Args:
+        cache_file (str): Path to an NDJSON cache written by
+            :meth:`EsConnection.save_cache` or via ``cache_output``
+        decoder (function, optional): Function that deserializes one line;
+            defaults to json.loads
+
+    Yields:
+        list: The hits contained in each cached page
+    """
+    if decoder is None:
+        decoder = json.loads
+    with open_cache(cache_file, 'r') as input_fp:
+        for line in input_fp:
+            if line.strip():
+                yield decoder(line)
+
+def _wrap_cached_pages(cached_pages):
+    """Convert cached hits into something resembling Elasticsearch responses
+
+    Args:
+        cached_pages (iterable): lists of hits, one per page
+
+    Yields:
+        dict: One page per element of ``cached_pages`` followed by the empty
+        page that terminates a scroll
+    """
+    for hits in cached_pages:
+        yield {
+            '_scroll_id': '0',
+            'hits': {
+                'hits': hits
+            }
+        }
+
+    # never forget to terminate fake pages with an empty page
+    yield {'_scroll_id': 0, 'hits': {'hits': []}}
 
 def build_timeseries_query(orig_query, start, end, start_key='@timestamp', end_key=None):
     """Create a query object with time ranges bounded.
@@ -483,6 +994,43 @@ def build_timeseries_query(orig_query, start, end, start_key='@timestamp', end_k
 
     return query
 
+def build_composite_query(orig_query, sources, metrics=None, page_size=1000,
+                          aggregation_name=AGGREGATION_NAME):
+    """Create a query object that returns composite aggregation buckets
+
+    Given a query dict, return a new query object that returns no documents
+    and instead groups all matching documents into buckets by each of
+    ``sources`` and applies ``metrics`` to each bucket.  The resulting query
+    can be paged through using :meth:`EsConnection.query_and_aggregate`.
+
+    Args:
+        orig_query (dict): A query object selecting the documents to aggregate
+        sources (list of dict): Each dict maps the name of a bucket key to a
+            ``terms``, ``histogram``, or ``date_histogram`` source as
+            described in the Elasticsearch composite aggregation documentation
+        metrics (dict or None): Maps the name of each metric to compute to
+            its metric aggregation (e.g., ``{'read': {'avg': {'field':
+            'read'}}}``)
+        page_size (int): Maximum number of buckets to return per page
+        aggregation_name (str): Name under which the composite aggregation
+            is issued
+
+    Returns:
+        dict: A query object containing the composite aggregation
+    """
+    query = copy.deepcopy(orig_query)
+    query['size'] = 0
+    aggregation = {
+        'composite': {
+            'size': page_size,
+            'sources': copy.deepcopy(sources),
+        }
+    }
+    if metrics:
+        aggregation['aggs'] = copy.deepcopy(metrics)
+    query['aggs'] = {aggregation_name: aggregation}
+    return query
+
 def mutate_query(mutable_query, field, value, term="term"):
     """Inserts a new condition into a query object
 
@@ -45,6 +45,13 @@ Examples:
                 total_bytes / 2**40,
                 direction))
 
+    When many interfaces are needed, ``EsnetSnmp.get_many_interface_counters``
+    retrieves them concurrently over a shared pool of connections::
+
+        esnetsnmp.get_many_interface_counters(
+            targets=[(ROUTER, INTERFACE, 'in'), (ROUTER, INTERFACE, 'out')],
+            agg_func='average')
+
     For simple queries, it is sufficient to specify the endpoint, interface,
     and direction directly in the initialization::
 
@@ -59,17 +66,396 @@ Examples:
 
 """
 
+import os
 import time
 import json
+import numbers
+import zipfile
+import tempfile
 import datetime
 import warnings
+import collections.abc
+import concurrent.futures
+import urllib.parse
 
 import requests
+import requests.adapters
+import numpy
 import pandas
 
 from .. import config
 from . import common
 
+# maximum number of concurrent REST requests issued by get_many_interface_counters
+MAX_WORKERS = 8
+# longest time range, in seconds, requested from the REST API at once
+MAX_WINDOW = 86400
+# times a request that is rate limited or fails transiently is retried
+MAX_RETRIES = 4
+# seconds to wait before the first retry; doubles with each subsequent retry
+RETRY_BACKOFF = 1.0
+# HTTP status codes that indicate a request should be retried
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+# seconds of data to keep in a SnmpCache
+CACHE_RETENTION = 30 * 86400
+# data newer than this many seconds may still change and is always re-requested
+CACHE_SETTLE_TIME = 900
+
+class SnmpSeries(collections.abc.MutableMapping):
+    """Data rates of a single direction of a single ESnet interface
+
+    Stores a time series as a pair of NumPy arrays, seconds since epoch
+    (int64) and data rate (float64), kept sorted by timestamp and free of
+    duplicate timestamps.  Behaves like the ``{timestamp: value}`` dict that
+    EsnetSnmp used to store so that existing code indexing or iterating over
+    it continues to work, while bulk operations can use the arrays directly.
+
+    Missing values (null in the REST API's output) are stored as NaN.
+    """
+    def __init__(self, data=None):
+        """Create a series, optionally populated from a dict
+
+        Args:
+            data (dict or None): Mapping of timestamps to values.  Timestamps
+                may be ints or strings that represent ints, as is the case
+                after a round trip through JSON.
+        """
+        self._epochs = numpy.empty(0, dtype='i8')
+        self._rates = numpy.empty(0, dtype='f8')
+        # single elements set through __setitem__ are buffered until read
+        self._pending = {}
+        if data:
+            self.extend(numpy.array(list(data.keys())).astype('i8'),
+                        numpy.array(list(data.values()), dtype='f8'))
+
+    @property
+    def epochs(self):
+        """numpy.ndarray: Sorted seconds since epoch of each data point"""
+        self._flush()
+        return self._epochs
+
+    @property
+    def rates(self):
+        """numpy.ndarray: Data rate corresponding to each of ``epochs``"""
+        self._flush()
+        return self._rates
+
+    def extend(self, epochs, rates):
+        """Add many data points at once
+
+        Args:
+            epochs (numpy.ndarray): Seconds since epoch of each data point
+            rates (numpy.ndarray): Data rate of each data point.  Where a
+                timestamp is already present or repeated, the last value
+                given for it is kept.
+        """
+        self._flush()
+        self._merge(numpy.asarray(epochs, dtype='i8'), numpy.asarray(rates, dtype='f8'))
+
+    def to_dict(self):
+        """Return the series as a dict of ``{timestamp: value}``
+
+        Returns:
+            dict: Python int timestamps mapped to float values
+        """
+        return dict(self.items())
+
+    def items(self):
+        """list of tuple: (timestamp, value) of each data point in time order"""
+        return list(zip(self.epochs.tolist(), self.rates.tolist()))
+
+    def keys(self):
+        """list of int: timestamp of each data point in time order"""
+        return self.epochs.tolist()
+
+    def values(self):
+        """list of float: value of each data point in time order"""
+        return self.rates.tolist()
+
+    def _merge(self, epochs, rates):
+        """Merge arrays of data points into the stored arrays"""
+        if not epochs.shape[0]:
+            return
+        if (not self._epochs.shape[0] or epochs[0] > self._epochs[-1]) \
+        and (epochs.shape[0] == 1 or (epochs[1:] > epochs[:-1]).all()):
+            # common case of appending newer data in order
+            self._epochs = numpy.concatenate((self._epochs, epochs))
+            self._rates = numpy.concatenate((self._rates, rates))
+            return
+
+        all_epochs = numpy.concatenate((self._epochs, epochs))
+        all_rates = numpy.concatenate((self._rates, rates))
+        # stable sort so that the last value for each timestamp sorts last
+        order = numpy.argsort(all_epochs, kind='mergesort')
+        all_epochs = all_epochs[order]
+        all_rates = all_rates[order]
+        keep = numpy.ones(all_epochs.shape[0], dtype=bool)
+        keep[:-1] = all_epochs[1:] != all_epochs[:-1]
+        self._epochs = all_epochs[keep]
+        self._rates = all_rates[keep]
+
+    def _flush(self):
+        """Merge buffered single elements into the stored arrays"""
+        if self._pending:
+            pending = self._pending
+            self._pending = {}
+            self._merge(numpy.fromiter(pending.keys(), dtype='i8', count=len(pending)),
+                        numpy.array(list(pending.values()), dtype='f8'))
+
+    def _index(self, key):
+        """Return the array index of a timestamp or raise KeyError"""
+        if isinstance(key, numbers.Integral):
+            self._flush()
+            index = numpy.searchsorted(self._epochs, key)
+            if index < self._epochs.shape[0] and self._epochs[index] == key:
+                return index
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        return float(self._rates[self._index(key)])
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, numbers.Integral):
+            raise TypeError("timestamps must be integers, not %s" % type(key).__name__)
+        self._pending[int(key)] = value
+
+    def __delitem__(self, key):
+        index = self._index(key)
+        self._epochs = numpy.delete(self._epochs, index)
+        self._rates = numpy.delete(self._rates, index)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return self.epochs.shape[0]
+
+    def __eq__(self, other):
+        if isinstance(other, SnmpSeries):
+            return bool(numpy.array_equal(self.epochs, other.epochs) \
+                and ((self.rates == other.rates) | (numpy.isnan(self.rates) & numpy.isnan(other.rates))).all())
+        return super(SnmpSeries, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+class SnmpCache(object):
+    """Local cache of data retrieved from the ESnet SNMP REST API
+
+    Stores the data of each (endpoint, interface, direction, agg_func,
+    interval) series in a compressed NumPy ``.npz`` file within a directory
+    along with the time ranges that have been retrieved for it.  Subsequent
+    requests for the same series then only need to retrieve the time ranges
+    that are not already cached.
+
+    Updates are staged in memory by :meth:`update` and only written to disk
+    by :meth:`commit`, so that callers can validate newly retrieved data
+    before caching it.  Data older than the retention period is discarded
+    whenever a series is written, and :meth:`prune` removes series that have
+    not been updated within it.
+    """
+    def __init__(self, cache_dir, retention=CACHE_RETENTION, settle_time=CACHE_SETTLE_TIME):
+        """Use a directory as a cache, creating it if necessary
+
+        Args:
+            cache_dir (str): Path to directory containing cached series
+            retention (int or None): Seconds of data to keep.  If None, keep
+                all data.
+            settle_time (int): Data newer than this many seconds is cached
+                but not considered complete, so it will be retrieved again
+        """
+        self.cache_dir = cache_dir
+        self.retention = retention
+        self.settle_time = settle_time
+        # series updated but not yet committed, keyed by path
+        self._staged = {}
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, key):
+        """Return the path of the file that caches a series
+
+        Args:
+            key (tuple): (endpoint, interface, direction, agg_func, interval)
+                identifying a series
+
+        Returns:
+            str: Path to the series' cache file
+        """
+        fields = ['default' if field is None else str(field) for field in key]
+        return os.path.join(self.cache_dir,
+                            '+'.join(urllib.parse.quote(field, safe='') for field in fields) + '.npz')
+
+    def load(self, key):
+        """Load a series from the cache
+
+        Args:
+            key (tuple): (endpoint, interface, direction, agg_func, interval)
+                identifying a series
+
+        Returns:
+            tuple: (epochs, rates, covered, timestep) where epochs and rates
+            are the cached data, covered is an N x 2 array of the inclusive
+            time ranges that have been retrieved, and timestep is the interval
+            reported by the REST API or None.  Staged updates that have not
+            yet been committed are included.  Series that are not cached or
+            whose cache file is unreadable are returned empty.
+        """
+        path = self.path(key)
+        if path in self._staged:
+            return self._staged[path][1:]
+        if os.path.isfile(path):
+            try:
+                with numpy.load(path) as npz:
+                    timestep = int(npz['timestep'])
+                    return (npz['epochs'],
+                            npz['rates'],
+                            npz['covered'],
+                            timestep if timestep > 0 else None)
+            except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile) as error:
+                warnings.warn("Ignoring unreadable cache file %s: %s" % (path, error))
+        return (numpy.empty(0, dtype='i8'),
+                numpy.empty(0, dtype='f8'),
+                numpy.empty((0, 2), dtype='i8'),
+                None)
+
+    def save(self, key, epochs, rates, covered, timestep=None):
+        """Write a series to the cache, applying the retention policy
+
+        Args:
+            key (tuple): (endpoint, interface, direction, agg_func, interval)
+                identifying a series
+            epochs (numpy.ndarray): Seconds since epoch of each data point
+            rates (numpy.ndarray): Data rate of each data point
+            covered (numpy.ndarray): N x 2 array of inclusive time ranges that
+                have been retrieved
+            timestep (int or None): Interval reported by the REST API
+        """
+        path = self.path(key)
+        covered = numpy.asarray(covered, dtype='i8').reshape(-1, 2)
+        if self.retention is not None:
+            cutoff = int(time.time()) - self.retention
+            keep = epochs >= cutoff
+            epochs = epochs[keep]
+            rates = rates[keep]
+            covered = covered[covered[:, 1] >= cutoff]
+            covered[:, 0] = numpy.maximum(covered[:, 0], cutoff)
+
+        if not covered.shape[0] and not epochs.shape[0]:
+            if os.path.isfile(path):
+                os.unlink(path)
+            return
+
+        # write to a temporary file first so readers never see a partial file
+        output = tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix='.npz.tmp', delete=False)
+        try:
+            numpy.savez_compressed(output,
+                                   epochs=numpy.asarray(epochs, dtype='i8'),
+                                   rates=numpy.asarray(rates, dtype='f8'),
+                                   covered=covered,
+                                   timestep=numpy.int64(timestep or 0))
+            output.close()
+            os.replace(output.name, path)
+        finally:
+            output.close()
+            if os.path.exists(output.name):
+                os.unlink(output.name)
+
+    def missing(self, key, begin, end):
+        """Find the parts of a time range that are not cached
+
+        Args:
+            key (tuple): (endpoint, interface, direction, agg_func, interval)
+                identifying a series
+            begin (int): First second of the range
+            end (int): Last second of the range, inclusive
+
+        Returns:
+            list of tuple: (begin, end) of each uncached range, both inclusive
+        """
+        return missing_ranges(self.load(key)[2], begin, end)
+
+    def update(self, key, responses, windows, begin, end):
+        """Stage newly retrieved data for a series and return all of its data
+
+        A window is only considered cached if its response contained data,
+        since the REST API may return no data when it is rate limiting.  The
+        update is not written to disk until :meth:`commit` is called.
+
+        Args:
+            key (tuple): (endpoint, interface, direction, agg_func, interval)
+                identifying a series
+            responses (list of dict): raw JSON output of the ESnet REST API
+                for consecutive windows of time, in order
+            windows (list of tuple): (begin, end) of the time range requested
+                for each of ``responses``
+            begin (int): First second of the range to return
+            end (int): Last second of the range to return, inclusive
+
+        Returns:
+            dict: The responses merged as by merge_responses() but containing
+            all of the data between ``begin`` and ``end``, including that which
+            was already cached
+        """
+        epochs, rates, covered, timestep = self.load(key)
+        series = SnmpSeries()
+        series.extend(epochs, rates)
+
+        result = {}
+        if responses:
+            result = merge_responses(responses)
+            if result.get('data'):
+                data = numpy.array(result['data'], dtype='f8')
+                series.extend(data[:, 0].astype('i8'), data[:, 1])
+            timestep = _get_interval_result(result) or timestep
+
+        # recent data may be incomplete, so don't consider it covered
+        settled = int(time.time()) - self.settle_time
+        new_ranges = [(window_begin, min(window_end, settled))
+                      for (window_begin, window_end), response in zip(windows, responses)
+                      if window_begin <= settled and response.get('data')]
+        covered = merge_ranges(covered.tolist() + new_ranges)
+        self._staged[self.path(key)] = (key, series.epochs, series.rates, covered, timestep)
+
+        keep = (series.epochs >= begin) & (series.epochs <= end)
+        result['data'] = [list(point) for point in zip(series.epochs[keep].tolist(),
+                                                        series.rates[keep].tolist())]
+        result['begin_time'] = min(result.get('begin_time', begin), begin)
+        result['end_time'] = max(result.get('end_time', end), end)
+        if timestep and _get_interval_result(result) is None:
+            result['agg'] = str(timestep)
+        return result
+
+    def commit(self):
+        """Write all staged updates to disk"""
+        for key, epochs, rates, covered, timestep in list(self._staged.values()):
+            self.save(key, epochs, rates, covered, timestep)
+        self._staged = {}
+
+    def discard(self):
+        """Forget all staged updates without writing them"""
+        self._staged = {}
+
+    def prune(self):
+        """Remove cached series that have not been updated within the retention period
+
+        Returns:
+            int: Number of cache files removed
+        """
+        if self.retention is None:
+            return 0
+        cutoff = int(time.time()) - self.retention
+        removed = 0
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            if filename.endswith('.npz') and os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+                removed += 1
+        return removed
+
 class EsnetSnmp(common.CacheableDict):
     """Container for ESnet SNMP counters
 
@@ -84,13 +470,17 @@ class EsnetSnmp(common.CacheableDict):
                         timestamp3: value3,
                         ...
                     },
-                    "out": { ... }
+                    "out": { ... },
+                    "units": "bytes/sec"
                 },
                 "interface_y": { ... }
             },
             "endpoint1": { ... }
         }
 
+    where each direction is a :class:`SnmpSeries`, which stores its
+    timestamps and values as NumPy arrays but can be used as a dict.
+
     Various methods are provided to access the data of interest.
     """
     def __init__(self,
@@ -130,6 +520,8 @@ class EsnetSnmp(common.CacheableDict):
             end (datetime.datetime): End of interval represented by this object, inclusive
             start_epoch (int): Seconds since epoch for self.start
             end_epoch (int): Seconds since epoch for self.end
+            session (requests.Session): Connection pool shared by all REST
+                API requests issued by this object; created on first use
         """
 
         super(EsnetSnmp, self).__init__(**kwargs)
@@ -152,6 +544,10 @@ class EsnetSnmp(common.CacheableDict):
         self.last_response = None
         self.timestep = None
 
+        # keep-alive connections shared by all requests made by this object
+        self.session = None
+        self._session_connections = 0
+
         if endpoint and interface and direction:
             self.get_interface_counters(endpoint=endpoint,
                                         interface=interface,
@@ -162,21 +558,29 @@ class EsnetSnmp(common.CacheableDict):
     def load_json(self, *args, **kwargs):
         """Loads input from serialized JSON
 
-        Need to coerce timestamp keys back into ints from strings
+        Converts each direction's ``{timestamp: value}`` dict, whose
+        timestamps JSON has turned into strings, into a SnmpSeries.
         """
         super(EsnetSnmp, self).load_json(*args, **kwargs)
 
-        for endpoint, interfaces in self.items():
-            for interface, directions in interfaces.items():
+        for interfaces in self.values():
+            for directions in interfaces.values():
                 for direction, data in directions.items():
                     if isinstance(data, dict):
-                        keys = list(data.keys())
-                        # make a copy of the key as an int
-                        for key in keys:
-                            data[int(key)] = data[key]
-                        # delete the old non-int key
-                        for key in keys:
-                            del data[key]
+                        directions[direction] = SnmpSeries(data)
+
+    def _save_cache(self, output, **kwargs):
+        """Generates serialized representation of self
+
+        Each SnmpSeries is serialized as a ``{timestamp: value}`` dict so that
+        the cache format is unchanged.
+
+        Args:
+            output: Object with a ``.write()`` method into which the serialized
+                form of self will be passed
+            kwargs (dict): Additional arguments to be passed to json.dumps()
+        """
+        output.write(json.dumps(self, default=_serialize_series, **kwargs))
 
     def _insert_result(self):
         """Parse the raw output of the REST API and update self
@@ -227,14 +631,15 @@ class EsnetSnmp(common.CacheableDict):
         if self.requested_interface not in self[self.requested_endpoint]:
             self[self.requested_endpoint][self.requested_interface] = {}
         if self.requested_direction not in self[self.requested_endpoint][self.requested_interface]:
-            self[self.requested_endpoint][self.requested_interface][self.requested_direction] = {}
+            self[self.requested_endpoint][self.requested_interface][self.requested_direction] = SnmpSeries()
 
         data = result.get('data')
         if not data:
             warnings.warn("No data in result")
-
-        for timestamp, value in data:
-            self[self.requested_endpoint][self.requested_interface][self.requested_direction][timestamp] = value
+        else:
+            data = numpy.array(data, dtype='f8')
+            self[self.requested_endpoint][self.requested_interface][self.requested_direction].extend(
+                data[:, 0].astype('i8'), data[:, 1])
 
         self[self.requested_endpoint][self.requested_interface]['units'] = 'bytes/sec'
 
@@ -316,44 +721,173 @@ class EsnetSnmp(common.CacheableDict):
         Returns:
            dict: raw return from the REST API call
         """
-        request_args = self.gen_url(endpoint, interface, direction, agg_func=None, interval=None, **kwargs)
+        request_args = self.gen_url(endpoint, interface, direction, agg_func=agg_func, interval=interval, **kwargs)
         request_args.update(kwargs)
 
-        self.last_response = _get_url(**request_args)
+        self.last_response = _get_url(session=self.get_session(), **request_args)
 
         self._insert_result()
 
         return self.last_response
 
+    def get_session(self, max_workers=MAX_WORKERS):
+        """Return a requests.Session whose connections are kept alive
+
+        Args:
+            max_workers (int): Number of connections to keep open to the REST
+                API so that concurrent requests need not reconnect
+
+        Returns:
+            requests.Session: Session shared by this object's requests
+        """
+        if self.session is None:
+            self.session = requests.Session()
+            self._session_connections = 0
+        if self._session_connections < max_workers:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self._session_connections = max_workers
+        return self.session
+
+    def get_many_interface_counters(self, targets, agg_func=None, interval=None,
+                                    max_workers=MAX_WORKERS, window=MAX_WINDOW,
+                                    max_retries=MAX_RETRIES, cache=None, **kwargs):
+        """Retrieves data rate data for many ESnet endpoints concurrently
+
+        Divides the time range of this object into windows of at most
+        ``window`` seconds, retrieves every window of every target over a pool
+        of keep-alive connections, and then stitches each target's windows
+        back together in time order.  Requests that are rate limited are
+        retried with exponential backoff.
+
+        If a cache is given, only the parts of the time range that it does not
+        already contain are retrieved, and the newly retrieved data is staged
+        in it.  Call ``cache.commit()`` once the results have been validated
+        to write them to disk.
+
+        Args:
+            targets (list of tuple): (endpoint, interface, direction) to
+                retrieve.  Results are inserted into self and returned in this
+                order.
+            agg_func (str or None): Specifies the reduction operator to be
+                applied over each interval; must be one of "average," "min," or
+                "max."  If None, uses the ESnet default.
+            interval (int or None): Resolution, in seconds, of the data to be
+                returned.  If None, uses the ESnet default.
+            max_workers (int): Maximum number of requests in flight at once
+            window (int or None): Longest time range, in seconds, to request at
+                once.  If None, request the entire range at once.
+            max_retries (int): Times to retry each rate-limited request
+            cache (SnmpCache or None): Cache of previously retrieved data
+            kwargs (dict): Extra parameters to pass to requests.get()
+
+        Returns:
+           list of dict: raw return from the REST API for each target, with the
+           data of all windows concatenated.  Data taken from the cache is
+           included as if it had been returned by the REST API.
+        """
+        # build every request up front since gen_url updates self
+        requests_args = []
+        windows = []
+        for endpoint, interface, direction in targets:
+            request_args = self.gen_url(endpoint, interface, direction, agg_func=agg_func, interval=interval)
+            request_args.update(kwargs)
+            if cache is None:
+                ranges = [(self.start_epoch, self.end_epoch)]
+            else:
+                ranges = cache.missing((endpoint, interface, direction, agg_func, interval),
+                                       self.start_epoch, self.end_epoch)
+            target_windows = []
+            target_requests = []
+            for range_begin, range_end in ranges:
+                for begin, end in split_window(range_begin, range_end, window):
+                    window_args = dict(request_args)
+                    window_args['params'] = dict(request_args['params'], begin=begin, end=end)
+                    target_requests.append(window_args)
+                    target_windows.append((begin, end))
+            requests_args.append(target_requests)
+            windows.append(target_windows)
+
+        session = self.get_session(max_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [[executor.submit(_get_url, session=session, max_retries=max_retries, **window_args)
+                        for window_args in target_requests]
+                       for target_requests in requests_args]
+            responses = [[future.result() for future in target_futures] for target_futures in futures]
+
+        results = []
+        for (endpoint, interface, direction), target_responses, target_windows in zip(targets, responses, windows):
+            self.requested_endpoint = endpoint
+            self.requested_interface = interface
+            self.requested_direction = direction
+            if cache is None:
+                self.last_response = merge_responses(target_responses)
+            else:
+                self.last_response = cache.update((endpoint, interface, direction, agg_func, interval),
+                                                  target_responses,
+                                                  target_windows,
+                                                  self.start_epoch,
+                                                  self.end_epoch)
+            self._insert_result()
+            results.append(self.last_response)
+
+        return results
+
     def to_dataframe(self, multiindex=False):
         """Return data as a Pandas DataFrame
 
         Args:
             multiindex (bool): If True, return a DataFrame indexed by timestamp,
                 endpoint, interface, and direction
-        """
-
-        to_df = []
 
+        Returns:
+            pandas.DataFrame: One row per data point with columns endpoint,
+            interface, direction, timestamp (in local time), and data_rate.
+            The endpoint, interface, and direction columns are categorical.
+        """
+        labels = {'endpoint': [], 'interface': [], 'direction': []}
+        lengths = []
+        epochs = []
+        rates = []
         for endpoint, interfaces in self.items():
             for interface, directions in interfaces.items():
                 for direction, data in directions.items():
-                    if isinstance(data, dict):
-                        for timestamp, value in data.items():
-                            to_df.append({
-                                'endpoint': endpoint,
-                                'interface': interface,
-                                'direction': direction,
-                                'timestamp': datetime.datetime.fromtimestamp(timestamp),
-                                'data_rate': value,
-                            })
-
-        dataframe = pandas.DataFrame.from_records(to_df)
+                    if isinstance(data, SnmpSeries):
+                        labels['endpoint'].append(endpoint)
+                        labels['interface'].append(interface)
+                        labels['direction'].append(direction)
+                        lengths.append(len(data))
+                        epochs.append(data.epochs)
+                        rates.append(data.rates)
+
+        columns = {}
+        for column, values in labels.items():
+            categories, codes = numpy.unique(numpy.array(values, dtype=object), return_inverse=True) \
+                if values else ([], numpy.empty(0, dtype='i8'))
+            columns[column] = pandas.Categorical.from_codes(numpy.repeat(codes, lengths),
+                                                            categories=categories)
+
+        # series usually share timestamps, so only convert each one once
+        epochs = numpy.concatenate(epochs) if epochs else numpy.empty(0, dtype='i8')
+        unique_epochs, inverse = numpy.unique(epochs, return_inverse=True)
+        timestamps = numpy.array([datetime.datetime.fromtimestamp(epoch) for epoch in unique_epochs.tolist()],
+                                 dtype='datetime64[ns]')
+        columns['timestamp'] = timestamps[inverse]
+        columns['data_rate'] = numpy.concatenate(rates) if rates else numpy.empty(0, dtype='f8')
+
+        dataframe = pandas.DataFrame(columns, columns=['endpoint', 'interface', 'direction', 'timestamp', 'data_rate'])
         if multiindex:
             return dataframe.set_index(['timestamp', 'endpoint', 'interface', 'direction'])
 
         return dataframe
 
+def _serialize_series(obj):
+    """Convert SnmpSeries into dicts for json.dumps()"""
+    if isinstance(obj, SnmpSeries):
+        return obj.to_dict()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
 def _get_interval_result(result):
     """Parse the raw output of the REST API output and return the timestep
 
@@ -373,18 +907,130 @@ def _get_interval_result(result):
 
     return None
 
-def _get_url(url, params, **kwargs):
+def split_window(start, end, window=None):
+    """Divide an inclusive range of epoch seconds into consecutive windows
+
+    Args:
+        start (int): First second of the range
+        end (int): Last second of the range, inclusive
+        window (int or None): Maximum length of each window in seconds.  If
+            None, return the whole range as a single window.
+
+    Returns:
+        list of tuple: (begin, end) of each window, both inclusive
+    """
+    if not window:
+        return [(start, end)]
+    windows = []
+    begin = start
+    while begin <= end:
+        windows.append((begin, min(begin + window - 1, end)))
+        begin += window
+    return windows
+
+def merge_responses(responses):
+    """Concatenate the REST API responses for consecutive windows of time
+
+    Args:
+        responses (list of dict): raw JSON output of the ESnet REST API for
+            consecutive windows of time, in order
+
+    Returns:
+        dict: The first response with the data of all responses appended in
+        time order and its end_time extended to that of the last response.
+        Data points repeated at the boundary of two windows are only included
+        once.
+    """
+    merged = dict(responses[0])
+    data = list(merged.get('data') or [])
+    for response in responses[1:]:
+        for point in response.get('data') or []:
+            if not data or point[0] > data[-1][0]:
+                data.append(point)
+        if 'end_time' in response:
+            merged['end_time'] = response['end_time']
+    merged['data'] = data
+    return merged
+
+def merge_ranges(ranges):
+    """Combine overlapping and adjacent inclusive ranges
+
+    Args:
+        ranges (list of tuple): (begin, end) of each range, both inclusive
+
+    Returns:
+        numpy.ndarray: N x 2 array of (begin, end) of each combined range, in
+        order
+    """
+    merged = []
+    for begin, end in sorted(tuple(bounds) for bounds in ranges):
+        if merged and begin <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([begin, end])
+    return numpy.array(merged, dtype='i8').reshape(-1, 2)
+
+def missing_ranges(covered, begin, end):
+    """Find the parts of an inclusive range not covered by other ranges
+
+    Args:
+        covered (list of tuple): (begin, end) of each covered range, both
+            inclusive
+        begin (int): First second of the range
+        end (int): Last second of the range, inclusive
+
+    Returns:
+        list of tuple: (begin, end) of each uncovered part, both inclusive
+    """
+    missing = []
+    for covered_begin, covered_end in merge_ranges(covered).tolist():
+        if covered_end < begin:
+            continue
+        if covered_begin > end:
+            break
+        if covered_begin > begin:
+            missing.append((begin, covered_begin - 1))
+        begin = covered_end + 1
+    if begin <= end:
+        missing.append((begin, end))
+    return missing
+
+def _get_url(url, params, session=None, max_retries=0, **kwargs):
     """Wraps the requests.get() call and returns the results as a decoded
     JSON object.
 
     Args:
         url (str): URL to request
         params (dict): Same as requests.get(params)
+        session (requests.Session or None): Session through which the
+            request should be issued.  If None, use a new connection.
+        max_retries (int): Times to retry requests that are rate limited,
+            fail with one of RETRY_STATUS_CODES, or time out while
+            connecting, waiting RETRY_BACKOFF seconds before the first retry
+            and twice as long before each subsequent one.  Other connection
+            errors, such as failures to resolve the host name, are raised
+            immediately.
         kwargs: Passed directly to requests.get()
 
     Returns:
         dict: Result of the remote query
     """
-    request = requests.get(url, params=params, **kwargs)
+    get = requests.get if session is None else session.get
+    for attempt in range(max_retries + 1):
+        delay = RETRY_BACKOFF * 2**attempt
+        try:
+            request = get(url, params=params, **kwargs)
+        except requests.exceptions.ConnectTimeout:
+            if attempt >= max_retries:
+                raise
+        else:
+            if request.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+                break
+            # honor the server's request to slow down if it made one
+            retry_after = request.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = int(retry_after)
+        time.sleep(delay)
+
     request.raise_for_status()
     return request.json()
@@ -11,13 +11,14 @@ around file names that contain spaces.
 """
 
 import re
-import time
-import datetime
-from tokio.common import to_epoch
+from tokio.common import strptime_epoch
 from tokio.connectors.common import SubprocessOutputList
 
 PEELER_REX = re.compile("^([A-Z]+)=(.*?)\s+([A-Z]+=.*)$")
 
+# Format of the DATE and START timestamps
+GLOBUS_DATE_FMT = "%Y%m%d%H%M%S.%f"
+
 class GlobusLog(SubprocessOutputList):
     """Interface into a Globus transfer log
 
@@ -124,8 +125,8 @@ def _listify_ips(ip_str):
     return [ip_str]
 
 RECAST_KEYS = {
-    "DATE": lambda x: to_epoch(datetime.datetime.strptime(x, "%Y%m%d%H%M%S.%f"), float),
-    "START": lambda x: to_epoch(datetime.datetime.strptime(x, "%Y%m%d%H%M%S.%f"), float),
+    "DATE": lambda x: strptime_epoch(x, GLOBUS_DATE_FMT, float),
+    "START": lambda x: strptime_epoch(x, GLOBUS_DATE_FMT, float),
     "BUFFER": int,
     "BLOCK": int,
     "NBYTES": int,
@@ -596,6 +596,16 @@ class Hdf5(h5py.File):
         _timesteps (dict): Keyed by dataset name (str) and has values
             corresponding to the timestep (in seconds) between each sampled
             datum in that dataset.
+        _literal_keys (dict): Keyed by dataset name (str) and has values
+            indicating whether or not that name exists as a literal object in
+            the underlying HDF5 file.  Invalidated whenever the file is
+            modified through this object.
+        _resolved_keys (dict): Keyed by logical dataset name (str) and has
+            values of the (literal key, provider) tuples returned by
+            _resolve_schema_key().  Invalidated along with _literal_keys.
+        _versions (dict): Keyed by dataset name (str) and has values
+            corresponding to the decoded version returned by get_version().
+            Invalidated along with _literal_keys.
     """
     def __init__(self, *args, **kwargs):
         """Initialize an HDF5 file
@@ -604,12 +614,23 @@ class Hdf5(h5py.File):
         and indexing that are provided by the TOKIO Time Series-specific HDF5
         object.
 
+        To allow other processes to read this file while it is being written
+        in single-writer/multiple-reader (SWMR) mode, open it for writing with
+        ``libver='latest'`` and commit via :meth:`commit_timeseries_swmr`.
+        Readers should open it with ``swmr=True`` and call :meth:`refresh`
+        before re-reading datasets.
+
         Args:
             ignore_version (bool): If true, do not throw KeyError if the HDF5
                 file does not contain a valid version.
         """
         ignore_version = kwargs.pop('ignore_version', False)
 
+        # h5py.File.__init__ may dereference keys, so caches must exist first
+        self._literal_keys = {}
+        self._resolved_keys = {}
+        self._versions = {}
+
         super(Hdf5, self).__init__(*args, **kwargs)
 
         # If True, always translate __getitem__ requests according to the
@@ -663,7 +684,7 @@ class Hdf5(h5py.File):
               * numpy.ndarray if key maps to a provider function that can
                 calculate the requested data
         """
-        if not self.always_translate and super(Hdf5, self).__contains__(key):
+        if not self.always_translate and self._contains_literal(key):
             # If the dataset exists in the underlying HDF5 file, just return it
             return super(Hdf5, self).__getitem__(key)
 
@@ -692,13 +713,108 @@ class Hdf5(h5py.File):
             errmsg = "_resolve_schema_key: undefined output from %s" % key
             raise KeyError(errmsg)
 
+    def __setitem__(self, key, value):
+        """Create a new object in the file and invalidate cached key lookups
+        """
+        self._invalidate_key_cache()
+        return super(Hdf5, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        """Delete an object from the file and invalidate cached key lookups
+        """
+        self._invalidate_key_cache()
+        return super(Hdf5, self).__delitem__(key)
+
+    def create_dataset(self, *args, **kwargs):
+        """Create a new dataset and invalidate cached key lookups
+        """
+        self._invalidate_key_cache()
+        return super(Hdf5, self).create_dataset(*args, **kwargs)
+
+    def create_group(self, *args, **kwargs):
+        """Create a new group and invalidate cached key lookups
+        """
+        self._invalidate_key_cache()
+        return super(Hdf5, self).create_group(*args, **kwargs)
+
+    def move(self, *args, **kwargs):
+        """Move an object and invalidate cached key lookups
+        """
+        self._invalidate_key_cache()
+        return super(Hdf5, self).move(*args, **kwargs)
+
+    def refresh(self, dataset_name=None):
+        """Pick up changes made by a SWMR writer
+
+        Refreshes the metadata of a dataset (and its timestamps) or of every
+        dataset in the file so that data appended or overwritten by another
+        process since this file was opened becomes visible.
+
+        Args:
+            dataset_name (str or None): Name of dataset to refresh.  If None,
+                refresh all datasets in the file.
+        """
+        self._invalidate_key_cache()
+        if dataset_name is None:
+            self.visititems(lambda _, obj: obj.refresh() if isinstance(obj, h5py.Dataset) else None)
+            return
+
+        for key in (dataset_name, get_timestamps_key(self, dataset_name)):
+            dataset = self.__getitem__(key)
+            if isinstance(dataset, h5py.Dataset):
+                dataset.refresh()
+
+    def _invalidate_key_cache(self):
+        """Forget all cached dataset name resolutions and versions
+
+        Must be called whenever objects are created, removed, or renamed in the
+        underlying HDF5 file since any of those may change the result of
+        resolving a logical dataset name.
+        """
+        self._literal_keys = {}
+        self._resolved_keys = {}
+        self._versions = {}
+
+    def _contains_literal(self, key):
+        """Determine if key exists as a literal object in the underlying file
+
+        Memoizes h5py.File.__contains__ since each call walks the HDF5 B-tree.
+
+        Args:
+            key: Name of the object to look up
+
+        Returns:
+            bool: True if key exists in the underlying HDF5 file
+        """
+        if not tokio.common.isstr(key):
+            return super(Hdf5, self).__contains__(key)
+
+        result = self._literal_keys.get(key)
+        if result is None:
+            result = super(Hdf5, self).__contains__(key)
+            self._literal_keys[key] = result
+        return result
+
     def _resolve_schema_key(self, key):
         """
         Given a key, either return a key that can be used to index self
         directly, or return a provider function and arguments to generate the
-        dataset dynamically
+        dataset dynamically.  Successful resolutions are cached until the file
+        is modified.
+        """
+        cacheable = tokio.common.isstr(key)
+        if cacheable and key in self._resolved_keys:
+            return self._resolved_keys[key]
+
+        result = self._resolve_schema_key_uncached(key)
+        if cacheable:
+            self._resolved_keys[key] = result
+        return result
+
+    def _resolve_schema_key_uncached(self, key):
+        """Resolve a key without consulting or updating the resolution cache
         """
-        if super(Hdf5, self).__contains__(key):
+        if self._contains_literal(key):
             # If the dataset exists in the underlying HDF5 file, just return it
             return key, None
 
@@ -706,7 +822,7 @@ class Hdf5(h5py.File):
         key = key.lstrip('/') if tokio.common.isstr(key) else key
         if key in self.schema:
             hdf5_key = self.schema.get(key)
-            if super(Hdf5, self).__contains__(hdf5_key):
+            if self._contains_literal(hdf5_key):
                 return hdf5_key, None
 
         # Key maps to a transformation
@@ -727,6 +843,8 @@ class Hdf5(h5py.File):
         """
         if dataset_name is None:
             return self._version
+        elif dataset_name in self._versions:
+            return self._versions[dataset_name]
         else:
             # resolve dataset name
             dataset = self.__getitem__(dataset_name)
@@ -738,7 +856,8 @@ class Hdf5(h5py.File):
             if version is None:
                 version = self._version
             if isinstance(version, bytes):
-                return version.decode() # for python3
+                version = version.decode() # for python3
+            self._versions[dataset_name] = version
             return version
 
     def set_version(self, version, dataset_name=None):
@@ -752,6 +871,10 @@ class Hdf5(h5py.File):
             dataset_name (str): Name of dataset to set version.  If None,
                 set the global file's version.
         """
+        # dataset versions fall back to the global version, so any change may
+        # affect any cached version
+        self._versions = {}
+
         if dataset_name is None:
             self._version = version
             return self._version
@@ -852,6 +975,38 @@ class Hdf5(h5py.File):
             return self._get_missing_h5lmt(dataset_name, inverse=inverse)
         return missing_values(self[dataset_name][:], inverse)
 
+    def get_last_valid_index(self, dataset_name):
+        """Find the last row of a dataset that contains any data
+
+        Scans backwards from the end of the dataset one chunk at a time so
+        that only the tail of a mostly populated dataset is read.
+
+        Args:
+            dataset_name (str): name of dataset to access
+
+        Returns:
+            int: index of the last row with at least one element that is not
+            missing, or -1 if the dataset contains no data
+        """
+        if self.get_version(dataset_name=dataset_name) is None:
+            present = self.get_missing(dataset_name, inverse=True).any(axis=1).nonzero()[0]
+            return int(present[-1]) if len(present) else -1
+
+        dataset = self[dataset_name]
+        step = dataset.chunks[0] if dataset.chunks else 1024
+        end = dataset.shape[0]
+        while end > 0:
+            start = max(0, end - step)
+            block = dataset[start:end]
+            present = ~((block == 0.0) & numpy.signbit(block))
+            if len(present.shape) > 1:
+                present = present.any(axis=1)
+            present = present.nonzero()[0]
+            if len(present):
+                return start + int(present[-1])
+            end = start
+        return -1
+
     def _get_missing_h5lmt(self, dataset_name, inverse=False):
         """Return the FSMissingGroup dataset from an H5LMT file
 
@@ -1067,12 +1222,15 @@ class Hdf5(h5py.File):
             'dtype': 'f8',
             'chunks': True,
             'compression': 'gzip',
+            'maxshape': (None,) + tuple(timeseries.dataset.shape[1:]),
         }
         extra_dataset_args.update(kwargs)
 
         # Create the dataset in the HDF5 file (if necessary)
         if timeseries.dataset_name in self:
             dataset_hdf5 = self[timeseries.dataset_name]
+        elif self.swmr_mode:
+            raise KeyError("cannot create dataset %s in SWMR mode" % timeseries.dataset_name)
         else:
             dataset_hdf5 = self.create_dataset(name=timeseries.dataset_name,
                                                shape=timeseries.dataset.shape,
@@ -1134,15 +1292,18 @@ class Hdf5(h5py.File):
 
         # Copy column names into metadata before committing metadata
         timeseries.dataset_metadata[COLUMN_NAME_KEY] = timeseries.columns
-        timeseries.dataset_metadata['updated'] = int(time.mktime(datetime.datetime.now().timetuple()))
+        if not self.swmr_mode:
+            # SWMR readers should only ever see metadata change when it must
+            timeseries.dataset_metadata['updated'] = int(time.mktime(datetime.datetime.now().timetuple()))
 
         # If timeseries.version was never set, don't set a dataset-level version in the HDF5
-        if timeseries.version is not None:
+        if timeseries.version is not None \
+        and not (self.swmr_mode and self.get_version(timeseries.dataset_name) == timeseries.version):
             self.set_version(timeseries.version, dataset_name=timeseries.dataset_name)
 
         # Set the file's global version to indicate its schema
         if timeseries.global_version is not None:
-            self['/'].attrs['version'] = timeseries.global_version
+            self._set_attr(self['/'], 'version', timeseries.global_version)
 
         # Insert/update dataset metadata
         for key, value in timeseries.dataset_metadata.items():
@@ -1153,20 +1314,104 @@ class Hdf5(h5py.File):
                 # Python3 happily converts each element to a numpy.string_,
                 # while Python2 first calls a.__repr__ to turn it into a single
                 # string, then converts that to numpy.string_.
-                dataset_hdf5.attrs[key] = numpy.array([numpy.string_(x) for x in value])
+                self._set_attr(dataset_hdf5, key, numpy.array([numpy.string_(x) for x in value]))
             elif tokio.common.isstr(value):
-                dataset_hdf5.attrs[key] = numpy.string_(value)
+                self._set_attr(dataset_hdf5, key, numpy.string_(value))
             elif value is None:
                 warnings.warn("Skipping attribute %s (null value) for %s" % (key, timeseries.dataset_name))
             else:
-                dataset_hdf5.attrs[key] = value
+                self._set_attr(dataset_hdf5, key, value)
 
         # Insert/update group metadata
         for key, value in timeseries.group_metadata.items():
             if tokio.common.isstr(value):
-                dataset_hdf5.parent.attrs[key] = numpy.string_(value)
+                self._set_attr(dataset_hdf5.parent, key, numpy.string_(value))
             else:
-                dataset_hdf5.parent.attrs[key] = value
+                self._set_attr(dataset_hdf5.parent, key, value)
+
+        # Make the committed data visible to SWMR readers
+        self.flush()
+
+    def _set_attr(self, obj, key, value):
+        """Set an attribute, skipping no-op rewrites while in SWMR mode
+
+        Args:
+            obj (h5py.Group or h5py.Dataset): object whose attribute to set
+            key (str): name of attribute
+            value: new value of attribute
+        """
+        if self.swmr_mode and attr_equals(obj, key, value):
+            return
+        obj.attrs[key] = value
+
+    def _metadata_is_current(self, timeseries):
+        """Determine if committing a TimeSeries would leave metadata untouched
+
+        Attributes cannot be created while a file is in SWMR mode, so only
+        TimeSeries whose dataset and metadata already exist in the file may be
+        committed after SWMR mode has been enabled.
+
+        Args:
+            timeseries (tokio.timeseries.TimeSeries): the time series to check
+
+        Returns:
+            bool: True if the dataset exists and all metadata that would be
+            written by commit_timeseries() is already present and identical
+        """
+        if timeseries.dataset_name not in self:
+            return False
+        dataset_hdf5 = self[timeseries.dataset_name]
+
+        dataset_metadata = dict(timeseries.dataset_metadata)
+        dataset_metadata.pop('updated', None)
+        dataset_metadata[COLUMN_NAME_KEY] = timeseries.columns
+        if timeseries.version is not None:
+            dataset_metadata['version'] = timeseries.version
+        global_metadata = {}
+        if timeseries.global_version is not None:
+            global_metadata['version'] = timeseries.global_version
+
+        for obj, metadata in ((dataset_hdf5, dataset_metadata),
+                              (dataset_hdf5.parent, timeseries.group_metadata),
+                              (self['/'], global_metadata)):
+            for key, value in metadata.items():
+                if value is not None and not attr_equals(obj, key, value):
+                    return False
+        return True
+
+    def commit_timeseries_swmr(self, timeseries_list, **kwargs):
+        """Commit several TimeSeries objects and switch the file into SWMR mode
+
+        Neither datasets nor attributes can be created once a file is in
+        single-writer/multiple-reader mode, so TimeSeries that would create
+        either are committed first.  The file is then switched into SWMR mode
+        and the remaining datasets are committed, flushing after each, so that
+        concurrent readers never see partially written datasets.
+
+        The file must have been opened with ``libver='latest'``.  Files
+        created without it cannot enter SWMR mode; these are committed
+        normally after issuing a warning.
+
+        Args:
+            timeseries_list (list of tokio.timeseries.TimeSeries): the time
+                series to save as datasets within self
+            kwargs (dict): Extra arguments to pass to self.commit_timeseries()
+        """
+        deferred = []
+        for timeseries in timeseries_list:
+            if self.swmr_mode or self._metadata_is_current(timeseries):
+                deferred.append(timeseries)
+            else:
+                self.commit_timeseries(timeseries, **kwargs)
+
+        if not self.swmr_mode:
+            try:
+                self.swmr_mode = True
+            except (OSError, ValueError) as error:
+                warnings.warn("Cannot enable SWMR mode on %s: %s" % (self.filename, error))
+
+        for timeseries in deferred:
+            self.commit_timeseries(timeseries, **kwargs)
 
 def missing_values(dataset, inverse=False):
     """Identify matrix values that are missing
@@ -1195,6 +1440,29 @@ def missing_values(dataset, inverse=False):
     return converter(dataset)
 
 
+def attr_equals(obj, key, value):
+    """Determine if an HDF5 attribute exists and has a given value
+
+    Strings are compared after decoding so that values stored as bytes or as
+    str compare equal to either.
+
+    Args:
+        obj (h5py.Group or h5py.Dataset): object whose attribute to check
+        key (str): name of attribute
+        value: expected value of attribute
+
+    Returns:
+        bool: True if the attribute exists and equals value
+    """
+    if key not in obj.attrs:
+        return False
+    existing = numpy.asarray(obj.attrs[key])
+    value = numpy.asarray(value)
+    if existing.dtype.kind in 'SUO' or value.dtype.kind in 'SUO':
+        existing = numpy.char.decode(existing) if existing.dtype.kind == 'S' else existing.astype('U')
+        value = numpy.char.decode(value) if value.dtype.kind == 'S' else value.astype('U')
+    return existing.shape == value.shape and bool(numpy.all(existing == value))
+
 def get_insert_indices(my_timestamps, existing_timestamps):
     """
     Given new timestamps and an existing series of timestamps, find the indices
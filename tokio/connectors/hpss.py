@@ -3,15 +3,17 @@
 
 import re
 import copy
-import time
 import datetime
-from tokio.common import to_epoch
+from tokio.common import strptime_epoch
 from tokio.connectors.common import SubprocessOutputDict
 
 REX_HEADING_LINE = re.compile(r"^[= ]+$")
 REX_EMPTY_LINE = re.compile(r"^\s*$")
 REX_TIMEDELTA = re.compile(r"^(\d+)-(\d+):(\d+):(\d+)$")
 
+# Format of timestamps at the start of each FTP log record
+FTP_DATE_FMT = "%a %b %d %H:%M:%S %Y"
+
 FLOAT_KEYS = set([
     'io_gb',
     'write_gb',
@@ -130,7 +132,7 @@ class FtpLog(SubprocessOutputDict):
         for line in input_str.splitlines():
             args = line.split()
             rec = {
-                'end_timestamp': time.mktime(datetime.datetime.strptime(" ".join(args[0:5]), "%a %b %d %H:%M:%S %Y").timetuple()),
+                'end_timestamp': strptime_epoch(" ".join(args[0:5]), FTP_DATE_FMT, float),
             }
             # HPSS 7.4 POPN command can be skipped
             if args[11] == "ftp" and args[8] == "POPN_Cmd":
@@ -318,7 +320,7 @@ class HsiLog(SubprocessOutputDict):
 
             rec['hpss_uid'] = int(args[7])
             rec['remote_host'] = args[5]
-            rec['end_timestamp'] = to_epoch(datetime.datetime.strptime(" ".join(args[0:5]), "%a %b %d %H:%M:%S %Y"), float)
+            rec['end_timestamp'] = strptime_epoch(" ".join(args[0:5]), FTP_DATE_FMT, float)
 
             if app not in self:
                 self[app] = []
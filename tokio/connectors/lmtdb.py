@@ -6,6 +6,10 @@ CachingDb class.
 
 import os
 import datetime
+import operator
+import threading
+import numpy
+import tokio.common
 from . import cachingdb
 
 ### Names and schemata of all LMT database tables worth caching
@@ -138,9 +142,13 @@ class LmtDb(cachingdb.CachingDb):
     """
     Class to wrap the connection to an LMT MySQL database or SQLite database
     """
-    def __init__(self, dbhost=None, dbuser=None, dbpassword=None, dbname=None, cache_file=None):
+    def __init__(self, dbhost=None, dbuser=None, dbpassword=None, dbname=None, cache_file=None,
+                 pool_size=None, result_cache=None):
         """
-        Initialize LmtDb with either a MySQL or SQLite backend
+        Initialize LmtDb with either a MySQL or SQLite backend.  If pool_size
+        is specified, time series queries are issued concurrently over up to
+        that many database connections.  If result_cache is a
+        cachingdb.QueryCache, repeated queries are answered from it.
         """
         # Get database parameters
         if dbhost is None:
@@ -157,7 +165,9 @@ class LmtDb(cachingdb.CachingDb):
             dbuser=dbuser,
             dbpassword=dbpassword,
             dbname=dbname,
-            cache_file=cache_file)
+            cache_file=cache_file,
+            pool_size=pool_size,
+            result_cache=result_cache)
 
         # The list of OST names is an immutable property of a database, so
         # fetch and cache it here.  Also maintain a mapping of OST_ID to
@@ -194,6 +204,13 @@ class LmtDb(cachingdb.CachingDb):
             self.mds_op_id_map[row[0]] = row[1]
         self.mds_op_names = tuple(self.mds_op_names)
 
+        # Most recently resolved TS_ID->TIMESTAMP map.  Consecutive queries
+        # against different tables usually cover the same time range, so
+        # keeping just one map avoids re-querying TIMESTAMP_INFO for each.
+        self.ts_map_range = None
+        self.ts_map = None
+        self._ts_map_lock = threading.Lock()
+
     def get_ts_ids(self, datetime_start, datetime_end):
         """
         Given a starting and ending time, return the lowest and highest ts_id
@@ -202,8 +219,8 @@ class LmtDb(cachingdb.CachingDb):
         # First figure out the timestamp range
         query_str = "SELECT TIMESTAMP_INFO.TS_ID FROM TIMESTAMP_INFO WHERE TIMESTAMP >= %(ps)s AND TIMESTAMP <= %(ps)s"
         query_variables = (
-            datetime_start.strftime("%Y-%m-%d %H:%M:%S"),
-            datetime_end.strftime("%Y-%m-%d %H:%M:%S"))
+            datetime_start.strftime(cachingdb.DATE_FMT),
+            datetime_end.strftime(cachingdb.DATE_FMT))
 
         result = self.query(query_str=query_str,
                             query_variables=query_variables)
@@ -211,23 +228,97 @@ class LmtDb(cachingdb.CachingDb):
         ### TODO: make sure this works (it's templated down in test_bin_cache_lmtdb.py)
         return min(ts_ids), max(ts_ids)
 
-    def get_timeseries_data(self, table, datetime_start, datetime_end, timechunk=datetime.timedelta(hours=1)):
+    def get_ts_map(self, datetime_start, datetime_end):
+        """Map TS_IDs to timestamps over a time range
+
+        The map for the most recently requested time range is retained in
+        memory so that querying several tables over the same range only
+        queries TIMESTAMP_INFO once.
+
+        Args:
+            datetime_start (datetime.datetime): lower bound on timestamps,
+                inclusive
+            datetime_end (datetime.datetime): upper bound on timestamps,
+                exclusive
+
+        Returns:
+            dict: with keys ``ts_ids`` (sorted numpy.ndarray of TS_IDs),
+            ``timestamps`` (numpy.ndarray of timestamps as returned by the
+            database) and ``epochs`` (numpy.ndarray of timestamps as seconds
+            since epoch), all aligned to each other
+        """
+        query_variables = (
+            datetime_start.strftime(cachingdb.DATE_FMT),
+            datetime_end.strftime(cachingdb.DATE_FMT))
+        with self._ts_map_lock:
+            if self.ts_map_range != query_variables:
+                self.ts_map = self._query_ts_map(query_variables)
+                self.ts_map_range = query_variables
+            return self.ts_map
+
+    def _query_ts_map(self, query_variables):
+        """Query TIMESTAMP_INFO to build the map returned by get_ts_map()
+        """
+        query_str = "SELECT TS_ID, TIMESTAMP FROM TIMESTAMP_INFO WHERE TIMESTAMP >= %(ps)s AND TIMESTAMP < %(ps)s"
+        result = self.query(query_str=query_str,
+                            query_variables=query_variables,
+                            table='TIMESTAMP_INFO',
+                            table_schema=LMTDB_TABLES['TIMESTAMP_INFO'])
+        ts_ids = numpy.fromiter(map(operator.itemgetter(0), result), dtype='i8', count=len(result))
+        timestamps = numpy.empty(len(result), dtype=object)
+        timestamps[:] = [row[1] for row in result]
+        order = numpy.argsort(ts_ids, kind='stable')
+
+        return {
+            'ts_ids': ts_ids[order],
+            'timestamps': timestamps[order],
+            'epochs': tokio.common.strptime_epochs(timestamps[order], cachingdb.DATE_FMT),
+        }
+
+    def get_timeseries_data(self, table, datetime_start, datetime_end, timechunk=datetime.timedelta(hours=1),
+                            epochs=False, by_ts_id=False):
         """
         Break a timeseries query into smaller queries over smaller time ranges.
         This is an optimization to avoid the O(N*M) scaling of the JOINs in the
-        underlying SQL query.
+        underlying SQL query.  If epochs is True, return the TIMESTAMP column as
+        seconds since epoch rather than as strings or datetime objects.
+
+        If by_ts_id is True, the JOIN is avoided altogether: the TS_IDs in the
+        time range are resolved once using get_ts_map(), the table is queried
+        by TS_ID range, and timestamps are attached to the results client-side.
+        The rows saved to the in-memory cache are then the table's own rows
+        (without TIMESTAMP) so they match the table's schema.
+
+        If a connection pool is open, the chunks are queried concurrently and
+        their results are reassembled in time order.
         """
         table_schema = LMTDB_TABLES.get(table.upper())
         if table_schema is None:
             raise KeyError("Table '%s' is not valid" % table)
         else:
             result_columns = ['TIMESTAMP'] + table_schema['columns']
+
+        if by_ts_id:
+            results = self._get_timeseries_data_by_ts_id(table, table_schema, datetime_start,
+                                                         datetime_end, timechunk, epochs)
+            return results, result_columns
+
         format_dict = {
             'schema': ', '.join(result_columns).replace("TS_ID,", "TIMESTAMP_INFO.TS_ID,"),
             'table': table,
         }
 
-        index0 = len(self.saved_results.get(table, {'rows': []})['rows'])
+        query_str = """SELECT
+                           %(schema)s
+                       FROM
+                           %(table)s
+                       INNER JOIN TIMESTAMP_INFO ON TIMESTAMP_INFO.TS_ID = %(table)s.TS_ID
+                       WHERE
+                           TIMESTAMP_INFO.TIMESTAMP >= %%(ps)s
+                           AND TIMESTAMP_INFO.TIMESTAMP < %%(ps)s
+                       """ % format_dict
+
+        queries = []
         chunk_start = datetime_start
         while chunk_start < datetime_end:
             if timechunk is None:
@@ -236,25 +327,139 @@ class LmtDb(cachingdb.CachingDb):
                 chunk_end = chunk_start + timechunk
             if chunk_end > datetime_end:
                 chunk_end = datetime_end
-            start_stamp = chunk_start.strftime("%Y-%m-%d %H:%M:%S")
-            end_stamp = chunk_end.strftime("%Y-%m-%d %H:%M:%S")
-
-            query_str = """SELECT
-                               %(schema)s
-                           FROM
-                               %(table)s
-                           INNER JOIN TIMESTAMP_INFO ON TIMESTAMP_INFO.TS_ID = %(table)s.TS_ID
-                           WHERE
-                               TIMESTAMP_INFO.TIMESTAMP >= %%(ps)s
-                               AND TIMESTAMP_INFO.TIMESTAMP < %%(ps)s
-                           """ % format_dict
-            self.query(query_str, (start_stamp, end_stamp), table=table, table_schema=table_schema)
+            start_stamp = chunk_start.strftime(cachingdb.DATE_FMT)
+            end_stamp = chunk_end.strftime(cachingdb.DATE_FMT)
+            queries.append((query_str, (start_stamp, end_stamp)))
             if timechunk is not None:
                 chunk_start += timechunk
 
-        return self.saved_results[table]['rows'][index0:], result_columns
+        results = []
+        for chunk_results in self.query_parallel(queries, table=table, table_schema=table_schema):
+            results += chunk_results
+        if epochs:
+            results = cachingdb.timestamps_to_epochs(results, [0])
+        return results, result_columns
+
+    def _get_timeseries_data_by_ts_id(self, table, table_schema, datetime_start, datetime_end,
+                                      timechunk, epochs):
+        """Retrieve timeseries data using TS_ID range scans
+
+        See get_timeseries_data().  Sorted TS_IDs are divided into contiguous
+        runs of roughly ``timechunk`` worth of timestamps, and each run becomes
+        one ``TS_ID BETWEEN`` range scan.  Rows whose TS_ID does not belong to
+        the time range are discarded.
+        """
+        ts_map = self.get_ts_map(datetime_start, datetime_end)
+        ts_ids = ts_map['ts_ids']
+        if not len(ts_ids):
+            return []
+        timestamps = ts_map['epochs'] if epochs else ts_map['timestamps']
+
+        if timechunk is None:
+            chunk_len = len(ts_ids)
+        else:
+            chunks = (datetime_end - datetime_start).total_seconds() / timechunk.total_seconds()
+            chunk_len = max(1, int(numpy.ceil(len(ts_ids) / max(chunks, 1.0))))
+
+        query_str = "SELECT %s FROM %s WHERE TS_ID >= %%(ps)s AND TS_ID <= %%(ps)s" % (
+            ', '.join(table_schema['columns']), table)
+        ts_id_col = table_schema['columns'].index('TS_ID')
+
+        queries = []
+        for index in range(0, len(ts_ids), chunk_len):
+            chunk = ts_ids[index:index + chunk_len]
+            queries.append((query_str, (int(chunk[0]), int(chunk[-1]))))
+
+        results = []
+        for rows in self.query_parallel(queries, table=table, table_schema=table_schema):
+            if not rows:
+                continue
+            row_ids = numpy.fromiter(map(operator.itemgetter(ts_id_col), rows), dtype='i8',
+                                     count=len(rows))
+            positions = numpy.searchsorted(ts_ids, row_ids).clip(max=len(ts_ids) - 1)
+            valid = ts_ids[positions] == row_ids
+            row_stamps = timestamps[positions].tolist()
+            if valid.all():
+                results += [(stamp,) + tuple(row) for stamp, row in zip(row_stamps, rows)]
+            else:
+                results += [(stamp,) + tuple(row)
+                            for stamp, row, keep in zip(row_stamps, rows, valid) if keep]
+        return results
+
+    def iter_timeseries_data(self, table, datetime_start, datetime_end,
+                             batch_size=cachingdb.ITER_BATCH_SIZE, epochs=False, cache_file=None):
+        """Retrieve timeseries data in batches of columns
+
+        Streaming counterpart to get_timeseries_data(by_ts_id=True).  Rows are
+        fetched from the database in batches and are not retained in memory,
+        so the time range can be arbitrarily large.
+
+        Args:
+            table (str): name of an LMT table containing a TS_ID column
+            datetime_start (datetime.datetime): lower bound on time series data
+                to retrieve, inclusive
+            datetime_end (datetime.datetime): upper bound on time series data
+                to retrieve, exclusive
+            batch_size (int): maximum number of rows per batch
+            epochs (bool): return timestamps as seconds since epoch
+            cache_file (str or cachingdb.CacheWriter, optional): path to an
+                SQLite database, or an open CacheWriter, to which the retrieved
+                rows and their TIMESTAMP_INFO rows are written
+
+        Yields:
+            dict: keyed by column name (TIMESTAMP and each of the table's
+            columns) whose values are numpy.ndarrays.  Batches are never empty.
+        """
+        table_schema = LMTDB_TABLES.get(table.upper())
+        if table_schema is None:
+            raise KeyError("Table '%s' is not valid" % table)
+
+        ts_map = self.get_ts_map(datetime_start, datetime_end)
+        ts_ids = ts_map['ts_ids']
+        if not len(ts_ids):
+            return
+        timestamps = ts_map['epochs'] if epochs else ts_map['timestamps']
+
+        writer = cache_file
+        if cache_file is not None and not isinstance(cache_file, cachingdb.CacheWriter):
+            writer = cachingdb.CacheWriter(cache_file)
+
+        try:
+            if writer is not None:
+                writer.write('TIMESTAMP_INFO',
+                             zip(ts_ids.tolist(), ts_map['timestamps'].tolist()),
+                             LMTDB_TABLES['TIMESTAMP_INFO'])
+
+            columns = table_schema['columns']
+            query_str = "SELECT %s FROM %s WHERE TS_ID >= %%(ps)s AND TS_ID <= %%(ps)s" % (
+                ', '.join(columns), table)
+            for batch in self.iter_query(query_str, (int(ts_ids[0]), int(ts_ids[-1])),
+                                         batch_size=batch_size,
+                                         table=table,
+                                         table_schema=table_schema,
+                                         cache_file=writer):
+                arrays = {}
+                for column, values in zip(columns, batch):
+                    arrays[column] = numpy.array(values)
+                positions = numpy.searchsorted(ts_ids, arrays['TS_ID']).clip(max=len(ts_ids) - 1)
+                valid = ts_ids[positions] == arrays['TS_ID']
+                arrays['TIMESTAMP'] = timestamps[positions]
+                if not valid.all():
+                    if not valid.any():
+                        continue
+                    for column in arrays:
+                        arrays[column] = arrays[column][valid]
+                yield arrays
+        except Exception:
+            if writer is not cache_file:
+                writer.close(commit=False)
+            raise
+        finally:
+            if writer is not cache_file:
+                writer.close()
 
-    def get_mds_data(self, datetime_start, datetime_end, timechunk=datetime.timedelta(hours=1)):
+    def get_mds_data(self, datetime_start, datetime_end, timechunk=datetime.timedelta(hours=1),
+                     epochs=False, by_ts_id=False):
         """Schema-agnostic method for retrieving MDS load data.
 
         Wraps get_timeseries_data() but fills in the exact table name used in
@@ -267,6 +472,9 @@ class LmtDb(cachingdb.CachingDb):
                 retrieve, exclusive
             timechunk (datetime.timedelta): divide time range query into
                 sub-ranges of this width to work around N*N scaling of JOINs
+            epochs (bool): return timestamps as seconds since epoch
+            by_ts_id (bool): query by TS_ID range rather than JOINing against
+                TIMESTAMP_INFO
 
         Returns:
             Tuple of (results, column names)  where results are tuples of tuples
@@ -276,9 +484,12 @@ class LmtDb(cachingdb.CachingDb):
         return self.get_timeseries_data('MDS_DATA',
                                         datetime_start,
                                         datetime_end,
-                                        timechunk=timechunk)
+                                        timechunk=timechunk,
+                                        epochs=epochs,
+                                        by_ts_id=by_ts_id)
 
-    def get_mds_ops_data(self, datetime_start, datetime_end, timechunk=datetime.timedelta(hours=1)):
+    def get_mds_ops_data(self, datetime_start, datetime_end, timechunk=datetime.timedelta(hours=1),
+                         epochs=False, by_ts_id=False):
         """Schema-agnostic method for retrieving metadata operations data.
 
         Wraps get_timeseries_data() but fills in the exact table name used in
@@ -291,6 +502,9 @@ class LmtDb(cachingdb.CachingDb):
                 retrieve, exclusive
             timechunk (datetime.timedelta): divide time range query into
                 sub-ranges of this width to work around N*N scaling of JOINs
+            epochs (bool): return timestamps as seconds since epoch
+            by_ts_id (bool): query by TS_ID range rather than JOINing against
+                TIMESTAMP_INFO
 
         Returns:
             Tuple of (results, column names)  where results are tuples of tuples
@@ -300,9 +514,12 @@ class LmtDb(cachingdb.CachingDb):
         return self.get_timeseries_data('MDS_OPS_DATA',
                                         datetime_start,
                                         datetime_end,
-                                        timechunk=timechunk)
+                                        timechunk=timechunk,
+                                        epochs=epochs,
+                                        by_ts_id=by_ts_id)
 
-    def get_oss_data(self, datetime_start, datetime_end, timechunk=datetime.timedelta(hours=1)):
+    def get_oss_data(self, datetime_start, datetime_end, timechunk=datetime.timedelta(hours=1),
+                     epochs=False, by_ts_id=False):
         """Schema-agnostic method for retrieving OSS data.
 
         Wraps get_timeseries_data() but fills in the exact table name used in
@@ -315,6 +532,9 @@ class LmtDb(cachingdb.CachingDb):
                 retrieve, exclusive
             timechunk (datetime.timedelta): divide time range query into
                 sub-ranges of this width to work around N*N scaling of JOINs
+            epochs (bool): return timestamps as seconds since epoch
+            by_ts_id (bool): query by TS_ID range rather than JOINing against
+                TIMESTAMP_INFO
 
         Returns:
             Tuple of (results, column names)  where results are tuples of tuples
@@ -324,9 +544,12 @@ class LmtDb(cachingdb.CachingDb):
         return self.get_timeseries_data('OSS_DATA',
                                         datetime_start,
                                         datetime_end,
-                                        timechunk=timechunk)
+                                        timechunk=timechunk,
+                                        epochs=epochs,
+                                        by_ts_id=by_ts_id)
 
-    def get_ost_data(self, datetime_start, datetime_end, timechunk=datetime.timedelta(hours=1)):
+    def get_ost_data(self, datetime_start, datetime_end, timechunk=datetime.timedelta(hours=1),
+                     epochs=False, by_ts_id=False):
         """Schema-agnostic method for retrieving OST data.
 
         Wraps get_timeseries_data() but fills in the exact table name used in
@@ -339,6 +562,9 @@ class LmtDb(cachingdb.CachingDb):
                 retrieve, exclusive
             timechunk (datetime.timedelta): divide time range query into
                 sub-ranges of this width to work around N*N scaling of JOINs
+            epochs (bool): return timestamps as seconds since epoch
+            by_ts_id (bool): query by TS_ID range rather than JOINing against
+                TIMESTAMP_INFO
 
         Returns:
             Tuple of (results, column names)  where results are tuples of tuples
@@ -348,4 +574,6 @@ class LmtDb(cachingdb.CachingDb):
         return self.get_timeseries_data('OST_DATA',
                                         datetime_start,
                                         datetime_end,
-                                        timechunk=timechunk)
+                                        timechunk=timechunk,
+                                        epochs=epochs,
+                                        by_ts_id=by_ts_id)
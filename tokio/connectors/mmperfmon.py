@@ -60,7 +60,7 @@ import mimetypes
 import pandas
 
 from .common import SubprocessOutputDict, walk_file_collection
-from ..common import to_epoch, recast_string, JSONEncoder
+from ..common import strptime_epoch, recast_string, JSONEncoder
 
 _REX_LEGEND = re.compile(r'^\s*(\d+):\s+([^|]+)\|([^|]+)\|(\S+)\s*$')
 _REX_ROWHEAD = re.compile(r'^\s*Row\s+Timestamp')
@@ -227,7 +227,7 @@ class Mmperfmon(SubprocessOutputDict):
         # begin processing the fully tabularized data structure
         for rowid in sorted(self.rows.keys()):
             fields = self.rows[rowid]
-            timestamp = to_epoch(datetime.datetime.strptime(fields[1], MMPERFMON_DATE_FMT))
+            timestamp = strptime_epoch(fields[1], MMPERFMON_DATE_FMT)
             for index, val in enumerate(fields[2:]):
                 orig_counter = self.legend[index + 1]['counter']
                 hostname = self.legend[index + 1]['host']
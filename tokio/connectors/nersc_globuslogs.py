@@ -5,6 +5,7 @@ Connects to NERSC's OMNI service and retrieves Globus transfer logs.
 """
 
 import copy
+import numpy
 from . import es
 
 QUERY = {
@@ -30,6 +31,9 @@ QUERY = {
     }
 }
 
+### Format of the DATE and START fields, which are expressed in UTC
+DATE_FMT = "%Y%m%d%H%M%S.%f"
+
 ### Only return the following _source fields
 SOURCE_FILTER = [
     '@timestamp',
@@ -56,6 +60,73 @@ SOURCE_FILTER = [
     'host',
 ]
 
+def date_to_epochs(values):
+    """Convert DATE or START fields into seconds since the epoch
+
+    Values that all have the same width are decoded directly from their
+    digits, which is much faster than parsing each one.  Anything else,
+    including missing values, is parsed with DATE_FMT.
+
+    Args:
+        values (list): Timestamps in DATE_FMT, where missing values are None
+
+    Returns:
+        numpy.ndarray: float64 seconds since the epoch
+    """
+    try:
+        widths = set(map(len, values))
+        width = widths.pop()
+        if widths or width < 14:
+            raise ValueError
+        chars = numpy.frombuffer(''.join(values).encode('ascii'), dtype='u1').reshape(len(values), width)
+    except (TypeError, ValueError, KeyError):
+        # no values, missing values, mixed widths, or non-ASCII characters
+        return es.to_epochs(values, fmt=DATE_FMT)
+
+    digits = chars.astype('i8') - ord('0')
+    fraction = digits[:, 15:21]
+    if ((digits[:, :14] < 0) | (digits[:, :14] > 9)).any() \
+    or (width > 14 and (chars[:, 14] != ord('.')).any()) \
+    or ((fraction < 0) | (fraction > 9)).any():
+        return es.to_epochs(values, fmt=DATE_FMT)
+
+    def field(start, stop):
+        """Decode the digits in a range of columns into an integer"""
+        return digits[:, start:stop].dot(10**numpy.arange(stop - start - 1, -1, -1))
+
+    months = (field(0, 4) - 1970) * 12 + field(4, 6) - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]').view('i8') + field(6, 8) - 1
+    seconds = days * 86400 + field(8, 10) * 3600 + field(10, 12) * 60 + field(12, 14)
+    microseconds = fraction.dot(10**numpy.arange(5, 5 - fraction.shape[1], -1))
+    return seconds + microseconds / 1.0e6
+
+### Conversions that to_dataframe() can apply to each field.  Fields with
+### many distinct values are kept as objects since categoricals would only
+### add overhead.
+DATAFRAME_DTYPES = {
+    '@timestamp': 'epoch',
+    'BLOCK': 'int',
+    'BUFFER': 'int',
+    'CODE': 'category',
+    'DATE': date_to_epochs,
+    'DEST': 'object',
+    'DESTIP': 'object',
+    'HOST': 'category',
+    'NBYTES': 'int',
+    'START': date_to_epochs,
+    'STREAMS': 'int',
+    'STRIPES': 'int',
+    'TASKID': 'object',
+    'TYPE': 'category',
+    'USER': 'category',
+    'VOLUME': 'object',
+    'bandwidth_mbps': 'float',
+    'duration': 'float',
+    'start_date': 'epoch',
+    'end_date': 'epoch',
+    'host': 'category',
+}
+
 class NerscGlobusLogs(es.EsConnection):
     """Connection handler for NERSC Globus transfer logs
     """
@@ -65,6 +136,7 @@ class NerscGlobusLogs(es.EsConnection):
         self.flush_every = 50000
         self.flush_function = lambda x: x
         self.source_filter = SOURCE_FILTER
+        self.slices = 1
 
     @classmethod
     def from_cache(cls, *args, **kwargs):
@@ -72,6 +144,7 @@ class NerscGlobusLogs(es.EsConnection):
         instance.filter_function = lambda x: x['hits']['hits']
         instance.flush_every = 50000
         instance.flush_function = lambda x: x
+        instance.slices = 1
         return instance
 
     def query(self, start, end, must=None, scroll=True):
@@ -164,14 +237,28 @@ class NerscGlobusLogs(es.EsConnection):
                 source_filter=self.source_filter,
                 filter_function=self.filter_function,
                 flush_every=self.flush_every,
-                flush_function=self.flush_function)
+                flush_function=self.flush_function,
+                slices=self.slices)
         else:
             super(NerscGlobusLogs, self).query(query=query)
 
-    def to_dataframe(self):
+    def to_dataframe(self, query=None, dtypes=None):
         """Converts self.scroll_pages to a DataFrame
 
+        Passing ``dtypes=DATAFRAME_DTYPES`` converts timestamps to seconds
+        since the epoch and stores low-cardinality fields such as USER and
+        TYPE as categoricals, which is faster and much smaller.
+
+        Args:
+            query (dict or None): If given, stream the results of this query
+                into the DataFrame instead of converting self.scroll_pages
+            dtypes (dict or None): Conversions to apply to each field as
+                accepted by :func:`tokio.connectors.es.convert_column`.  If
+                None, pandas infers the type of each column.
+
         Returns:
             pandas.DataFrame: Contents of the last query's pages
         """
-        return super(NerscGlobusLogs, self).to_dataframe(fields=self.source_filter)
+        return super(NerscGlobusLogs, self).to_dataframe(fields=self.source_filter,
+                                                         query=query,
+                                                         dtypes=dtypes)
@@ -36,6 +36,7 @@ FROM
 HIT_MEMORY = 0
 HIT_CACHE_DB = 1
 HIT_REMOTE_DB = 2
+HIT_RESULT_CACHE = 3
 
 class NerscJobsDb(cachingdb.CachingDb):
     """
@@ -55,8 +56,12 @@ class NerscJobsDb(cachingdb.CachingDb):
     jobs database is immutable and can be cached indefinitely once it appears
     there.  At any time the memory cache can be committed to a cache database to
     be used or transported later.
+
+    Query results can also be persisted across instances by passing a
+    cachingdb.QueryCache as result_cache.
     """
-    def __init__(self, dbhost=None, dbuser=None, dbpassword=None, dbname=None, cache_file=None):
+    def __init__(self, dbhost=None, dbuser=None, dbpassword=None, dbname=None, cache_file=None,
+                 result_cache=None):
         # in-memory query cache
         self.cached_queries = {}
         self.last_results = None # for debugging
@@ -75,7 +80,8 @@ class NerscJobsDb(cachingdb.CachingDb):
             dbuser=dbuser,
             dbpassword=dbpassword,
             dbname=dbname,
-            cache_file=cache_file)
+            cache_file=cache_file,
+            result_cache=result_cache)
 
     def drop_cache(self):
         """
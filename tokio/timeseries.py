@@ -265,6 +265,43 @@ class TimeSeries(object):
             self.dataset[t_index, c_index] = value
         return True
 
+    def insert_elements(self, timestamps, column_indices, values, align='l', reducer=None):
+        """Inserts many values into the dataset at once
+
+        Vectorized equivalent of calling insert_element() once per value.
+        Elements whose timestamps fall outside of the dataset or whose column
+        index is negative are skipped.  If several values map to the same
+        element and no reducer is given, the last one wins.
+
+        Args:
+            timestamps (numpy.ndarray): seconds since epoch for each value;
+                determine the row indices into which `values` are inserted
+            column_indices (numpy.ndarray): column index for each value
+            values (numpy.ndarray): values to insert into the dataset
+            align (str): "left" or "right"; governs whether or not the values
+                given for the ``timestamps`` argument represent the left or
+                right edges of the bins.
+            reducer (numpy.ufunc or None): If given, combine each value with
+                the existing value of its element using this function (e.g.,
+                numpy.add) rather than overwriting it.  Applied unbuffered so
+                that every value mapping to the same element is reduced.
+
+        Returns:
+            int: number of elements that were inserted
+        """
+        t_index = ((numpy.asarray(timestamps, dtype='i8') - self.timestamps[0])
+                   // self.timestep).astype('i8')
+        if align[0] == 'r':
+            t_index -= 1
+
+        c_index = numpy.asarray(column_indices, dtype='i8')
+        valid = (t_index >= 0) & (t_index < self.timestamps.shape[0]) & (c_index >= 0)
+        if reducer is None:
+            self.dataset[t_index[valid], c_index[valid]] = numpy.asarray(values)[valid]
+        else:
+            reducer.at(self.dataset, (t_index[valid], c_index[valid]), numpy.asarray(values)[valid])
+        return int(valid.sum())
+
     def convert_to_deltas(self, align='l'):
         """Converts a matrix of monotonically increasing rows into deltas.
         
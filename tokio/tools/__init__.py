@@ -26,6 +26,11 @@ try:
 except ImportError:
     pass
 
+try:
+    import tokio.tools.parquet
+except ImportError:
+    pass
+
 ### For backwards compatibility
 try:
     import tokio.analysis.umami as umami
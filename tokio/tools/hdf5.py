@@ -41,7 +41,7 @@ def enumerate_hdf5(fsname, datetime_start, datetime_end):
                                                     lookup_key=fsname,
                                                     match_first=True)
 
-def get_files_and_indices(fsname, dataset_name, datetime_start, datetime_end):
+def get_files_and_indices(fsname, dataset_name, datetime_start, datetime_end, swmr=False):
     """Retrieve filenames and indices within files corresponding to a date range
 
     Given a logical file system name and a dataset within that file system's
@@ -57,6 +57,8 @@ def get_files_and_indices(fsname, dataset_name, datetime_start, datetime_end):
         datetime_end (datetime.datetime): Stop including files with timestamps
             that follow this end date.  Resulting files _will_ include this
             date.
+        swmr (bool): Open files in single-writer/multiple-reader mode so that
+            files being actively written by an archiver can be read safely.
 
     Returns:
         list: List of three-item tuples of types (str, int, int), where
@@ -76,7 +78,7 @@ def get_files_and_indices(fsname, dataset_name, datetime_start, datetime_end):
     output = []
 
     for h5lmt_file in h5lmt_files:
-        with tokio.connectors.hdf5.Hdf5(h5lmt_file, mode="r") as hdf5:
+        with tokio.connectors.hdf5.Hdf5(h5lmt_file, mode="r", swmr=swmr) as hdf5:
             i_0 = 0
             timestamps = hdf5.get_timestamps(dataset_name)
             if datetime.datetime.fromtimestamp(timestamps[0]) <= datetime_start:
@@ -97,7 +99,8 @@ def get_files_and_indices(fsname, dataset_name, datetime_start, datetime_end):
         output.append((h5lmt_file, i_0, i_f))
     return output
 
-def get_dataframe_from_time_range(fsname, dataset_name, datetime_start, datetime_end, fix_errors=False):
+def get_dataframe_from_time_range(fsname, dataset_name, datetime_start, datetime_end, fix_errors=False,
+                                  swmr=False):
     """Returns all TOKIO Time Series data within a time range as a DataFrame.
 
     Given a time range,
@@ -117,6 +120,8 @@ def get_dataframe_from_time_range(fsname, dataset_name, datetime_start, datetime
         fix_errors (bool): Replace negative values with -0.0.  Necessary if any
             HDF5 files contain negative values as a result of being archived
             with a buggy version of pytokio.
+        swmr (bool): Open files in single-writer/multiple-reader mode so that
+            files being actively written by an archiver can be read safely.
 
     Returns:
         pandas.DataFrame: DataFrame indexed in time and whose columns correspond
@@ -129,7 +134,7 @@ def get_dataframe_from_time_range(fsname, dataset_name, datetime_start, datetime
         return result
 
     for hdf_filename in hdf5_filenames:
-        with tokio.connectors.hdf5.Hdf5(hdf_filename, mode='r') as hdf_file:
+        with tokio.connectors.hdf5.Hdf5(hdf_filename, mode='r', swmr=swmr) as hdf_file:
             df_slice = hdf_file.to_dataframe(dataset_name)
             df_slice = df_slice[(df_slice.index >= datetime_start)
                                 & (df_slice.index < datetime_end)]
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""Export TOKIO Time Series datasets to Apache Arrow and Parquet
+
+Streams datasets out of one or more TOKIO Time Series HDF5 files as Arrow
+record batches without materializing whole datasets in memory.  Each record
+batch covers a whole number of HDF5 chunks so that reads from the HDF5 file
+and Parquet row groups line up, and the NumPy buffers read from HDF5 are
+handed to Arrow without further copying.
+
+Requires the optional ``pyarrow`` package.
+"""
+
+import time
+import numpy
+import tokio.connectors.hdf5
+
+HAVE_PYARROW = True
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    HAVE_PYARROW = False
+
+TIMESTAMP_FIELD = 'timestamp'
+
+# Minimum number of rows to read from HDF5 per record batch; rounded up to a
+# whole number of HDF5 chunks
+DEFAULT_BATCH_ROWS = 8192
+
+def _require_pyarrow():
+    """Raise a helpful error if pyarrow is not available
+    """
+    if not HAVE_PYARROW:
+        raise ImportError("pyarrow is required to export Arrow/Parquet data")
+
+def _to_epoch(datetime_obj):
+    """Convert a local datetime into an epoch timestamp, passing through None
+    """
+    if datetime_obj is None:
+        return None
+    return int(time.mktime(datetime_obj.timetuple()))
+
+def _decode(value):
+    """Decode bytes-valued HDF5 attributes into str
+    """
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+def get_batch_rows(dataset, min_rows=DEFAULT_BATCH_ROWS):
+    """Determine the number of rows to read per record batch
+
+    Args:
+        dataset (h5py.Dataset or numpy.ndarray): dataset being exported
+        min_rows (int): smallest acceptable number of rows per batch
+
+    Returns:
+        int: min_rows rounded up to a whole number of the dataset's chunks
+    """
+    chunks = getattr(dataset, 'chunks', None)
+    if not chunks:
+        return min_rows
+    chunk_rows = chunks[0]
+    return chunk_rows * max(1, -(-min_rows // chunk_rows))
+
+def get_schema(hdf5_file, dataset_name, columns=None):
+    """Build the Arrow schema for a dataset
+
+    The schema has one timestamp field followed by one field per column of the
+    dataset.  The dataset's units and version are attached to every column
+    field as field-level metadata.
+
+    Args:
+        hdf5_file (tokio.connectors.hdf5.Hdf5): file containing dataset_name
+        dataset_name (str): name of dataset to describe
+        columns (list of str): names of columns to include.  If None, include
+            all columns in the order they appear in the dataset.
+
+    Returns:
+        pyarrow.Schema: schema of the record batches for dataset_name
+    """
+    _require_pyarrow()
+    dataset = hdf5_file[dataset_name]
+    if columns is None:
+        columns = list(hdf5_file.get_columns(dataset_name))
+
+    field_metadata = {}
+    units = _decode(getattr(dataset, 'attrs', {}).get('units'))
+    if units is not None:
+        field_metadata['units'] = str(units)
+    version = hdf5_file.get_version(dataset_name)
+    if version is not None:
+        field_metadata['version'] = str(version)
+
+    value_type = pyarrow.from_numpy_dtype(dataset.dtype)
+    fields = [pyarrow.field(TIMESTAMP_FIELD, pyarrow.timestamp('s', tz='UTC'), nullable=False)]
+    for column in columns:
+        fields.append(pyarrow.field(str(column), value_type, metadata=field_metadata or None))
+
+    return pyarrow.schema(fields, metadata={'dataset': dataset_name})
+
+def _values_to_array(values, value_type):
+    """Wrap a contiguous NumPy vector as an Arrow array without copying it
+
+    Missing elements (encoded as -0.0) become nulls by attaching a validity
+    bitmap to the existing data buffer.
+    """
+    missing = (values == 0) & numpy.signbit(values)
+    null_count = int(missing.sum())
+    if not null_count:
+        return pyarrow.Array.from_buffers(value_type, len(values),
+                                          [None, pyarrow.py_buffer(values)])
+    validity = numpy.packbits(~missing, bitorder='little')
+    return pyarrow.Array.from_buffers(value_type, len(values),
+                                      [pyarrow.py_buffer(validity), pyarrow.py_buffer(values)],
+                                      null_count=null_count)
+
+def iter_record_batches(hdf5_file, dataset_name, datetime_start=None, datetime_end=None,
+                        columns=None, schema=None, batch_rows=DEFAULT_BATCH_ROWS):
+    """Generate Arrow record batches from a single HDF5 file
+
+    Args:
+        hdf5_file (tokio.connectors.hdf5.Hdf5): file containing dataset_name
+        dataset_name (str): name of dataset to export
+        datetime_start (datetime.datetime or None): only export rows with
+            timestamps at or after this time
+        datetime_end (datetime.datetime or None): only export rows with
+            timestamps before this time
+        columns (list of str): names of columns to export.  Columns that do
+            not exist in this file are exported as nulls.  If None, export
+            all columns in the file.
+        schema (pyarrow.Schema): schema of the emitted batches.  If None, one
+            is generated by :meth:`get_schema`.
+        batch_rows (int): minimum number of rows per batch; rounded up to a
+            whole number of HDF5 chunks.
+
+    Yields:
+        pyarrow.RecordBatch: Consecutive, time-ordered slices of the dataset
+    """
+    _require_pyarrow()
+    if schema is None:
+        schema = get_schema(hdf5_file, dataset_name, columns)
+    if columns is None:
+        columns = schema.names[1:]
+
+    dataset = hdf5_file[dataset_name]
+    timestamps = hdf5_file.get_timestamps(dataset_name)[...].astype('i8')
+    num_rows = min(len(timestamps), dataset.shape[0])
+
+    # map requested columns onto this file's column order; -1 means absent
+    file_columns = {str(name): index for index, name in enumerate(hdf5_file.get_columns(dataset_name))}
+    col_indices = numpy.array([file_columns.get(str(column), -1) for column in columns], dtype='i8')
+    present = col_indices >= 0
+
+    epoch_start = _to_epoch(datetime_start)
+    epoch_end = _to_epoch(datetime_end)
+    i_start = 0 if epoch_start is None else int(numpy.searchsorted(timestamps[:num_rows], epoch_start, 'left'))
+    i_end = num_rows if epoch_end is None else int(numpy.searchsorted(timestamps[:num_rows], epoch_end, 'left'))
+
+    step = get_batch_rows(dataset, batch_rows)
+    row = i_start
+    while row < i_end:
+        # align batch boundaries with HDF5 chunk boundaries
+        next_row = min(i_end, (row // step + 1) * step)
+        num_batch_rows = next_row - row
+        block = dataset[row:next_row, :]
+
+        # transpose once so that each column is a contiguous buffer
+        selected = iter(numpy.ascontiguousarray(block[:, col_indices[present]].T))
+
+        batch_timestamps = numpy.ascontiguousarray(timestamps[row:next_row])
+        arrays = [pyarrow.Array.from_buffers(schema.field(0).type, num_batch_rows,
+                                             [None, pyarrow.py_buffer(batch_timestamps)])]
+        for index, is_present in enumerate(present):
+            value_type = schema.field(index + 1).type
+            if is_present:
+                arrays.append(_values_to_array(next(selected), value_type))
+            else:
+                arrays.append(pyarrow.nulls(num_batch_rows, type=value_type))
+
+        yield pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+        row = next_row
+
+def hdf5_to_parquet(hdf5_filenames, dataset_name, output_file, datetime_start=None,
+                    datetime_end=None, columns=None, batch_rows=DEFAULT_BATCH_ROWS,
+                    compression='snappy'):
+    """Write a dataset from one or more HDF5 files into a single Parquet file
+
+    Files are read in the order given and each record batch is written as its
+    own Parquet row group, so memory consumption is bounded by the size of a
+    single batch regardless of the time range being exported.
+
+    Args:
+        hdf5_filenames (list of str): paths to TOKIO Time Series HDF5 files in
+            time order
+        dataset_name (str): name of dataset to export
+        output_file (str): path to the Parquet file to create
+        datetime_start (datetime.datetime or None): only export rows with
+            timestamps at or after this time
+        datetime_end (datetime.datetime or None): only export rows with
+            timestamps before this time
+        columns (list of str): names of columns to export.  If None, use all
+            columns of the dataset in the first file.
+        batch_rows (int): minimum number of rows per row group
+        compression (str): Parquet compression codec
+
+    Returns:
+        int: Number of rows written
+    """
+    _require_pyarrow()
+    writer = None
+    schema = None
+    rows_written = 0
+    try:
+        for hdf5_filename in hdf5_filenames:
+            with tokio.connectors.hdf5.Hdf5(hdf5_filename, mode='r') as hdf5_file:
+                if schema is None:
+                    schema = get_schema(hdf5_file, dataset_name, columns)
+                    writer = pyarrow.parquet.ParquetWriter(output_file, schema, compression=compression)
+                for batch in iter_record_batches(hdf5_file=hdf5_file,
+                                                 dataset_name=dataset_name,
+                                                 datetime_start=datetime_start,
+                                                 datetime_end=datetime_end,
+                                                 columns=schema.names[1:],
+                                                 schema=schema,
+                                                 batch_rows=batch_rows):
+                    writer.write_batch(batch, row_group_size=batch.num_rows)
+                    rows_written += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return rows_written